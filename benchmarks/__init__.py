@@ -0,0 +1,22 @@
+#
+# Copyright 2019-2020 Lukas Schmelzeisen
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+# Benchmarks for the hot paths of retrieval, parsing, and result I/O. Run via
+#
+#     python -m benchmarks --output results.json
+#
+# and compare against the results of an earlier run (e.g., of the last release) via
+# --compare. See "python -m benchmarks --help" for all options.
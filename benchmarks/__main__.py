@@ -0,0 +1,101 @@
+#
+# Copyright 2019-2020 Lukas Schmelzeisen
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import re
+import sys
+from argparse import ArgumentParser
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from typing import Optional, Sequence
+
+from . import batch_results, parse, results_io  # noqa: F401 (register benchmarks)
+from ._harness import (
+    BENCHMARKS,
+    BenchmarkContext,
+    compare_results,
+    run_benchmark,
+    write_results,
+)
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = ArgumentParser(
+        prog="python -m benchmarks", description="Benchmark NASTY's hot paths."
+    )
+    parser.add_argument(
+        "-o", "--output", type=Path, help="JSON file to write the results to."
+    )
+    parser.add_argument(
+        "-k", "--filter", default="", help="Only run benchmarks matching this regex."
+    )
+    parser.add_argument(
+        "--scale",
+        type=float,
+        default=1.0,
+        help="Factor for the size of all fixtures (default: 1.0). For example, "
+        "batch_results.init uses 10k entries per unit of scale.",
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=5, help="Timed runs per benchmark (default: 5)."
+    )
+    parser.add_argument(
+        "--transport-dir",
+        type=Path,
+        help="Parse batches recorded via NASTY_TRANSPORT=record in this directory "
+        "instead of synthetic ones.",
+    )
+    parser.add_argument(
+        "--compare", type=Path, help="JSON file with results of an earlier run."
+    )
+    parser.add_argument(
+        "--max-slowdown",
+        type=float,
+        default=1.2,
+        help="Fail if throughput dropped by more than this factor compared to "
+        "--compare (default: 1.2).",
+    )
+    args = parser.parse_args(argv)
+
+    results = []
+    with TemporaryDirectory(prefix="nasty-benchmarks-") as tmp_dir:
+        context = BenchmarkContext(
+            Path(tmp_dir), scale=args.scale, transport_dir=args.transport_dir
+        )
+        for name in sorted(BENCHMARKS):
+            if not re.search(args.filter, name):
+                continue
+            result = run_benchmark(name, context, repeat=args.repeat)
+            results.append(result)
+            sys.stdout.write(
+                "{:<32} {:>9} items {:>10.4f}s {:>12.0f} items/s\n".format(
+                    name, result.items, min(result.timings), result.items_per_second
+                )
+            )
+
+    if args.output:
+        write_results(args.output, results)
+
+    if args.compare:
+        regressions = compare_results(args.compare, results, args.max_slowdown)
+        for regression in regressions:
+            sys.stdout.write("Regression: {}\n".format(regression))
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
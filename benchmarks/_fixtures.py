@@ -0,0 +1,55 @@
+#
+# Copyright 2019-2020 Lukas Schmelzeisen
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from typing import List, Mapping, cast
+
+from nasty._mock_server import MockTimelines, MockTwitterConfig
+from nasty._retriever.search_retriever import SearchRetrieverBatch
+from nasty._util.json_ import dumps, loads
+from nasty.tweet.tweet import Tweet
+
+# Batches of the same size that the Retrievers request by default.
+BATCH_SIZE = 20
+
+
+def synthetic_batches(kind: str, num_batches: int) -> List[bytes]:
+    """Serialized batches of a synthetic "search", "replies", or "thread" timeline."""
+    timelines = MockTimelines(
+        MockTwitterConfig(
+            num_tweets=num_batches * BATCH_SIZE,
+            tombstone_probability=0.01,
+            missing_meta_probability=0.01,
+        )
+    )
+
+    batches = []
+    for i in range(num_batches):
+        offset = i * BATCH_SIZE
+        if kind == "search":
+            json = timelines.search_batch("q", "scroll:{}".format(offset), BATCH_SIZE)
+        else:
+            cursor = "{}:{}".format(kind, offset) if i else None
+            json = timelines.conversation_batch("1", cursor, BATCH_SIZE)
+        batches.append(dumps(json).encode("UTF-8"))
+    return batches
+
+
+def synthetic_tweets(num_tweets: int) -> List[Tweet]:
+    tweets: List[Tweet] = []
+    for batch in synthetic_batches("search", -(-num_tweets // BATCH_SIZE)):
+        json = cast(Mapping[str, Mapping[str, object]], loads(batch))
+        tweets.extend(SearchRetrieverBatch(json).tweets)
+    return tweets[:num_tweets]
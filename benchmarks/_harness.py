@@ -0,0 +1,166 @@
+#
+# Copyright 2019-2020 Lukas Schmelzeisen
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import json
+import platform
+from datetime import datetime
+from pathlib import Path
+from statistics import mean, median
+from time import perf_counter
+from typing import Callable, Dict, List, Mapping, Optional, Sequence, Tuple
+
+from typing_extensions import Final
+
+import nasty
+from nasty._util.json_ import _loads, dumps
+
+# A benchmark is set up by a function that receives a BenchmarkContext and returns the
+# function to be timed together with the number of items (e.g., Tweets) it processes
+# per call. Setup time is not measured.
+BenchmarkFunc = Callable[[], object]
+BenchmarkSetup = Callable[["BenchmarkContext"], Tuple[BenchmarkFunc, int]]
+
+BENCHMARKS: Final[Dict[str, BenchmarkSetup]] = {}
+
+
+def benchmark(name: str) -> Callable[[BenchmarkSetup], BenchmarkSetup]:
+    """Registers the decorated setup function as benchmark with the given name."""
+
+    def decorator(setup: BenchmarkSetup) -> BenchmarkSetup:
+        if name in BENCHMARKS:
+            raise ValueError("Benchmark '{}' is already registered.".format(name))
+        BENCHMARKS[name] = setup
+        return setup
+
+    return decorator
+
+
+class BenchmarkContext:
+    def __init__(self, tmp_dir: Path, *, scale: float, transport_dir: Optional[Path]):
+        self.tmp_dir: Final = tmp_dir
+        self.scale: Final = scale
+        self.transport_dir: Final = transport_dir
+        self._cleanups: Final[List[Callable[[], object]]] = []
+
+    def scaled(self, n: int) -> int:
+        return max(1, round(n * self.scale))
+
+    def add_cleanup(self, cleanup: Callable[[], object]) -> None:
+        """Registers a function undoing changes to global state made during setup.
+
+        Cleanups run in reverse order once the benchmark finished, so that benchmarks
+        do not affect each other or the process running them (e.g., pytest).
+        """
+        self._cleanups.append(cleanup)
+
+    def cleanup(self) -> None:
+        while self._cleanups:
+            self._cleanups.pop()()
+
+    def benchmark_dir(self, name: str) -> Path:
+        directory = self.tmp_dir / name
+        directory.mkdir(parents=True, exist_ok=True)
+        return directory
+
+
+class BenchmarkResult:
+    def __init__(self, name: str, items: int, timings: Sequence[float]):
+        self.name: Final = name
+        self.items: Final = items
+        self.timings: Final = timings
+
+    @property
+    def items_per_second(self) -> float:
+        return self.items / min(self.timings)
+
+    def to_json(self) -> Mapping[str, object]:
+        return {
+            "name": self.name,
+            "items": self.items,
+            "repeat": len(self.timings),
+            "min": min(self.timings),
+            "median": median(self.timings),
+            "mean": mean(self.timings),
+            "items_per_second": self.items_per_second,
+        }
+
+
+def run_benchmark(
+    name: str, context: BenchmarkContext, *, repeat: int
+) -> BenchmarkResult:
+    try:
+        func, items = BENCHMARKS[name](context)
+        func()  # Warm-up, e.g., to populate caches of the OS and the interpreter.
+
+        timings = []
+        for _ in range(repeat):
+            start = perf_counter()
+            func()
+            timings.append(perf_counter() - start)
+    finally:
+        context.cleanup()
+    return BenchmarkResult(name, items, timings)
+
+
+def environment() -> Mapping[str, object]:
+    return {
+        "nasty_version": nasty.__version__,
+        "python_version": platform.python_version(),
+        "python_implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "json_backend": _loads.__module__,
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+    }
+
+
+def write_results(file: Path, results: Sequence[BenchmarkResult]) -> None:
+    file.write_text(
+        dumps(
+            {
+                "environment": environment(),
+                "results": [result.to_json() for result in results],
+            },
+            indent=2,
+        )
+        + "\n",
+        encoding="UTF-8",
+    )
+
+
+def compare_results(
+    baseline_file: Path, results: Sequence[BenchmarkResult], max_slowdown: float
+) -> List[str]:
+    """Compares results against an earlier run, e.g., of the previous release.
+
+    :return: Descriptions of all benchmarks whose throughput dropped by more than the
+        factor max_slowdown.
+    """
+    baseline = {
+        result["name"]: result
+        for result in json.loads(baseline_file.read_text(encoding="UTF-8"))["results"]
+    }
+    regressions = []
+    for result in results:
+        if result.name not in baseline:
+            continue
+        old = float(baseline[result.name]["items_per_second"])
+        if old > result.items_per_second * max_slowdown:
+            regressions.append(
+                "{}: {:.0f} items/s (was {:.0f} items/s)".format(
+                    result.name, result.items_per_second, old
+                )
+            )
+    return regressions
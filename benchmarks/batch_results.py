@@ -0,0 +1,167 @@
+#
+# Copyright 2019-2020 Lukas Schmelzeisen
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from datetime import datetime
+from itertools import count
+from pathlib import Path
+from typing import Callable, Iterable, List, Mapping, Optional, Sequence, Tuple
+
+import nasty._util.tweepy_
+from nasty._settings import TwitterApiSettings
+from nasty._util.io_ import write_lines_file
+from nasty._util.json_ import write_json, write_jsonl_lines
+from nasty.batch.batch_entry import BatchEntry
+from nasty.batch.batch_results import BatchResults
+from nasty.request.search import Search
+from nasty.tweet.tweet import Tweet, TweetId
+
+from ._fixtures import synthetic_tweets
+from ._harness import BenchmarkContext, BenchmarkFunc, benchmark
+
+_NUM_ENTRIES = 10_000
+_NUM_TRANSFORMED_ENTRIES = 1_000
+_TWEETS_PER_ENTRY = 10
+
+
+def _write_results_dir(
+    results_dir: Path, num_entries: int, tweets: Optional[Sequence[Tweet]]
+) -> None:
+    """Writes the meta files of a batch, plus data (or IDs) files if tweets are given.
+
+    Each entry receives the next _TWEETS_PER_ENTRY of the given Tweets.
+    """
+    if results_dir.exists():
+        return
+    results_dir.mkdir(parents=True)
+    completed_at = datetime.now()
+    for i in range(num_entries):
+        entry = BatchEntry(
+            Search(str(i)),
+            id_="{:08x}".format(i),
+            completed_at=completed_at,
+            exception=None,
+        )
+        write_json(results_dir / entry.meta_file_name, entry)
+        if tweets is not None:
+            offset = (i * _TWEETS_PER_ENTRY) % len(tweets)
+            write_jsonl_lines(
+                results_dir / entry.data_file_name,
+                tweets[offset : offset + _TWEETS_PER_ENTRY],
+                use_lzma=True,
+            )
+
+
+class _StubTweepyApi:
+    # Answers statuses_lookup() like tweepy.API with a JSONParser, without network.
+
+    def __init__(self, tweets: Iterable[Tweet]):
+        self._tweets: Mapping[TweetId, Mapping[str, object]] = {
+            tweet.id: tweet.to_json() for tweet in tweets
+        }
+
+    def statuses_lookup(
+        self, tweet_ids: List[TweetId], **_kwargs: object
+    ) -> Mapping[str, Mapping[TweetId, Optional[Mapping[str, object]]]]:
+        return {"id": {tweet_id: self._tweets.get(tweet_id) for tweet_id in tweet_ids}}
+
+
+@benchmark("batch_results.init")
+def batch_results_init(context: BenchmarkContext) -> Tuple[BenchmarkFunc, int]:
+    num_entries = context.scaled(_NUM_ENTRIES)
+    results_dir = context.benchmark_dir("batch_results") / "init-{}".format(num_entries)
+    _write_results_dir(results_dir, num_entries, None)
+
+    def run() -> None:
+        BatchResults(results_dir)
+
+    return run, num_entries
+
+
+@benchmark("batch_results.idify")
+def batch_results_idify(context: BenchmarkContext) -> Tuple[BenchmarkFunc, int]:
+    num_entries = context.scaled(_NUM_TRANSFORMED_ENTRIES)
+    benchmark_dir = context.benchmark_dir("batch_results")
+    results_dir = benchmark_dir / "idify-{}".format(num_entries)
+    _write_results_dir(results_dir, num_entries, synthetic_tweets(10_000))
+    batch_results = BatchResults(results_dir)
+    runs = count()
+
+    def run() -> None:
+        # Write to a fresh directory each time, as already idified entries are skipped.
+        batch_results.idify(benchmark_dir / "idified-{}".format(next(runs)))
+
+    return run, num_entries * _TWEETS_PER_ENTRY
+
+
+@benchmark("batch_results.unidify")
+def batch_results_unidify(context: BenchmarkContext) -> Tuple[BenchmarkFunc, int]:
+    num_entries = context.scaled(_NUM_TRANSFORMED_ENTRIES)
+    benchmark_dir = context.benchmark_dir("batch_results")
+    tweets = synthetic_tweets(num_entries * _TWEETS_PER_ENTRY)
+
+    results_dir = benchmark_dir / "unidify-{}".format(num_entries)
+    if not results_dir.exists():
+        _write_results_dir(results_dir, num_entries, tweets)
+        written_results = BatchResults(results_dir)
+        for entry in written_results:
+            write_lines_file(
+                results_dir / entry.ids_file_name,
+                list(written_results.tweet_ids(entry)),
+            )
+            (results_dir / entry.data_file_name).unlink()
+    batch_results = BatchResults(results_dir)
+
+    # statuses_lookup() only constructs a tweepy.API if none exists yet.
+    tweepy_api = nasty._util.tweepy_.TWEEPY_API
+    nasty._util.tweepy_.TWEEPY_API = _StubTweepyApi(tweets)  # type: ignore
+    context.add_cleanup(lambda: setattr(nasty._util.tweepy_, "TWEEPY_API", tweepy_api))
+    settings = TwitterApiSettings()
+    runs = count()
+
+    def run() -> None:
+        batch_results.unidify(
+            settings, benchmark_dir / "unidified-{}".format(next(runs))
+        )
+
+    return run, len(tweets)
+
+
+def _read_benchmark(
+    context: BenchmarkContext, read: Callable[[BatchResults], Iterable[object]]
+) -> Tuple[BenchmarkFunc, int]:
+    num_entries = context.scaled(_NUM_TRANSFORMED_ENTRIES)
+    results_dir = context.benchmark_dir("batch_results") / "read-{}".format(num_entries)
+    _write_results_dir(results_dir, num_entries, synthetic_tweets(10_000))
+    batch_results = BatchResults(results_dir)
+
+    def run() -> None:
+        for _ in read(batch_results):
+            pass
+
+    return run, num_entries * _TWEETS_PER_ENTRY
+
+
+@benchmark("batch_results.tweets")
+def batch_results_tweets(context: BenchmarkContext) -> Tuple[BenchmarkFunc, int]:
+    return _read_benchmark(
+        context,
+        lambda results: (tweet for entry in results for tweet in results.tweets(entry)),
+    )
+
+
+@benchmark("batch_results.iter_tweets")
+def batch_results_iter_tweets(context: BenchmarkContext) -> Tuple[BenchmarkFunc, int]:
+    return _read_benchmark(context, lambda results: results.iter_tweets())
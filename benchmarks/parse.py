@@ -0,0 +1,88 @@
+#
+# Copyright 2019-2020 Lukas Schmelzeisen
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from typing import List, Mapping, Tuple, Type, cast
+from urllib.parse import urlsplit
+
+from nasty._retriever.replay import ReplayStore
+from nasty._retriever.replies_retriever import RepliesRetrieverBatch
+from nasty._retriever.retriever import RetrieverBatch
+from nasty._retriever.search_retriever import SearchRetrieverBatch
+from nasty._retriever.thread_retriever import ThreadRetrieverBatch
+from nasty._util.json_ import loads
+
+from ._fixtures import synthetic_batches
+from ._harness import BenchmarkContext, BenchmarkFunc, benchmark
+
+_NUM_BATCHES = 100
+
+
+def _recorded_batches(kind: str, context: BenchmarkContext) -> List[bytes]:
+    # Batches recorded via NASTY_TRANSPORT=record. Replies and threads are fetched from
+    # the same endpoint, so both are benchmarked on all conversation batches.
+    assert context.transport_dir is not None
+    path_prefix = "/2/search/" if kind == "search" else "/2/timeline/conversation/"
+    return [
+        response.content
+        for _, url, response in ReplayStore(context.transport_dir).recordings()
+        if response.status_code == 200 and urlsplit(url).path.startswith(path_prefix)
+    ]
+
+
+def _parse_benchmark(
+    kind: str, batch_type: Type[RetrieverBatch], context: BenchmarkContext
+) -> Tuple[BenchmarkFunc, int]:
+    if context.transport_dir is not None:
+        batches = _recorded_batches(kind, context)
+    else:
+        batches = synthetic_batches(kind, context.scaled(_NUM_BATCHES))
+
+    def parse(batch: bytes) -> int:
+        # Access all Tweets, as they are only constructed lazily.
+        json = cast(Mapping[str, Mapping[str, object]], loads(batch))
+        return sum(1 for _ in batch_type(json).tweets)
+
+    # Skip recorded batches that the batch type does not understand, e.g., thread
+    # continuations for replies.
+    fixtures = []
+    num_tweets = 0
+    for batch in batches:
+        try:
+            num_tweets += parse(batch)
+        except (KeyError, IndexError, RuntimeError):
+            continue
+        fixtures.append(batch)
+
+    def run() -> None:
+        for batch in fixtures:
+            parse(batch)
+
+    return run, num_tweets
+
+
+@benchmark("parse.search")
+def parse_search(context: BenchmarkContext) -> Tuple[BenchmarkFunc, int]:
+    return _parse_benchmark("search", SearchRetrieverBatch, context)
+
+
+@benchmark("parse.replies")
+def parse_replies(context: BenchmarkContext) -> Tuple[BenchmarkFunc, int]:
+    return _parse_benchmark("replies", RepliesRetrieverBatch, context)
+
+
+@benchmark("parse.thread")
+def parse_thread(context: BenchmarkContext) -> Tuple[BenchmarkFunc, int]:
+    return _parse_benchmark("thread", ThreadRetrieverBatch, context)
@@ -0,0 +1,104 @@
+#
+# Copyright 2019-2020 Lukas Schmelzeisen
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from typing import Optional, Tuple
+
+from nasty._util.codec import Codec, GzipCodec, ZstdCodec
+from nasty._util.json_ import read_json_lines, write_jsonl_lines
+from nasty.tweet.tweet import Tweet
+
+from ._fixtures import synthetic_tweets
+from ._harness import BenchmarkContext, BenchmarkFunc, benchmark
+
+_NUM_TWEETS = 10_000
+
+
+def _suffix(use_lzma: bool, codec: Optional[Codec]) -> str:
+    if codec is not None:
+        return codec.suffix
+    return ".xz" if use_lzma else ""
+
+
+def _write_benchmark(
+    context: BenchmarkContext, *, use_lzma: bool = False, codec: Optional[Codec] = None
+) -> Tuple[BenchmarkFunc, int]:
+    tweets = synthetic_tweets(context.scaled(_NUM_TWEETS))
+    file = context.benchmark_dir("io") / "write.jsonl{}".format(
+        _suffix(use_lzma, codec)
+    )
+
+    def run() -> None:
+        write_jsonl_lines(
+            file, tweets, overwrite_existing=True, use_lzma=use_lzma, codec=codec
+        )
+
+    return run, len(tweets)
+
+
+def _read_benchmark(
+    context: BenchmarkContext, *, use_lzma: bool = False, codec: Optional[Codec] = None
+) -> Tuple[BenchmarkFunc, int]:
+    tweets = synthetic_tweets(context.scaled(_NUM_TWEETS))
+    file = context.benchmark_dir("io") / "read.jsonl{}".format(_suffix(use_lzma, codec))
+    write_jsonl_lines(
+        file, tweets, overwrite_existing=True, use_lzma=use_lzma, codec=codec
+    )
+
+    def run() -> None:
+        for _ in read_json_lines(file, Tweet, use_lzma=use_lzma, codec=codec):
+            pass
+
+    return run, len(tweets)
+
+
+@benchmark("io.write_jsonl_lines")
+def write_jsonl(context: BenchmarkContext) -> Tuple[BenchmarkFunc, int]:
+    return _write_benchmark(context, use_lzma=False)
+
+
+@benchmark("io.write_jsonl_lines.lzma")
+def write_jsonl_lzma(context: BenchmarkContext) -> Tuple[BenchmarkFunc, int]:
+    return _write_benchmark(context, use_lzma=True)
+
+
+@benchmark("io.read_json_lines")
+def read_jsonl(context: BenchmarkContext) -> Tuple[BenchmarkFunc, int]:
+    return _read_benchmark(context, use_lzma=False)
+
+
+@benchmark("io.read_json_lines.lzma")
+def read_jsonl_lzma(context: BenchmarkContext) -> Tuple[BenchmarkFunc, int]:
+    return _read_benchmark(context, use_lzma=True)
+
+
+@benchmark("io.write_jsonl_lines.zstd")
+def write_jsonl_zstd(context: BenchmarkContext) -> Tuple[BenchmarkFunc, int]:
+    return _write_benchmark(context, codec=ZstdCodec())
+
+
+@benchmark("io.read_json_lines.zstd")
+def read_jsonl_zstd(context: BenchmarkContext) -> Tuple[BenchmarkFunc, int]:
+    return _read_benchmark(context, codec=ZstdCodec())
+
+
+@benchmark("io.write_jsonl_lines.gzip")
+def write_jsonl_gzip(context: BenchmarkContext) -> Tuple[BenchmarkFunc, int]:
+    return _write_benchmark(context, codec=GzipCodec())
+
+
+@benchmark("io.read_json_lines.gzip")
+def read_jsonl_gzip(context: BenchmarkContext) -> Tuple[BenchmarkFunc, int]:
+    return _read_benchmark(context, codec=GzipCodec())
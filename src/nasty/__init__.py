@@ -32,20 +32,28 @@ from nasty.__main__ import main
 from nasty.batch.batch import Batch
 from nasty.batch.batch_entry import BatchEntry
 from nasty.batch.batch_results import BatchResults
+from nasty.batch.results_layout import ResultsLayout
 from nasty.request.conversation_request import ConversationRequest
 from nasty.request.replies import Replies
 from nasty.request.request import DEFAULT_BATCH_SIZE, DEFAULT_MAX_TWEETS, Request
 from nasty.request.search import DEFAULT_FILTER, Search, SearchFilter
+from nasty.request.search_planner import (
+    HistoricalVolumeEstimator,
+    ProbeVolumeEstimator,
+    SearchPlanner,
+    VolumeEstimator,
+)
 from nasty.request.thread import Thread
 from nasty.tweet.conversation_tweet_stream import ConversationTweetStream
 from nasty.tweet.tweet import Tweet, TweetId, User, UserId
-from nasty.tweet.tweet_stream import TweetStream
+from nasty.tweet.tweet_stream import AsyncTweetStream, TweetStream
 
 __all__ = [
     "main",
     "Batch",
     "BatchEntry",
     "BatchResults",
+    "ResultsLayout",
     "ConversationRequest",
     "Replies",
     "DEFAULT_BATCH_SIZE",
@@ -54,6 +62,10 @@ __all__ = [
     "DEFAULT_FILTER",
     "Search",
     "SearchFilter",
+    "HistoricalVolumeEstimator",
+    "ProbeVolumeEstimator",
+    "SearchPlanner",
+    "VolumeEstimator",
     "Thread",
     "ConversationTweetStream",
     "Tweet",
@@ -61,6 +73,7 @@ __all__ = [
     "User",
     "UserId",
     "TweetStream",
+    "AsyncTweetStream",
 ]
 
 # Don't show log messages in applications that don't configure logging.
@@ -14,12 +14,12 @@
 # limitations under the License.
 #
 
-import json
 import sys
 from datetime import date
 from pathlib import Path
-from typing import Mapping, Optional
+from typing import Iterable, Mapping, Optional, cast
 
+from more_itertools import chunked
 from nasty_utils import (
     Argument,
     ArgumentGroup,
@@ -33,9 +33,12 @@ from pydantic import validator
 
 import nasty
 from nasty._settings import NastySettings
+from nasty._util.codec import Codec
+from nasty._util.json_ import dumps, loads
 from nasty._util.tweepy_ import statuses_lookup
 from nasty.batch.batch import Batch
 from nasty.batch.batch_results import BatchResults
+from nasty.batch.results_layout import ResultsLayout
 from nasty.request.replies import Replies
 from nasty.request.request import DEFAULT_BATCH_SIZE, Request
 from nasty.request.search import DEFAULT_FILTER, Search, SearchFilter
@@ -105,13 +108,11 @@ class RequestProgram(Program):
         request = self._build_request()
         if self.to_batch:
             batch = Batch()
-            if self.to_batch.exists():
-                batch.load(self.to_batch)
             self._batch_submit(batch, request)
-            batch.dump(self.to_batch)
+            batch.dump(self.to_batch, append=True)
         else:
             for tweet in request.request():
-                sys.stdout.write(json.dumps(tweet.to_json()) + "\n")
+                sys.stdout.write(dumps(tweet.to_json()) + "\n")
 
     def _build_request(self) -> Request:
         raise NotImplementedError()
@@ -204,6 +205,34 @@ class SearchProgram(RequestProgram):
             raise ValueError("-d/--daily requires -s/--since and -u/--until.")
         return v
 
+    adaptive: Optional[int] = Argument(
+        alias="adaptive",
+        description=(
+            "For a request with since and until date, append search requests for "
+            "time windows that each contain about N Tweets, as estimated via probe "
+            "requests. Busy days are split into multiple requests and quiet days are "
+            "merged into one."
+        ),
+        metavar="N",
+        group=_BATCH_ARGUMENT_GROUP,
+    )
+
+    @validator("adaptive")
+    def _adaptive_validator(
+        cls, v: Optional[int], values: Mapping[str, object]  # noqa:N805
+    ) -> Optional[int]:
+        if v is None:
+            return v
+        if v <= 0:
+            raise ValueError("--adaptive requires a positive number of Tweets.")
+        if not values["to_batch"]:
+            raise ValueError("--adaptive requires -b/--to-batch.")
+        if values["since"] is None or values["until"] is None:
+            raise ValueError("--adaptive requires -s/--since and -u/--until.")
+        if values.get("daily"):
+            raise ValueError("--adaptive can not be combined with -d/--daily.")
+        return v
+
     @overrides
     def _build_request(self) -> Search:
         return Search(
@@ -222,6 +251,9 @@ class SearchProgram(RequestProgram):
         if self.daily:
             for daily_request in request.to_daily_requests():
                 super()._batch_submit(batch, daily_request)
+        elif self.adaptive:
+            for adaptive_request in request.to_adaptive_requests(self.adaptive):
+                super()._batch_submit(batch, adaptive_request)
         else:
             super()._batch_submit(batch, request)
 
@@ -299,6 +331,7 @@ class BatchProgram(Program):
         title = "batch"
         aliases = ("b",)
         description = "Execute previously created batch of requests."
+        arbitrary_types_allowed = True  # For Codec.
 
     settings: NastySettings = Argument(
         alias="config", description="Overwrite default config file path."
@@ -320,11 +353,83 @@ class BatchProgram(Program):
         group=_BATCH_ARGUMENT_GROUP,
     )
 
+    codec: Optional[Codec] = Argument(
+        description=(
+            "Compression of written data files as NAME[:LEVEL[:DICT]], e.g., xz, "
+            "gzip:9, none, or zstd:19:tweets.zstd-dict. Defaults to NASTY_CODEC, or "
+            "xz. Completed requests keep the compression they were written with."
+        ),
+        metavar="CODEC",
+        group=_BATCH_ARGUMENT_GROUP,
+    )
+
+    @validator("codec", pre=True)
+    def _codec_validator(cls, v: Optional[str]) -> Optional[Codec]:  # noqa: N805
+        return Codec.parse(v) if v else None
+
     @overrides
     def run(self) -> None:
         batch = Batch()
         batch.load(self.batch_file)
-        batch.execute(self.results_dir)
+        batch.execute(self.results_dir, codec=self.codec)
+
+
+_SUBMIT_ARGUMENT_GROUP = ArgumentGroup(
+    name="Submit Arguments",
+    description=(
+        "Requests are read line-by-line in JSON (as they are stored in batch files, "
+        'e.g., {"type": "Search", "query": "trump", "filter": "TOP", "lang": "en"}) '
+        "from stdin, or from a requests file if given."
+    ),
+)
+
+# Number of requests appended to the batch file at once.
+_SUBMIT_CHUNK_SIZE = 10_000
+
+
+class SubmitProgram(Program):
+    class Config(ProgramConfig):
+        title = "submit"
+        description = "Append many requests to a batch file at once."
+
+    settings: NastySettings = Argument(
+        alias="config", description="Overwrite default config file path."
+    )
+
+    batch_file: Path = Argument(
+        alias="batch-file",
+        short_alias="b",
+        description="Batch file to which requests will be appended.",
+        metavar="FILE",
+        group=_SUBMIT_ARGUMENT_GROUP,
+    )
+
+    requests_file: Optional[Path] = Argument(
+        alias="requests-file",
+        short_alias="f",
+        description="JSONL file of requests to read instead of stdin.",
+        metavar="FILE",
+        group=_SUBMIT_ARGUMENT_GROUP,
+    )
+
+    @overrides
+    def run(self) -> None:
+        if self.requests_file:
+            with self.requests_file.open("r", encoding="UTF-8") as fin:
+                self._submit(fin)
+        else:
+            self._submit(sys.stdin)
+
+    def _submit(self, lines: Iterable[str]) -> None:
+        requests = (
+            Request.from_json(cast(Mapping[str, object], loads(line)))
+            for line in lines
+            if line.strip()
+        )
+        for chunk in chunked(requests, _SUBMIT_CHUNK_SIZE):
+            batch = Batch()
+            batch.extend(chunk)
+            batch.dump(self.batch_file, append=True)
 
 
 _IDIFY_ARGUMENT_GROUP = ArgumentGroup(
@@ -381,7 +486,9 @@ class IdifyProgram(Program):
             batch_results.idify(self.out_dir if self.out_dir else self.in_dir)
         else:
             for line in sys.stdin:
-                sys.stdout.write(str(Tweet(json.loads(line)).id) + "\n")
+                sys.stdout.write(
+                    str(Tweet(cast(Mapping[str, object], loads(line))).id) + "\n"
+                )
 
 
 _UNIDIFY_ARGUMENT_GROUP = ArgumentGroup(
@@ -446,7 +553,51 @@ class UnidifyProgram(Program):
                 (TweetId(line.strip()) for line in sys.stdin), self.settings.twitter_api
             ):
                 if tweet is not None:
-                    sys.stdout.write(json.dumps(tweet.to_json()) + "\n")
+                    sys.stdout.write(dumps(tweet.to_json()) + "\n")
+
+
+_MIGRATE_ARGUMENT_GROUP = ArgumentGroup(
+    name="Migrate Arguments",
+    description="Control which results directory is migrated to which layout.",
+)
+
+
+class MigrateProgram(Program):
+    class Config(ProgramConfig):
+        title = "migrate"
+        description = (
+            "Rearrange the files of a results directory into another layout. Do not "
+            "run while executing a batch into the directory."
+        )
+
+    settings: NastySettings = Argument(
+        alias="config", description="Overwrite default config file path."
+    )
+
+    results_dir: Path = Argument(
+        alias="results-dir",
+        short_alias="r",
+        description="Directory with results of a batch of requests.",
+        metavar="DIR",
+        group=_MIGRATE_ARGUMENT_GROUP,
+    )
+
+    layout: ResultsLayout = Argument(
+        ResultsLayout.SHARDED,
+        alias="layout",
+        short_alias="l",
+        description=(
+            "Layout to migrate to: 'sharded' distributes entries over nested "
+            "directories, 'flat' puts them all into the results directory. Defaults "
+            "to 'sharded'."
+        ),
+        group=_MIGRATE_ARGUMENT_GROUP,
+    )
+
+    @overrides
+    def run(self) -> None:
+        batch_results = BatchResults(self.results_dir)
+        batch_results.migrate(self.layout)
 
 
 class NastyProgram(Program):
@@ -459,8 +610,10 @@ class NastyProgram(Program):
             RepliesProgram,
             ThreadProgram,
             BatchProgram,
+            SubmitProgram,
             IdifyProgram,
             UnidifyProgram,
+            MigrateProgram,
         )
 
     settings: NastySettings = Argument(
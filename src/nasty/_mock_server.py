@@ -0,0 +1,651 @@
+#
+# Copyright 2019-2020 Lukas Schmelzeisen
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+# Local stand-in for the parts of Twitter that NASTY talks to, so that retrieval, rate
+# limiting, and storage can be load-tested without network access. Start it via
+#
+#     python -m nasty._mock_server --port 8080 --num-tweets 1000
+#
+# and point NASTY at it by setting NASTY_MOCK_SERVER=http://127.0.0.1:8080.
+
+import gzip
+import hashlib
+import random
+import re
+import zlib
+from argparse import ArgumentParser
+from datetime import datetime, timedelta, timezone
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from logging import getLogger
+from socketserver import ThreadingMixIn
+from threading import Lock, Thread
+from time import sleep, time
+from types import TracebackType
+from typing import Any, Counter, Dict, List, Mapping, Optional, Sequence, Tuple, Type
+from urllib.parse import parse_qs, urlsplit
+
+from typing_extensions import Final
+
+from ._util.consts import TWITTER_CREATED_AT_FORMAT
+from ._util.json_ import dumps
+
+logger = getLogger(__name__)
+
+MAIN_JS_PATH: Final = "/responsive-web/client-web/main.0000mock.js"
+BEARER_TOKEN: Final = "mock-bearer-token"
+
+_CONVERSATION_PATH: Final = re.compile(r"/2/timeline/conversation/([0-9]+)\.json")
+_FIRST_TWEET_ID: Final = 1_000_000_000_000_000_000
+_FIRST_CREATED_AT: Final = datetime(2020, 1, 1, tzinfo=timezone.utc)
+_NUM_USERS: Final = 1000
+
+
+class MockTwitterConfig:
+    """Shape of the synthetic timelines and how often the server misbehaves.
+
+    Every search query and every conversation is a timeline of num_tweets Tweets, which
+    are generated deterministically from the seed, the query or Tweet-ID, and their
+    position. Requests are served in batches of the size requested via the "count"
+    parameter. Search timelines keep returning empty batches once they are exhausted,
+    just like Twitter does.
+
+    The *_probability-arguments give the chance with which individual requests (or
+    individual timeline entries for tombstones and missing meta information) are
+    answered abnormally. Independently of these, each guest token may only be used for
+    session_rate_limit requests per rate_limit_window seconds, after which requests are
+    answered with HTTP 429.
+    """
+
+    def __init__(
+        self,
+        *,
+        num_tweets: int = 200,
+        crawl_delay: float = 1.0,
+        session_rate_limit: int = 180,
+        rate_limit_window: float = 900.0,
+        rate_limit_probability: float = 0.0,
+        forbidden_probability: float = 0.0,
+        server_error_probability: float = 0.0,
+        empty_batch_probability: float = 0.0,
+        tombstone_probability: float = 0.0,
+        missing_meta_probability: float = 0.0,
+        latency: float = 0.0,
+        seed: int = 0,
+    ):
+        self.num_tweets: Final = num_tweets
+        self.crawl_delay: Final = crawl_delay
+        self.session_rate_limit: Final = session_rate_limit
+        self.rate_limit_window: Final = rate_limit_window
+        self.rate_limit_probability: Final = rate_limit_probability
+        self.forbidden_probability: Final = forbidden_probability
+        self.server_error_probability: Final = server_error_probability
+        self.empty_batch_probability: Final = empty_batch_probability
+        self.tombstone_probability: Final = tombstone_probability
+        self.missing_meta_probability: Final = missing_meta_probability
+        self.latency: Final = latency
+        self.seed: Final = seed
+
+
+class _GuestTokenQuota:
+    def __init__(self, limit: int, window: float):
+        self.limit: Final = limit
+        self.remaining = limit
+        self.reset = time() + window
+
+
+class _Response:
+    def __init__(
+        self,
+        status: HTTPStatus,
+        body: bytes = b"",
+        *,
+        content_type: str = "application/json; charset=utf-8",
+        headers: Optional[Mapping[str, str]] = None,
+    ):
+        self.status: Final = status
+        self.body: Final = body
+        self.content_type: Final = content_type
+        self.headers: Final = dict(headers or {})
+
+
+class MockTwitterServer:
+    """Threaded HTTP server emulating Twitter's web endpoints used by the Retrievers.
+
+    Serves robots.txt, the HTML stubs that hand out guest tokens, the main.js carrying
+    the bearer token, the search endpoint (/2/search/adaptive.json), and the
+    conversation endpoint (/2/timeline/conversation/<id>.json), for both the replies
+    and the thread of a Tweet.
+
+    Can be used as a context manager, which serves requests in a background thread.
+    status_counts counts the responses sent, per endpoint and status code.
+    """
+
+    def __init__(
+        self,
+        config: Optional[MockTwitterConfig] = None,
+        *,
+        host: str = "127.0.0.1",
+        port: int = 0,
+    ):
+        self.config: Final = config or MockTwitterConfig()
+        self.timelines: Final = MockTimelines(self.config)
+        self.status_counts: Final[Counter[Tuple[str, int]]] = Counter()
+
+        self._lock: Final = Lock()
+        self._random: Final = random.Random(self.config.seed)
+        self._quotas: Dict[str, _GuestTokenQuota] = {}
+        self._next_guest_token = 1
+        self._thread: Optional[Thread] = None
+
+        server = self
+
+        class Handler(_MockTwitterRequestHandler):
+            mock_server = server
+
+        self._http_server: Final = _ThreadingHTTPServer((host, port), Handler)
+
+    @property
+    def url(self) -> str:
+        host, port = self._http_server.server_address[:2]
+        return "http://{}:{}".format(host, port)
+
+    def serve_forever(self) -> None:
+        logger.info("Serving mock Twitter on {}.".format(self.url))
+        self._http_server.serve_forever()
+
+    def start(self) -> None:
+        self._thread = Thread(
+            target=self._http_server.serve_forever,
+            name="nasty-mock-server",
+            daemon=True,
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._http_server.shutdown()
+        self._http_server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self) -> "MockTwitterServer":
+        self.start()
+        return self
+
+    def __exit__(
+        self,
+        exc_type: Optional[Type[BaseException]],
+        exc_value: Optional[BaseException],
+        traceback: Optional[TracebackType],
+    ) -> None:
+        self.stop()
+
+    def handle(
+        self, path: str, params: Mapping[str, str], headers: Mapping[str, str]
+    ) -> _Response:
+        """Computes the response to a GET request."""
+        if self.config.latency > 0.0:
+            sleep(self.config.latency)
+        endpoint, response = self._route(path, params, headers)
+        with self._lock:
+            self.status_counts[(endpoint, response.status.value)] += 1
+        return response
+
+    def _route(
+        self, path: str, params: Mapping[str, str], headers: Mapping[str, str]
+    ) -> Tuple[str, _Response]:
+        if path == "/robots.txt":
+            return "robots.txt", self._robots_txt()
+        if path == "/search" or path.startswith("/_/status/"):
+            return "stub", self._timeline_stub()
+        if path == MAIN_JS_PATH:
+            return "main.js", self._main_js()
+
+        conversation = _CONVERSATION_PATH.fullmatch(path)
+        if path == "/2/search/adaptive.json":
+            endpoint = "search"
+        elif conversation:
+            endpoint = "conversation"
+        else:
+            return "unknown", _Response(HTTPStatus.NOT_FOUND)
+
+        error, rate_limit_headers = self._check_api_request(headers)
+        if error is not None:
+            return endpoint, _Response(error, headers=rate_limit_headers)
+
+        count = int(params.get("count", "20"))
+        cursor = params.get("cursor")
+        empty = self._chance(self.config.empty_batch_probability)
+        if conversation:
+            json = self.timelines.conversation_batch(
+                conversation.group(1), cursor, count, empty=empty
+            )
+        else:
+            json = self.timelines.search_batch(
+                params.get("q", ""), cursor, count, empty=empty
+            )
+        return (
+            endpoint,
+            _Response(
+                HTTPStatus.OK, dumps(json).encode("UTF-8"), headers=rate_limit_headers
+            ),
+        )
+
+    def _robots_txt(self) -> _Response:
+        return _Response(
+            HTTPStatus.OK,
+            "User-agent: *\nCrawl-delay: {}\n".format(self.config.crawl_delay).encode(),
+            content_type="text/plain",
+        )
+
+    def _timeline_stub(self) -> _Response:
+        with self._lock:
+            guest_token = str(self._next_guest_token)
+            self._next_guest_token += 1
+            self._quotas[guest_token] = _GuestTokenQuota(
+                self.config.session_rate_limit, self.config.rate_limit_window
+            )
+        html = (
+            '<html><head><script src="https://abs.twimg.com{}"></script><script>'
+            'document.cookie = decodeURIComponent("gt={}; Max-Age=10800; Domain=.'
+            'twitter.com; Path=/; Secure");</script></head></html>'
+        ).format(MAIN_JS_PATH, guest_token)
+        return _Response(
+            HTTPStatus.OK, html.encode(), content_type="text/html; charset=utf-8"
+        )
+
+    def _main_js(self) -> _Response:
+        return _Response(
+            HTTPStatus.OK,
+            'e="Web-12",t="{}"'.format(BEARER_TOKEN).encode(),
+            content_type="application/javascript",
+        )
+
+    def _check_api_request(
+        self, headers: Mapping[str, str]
+    ) -> Tuple[Optional[HTTPStatus], Mapping[str, str]]:
+        if headers.get("authorization") != "Bearer " + BEARER_TOKEN:
+            return HTTPStatus.FORBIDDEN, {}
+
+        with self._lock:
+            quota = self._quotas.get(headers.get("x-guest-token", ""))
+            if quota is None:
+                return HTTPStatus.FORBIDDEN, {}
+
+            now = time()
+            if quota.reset <= now:
+                quota.remaining = quota.limit
+                quota.reset = now + self.config.rate_limit_window
+            exhausted = quota.remaining == 0
+            quota.remaining = max(0, quota.remaining - 1)
+            rate_limit_headers = {
+                "X-Rate-Limit-Limit": str(quota.limit),
+                "X-Rate-Limit-Remaining": str(quota.remaining),
+                "X-Rate-Limit-Reset": str(int(quota.reset)),
+            }
+
+        if exhausted or self._chance(self.config.rate_limit_probability):
+            return HTTPStatus.TOO_MANY_REQUESTS, rate_limit_headers
+        if self._chance(self.config.forbidden_probability):
+            return HTTPStatus.FORBIDDEN, rate_limit_headers
+        if self._chance(self.config.server_error_probability):
+            return HTTPStatus.SERVICE_UNAVAILABLE, rate_limit_headers
+        return None, rate_limit_headers
+
+    def _chance(self, probability: float) -> bool:
+        if probability <= 0.0:
+            return False
+        with self._lock:
+            return self._random.random() < probability
+
+
+class MockTimelines:
+    """Generates the batches of the synthetic timelines described by a config.
+
+    Used by the MockTwitterServer, but also usable on its own, e.g., to obtain batch
+    JSON for benchmarks.
+    """
+
+    def __init__(self, config: MockTwitterConfig):
+        self.config: Final = config
+
+    def search_batch(
+        self, query: str, cursor: Optional[str], count: int, *, empty: bool = False
+    ) -> Mapping[str, object]:
+        offset = _parse_cursor(cursor, "scroll")
+        timeline = _Timeline(self.config, "search:" + query)
+        positions = [] if empty else timeline.positions(offset, count)
+        next_offset = offset + len(positions)
+
+        entries: List[Mapping[str, object]] = []
+        for position in positions:
+            entry_content: Mapping[str, object]
+            tweet = {"id": timeline.tweet_id(position), "displayType": "Tweet"}
+            if timeline.is_tombstone(position):
+                # Search results only contain tombstones for Tweets that are still
+                # accessible, i.e., the Tweet is referenced and has meta information.
+                entry_content = {
+                    "tombstone": {
+                        "displayType": "NonCompliant",
+                        "tombstoneInfo": {"text": "This Tweet violated the Rules."},
+                        "tweet": tweet,
+                    }
+                }
+            else:
+                entry_content = {"tweet": tweet}
+            entries.append(
+                {
+                    "entryId": "sq-I-t-" + timeline.tweet_id(position),
+                    "sortIndex": str(999999 - position),
+                    "content": {"item": {"content": entry_content}},
+                }
+            )
+        cursor_entry = {
+            "entryId": "sq-cursor-bottom",
+            "sortIndex": "0",
+            "content": {
+                "operation": {
+                    "cursor": {"value": "scroll:{}".format(next_offset)},
+                    "cursorType": "Bottom",
+                }
+            },
+        }
+
+        instructions: List[Mapping[str, object]]
+        if cursor is None:
+            instructions = [{"addEntries": {"entries": entries + [cursor_entry]}}]
+        else:
+            instructions = [
+                {"addEntries": {"entries": entries}},
+                {
+                    "replaceEntry": {
+                        "entryIdToReplace": "sq-cursor-bottom",
+                        "entry": cursor_entry,
+                    }
+                },
+            ]
+        return {
+            "globalObjects": timeline.global_objects(positions, with_tombstones=True),
+            "timeline": {
+                "id": "search-{}".format(zlib.crc32(query.encode())),
+                "instructions": instructions,
+            },
+        }
+
+    def conversation_batch(
+        self, tweet_id: str, cursor: Optional[str], count: int, *, empty: bool = False
+    ) -> Mapping[str, object]:
+        # Both RepliesRetriever and ThreadRetriever query this endpoint. The first batch
+        # serves both: the first conversation thread is the author's own thread (of
+        # which ThreadRetriever follows the "-show_more_cursor"), and all conversation
+        # threads start with a reply (of which RepliesRetriever follows the
+        # "cursor-bottom-" entry). The cursors remember which of the two is followed.
+        timeline = _Timeline(self.config, "conversation:" + tweet_id)
+        instructions: List[Mapping[str, object]]
+
+        if cursor is not None and cursor.startswith("thread:"):
+            offset = _parse_cursor(cursor, "thread")
+            positions = [] if empty else timeline.positions(offset, count)
+            items = [_conversation_item(timeline, p) for p in positions]
+            if positions and offset + len(positions) < timeline.num_tweets:
+                items.append(
+                    _show_more_item(tweet_id, offset + len(positions), len(positions))
+                )
+            instructions = [{"addToModule": {"moduleItems": items}}]
+
+        else:
+            offset = _parse_cursor(cursor, "replies")
+            positions = [] if empty else timeline.positions(offset, count)
+            entries: List[Mapping[str, object]] = []
+            if cursor is None:
+                entries.append(
+                    {
+                        "entryId": "tweet-" + tweet_id,
+                        "sortIndex": "9999999999",
+                        "content": {
+                            "item": {"content": {"tweet": {"id": tweet_id}}},
+                        },
+                    }
+                )
+            for i, position in enumerate(positions):
+                items = [_conversation_item(timeline, position)]
+                if cursor is None and i == 0 and len(positions) < timeline.num_tweets:
+                    items.append(_show_more_item(tweet_id, 1, len(positions)))
+                entries.append(
+                    {
+                        "entryId": "conversationThread-" + timeline.tweet_id(position),
+                        "sortIndex": str(999999 - position),
+                        "content": {"timelineModule": {"items": items}},
+                    }
+                )
+            if empty or offset + len(positions) < timeline.num_tweets:
+                entries.append(
+                    {
+                        "entryId": "cursor-bottom-{}".format(offset),
+                        "sortIndex": "0",
+                        "content": {
+                            "operation": {
+                                "cursor": {
+                                    "value": "replies:{}".format(
+                                        offset + len(positions)
+                                    ),
+                                    "cursorType": "Bottom",
+                                }
+                            }
+                        },
+                    }
+                )
+            instructions = [{"addEntries": {"entries": entries}}]
+
+        return {
+            "globalObjects": timeline.global_objects(positions, with_tombstones=False),
+            "timeline": {
+                "id": "Conversation-" + tweet_id,
+                "instructions": instructions,
+            },
+        }
+
+
+class _Timeline:
+    def __init__(self, config: MockTwitterConfig, key: str):
+        self.config: Final = config
+        self.num_tweets: Final = config.num_tweets
+        self._hash: Final = zlib.crc32("{}:{}".format(config.seed, key).encode())
+
+    def positions(self, offset: int, count: int) -> Sequence[int]:
+        return range(offset, min(offset + count, self.num_tweets))
+
+    def tweet_id(self, position: int) -> str:
+        # Distinct timelines should (mostly) not share Tweet-IDs.
+        return str(_FIRST_TWEET_ID + (self._hash << 24) + position)
+
+    def is_tombstone(self, position: int) -> bool:
+        return self._chance(position, 1, self.config.tombstone_probability)
+
+    def has_meta(self, position: int) -> bool:
+        return not self._chance(position, 2, self.config.missing_meta_probability)
+
+    def _chance(self, position: int, salt: int, probability: float) -> bool:
+        if probability <= 0.0:
+            return False
+        digest = hashlib.blake2b(
+            "{}:{}:{}".format(self._hash, position, salt).encode(), digest_size=8
+        ).digest()
+        return int.from_bytes(digest, "big") / float(2 ** 64) < probability
+
+    def global_objects(
+        self, positions: Sequence[int], *, with_tombstones: bool
+    ) -> Mapping[str, object]:
+        tweets: Dict[str, object] = {}
+        users: Dict[str, object] = {}
+        for position in positions:
+            if not self.has_meta(position) or (
+                not with_tombstones and self.is_tombstone(position)
+            ):
+                continue
+            tweet = self._tweet_json(position)
+            tweets[tweet["id_str"]] = tweet
+            user_id = tweet["user_id_str"]
+            users[user_id] = _user_json(user_id)
+        return {"tweets": tweets, "users": users}
+
+    def _tweet_json(self, position: int) -> Dict[str, Any]:
+        tweet_id = self.tweet_id(position)
+        user_id = str(1 + (self._hash + position) % _NUM_USERS)
+        created_at = _FIRST_CREATED_AT + timedelta(minutes=position)
+        text = "Synthetic Tweet #{} of timeline {:08x}.".format(position, self._hash)
+        return {
+            "created_at": created_at.strftime(TWITTER_CREATED_AT_FORMAT),
+            "id": int(tweet_id),
+            "id_str": tweet_id,
+            "full_text": text,
+            "truncated": False,
+            "display_text_range": [0, len(text)],
+            "entities": {
+                "hashtags": [],
+                "symbols": [],
+                "user_mentions": [],
+                "urls": [],
+            },
+            "source": '<a href="https://mobile.twitter.com">Twitter Web App</a>',
+            "user_id": int(user_id),
+            "user_id_str": user_id,
+            "retweet_count": position % 7,
+            "favorite_count": position % 13,
+            "reply_count": position % 3,
+            "quote_count": 0,
+            "conversation_id_str": tweet_id,
+            "lang": "en",
+        }
+
+
+def _user_json(user_id: str) -> Mapping[str, object]:
+    return {
+        "id": int(user_id),
+        "id_str": user_id,
+        "name": "Mock User {}".format(user_id),
+        "screen_name": "mock_user_{}".format(user_id),
+        "location": "",
+        "description": "",
+        "followers_count": int(user_id),
+        "friends_count": 0,
+        "created_at": _FIRST_CREATED_AT.strftime(TWITTER_CREATED_AT_FORMAT),
+        "verified": False,
+    }
+
+
+def _conversation_item(timeline: _Timeline, position: int) -> Mapping[str, object]:
+    tweet_id = timeline.tweet_id(position)
+    content: Mapping[str, object]
+    if timeline.is_tombstone(position):
+        content = {"tombstone": {"displayType": "Inline", "epitaph": "Suspended"}}
+    else:
+        content = {"tweet": {"id": tweet_id, "displayType": "SelfThread"}}
+    return {"entryId": "tweet-" + tweet_id, "item": {"content": content}}
+
+
+def _show_more_item(tweet_id: str, offset: int, count: int) -> Mapping[str, object]:
+    return {
+        "entryId": "conversationThread-{}-show_more_cursor".format(tweet_id),
+        "item": {
+            "content": {
+                "timelineCursor": {
+                    "value": "thread:{}".format(offset),
+                    "cursorType": "ShowMore",
+                    "displayTreatment": {"actionText": "{} more replies".format(count)},
+                }
+            }
+        },
+    }
+
+
+def _parse_cursor(cursor: Optional[str], prefix: str) -> int:
+    if cursor is None or not cursor.startswith(prefix + ":"):
+        return 0
+    return int(cursor[len(prefix) + 1 :])
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class _MockTwitterRequestHandler(BaseHTTPRequestHandler):
+    mock_server: MockTwitterServer
+    protocol_version = "HTTP/1.1"  # Keep connections alive.
+
+    def do_GET(self) -> None:  # noqa: N802
+        url = urlsplit(self.path)
+        params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        headers = {key.lower(): value for key, value in self.headers.items()}
+
+        response = self.mock_server.handle(url.path, params, headers)
+        body = response.body
+        if body and "gzip" in headers.get("accept-encoding", ""):
+            body = gzip.compress(body, compresslevel=1)
+            response.headers["Content-Encoding"] = "gzip"
+
+        self.send_response(response.status.value)
+        self.send_header("Content-Type", response.content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in response.headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args: Any) -> None:  # noqa: A002
+        logger.debug(format % args)
+
+
+def main() -> None:
+    parser = ArgumentParser(description="Serve a local stand-in for Twitter.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--num-tweets", type=int, default=200)
+    parser.add_argument("--crawl-delay", type=float, default=1.0)
+    parser.add_argument("--session-rate-limit", type=int, default=180)
+    parser.add_argument("--rate-limit-probability", type=float, default=0.0)
+    parser.add_argument("--forbidden-probability", type=float, default=0.0)
+    parser.add_argument("--server-error-probability", type=float, default=0.0)
+    parser.add_argument("--empty-batch-probability", type=float, default=0.0)
+    parser.add_argument("--tombstone-probability", type=float, default=0.0)
+    parser.add_argument("--missing-meta-probability", type=float, default=0.0)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    config = MockTwitterConfig(
+        num_tweets=args.num_tweets,
+        crawl_delay=args.crawl_delay,
+        session_rate_limit=args.session_rate_limit,
+        rate_limit_probability=args.rate_limit_probability,
+        forbidden_probability=args.forbidden_probability,
+        server_error_probability=args.server_error_probability,
+        empty_batch_probability=args.empty_batch_probability,
+        tombstone_probability=args.tombstone_probability,
+        missing_meta_probability=args.missing_meta_probability,
+        latency=args.latency,
+        seed=args.seed,
+    )
+    server = MockTwitterServer(config, host=args.host, port=args.port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,426 @@
+#
+# Copyright 2019-2020 Lukas Schmelzeisen
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import asyncio
+from abc import ABC
+from http import HTTPStatus
+from logging import getLogger
+from os import getenv
+from time import monotonic
+from typing import Any, Awaitable, Callable, Mapping, Optional, Sequence, TypeVar, cast
+from urllib.parse import urlparse
+
+from overrides import overrides
+from requests.exceptions import RetryError
+from typing_extensions import Final, final
+
+from .._util.errors import UnexpectedStatusCodeException
+from .._util.json_ import loads
+from .._util.metrics import (
+    GUEST_SESSIONS,
+    HTTP_REQUEST_DURATION,
+    HTTP_REQUESTS,
+    HTTP_RESPONSE_BYTES,
+    SLEEP_SECONDS,
+)
+from ..request.replies import Replies
+from ..request.request import Request
+from ..request.search import Search
+from ..request.thread import Thread
+from ..tweet.tweet import Tweet
+from ..tweet.tweet_stream import AsyncTweetStream
+from .rate_limiter import RATE_LIMITER
+from .replay import (
+    NoRecordedResponseException,
+    RecordedResponse,
+    replay_store,
+    transport_mode,
+)
+from .replies_retriever import RepliesRetriever
+from .retriever import (
+    ACCEPT_LANGUAGE,
+    ROBOTS_TXT_URL,
+    USER_AGENT,
+    FetchAttempts,
+    Retriever,
+    RetrieverBatch,
+    cached_crawl_delay,
+    parse_main_js,
+    parse_timeline_stub,
+    update_crawl_delay,
+)
+from .search_retriever import SearchRetriever
+from .session_pool import GUEST_SESSION_POOL, GuestSession
+from .thread_retriever import ThreadRetriever
+from .transport import (
+    MAX_RETRIES,
+    RETRY_BACKOFF_FACTOR,
+    RETRY_STATUS_CODES,
+    accept_encoding,
+    pool_size,
+    timeouts,
+    twitter_url,
+    use_http2,
+)
+
+try:
+    import httpx
+except ImportError as e:  # pragma: no cover
+    raise ImportError(
+        "The asyncio retrieval engine requires httpx to be installed. Install it via "
+        "'pip install nasty[async]'."
+    ) from e
+
+logger = getLogger(__name__)
+
+_T_Request = TypeVar("_T_Request", bound=Request)
+
+
+class AsyncRetrieverTweetStream(AsyncTweetStream):
+    def __init__(
+        self,
+        update_callback: Callable[[], Awaitable[bool]],
+        close_callback: Callable[[], Awaitable[None]],
+    ):
+        self._update_callback: Final = update_callback
+        self._close_callback: Final = close_callback
+        self._tweets: Sequence[Tweet] = []
+        self._tweets_position = 0
+
+    def update_tweets(self, tweets: Sequence[Tweet]) -> None:
+        self._tweets = tweets
+        self._tweets_position = 0
+
+    @overrides
+    async def __anext__(self) -> Tweet:
+        if self._tweets_position == len(self._tweets):
+            try:
+                updated = await self._update_callback()
+            except BaseException:
+                await self.aclose()
+                raise
+            if not updated:
+                await self.aclose()
+                raise StopAsyncIteration()
+
+        self._tweets_position += 1
+        return self._tweets[self._tweets_position - 1]
+
+    @overrides
+    async def aclose(self) -> None:
+        await self._close_callback()
+
+
+class AsyncRetriever(Retriever[_T_Request], ABC):
+    """Retrieves Tweets like the Retriever, but without blocking the calling thread.
+
+    The timeline URLs and the parsing of batches are shared with the synchronous
+    Retriever that a concrete AsyncRetriever derives from. Only network access is
+    replaced: requests are performed via httpx and all waiting (rate limiting, backoff
+    between retries) is done via asyncio, so that thousands of requests can be in
+    flight on a single event loop at the same time.
+    """
+
+    def __init__(self, request: _T_Request):
+        super().__init__(request)
+        self._async_tweet_stream: Final = AsyncRetrieverTweetStream(
+            self._update_async_tweet_stream, self._close_client
+        )
+        self._client: Optional[httpx.AsyncClient] = None
+
+    @overrides
+    def _setup_sync_transport(self) -> None:
+        # Requests are performed via the httpx client of _get_client() instead, and
+        # batches are never prefetched, as they are fetched concurrently anyway.
+        pass
+
+    @property
+    def async_tweet_stream(self) -> AsyncRetrieverTweetStream:
+        return self._async_tweet_stream
+
+    @final
+    async def _update_async_tweet_stream(self) -> bool:
+        if self._request_finished:
+            return False
+
+        try:
+            batch = await self._fetch_non_empty_batch_async()
+        except BaseException:
+            self._end_guest_session(discard=True)
+            raise
+        if batch is None:
+            self._end_guest_session()
+            return False
+
+        self.async_tweet_stream.update_tweets(self._consume_batch(batch))
+        if self._request_finished:
+            self._end_guest_session()
+        return True
+
+    @final
+    async def _fetch_non_empty_batch_async(self) -> Optional[RetrieverBatch]:
+        """Asynchronous version of Retriever._fetch_non_empty_batch()."""
+
+        # Rotate sessions that are about to run into their rate limit, before they
+        # actually do so.
+        if self._guest_session is None or self._guest_session.rate_limited:
+            await self._fetch_new_twitter_session_async()
+
+        attempts = FetchAttempts()
+        while True:
+            try:
+                batch = await self._fetch_batch_async()
+            except RetryError:
+                if not attempts.retry_after_retry_error():
+                    return None
+                await self._fetch_new_twitter_session_async()
+                continue
+            except UnexpectedStatusCodeException as e:
+                wait = self._retry_wait(attempts, e)
+                if wait is None:
+                    await self._fetch_new_twitter_session_async()
+                else:
+                    await asyncio.sleep(wait)
+                continue
+            attempts.fetch_succeeded()
+
+            if batch.tweets:
+                return batch
+            if not attempts.retry_after_empty_batch():
+                return None
+
+    @final
+    async def _fetch_new_twitter_session_async(self) -> None:
+        """Asynchronous version of Retriever._fetch_new_twitter_session()."""
+
+        self._end_guest_session(discard=True)
+
+        guest_session = GUEST_SESSION_POOL.lease()
+        if guest_session is not None:
+            logger.debug("  Reusing pooled Twitter session {}.".format(guest_session))
+            GUEST_SESSIONS.inc("pooled")
+        else:
+            guest_session = await self._establish_guest_session_async()
+            GUEST_SESSIONS.inc("established")
+
+        client = self._reset_client_headers()
+        for name, value in guest_session.cookies.items():
+            client.cookies.set(name, value, domain=".twitter.com", path="/")
+        client.headers["Authorization"] = "Bearer {}".format(guest_session.bearer_token)
+        client.headers["X-Guest-Token"] = guest_session.guest_token
+        self._guest_session = guest_session
+
+    @final
+    async def _establish_guest_session_async(self) -> GuestSession:
+        """Asynchronous version of Retriever._establish_guest_session()."""
+
+        logger.debug("  Establishing new Twitter session.")
+
+        client = self._reset_client_headers()
+
+        response = await self._session_get_async(**self._timeline_url())
+        main_js_url, guest_token = parse_timeline_stub(response.text)
+
+        bearer_token = GUEST_SESSION_POOL.bearer_token(main_js_url)
+        if bearer_token is None:
+            response = await self._session_get_async(main_js_url)
+            bearer_token = parse_main_js(response.text)
+            GUEST_SESSION_POOL.add_bearer_token(main_js_url, bearer_token)
+
+        cookies = {
+            cookie.name: cookie.value
+            for cookie in client.cookies.jar
+            if cookie.value is not None
+        }
+        cookies["gt"] = guest_token
+
+        logger.debug(
+            "    Guest token: {}. Bearer token: {}.".format(guest_token, bearer_token)
+        )
+        return GuestSession(
+            bearer_token=bearer_token, guest_token=guest_token, cookies=cookies
+        )
+
+    @final
+    def _reset_client_headers(self) -> httpx.AsyncClient:
+        client = self._get_client()
+        client.headers.clear()
+        client.cookies.clear()
+        client.headers["User-Agent"] = USER_AGENT
+        client.headers["Accept-Language"] = ACCEPT_LANGUAGE
+        client.headers["Accept-Encoding"] = accept_encoding()
+        return client
+
+    @final
+    async def _fetch_batch_async(self) -> RetrieverBatch:
+        response = await self._session_get_async(**self._batch_url())
+        return self._retriever_batch_type()(
+            cast(Mapping[str, Mapping[str, object]], loads(response.content))
+        )
+
+    @final
+    async def _session_get_async(self, url: str, **kwargs: Any) -> httpx.Response:
+        crawl_delay_ = None
+        if not getenv("NASTY_DISRESPECT_ROBOTSTXT"):
+            crawl_delay_ = cached_crawl_delay()
+            if crawl_delay_ is None:
+                response = await self._client_get(ROBOTS_TXT_URL)
+                crawl_delay_ = update_crawl_delay(response.text)
+
+        delay = RATE_LIMITER.reserve(self._request_rate_limits(url, crawl_delay_))
+        if delay > 0.0:
+            SLEEP_SECONDS.inc("rate_limit", amount=delay)
+            await asyncio.sleep(delay)
+
+        # Requests silently drops parameters that are None, while httpx would send them
+        # as empty values.
+        params = cast(Optional[Mapping[str, object]], kwargs.get("params"))
+        if params is not None:
+            kwargs["params"] = {
+                key: value for key, value in params.items() if value is not None
+            }
+
+        host = urlparse(url).netloc
+        start = monotonic()
+        response = await self._client_get(url, **kwargs)
+        HTTP_REQUEST_DURATION.observe(monotonic() - start, host)
+        HTTP_REQUESTS.inc(host, response.status_code)
+        HTTP_RESPONSE_BYTES.inc(host, amount=len(response.content))
+        if self._guest_session is not None:
+            self._guest_session.update_rate_limit(response.headers)
+
+        status = HTTPStatus(response.status_code)
+        logger.debug(
+            "    Received {} {} for {}".format(status.value, status.name, response.url)
+        )
+        if response.status_code != HTTPStatus.OK.value:
+            raise UnexpectedStatusCodeException(
+                str(response.url), HTTPStatus(response.status_code)
+            )
+
+        return response
+
+    @final
+    async def _client_get(self, url: str, **kwargs: Any) -> httpx.Response:
+        """Performs a GET request with automated retries.
+
+        Emulates the urllib3-Retry configuration of the synchronous Retriever: failed
+        connections and responses with status codes from RETRY_STATUS_CODES are retried
+        up to MAX_RETRIES times with exponential backoff after which a RetryError is
+        raised.
+        """
+        client = self._get_client()
+        for retry in range(MAX_RETRIES + 1):
+            if retry:
+                await asyncio.sleep(RETRY_BACKOFF_FACTOR * (2 ** (retry - 1)))
+
+            try:
+                response = await client.get(twitter_url(url), **kwargs)
+            except httpx.TransportError:
+                if retry == MAX_RETRIES:
+                    raise
+                continue
+
+            if response.status_code not in RETRY_STATUS_CODES:
+                return response
+
+        raise RetryError("Max retries exceeded with URL '{}'.".format(url))
+
+    @final
+    def _get_client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            connect_timeout, read_timeout = timeouts()
+            limits = httpx.Limits(max_keepalive_connections=pool_size())
+            transport: httpx.AsyncBaseTransport = httpx.AsyncHTTPTransport(
+                limits=limits, http2=use_http2()
+            )
+            mode = transport_mode()
+            if mode == "record":
+                transport = _RecordingAsyncTransport(transport)
+            elif mode == "replay":
+                transport = _ReplayAsyncTransport()
+            self._client = httpx.AsyncClient(
+                follow_redirects=True,
+                timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+                limits=limits,
+                transport=transport,
+            )
+        return self._client
+
+    @final
+    async def _close_client(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+        self._end_guest_session()
+
+
+class _RecordingAsyncTransport(httpx.AsyncBaseTransport):
+    # Counterpart of RecordingHTTPAdapter for the AsyncRetriever.
+
+    def __init__(self, transport: httpx.AsyncBaseTransport):
+        self._transport: Final = transport
+
+    @overrides
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        response = await self._transport.handle_async_request(request)
+        content = await response.aread()
+        replay_store().record(
+            request.method,
+            str(request.url),
+            request.content,
+            RecordedResponse(
+                status_code=response.status_code,
+                reason=response.reason_phrase,
+                headers=response.headers.multi_items(),
+                content=content,
+            ),
+        )
+        return response
+
+    @overrides
+    async def aclose(self) -> None:
+        await self._transport.aclose()
+
+
+class _ReplayAsyncTransport(httpx.AsyncBaseTransport):
+    # Counterpart of ReplayHTTPAdapter for the AsyncRetriever.
+
+    @overrides
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        url = str(request.url)
+        recorded = replay_store().replay(request.method, url, request.content)
+        if recorded is None:
+            raise NoRecordedResponseException(request.method, url)
+        return httpx.Response(
+            recorded.status_code,
+            headers=recorded.headers,
+            content=recorded.content,
+            request=request,
+            extensions={"reason_phrase": recorded.reason.encode("ascii")},
+        )
+
+
+class AsyncSearchRetriever(AsyncRetriever[Search], SearchRetriever):
+    pass
+
+
+class AsyncRepliesRetriever(AsyncRetriever[Replies], RepliesRetriever):
+    pass
+
+
+class AsyncThreadRetriever(AsyncRetriever[Thread], ThreadRetriever):
+    pass
@@ -14,14 +14,13 @@
 # limitations under the License.
 #
 
-from abc import ABC, abstractmethod
-from typing import Iterable, Mapping, Type, TypeVar, cast
+from abc import ABC
+from typing import Mapping, Type, TypeVar, cast
 
 from overrides import overrides
 
 from ..request.conversation_request import ConversationRequest
 from ..tweet.conversation_tweet_stream import ConversationTweetStream
-from ..tweet.tweet import TweetId
 from .retriever import Retriever, RetrieverBatch, RetrieverTweetStream
 
 
@@ -31,15 +30,7 @@ class ConversationRetrieverTweetStream(RetrieverTweetStream, ConversationTweetSt
 
 
 class ConversationRetrieverBatch(RetrieverBatch, ABC):
-    def __init__(self, json: Mapping[str, Mapping[str, object]]):
-        # TODO: See if this is necessary for ThreadRetriever
-        self.num_tombstones = 0
-        super().__init__(json)
-
-    @abstractmethod
-    @overrides
-    def _tweet_ids(self) -> Iterable[TweetId]:
-        pass
+    pass
 
 
 _T_ConversationRequest = TypeVar("_T_ConversationRequest", bound=ConversationRequest)
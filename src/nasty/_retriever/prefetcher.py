@@ -0,0 +1,126 @@
+#
+# Copyright 2019-2020 Lukas Schmelzeisen
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from logging import getLogger
+from queue import Empty, Full, Queue
+from threading import Event, Thread
+from typing import Callable, Generic, Optional, TypeVar, Union
+from weakref import WeakMethod
+
+from typing_extensions import Final
+
+logger = getLogger(__name__)
+
+# How often the background thread checks whether it should stop while it waits for the
+# consumer to make room in the queue.
+_POLL_INTERVAL: Final = 0.1
+
+_T_Batch = TypeVar("_T_Batch")
+
+
+class BatchPrefetcher(Generic[_T_Batch]):
+    """Fetches batches in a background thread while the consumer works on earlier ones.
+
+    Batches are fetched via the given fetch-callback, which returns the next batch
+    (e.g., its Tweets) or None, if there are no more batches. At most num_batches
+    batches are kept in memory. Exceptions raised by the callback are reraised by get().
+
+    The background thread only holds weak references to the callbacks' owner (i.e., the
+    Retriever), so that it stops once the owner is garbage collected, for example,
+    because the consumer dropped the TweetStream without calling close().
+    """
+
+    def __init__(
+        self,
+        fetch: Callable[[], Optional[_T_Batch]],
+        stopped: Callable[[], None],
+        num_batches: int,
+    ):
+        if num_batches < 1:
+            raise ValueError(
+                "Number of batches needs to be at least 1, was {}.".format(num_batches)
+            )
+
+        self._fetch: Final = WeakMethod(fetch)
+        self._stopped: Final = WeakMethod(stopped)
+        self._queue: Final[Queue[Union[_T_Batch, BaseException, None]]] = Queue(
+            maxsize=num_batches
+        )
+        self._stop: Final = Event()
+        self._finished = False
+        self._thread: Optional[Thread] = None
+
+    def get(self) -> Optional[_T_Batch]:
+        """Blocks until the next batch is available.
+
+        :return: The next batch or None, if there are no more batches.
+        """
+        if self._finished:
+            return None
+        if self._thread is None:
+            self._thread = Thread(target=self._run, name="nasty-prefetch", daemon=True)
+            self._thread.start()
+
+        item = self._queue.get()
+        if item is None or isinstance(item, BaseException):
+            self._finished = True
+        if isinstance(item, BaseException):
+            raise item
+        return item
+
+    def close(self) -> None:
+        """Stops the background thread once it finishes its current fetch.
+
+        Batches that were already fetched but not consumed are dropped.
+        """
+        self._finished = True
+        self._stop.set()
+        while True:
+            try:
+                self._queue.get_nowait()
+            except Empty:
+                break
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            fetch = self._fetch()
+            if fetch is None:
+                return
+
+            item: Union[_T_Batch, BaseException, None]
+            try:
+                item = fetch()
+            except BaseException as e:
+                item = e
+            del fetch
+
+            if not self._put(item) or item is None or isinstance(item, BaseException):
+                break
+
+        stopped = self._stopped()
+        if stopped is not None:
+            stopped()
+
+    def _put(self, item: Union[_T_Batch, BaseException, None]) -> bool:
+        while not self._stop.is_set():
+            if self._fetch() is None:
+                return False
+            try:
+                self._queue.put(item, timeout=_POLL_INTERVAL)
+                return True
+            except Full:
+                pass
+        return False
@@ -0,0 +1,174 @@
+#
+# Copyright 2019-2020 Lukas Schmelzeisen
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from logging import getLogger
+from os import getenv
+from threading import Lock
+from time import monotonic
+from typing import Callable, Dict, Hashable, List, Optional, Sequence, Tuple
+from urllib.parse import urlparse
+
+from typing_extensions import Final
+
+from .replay import transport_mode
+
+logger = getLogger(__name__)
+
+
+class RateLimit:
+    """Allows rate requests per second on average, with bursts of up to burst many."""
+
+    def __init__(self, rate: float, burst: int = 1):
+        if rate <= 0.0:
+            raise ValueError("Rate needs to be positive, was {}.".format(rate))
+        if burst < 1:
+            raise ValueError("Burst needs to be at least 1, was {}.".format(burst))
+        self.rate: Final = rate
+        self.burst: Final = burst
+
+    def __eq__(self, other: object) -> bool:
+        return type(self) == type(other) and self.__dict__ == other.__dict__
+
+    def __repr__(self) -> str:
+        return "{}(rate={}, burst={})".format(
+            type(self).__name__, self.rate, self.burst
+        )
+
+
+class _Bucket:
+    # Token bucket implemented via the generic cell rate algorithm, i.e., instead of
+    # counting tokens we only keep track of the theoretical arrival time (TAT) of the
+    # next request. This makes it cheap to compute when a future request will conform.
+
+    def __init__(self, limit: RateLimit, now: float):
+        self.limit: Final = limit
+        self._interval: Final = 1.0 / limit.rate
+        self._tolerance: Final = (limit.burst - 1) * self._interval
+        self._tat = now
+
+    def earliest(self, now: float) -> float:
+        return max(now, self._tat - self._tolerance)
+
+    def consume(self, at: float) -> None:
+        self._tat = max(self._tat, at) + self._interval
+
+
+class RateLimiter:
+    """Process-wide scheduler that spaces out requests to honor multiple rate limits.
+
+    Each request is subject to a number of rate limits, identified by arbitrary keys
+    (e.g., one for the host and one for the guest token). reserve() atomically books the
+    earliest time slot that conforms to all of them and returns how long the caller
+    needs to wait for it. Because slots are booked in the order in which reserve() is
+    called, waiting callers are served first-come, first-served. Since every Retriever
+    only has a single request in flight at a time, this means that concurrent
+    Retrievers (e.g., the workers of a Batch) take turns in round-robin fashion, and
+    aggregate throughput matches the configured rates exactly.
+    """
+
+    def __init__(self, clock: Callable[[], float] = monotonic):
+        self._clock: Final = clock
+        self._lock: Final = Lock()
+        self._buckets: Dict[Hashable, _Bucket] = {}
+
+    def reserve(self, limits: Sequence[Tuple[Hashable, RateLimit]]) -> float:
+        """Books the next time slot that conforms to all given rate limits.
+
+        :return: Number of seconds the caller needs to wait before it may perform its
+            request.
+        """
+        with self._lock:
+            now = self._clock()
+            buckets: List[_Bucket] = []
+            for key, limit in limits:
+                bucket = self._buckets.get(key)
+                if bucket is None or bucket.limit != limit:
+                    bucket = _Bucket(limit, now)
+                    self._buckets[key] = bucket
+                buckets.append(bucket)
+
+            at = max((bucket.earliest(now) for bucket in buckets), default=now)
+            for bucket in buckets:
+                bucket.consume(at)
+            return at - now
+
+    def clear(self) -> None:
+        with self._lock:
+            self._buckets.clear()
+
+
+RATE_LIMITER: Final = RateLimiter()
+
+# Fraction of the host rate limit available to this process. See set_host_rate_share().
+_host_rate_share = 1.0
+
+
+def set_host_rate_share(share: float) -> None:
+    """Limits requests of this process to a fraction of the configured host rate limit.
+
+    RATE_LIMITER only sees the requests of its own process. If a Batch is executed in
+    multiple processes, each of them therefore gets an equal share of the rate, so that
+    their requests combined still honor the limit.
+    """
+    global _host_rate_share
+    if not 0.0 < share <= 1.0:
+        raise ValueError("Share needs to be in (0, 1], was {}.".format(share))
+    _host_rate_share = share
+
+
+def _rate_limit_from_env(name: str) -> Optional[RateLimit]:
+    rate = getenv(name)
+    if not rate:
+        return None
+    return RateLimit(float(rate), int(getenv(name + "_BURST", default="1")))
+
+
+def request_rate_limits(
+    url: str, *, crawl_delay: Optional[float], guest_token: Optional[str]
+) -> Sequence[Tuple[Hashable, RateLimit]]:
+    """Determines the rate limits that a request to the given URL is subject to.
+
+    Requests to each host are limited to NASTY_RATE_LIMIT requests per second (with
+    bursts of up to NASTY_RATE_LIMIT_BURST requests). If not set, this defaults to one
+    request per crawl-delay from robots.txt. Additionally, requests using the same guest
+    token can be limited via NASTY_GUEST_TOKEN_RATE_LIMIT and
+    NASTY_GUEST_TOKEN_RATE_LIMIT_BURST, which are unlimited by default.
+
+    :param crawl_delay: The crawl-delay or None, if robots.txt is being ignored.
+    :param guest_token: The guest token sent with the request, if any.
+    """
+    limits: List[Tuple[Hashable, RateLimit]] = []
+
+    # Replayed responses do not reach Twitter, so there is nothing to protect.
+    if transport_mode() == "replay":
+        return limits
+
+    host_limit = _rate_limit_from_env("NASTY_RATE_LIMIT")
+    if host_limit is None and crawl_delay:
+        host_limit = RateLimit(1.0 / crawl_delay)
+    if host_limit is not None:
+        if _host_rate_share != 1.0:
+            host_limit = RateLimit(
+                host_limit.rate * _host_rate_share,
+                max(1, int(host_limit.burst * _host_rate_share)),
+            )
+        limits.append((("host", urlparse(url).netloc), host_limit))
+
+    guest_token_limit = _rate_limit_from_env("NASTY_GUEST_TOKEN_RATE_LIMIT")
+    if guest_token is not None and guest_token_limit is not None:
+        limits.append((("guest_token", guest_token), guest_token_limit))
+
+    return limits
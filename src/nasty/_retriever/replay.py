@@ -0,0 +1,280 @@
+#
+# Copyright 2019-2020 Lukas Schmelzeisen
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import base64
+import hashlib
+from collections import defaultdict
+from logging import getLogger
+from os import getenv
+from pathlib import Path
+from threading import Lock
+from typing import (
+    Any,
+    DefaultDict,
+    Dict,
+    Iterator,
+    List,
+    Mapping,
+    Optional,
+    Sequence,
+    Tuple,
+    cast,
+)
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from typing_extensions import Final
+
+from .._util.disk_cache import nasty_cache_dir
+from .._util.io_ import locked, read_binary_lines_file
+from .._util.json_ import dumps, loads
+from .._util.typing_ import checked_cast
+
+logger = getLogger(__name__)
+
+# Headers that describe the encoding of the body on the wire. We always store decoded
+# bodies, so these no longer apply on replay.
+_WIRE_HEADERS: Final = frozenset(["content-encoding", "content-length"])
+
+
+def transport_mode() -> Optional[str]:
+    """Whether HTTP traffic is recorded or replayed (set NASTY_TRANSPORT accordingly).
+
+    :return: "record", "replay", or None if requests go to the network as usual.
+    """
+    mode = getenv("NASTY_TRANSPORT")
+    if not mode:
+        return None
+    if mode not in ("record", "replay"):
+        raise ValueError(
+            "Unknown NASTY_TRANSPORT '{}', expected 'record' or 'replay'.".format(mode)
+        )
+    return mode
+
+
+def transport_dir() -> Path:
+    """Directory of the ReplayStore, configurable via NASTY_TRANSPORT_DIR."""
+    directory = getenv("NASTY_TRANSPORT_DIR")
+    return Path(directory) if directory else nasty_cache_dir() / "transport"
+
+
+class NoRecordedResponseException(Exception):
+    def __init__(self, method: str, url: str):
+        self.method: Final = method
+        self.url: Final = url
+        super().__init__(
+            "No recorded response for {} request to URL '{}'.".format(method, url)
+        )
+
+
+class RecordedResponse:
+    def __init__(
+        self,
+        *,
+        status_code: int,
+        reason: str,
+        headers: Sequence[Tuple[str, str]],
+        content: bytes,
+    ):
+        self.status_code: Final = status_code
+        self.reason: Final = reason
+        self.headers: Final = headers
+        self.content: Final = content
+
+
+class ReplayStore:
+    """On-disk store of HTTP responses, keyed on method, URL and body of the request.
+
+    Responses are appended to one of 256 shards, chosen by the hash of their key. Next
+    to each shard's JSONL file, an index file maps keys to the offsets of their
+    responses. Replaying therefore only needs to load the (small) indices of the shards
+    that are actually accessed and can then seek to each response directly, instead of
+    keeping the whole recording in memory.
+
+    Keys that were recorded multiple times (e.g., because Twitter first answered with
+    HTTP 429 and later with the actual batch) are replayed in the recorded order, after
+    which the last response is repeated.
+
+    Appending is guarded by file locks, so that multiple threads or processes can
+    record into the same store.
+    """
+
+    def __init__(self, directory: Path):
+        self.directory: Final = directory
+        self._lock: Final = Lock()
+        self._indices: Dict[str, Mapping[str, Sequence[int]]] = {}
+        self._num_replayed: DefaultDict[str, int] = defaultdict(int)
+
+    @staticmethod
+    def key(method: str, url: str, body: Optional[bytes]) -> str:
+        hash_ = hashlib.sha256()
+        for part in (method.encode("UTF-8"), url.encode("UTF-8"), body or b""):
+            hash_.update(len(part).to_bytes(8, "big"))
+            hash_.update(part)
+        return hash_.hexdigest()
+
+    def _shard_files(self, key: str) -> Tuple[Path, Path]:
+        shard = key[:2]
+        return (self.directory / (shard + ".jsonl"), self.directory / (shard + ".idx"))
+
+    def record(
+        self, method: str, url: str, body: Optional[bytes], response: RecordedResponse
+    ) -> None:
+        key = self.key(method, url, body)
+        data_file, index_file = self._shard_files(key)
+        line = dumps(
+            {
+                "key": key,
+                "method": method,
+                "url": url,
+                "status_code": response.status_code,
+                "reason": response.reason,
+                "headers": [
+                    [name, value]
+                    for name, value in response.headers
+                    if name.lower() not in _WIRE_HEADERS
+                ],
+                "content": base64.b64encode(response.content).decode("ascii"),
+            }
+        ).encode("UTF-8")
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+        with locked(index_file):
+            with data_file.open("ab") as fout:
+                offset = fout.tell()
+                fout.write(line + b"\n")
+            with index_file.open("a", encoding="UTF-8") as fout:
+                fout.write("{} {}\n".format(key, offset))
+
+    def replay(
+        self, method: str, url: str, body: Optional[bytes]
+    ) -> Optional[RecordedResponse]:
+        key = self.key(method, url, body)
+        data_file, index_file = self._shard_files(key)
+
+        with self._lock:
+            index = self._indices.get(key[:2])
+            if index is None:
+                index = self._load_index(index_file)
+                self._indices[key[:2]] = index
+            offsets = index.get(key)
+            if not offsets:
+                return None
+            offset = offsets[min(self._num_replayed[key], len(offsets) - 1)]
+            self._num_replayed[key] += 1
+
+        with data_file.open("rb") as fin:
+            fin.seek(offset)
+            return self._recorded_response(loads(fin.readline()))
+
+    def recordings(self) -> Iterator[Tuple[str, str, RecordedResponse]]:
+        """Iterates over all recorded responses, as tuples of method, URL, and response.
+
+        Recordings are grouped by shard, i.e., they are not in the recorded order.
+        """
+        for data_file in sorted(self.directory.glob("*.jsonl")):
+            for line in read_binary_lines_file(data_file):
+                obj = cast(Mapping[str, Any], loads(line))
+                yield (
+                    checked_cast(str, obj["method"]),
+                    checked_cast(str, obj["url"]),
+                    self._recorded_response(obj),
+                )
+
+    @staticmethod
+    def _recorded_response(obj: object) -> RecordedResponse:
+        obj = cast(Mapping[str, Any], obj)
+        return RecordedResponse(
+            status_code=checked_cast(int, obj["status_code"]),
+            reason=checked_cast(str, obj["reason"]),
+            headers=[(name, value) for name, value in obj["headers"]],
+            content=base64.b64decode(obj["content"]),
+        )
+
+    @staticmethod
+    def _load_index(index_file: Path) -> Mapping[str, Sequence[int]]:
+        index: DefaultDict[str, List[int]] = defaultdict(list)
+        if index_file.exists():
+            with index_file.open("r", encoding="UTF-8") as fin:
+                for line in fin:
+                    key, offset = line.split()
+                    index[key].append(int(offset))
+        return index
+
+
+_replay_store: Optional[ReplayStore] = None
+_replay_store_lock: Final = Lock()
+
+
+def replay_store() -> ReplayStore:
+    global _replay_store
+    with _replay_store_lock:
+        if _replay_store is None or _replay_store.directory != transport_dir():
+            _replay_store = ReplayStore(transport_dir())
+        return _replay_store
+
+
+class RecordingHTTPAdapter(HTTPAdapter):
+    """HTTPAdapter that stores all received responses in the replay_store()."""
+
+    def send(  # type: ignore
+        self, request: requests.PreparedRequest, **kwargs: Any
+    ) -> requests.Response:
+        response = super().send(request, **kwargs)
+        replay_store().record(
+            cast(str, request.method),
+            cast(str, request.url),
+            _body_bytes(request.body),
+            RecordedResponse(
+                status_code=response.status_code,
+                reason=response.reason,
+                headers=list(response.headers.items()),
+                content=response.content,
+            ),
+        )
+        return response
+
+
+class ReplayHTTPAdapter(HTTPAdapter):
+    """HTTPAdapter that answers requests from the replay_store() without network."""
+
+    def send(  # type: ignore
+        self, request: requests.PreparedRequest, **kwargs: Any
+    ) -> requests.Response:
+        method = cast(str, request.method)
+        url = cast(str, request.url)
+        recorded = replay_store().replay(method, url, _body_bytes(request.body))
+        if recorded is None:
+            raise NoRecordedResponseException(method, url)
+
+        response = requests.Response()
+        response.status_code = recorded.status_code
+        response.reason = recorded.reason
+        response.headers = CaseInsensitiveDict(recorded.headers)
+        response._content = recorded.content  # type: ignore
+        response._content_consumed = True  # type: ignore
+        response.encoding = requests.utils.get_encoding_from_headers(response.headers)
+        response.url = url
+        response.request = request
+        response.connection = self  # type: ignore
+        return response
+
+
+def _body_bytes(body: object) -> Optional[bytes]:
+    if body is None or isinstance(body, bytes):
+        return body
+    return str(body).encode("UTF-8")
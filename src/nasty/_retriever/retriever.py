@@ -14,71 +14,425 @@
 # limitations under the License.
 #
 
+import hashlib
 import re
 from abc import ABC, abstractmethod
 from http import HTTPStatus
 from logging import getLogger
 from os import getenv
-from time import sleep
+from time import monotonic, sleep, time
 from typing import (
     Any,
     Callable,
+    Dict,
     Generic,
-    Iterable,
+    Hashable,
+    List,
     Mapping,
     Optional,
     Sequence,
+    Set,
+    Tuple,
     Type,
     TypeVar,
+    Union,
     cast,
+    overload,
 )
+from urllib.parse import urlparse
 
 import requests
 from overrides import overrides
-from requests.adapters import HTTPAdapter
 from requests.exceptions import RetryError
 from typing_extensions import Final, final
-from urllib3 import Retry
 
+from .._util.disk_cache import disk_cache
 from .._util.errors import UnexpectedStatusCodeException
+from .._util.json_ import JsonSerializable, dumps, loads
+from .._util.metrics import (
+    DUPLICATE_TWEETS,
+    GUEST_SESSIONS,
+    HTTP_REQUEST_DURATION,
+    HTTP_REQUESTS,
+    HTTP_RESPONSE_BYTES,
+    SLEEP_SECONDS,
+    TOMBSTONES,
+    TWEETS,
+    TWEETS_WITHOUT_META,
+    UNKNOWN_TIMELINE_ENTRIES,
+)
 from .._util.typing_ import checked_cast
 from ..request.request import Request
 from ..tweet.tweet import Tweet, TweetId, UserId
 from ..tweet.tweet_stream import TweetStream
+from .prefetcher import BatchPrefetcher
+from .rate_limiter import RATE_LIMITER, RateLimit, request_rate_limits
+from .session_pool import GUEST_SESSION_POOL, GuestSession
+from .timeline import ParsedTimeline, TimelineParser
+from .transport import accept_encoding, shared_http_adapter, timeouts, twitter_url
 
 logger = getLogger(__name__)
 
 crawl_delay: Optional[float] = None
 
+ROBOTS_TXT_URL: Final = "https://mobile.twitter.com/robots.txt"
+CRAWL_DELAY_TTL: Final = 24 * 60 * 60  # 1 day.
+
+# We use the current Chrome User-Agent string to get the most recent version of the
+# Twitter mobile website.
+USER_AGENT: Final = (
+    "Mozilla/5.0 (Linux; Android 6.0; Nexus 5 Build/MRA58N)"
+    " AppleWebKit/537.36 (KHTML, like Gecko)"
+    " Chrome/68.0.3440.84 Mobile Safari/537.36"
+    " NASTYbot"
+)
+
+# The following header should not matter for the actual returned Tweets. Still, since
+# api.twitter.com also returns some localized strings for the UI (e.g. headings), we
+# set this to English, so these strings are always the same. If not set, Twitter will
+# guesstimate the language from the IP.
+ACCEPT_LANGUAGE: Final = "en_US,en"
+
+
+def parse_crawl_delay(robots_txt: str) -> float:
+    for line in robots_txt.splitlines():
+        if line.lower().startswith("crawl-delay:"):
+            return float(line[len("crawl-delay:") :])
+    raise RuntimeError("Could not determine crawl-delay.")
+
+
+def cached_crawl_delay() -> Optional[float]:
+    """Returns the crawl-delay if known to this process or to the disk cache.
+
+    :return: The crawl-delay or None, if robots.txt needs to be (re-)fetched.
+    """
+    global crawl_delay
+    if crawl_delay is None:
+        cache = disk_cache()
+        if cache is not None:
+            cached = cache.get("crawl_delay")
+            if cached is not None:
+                crawl_delay = checked_cast(float, cached)
+    return crawl_delay
+
+
+def update_crawl_delay(robots_txt: str) -> float:
+    global crawl_delay
+    crawl_delay = parse_crawl_delay(robots_txt)
+    logger.debug("    Determined crawl-delay of {:.2f}s.".format(crawl_delay))
+
+    cache = disk_cache()
+    if cache is not None:
+        cache.set("crawl_delay", crawl_delay, ttl=CRAWL_DELAY_TTL)
+    return crawl_delay
+
+
+def parse_timeline_stub(html: str) -> Tuple[str, str]:
+    """Extracts the URL of the main.js-script and the guest token from the HTML stub.
+
+    :return: Tuple of main.js-URL and guest token.
+    """
+    main_js_url = re.findall(
+        "(https://abs.twimg.com/responsive-web/"
+        "(?:client[-_])?web(?:[-_]legacy)?/main.[a-z0-9]+.js)",
+        html,
+    )[0]
+    guest_token = re.findall(
+        'document\\.cookie = decodeURIComponent\\(\\"gt=([0-9]+);', html
+    )[0]
+    return main_js_url, guest_token
+
+
+def parse_main_js(main_js: str) -> str:
+    """Extracts the bearer token from the main.js-script."""
+    return cast(str, re.findall('.="Web-12",.="([^"]+)"', main_js)[0])
+
+
+class RetrieverCheckpoint(JsonSerializable):
+    """Position in the Tweets of a request, from which its retrieval can be resumed.
+
+    Twitter only lets us continue a timeline at the start of a batch. Therefore, we
+    store the cursor of the batch that contains the next Tweet (None for the first
+    batch) and how many of the Tweets of that batch were already consumed. Once all
+    Tweets of the request were consumed, finished is set instead.
+    """
+
+    def __init__(
+        self,
+        *,
+        cursor: Optional[str],
+        num_skipped: int,
+        num_retrieved: int,
+        finished: bool = False,
+    ):
+        if not 0 <= num_skipped <= num_retrieved:
+            raise ValueError(
+                "Checkpoint can not skip {} of {} retrieved Tweets.".format(
+                    num_skipped, num_retrieved
+                )
+            )
+        self.cursor: Final = cursor
+        self.num_skipped: Final = num_skipped
+        self.num_retrieved: Final = num_retrieved
+        self.finished: Final = finished
+
+    def __eq__(self, other: object) -> bool:
+        return type(self) == type(other) and self.__dict__ == other.__dict__
+
+    @overrides
+    def to_json(self) -> Mapping[str, object]:
+        obj: Dict[str, object] = {
+            "cursor": self.cursor,
+            "num_skipped": self.num_skipped,
+            "num_retrieved": self.num_retrieved,
+        }
+        if self.finished:
+            obj["finished"] = True
+        return obj
+
+    @classmethod
+    @overrides
+    def from_json(cls, obj: Mapping[str, object]) -> "RetrieverCheckpoint":
+        return cls(
+            cursor=checked_cast(str, obj["cursor"]) if obj["cursor"] else None,
+            num_skipped=checked_cast(int, obj["num_skipped"]),
+            num_retrieved=checked_cast(int, obj["num_retrieved"]),
+            finished=checked_cast(bool, obj.get("finished", False)),
+        )
+
 
 class RetrieverTweetStream(TweetStream):
-    def __init__(self, update_callback: Callable[[], bool]):
+    def __init__(
+        self,
+        update_callback: Callable[[], bool],
+        close_callback: Optional[Callable[[], None]] = None,
+        restore_callback: Optional[Callable[[RetrieverCheckpoint], None]] = None,
+        *,
+        request_fingerprint: Optional[str] = None,
+        deduplicate: bool = False,
+    ):
+        """Construct a new stream.
+
+        :param deduplicate: If set, Tweets whose ID was already returned by this stream
+            are dropped. Twitter sometimes repeats Tweets in consecutive batches. The
+            seen IDs are not part of state(), i.e., a resumed stream starts afresh.
+        """
         self._update_callback: Final = update_callback
+        self._close_callback: Final = close_callback
+        self._restore_callback: Final = restore_callback
+        self._request_fingerprint: Final = request_fingerprint
         self._tweets: Sequence[Tweet] = []
         self._tweets_position = 0
+        self._batch_checkpoint = RetrieverCheckpoint(
+            cursor=None, num_skipped=0, num_retrieved=0
+        )
+        self._next_batch_checkpoint: Optional[RetrieverCheckpoint] = None
+        self._num_to_skip = 0
+        self._started = False
+        self._exhausted = False
+        self._seen_tweet_ids: Final[Optional[Set[TweetId]]] = (
+            set() if deduplicate else None
+        )
 
-    def update_tweets(self, tweets: Sequence[Tweet]) -> None:
+    def update_tweets(
+        self,
+        tweets: Sequence[Tweet],
+        batch_checkpoint: RetrieverCheckpoint,
+        next_batch_checkpoint: Optional[RetrieverCheckpoint] = None,
+    ) -> None:
+        """Replaces the current Tweets with those of the next batch.
+
+        :param batch_checkpoint: Checkpoint pointing at the start of the batch.
+        :param next_batch_checkpoint: Checkpoint pointing at the start of the batch
+            after it, if known. Used once all Tweets of the batch were consumed, so
+            that resuming does not fetch the batch again.
+        """
         self._tweets = tweets
-        self._tweets_position = 0
+        self._tweets_position = min(self._num_to_skip, len(tweets))
+        self._batch_checkpoint = batch_checkpoint
+        self._next_batch_checkpoint = next_batch_checkpoint
+        self._num_to_skip = 0
+
+    def checkpoint(self) -> RetrieverCheckpoint:
+        """Position right after the last Tweet returned by this stream."""
+        num_consumed = self._tweets_position + self._num_to_skip
+        if self._exhausted or (
+            self._next_batch_checkpoint is not None
+            and self._tweets
+            and num_consumed == len(self._tweets)
+        ):
+            next_batch_checkpoint = self._next_batch_checkpoint
+            return RetrieverCheckpoint(
+                cursor=(
+                    next_batch_checkpoint.cursor
+                    if next_batch_checkpoint is not None
+                    else self._batch_checkpoint.cursor
+                ),
+                num_skipped=0,
+                num_retrieved=self._batch_checkpoint.num_retrieved + num_consumed,
+                finished=self._exhausted
+                or (
+                    next_batch_checkpoint is not None and next_batch_checkpoint.finished
+                ),
+            )
+        return RetrieverCheckpoint(
+            cursor=self._batch_checkpoint.cursor,
+            num_skipped=num_consumed,
+            num_retrieved=self._batch_checkpoint.num_retrieved + num_consumed,
+        )
+
+    def restore(self, checkpoint: RetrieverCheckpoint) -> None:
+        """Continues this stream at a checkpoint from a stream of the same request.
+
+        Needs to be called before the first Tweet is requested from the stream.
+        """
+        if self._started:
+            raise RuntimeError("Can not restore a stream that was already iterated.")
+        if self._restore_callback is None:
+            raise RuntimeError("Stream does not support restoring checkpoints.")
+        self._restore_callback(checkpoint)
+        self._batch_checkpoint = RetrieverCheckpoint(
+            cursor=checkpoint.cursor,
+            num_skipped=0,
+            num_retrieved=checkpoint.num_retrieved - checkpoint.num_skipped,
+        )
+        self._num_to_skip = checkpoint.num_skipped
+        self._exhausted = checkpoint.finished
+
+    @overrides
+    def state(self) -> str:
+        state = dict(self.checkpoint().to_json())
+        if self._request_fingerprint is not None:
+            state["request"] = self._request_fingerprint
+        return dumps(state)
+
+    @overrides
+    def resume(self, state: str) -> None:
+        try:
+            obj = cast(Mapping[str, object], loads(state))
+            checkpoint = RetrieverCheckpoint.from_json(obj)
+        except (AssertionError, AttributeError, KeyError, TypeError, ValueError) as e:
+            raise ValueError("Malformed stream state '{}'.".format(state)) from e
+        if obj.get("request") != self._request_fingerprint:
+            raise ValueError(
+                "Stream state '{}' belongs to a different request.".format(state)
+            )
+        self.restore(checkpoint)
 
     @overrides
     def __next__(self) -> Tweet:
-        if self._tweets_position == len(self._tweets):
-            if not self._update_callback():
-                raise StopIteration()
+        self._started = True
+        while True:
+            # Loop, as the Tweets to skip after restoring may span the whole batch.
+            while self._tweets_position == len(self._tweets):
+                if self._exhausted or not self._update_callback():
+                    self._exhausted = True
+                    raise StopIteration()
+
+            self._tweets_position += 1
+            tweet = self._tweets[self._tweets_position - 1]
+            if self._seen_tweet_ids is None:
+                return tweet
+            if tweet.id not in self._seen_tweet_ids:
+                self._seen_tweet_ids.add(tweet.id)
+                return tweet
+            DUPLICATE_TWEETS.inc("stream")
+
+    @overrides
+    def close(self) -> None:
+        if self._close_callback is not None:
+            self._close_callback()
+
+
+class LazyTweets(Sequence[Tweet]):
+    """Sequence of Tweets that are only constructed once they are accessed.
+
+    Constructing a Tweet requires merging the Tweet JSON with that of its user. This is
+    done in place, i.e., without copying the Tweet JSON, as each Tweet object is only
+    contained once in a batch. Once all Tweets have been accessed, references to the
+    batch's JSON are dropped, so that it can be garbage collected, e.g., including all
+    user objects and Tweets that are not part of the timeline itself.
+    """
+
+    def __init__(
+        self,
+        tweet_ids: Sequence[TweetId],
+        id_to_tweet_json: Mapping[TweetId, Mapping[str, object]],
+        id_to_user_json: Mapping[UserId, object],
+    ):
+        self._tweet_ids: Final = tweet_ids
+        self._tweets: Final[List[Optional[Tweet]]] = [None] * len(tweet_ids)
+        self._num_unconstructed = len(tweet_ids)
+        self._id_to_tweet_json: Optional[
+            Mapping[TweetId, Mapping[str, object]]
+        ] = id_to_tweet_json
+        self._id_to_user_json: Optional[Mapping[UserId, object]] = id_to_user_json
+
+    def __len__(self) -> int:
+        return len(self._tweet_ids)
+
+    @overload
+    def __getitem__(self, index: int) -> Tweet:
+        ...
+
+    @overload
+    def __getitem__(self, index: slice) -> Sequence[Tweet]:
+        ...
+
+    def __getitem__(self, index: Union[int, slice]) -> Union[Tweet, Sequence[Tweet]]:
+        if isinstance(index, slice):
+            if self._id_to_tweet_json is None or self._id_to_user_json is None:
+                return cast(Sequence[Tweet], self._tweets[index])
+            return LazyTweets(
+                self._tweet_ids[index], self._id_to_tweet_json, self._id_to_user_json
+            )
+
+        tweet = self._tweets[index]
+        if tweet is None:
+            tweet = self._construct_tweet(self._tweet_ids[index])
+            self._tweets[index] = tweet
+            self._num_unconstructed -= 1
+            if not self._num_unconstructed:
+                self._id_to_tweet_json = None
+                self._id_to_user_json = None
+        return tweet
+
+    def _construct_tweet(self, tweet_id: TweetId) -> Tweet:
+        assert self._id_to_tweet_json is not None and self._id_to_user_json is not None
+        tweet_json = cast(Dict[str, object], self._id_to_tweet_json[tweet_id])
+
+        # Guard against the same Tweet being contained in the batch multiple times.
+        if "user" not in tweet_json:
+            tweet_json["user"] = self._id_to_user_json[
+                checked_cast(UserId, tweet_json["user_id_str"])
+            ]
+
+            # Delete remaining user fields in order to be similar to the Twitter
+            # developer API and because the information is stored in the user object
+            # anyways.
+            tweet_json.pop("user_id", None)  # present on Search, not on Conversation
+            tweet_json.pop("user_id_str")
 
-        self._tweets_position += 1
-        return self._tweets[self._tweets_position - 1]
+        return Tweet(tweet_json)
 
 
 class RetrieverBatch(ABC):
     def __init__(self, json: Mapping[str, Mapping[str, object]]):
-        self._json: Final = json
-        self.tweets: Final = self._tweets()
-        self.next_cursor: Final = self._next_cursor()
+        self._json = json
+        timeline = self._timeline_parser().parse(
+            cast(Sequence[Mapping[str, Any]], json["timeline"]["instructions"])
+        )
+        self.num_tombstones: Final = timeline.num_tombstones
+        self.num_unknown_entries: Final = timeline.num_unknown_entries
+        self.num_tweets_without_meta = 0
+        self.tweets: Final = self._tweets(timeline.tweet_ids)
+        self.next_cursor: Final = self._next_cursor(timeline)
+
+        # Everything we still need from the JSON is referenced by self.tweets.
+        del self._json
 
     @final
-    def _tweets(self) -> Sequence[Tweet]:
+    def _tweets(self, timeline_tweet_ids: Sequence[TweetId]) -> LazyTweets:
         id_to_tweet_json: Final = cast(
             Mapping[TweetId, Mapping[str, object]],
             self._json["globalObjects"]["tweets"],
@@ -87,8 +441,8 @@ class RetrieverBatch(ABC):
             Mapping[UserId, object], self._json["globalObjects"]["users"]
         )
 
-        result = []
-        for tweet_id in self._tweet_ids():
+        tweet_ids = []
+        for tweet_id in timeline_tweet_ids:
             if tweet_id not in id_to_tweet_json:
                 # For conversation it can sometimes happen that a Tweet-ID is returned
                 # without accompanying meta information. I have no idea why this happens
@@ -97,31 +451,107 @@ class RetrieverBatch(ABC):
                     "Found Tweet-ID {} in timeline, but did not receive "
                     "Tweet meta information.".format(tweet_id)
                 )
+                self.num_tweets_without_meta += 1
                 # TODO: move this to a ConversationRetrieverBatch
                 # TODO: add way to expose this over api
                 continue
+            tweet_ids.append(tweet_id)
 
-            tweet_json = dict(id_to_tweet_json[tweet_id])
-            tweet_json["user"] = id_to_user_json[
-                checked_cast(UserId, tweet_json["user_id_str"])
-            ]
-
-            # Delete remaining user fields in order to be similar to the Twitter
-            # developer API and because the information is stored in the user object
-            # anyways.
-            tweet_json.pop("user_id", None)  # present on Search, not on Conversation
-            tweet_json.pop("user_id_str")
-
-            result.append(Tweet(tweet_json))
-        return result
+        return LazyTweets(tweet_ids, id_to_tweet_json, id_to_user_json)
 
+    @classmethod
     @abstractmethod
-    def _tweet_ids(self) -> Iterable[TweetId]:
+    def _timeline_parser(cls) -> TimelineParser:
         raise NotImplementedError()
 
-    @abstractmethod
-    def _next_cursor(self) -> Optional[str]:
-        raise NotImplementedError()
+    def _next_cursor(self, timeline: ParsedTimeline) -> Optional[str]:
+        return timeline.cursor
+
+
+class FetchAttempts:
+    """Counts consecutive failures while trying to fetch the next batch.
+
+    Used by both the Retriever and the AsyncRetriever so that they give up under the
+    same conditions.
+    """
+
+    def __init__(self) -> None:
+        self._consecutive_retry_errors = 0
+        self._consecutive_rate_limits = 0
+        self._consecutive_forbidden = 0
+        self._consecutive_empty_batches = 0
+        self._waited_for_rate_limit_reset = False
+
+    def retry_after_retry_error(self) -> bool:
+        """Returns whether to retry with a new session or to stop the request."""
+        self._consecutive_retry_errors += 1
+        if self._consecutive_retry_errors != 3:
+            return True
+        logger.warning("Received 3 consecutive RetryErrors.")
+        return False
+
+    def retry_after_unexpected_status_code(
+        self, e: UnexpectedStatusCodeException
+    ) -> bool:
+        """Returns whether to retry with a new session or to reraise the exception."""
+        if e.status_code == HTTPStatus.TOO_MANY_REQUESTS:  # HTTP 429
+            self._consecutive_rate_limits += 1
+            if self._consecutive_rate_limits != 3:
+                return True
+            logger.warning("Received 3 consecutive TOO MANY REQUESTS responses.")
+        elif e.status_code == HTTPStatus.FORBIDDEN:  # HTTP 403
+            self._consecutive_forbidden += 1
+            if self._consecutive_forbidden != 3:
+                return True
+            logger.warning("Received 3 consecutive FORBIDDEN responses.")
+        return False
+
+    def wait_for_rate_limit_reset(
+        self, e: UnexpectedStatusCodeException, rate_limit_reset: Optional[float]
+    ) -> Optional[float]:
+        """Returns how long to wait before retrying after giving up on an exception.
+
+        If we keep receiving TOO MANY REQUESTS responses even for fresh sessions, we
+        wait until the rate limit of the current session is reset, as given by its
+        X-Rate-Limit-Reset header. This is only done once per batch and only if the
+        reset happens within NASTY_RATE_LIMIT_MAX_WAIT seconds (default: 15 minutes,
+        i.e., the length of Twitter's rate limit windows).
+
+        :return: Number of seconds to wait, or None if the exception should be raised.
+        """
+        if (
+            e.status_code != HTTPStatus.TOO_MANY_REQUESTS
+            or rate_limit_reset is None
+            or self._waited_for_rate_limit_reset
+        ):
+            return None
+
+        wait = max(0.0, rate_limit_reset - time())
+        if wait > float(getenv("NASTY_RATE_LIMIT_MAX_WAIT", default="900")):
+            return None
+
+        logger.info("Waiting {:.0f}s for rate limit reset.".format(wait))
+        self._waited_for_rate_limit_reset = True
+        self._consecutive_rate_limits = 0
+        return wait
+
+    def fetch_succeeded(self) -> None:
+        self._consecutive_rate_limits = 0
+
+    def retry_after_empty_batch(self) -> bool:
+        """Returns whether to fetch the same batch again or to stop the request.
+
+        Ideally, we would like to omit this last request but there seems to be no way to
+        detect this prior to having the last batch loaded. Additionally, Twitter will
+        sometimes stop sending results early, which we also can not detect. Because of
+        this, we only stop loading once we receive empty batches multiple times in a
+        row.
+        """
+        self._consecutive_empty_batches += 1
+        if self._consecutive_empty_batches != 3:
+            return True
+        logger.info("Received 3 consecutive empty batches.")
+        return False
 
 
 _T_Request = TypeVar("_T_Request", bound=Request)
@@ -141,38 +571,40 @@ class Retriever(Generic[_T_Request], ABC):
     """
 
     def __init__(self, request: _T_Request):
-        self._tweet_stream: Final = self._tweet_stream_type()(self._update_tweet_stream)
+        self._tweet_stream: Final = self._tweet_stream_type()(
+            self._update_tweet_stream,
+            self._close_tweet_stream,
+            self._restore_tweet_stream,
+            request_fingerprint=self._request_fingerprint(request),
+            deduplicate=bool(getenv("NASTY_DEDUP")),
+        )
         self._request: Final = request
-        self._session: Final = requests.Session()
+        self._guest_session: Optional[GuestSession] = None
         self._request_finished = False
         self._retrieved_tweets = 0
         self._cursor: Optional[str] = None
-
-        # Configure on which status codes we should perform automated retries.
-        self._session.mount(
-            "https://",
-            HTTPAdapter(
-                max_retries=Retry(
-                    total=5,
-                    connect=5,
-                    redirect=10,
-                    backoff_factor=0.1,
-                    raise_on_redirect=True,
-                    raise_on_status=True,
-                    status_forcelist=[
-                        HTTPStatus.REQUEST_TIMEOUT,  # HTTP 408
-                        HTTPStatus.CONFLICT,  # HTTP 409
-                        HTTPStatus.INTERNAL_SERVER_ERROR,  # HTTP 500
-                        HTTPStatus.NOT_IMPLEMENTED,  # HTTP 501
-                        HTTPStatus.BAD_GATEWAY,  # HTTP 502
-                        HTTPStatus.SERVICE_UNAVAILABLE,  # HTTP 503
-                        HTTPStatus.GATEWAY_TIMEOUT,  # HTTP 504
-                    ],
-                )
-            ),
-        )
-
-        self._fetch_new_twitter_session()
+        self._prefetcher: Optional[
+            BatchPrefetcher[
+                Tuple[Sequence[Tweet], RetrieverCheckpoint, RetrieverCheckpoint]
+            ]
+        ] = None
+        self._setup_sync_transport()
+
+    def _setup_sync_transport(self) -> None:
+        """Sets up network access via requests, which the AsyncRetriever replaces."""
+        self._session = requests.Session()
+
+        # Plain HTTP is only used to talk to a mock server (see twitter_url()).
+        self._session.mount("https://", shared_http_adapter())
+        self._session.mount("http://", shared_http_adapter())
+
+        # If enabled, batches are fetched in a background thread, so that network
+        # latency and rate limiting overlap with the consumer's processing.
+        prefetch_batches = int(getenv("NASTY_PREFETCH_BATCHES", default="0"))
+        if prefetch_batches:
+            self._prefetcher = BatchPrefetcher(
+                self._fetch_next_tweets, self._end_guest_session, prefetch_batches
+            )
 
     @classmethod
     def _tweet_stream_type(cls) -> Type[RetrieverTweetStream]:
@@ -195,64 +627,137 @@ class Retriever(Generic[_T_Request], ABC):
     def _batch_url(self) -> Mapping[str, object]:
         raise NotImplementedError()
 
-    def _update_tweet_stream(self) -> bool:  # noqa: C901
-        # TODO: try to reduce complexity and get red of noqa
+    def _update_tweet_stream(self) -> bool:
+        if self._prefetcher is not None:
+            batch = self._prefetcher.get()
+        else:
+            batch = self._fetch_next_tweets()
+        if batch is None:
+            return False
+
+        self.tweet_stream.update_tweets(*batch)
+        return True
+
+    def _close_tweet_stream(self) -> None:
+        if self._prefetcher is not None:
+            # The guest session is given up by the prefetcher's thread once it stops.
+            self._prefetcher.close()
+        else:
+            self._end_guest_session()
 
+    @staticmethod
+    def _request_fingerprint(request: Request) -> str:
+        """Short hash identifying the request, to tell apart states of its streams."""
+        return hashlib.sha256(dumps(request.to_json()).encode("UTF-8")).hexdigest()[:16]
+
+    def _restore_tweet_stream(self, checkpoint: RetrieverCheckpoint) -> None:
+        self._cursor = checkpoint.cursor
+        self._retrieved_tweets = checkpoint.num_retrieved - checkpoint.num_skipped
+        self._request_finished = checkpoint.finished
+
+    @final
+    def _fetch_next_tweets(
+        self,
+    ) -> Optional[Tuple[Sequence[Tweet], RetrieverCheckpoint, RetrieverCheckpoint]]:
+        """Fetches the next batch and advances the request state past it.
+
+        :return: The Tweets of the next batch and checkpoints pointing at its start and
+            at the start of the batch after it, or None, if the request is finished.
+        """
         if self._request_finished:
-            return False
+            return None
 
-        consecutive_retry_error = 0
-        consecutive_rate_limits = 0
-        consecutive_forbidden = 0
-        consecutive_empty_batches = 0
-        batch = None
+        checkpoint = RetrieverCheckpoint(
+            cursor=self._cursor, num_skipped=0, num_retrieved=self._retrieved_tweets
+        )
+        try:
+            batch = self._fetch_non_empty_batch()
+        except BaseException:
+            self._end_guest_session(discard=True)
+            raise
+        if batch is None:
+            self._end_guest_session()
+            return None
+
+        tweets = self._consume_batch(batch)
+        if self._request_finished:
+            self._end_guest_session()
+        return (
+            tweets,
+            checkpoint,
+            RetrieverCheckpoint(
+                cursor=self._cursor,
+                num_skipped=0,
+                num_retrieved=self._retrieved_tweets,
+                finished=self._request_finished,
+            ),
+        )
+
+    @final
+    def _fetch_non_empty_batch(self) -> Optional[RetrieverBatch]:
+        # Rotate sessions that are about to run into their rate limit, before they
+        # actually do so.
+        if self._guest_session is None or self._guest_session.rate_limited:
+            self._fetch_new_twitter_session()
+
+        attempts = FetchAttempts()
         while True:
             try:
                 batch = self._fetch_batch()
             except RetryError:
-                consecutive_retry_error += 1
-                if consecutive_retry_error != 3:
-                    self._fetch_new_twitter_session()
-                    continue
-                logger.warning("Received 3 consecutive RetryErrors.")
-                return False
+                if not attempts.retry_after_retry_error():
+                    return None
+                self._fetch_new_twitter_session()
+                continue
             except UnexpectedStatusCodeException as e:
-                if e.status_code == HTTPStatus.TOO_MANY_REQUESTS:  # HTTP 429
-                    consecutive_rate_limits += 1
-                    if consecutive_rate_limits != 3:
-                        self._fetch_new_twitter_session()
-                        continue
-                    logger.warning(
-                        "Received 3 consecutive TOO MANY REQUESTS responses."
-                    )
-                elif e.status_code == HTTPStatus.FORBIDDEN:  # HTTP 403
-                    consecutive_forbidden += 1
-                    if consecutive_forbidden != 3:
-                        self._fetch_new_twitter_session()
-                        continue
-                    logger.warning("Received 3 consecutive FORBIDDEN responses.")
-                raise
-            consecutive_rate_limits = 0
+                wait = self._retry_wait(attempts, e)
+                if wait is None:
+                    self._fetch_new_twitter_session()
+                else:
+                    sleep(wait)
+                continue
+            attempts.fetch_succeeded()
 
             # Stop the iteration once the returned batch no longer contains any Tweets.
-            # Ideally, we would like to omit this last request but there seems to be no
-            # way to detect this prior to having the last batch loaded. Additionally,
-            # Twitter will sometimes stop sending results early, which we also can not
-            # detect. Because of this, we only stop loading once we receive empty
-            # batches multiple times in a row.
-            if not batch.tweets:
-                consecutive_empty_batches += 1
-                if consecutive_empty_batches != 3:
-                    continue
-                logger.info("Received 3 consecutive empty batches.")
-                return False
-
-            break
-
-        tweets = batch.tweets
+            if batch.tweets:
+                return batch
+            if not attempts.retry_after_empty_batch():
+                return None
+
+    @final
+    def _retry_wait(
+        self, attempts: FetchAttempts, e: UnexpectedStatusCodeException
+    ) -> Optional[float]:
+        """Decides how to retry after fetching a batch failed with the exception.
+
+        :return: None, if the retry should use a new session, or else the number of
+            seconds to wait before retrying with the current session.
+        :raises UnexpectedStatusCodeException: If the batch should not be retried.
+        """
+        if attempts.retry_after_unexpected_status_code(e):
+            return None
+        wait = attempts.wait_for_rate_limit_reset(e, self._rate_limit_reset())
+        if wait is None:
+            raise e
+        SLEEP_SECONDS.inc("rate_limit_reset", amount=wait)
+        return wait
+
+    @final
+    def _consume_batch(self, batch: RetrieverBatch) -> Sequence[Tweet]:
+        """Advances the request state past the given batch.
+
+        :return: The Tweets of the batch that still fit into max_tweets.
+        """
+        tweets: Sequence[Tweet] = batch.tweets
         if self._request.max_tweets:
             tweets = tweets[: self._request.max_tweets - self._retrieved_tweets]
         self._retrieved_tweets += len(tweets)
+
+        request_type = type(self._request).__name__.lower()
+        TWEETS.inc(request_type, amount=len(tweets))
+        TOMBSTONES.inc(request_type, amount=batch.num_tombstones)
+        TWEETS_WITHOUT_META.inc(request_type, amount=batch.num_tweets_without_meta)
+        UNKNOWN_TIMELINE_ENTRIES.inc(request_type, amount=batch.num_unknown_entries)
         logger.debug(
             "  Received new batch of {} Tweets ({}/{})".format(
                 len(tweets), self._retrieved_tweets, self._request.max_tweets
@@ -263,12 +768,11 @@ class Retriever(Generic[_T_Request], ABC):
             and self._request.max_tweets == self._retrieved_tweets
         ):
             self._request_finished = True
-        self.tweet_stream.update_tweets(tweets)
 
         self._cursor = batch.next_cursor
         if self._cursor is None:
             self._request_finished = True
-        return True
+        return tweets
 
     @final
     def _fetch_new_twitter_session(self) -> None:
@@ -289,10 +793,16 @@ class Retriever(Generic[_T_Request], ABC):
 
         Each established session is only good for a given number of requests.
         Information on this can be obtained by checking the X-Rate-Limit-* headers in
-        the responses from api.twitter.com. Currently, we do not pay attention to these,
-        and just establish a new session once we run into the first rate limit error.
-        Cursor parameters, i.e. those that specify the current position in the result
-        list seem to persist across sessions.
+        the responses from api.twitter.com. We track these per session and rotate to
+        another session once the remaining quota drops below a low watermark (see
+        GuestSession.rate_limited), so that we usually do not run into rate limit errors
+        at all. Cursor parameters, i.e. those that specify the current position in the
+        result list seem to persist across sessions.
+
+        Since establishing a session is expensive, sessions are shared between
+        Retrievers via the GUEST_SESSION_POOL. This function therefore discards the
+        current session (we only call it if the current one ran into errors) and
+        only establishes a new one if no idle session is available in the pool.
 
         Technically, a normal web browser would also receive a few cookies from Twitter
         in this process. Currently, api.twitter.com doesn't seem to check for these. In
@@ -304,86 +814,141 @@ class Retriever(Generic[_T_Request], ABC):
         rate-limit us, should they decide to.
         """
 
-        logger.debug("  Establishing new Twitter session.")
-
-        self._session.headers.clear()
-        self._session.cookies.clear()
+        self._end_guest_session(discard=True)
+
+        guest_session = GUEST_SESSION_POOL.lease()
+        if guest_session is not None:
+            logger.debug("  Reusing pooled Twitter session {}.".format(guest_session))
+            GUEST_SESSIONS.inc("pooled")
+        else:
+            guest_session = self._establish_guest_session()
+            GUEST_SESSIONS.inc("established")
+
+        self._reset_session_headers()
+        for name, value in guest_session.cookies.items():
+            self._session.cookies.set_cookie(  # type: ignore
+                requests.cookies.create_cookie(
+                    name, value, domain=".twitter.com", path="/"
+                )
+            )
 
-        # We use the current Chrome User-Agent string to get the most recent version of
-        # the Twitter mobile website.
-        self._session.headers["User-Agent"] = (
-            "Mozilla/5.0 (Linux; Android 6.0; Nexus 5 Build/MRA58N)"
-            " AppleWebKit/537.36 (KHTML, like Gecko)"
-            " Chrome/68.0.3440.84 Mobile Safari/537.36"
-            " NASTYbot"
+        # Set the two headers that we need to access api.twitter.com.
+        self._session.headers["Authorization"] = "Bearer {}".format(
+            guest_session.bearer_token
         )
+        self._session.headers["X-Guest-Token"] = guest_session.guest_token
+        self._guest_session = guest_session
 
-        # The following header should not matter for the actual returned Tweets. Still,
-        # since api.twitter.com also returns some localized strings for the UI (e.g.
-        # headings), we set this to English, so these strings are always the same. If
-        # not set, Twitter will guesstimate the language from the IP.
-        self._session.headers["Accept-Language"] = "en_US,en"
+    @final
+    def _establish_guest_session(self) -> GuestSession:
+        logger.debug("  Establishing new Twitter session.")
+
+        self._reset_session_headers()
 
         # Query HTML stub page. Also automatically adds any returned cookies by Twitter
         # via response headers to the session.
         response = self._session_get(**self._timeline_url())
-        main_js_url = re.findall(
-            "(https://abs.twimg.com/responsive-web/"
-            "(?:client[-_])?web(?:[-_]legacy)?/main.[a-z0-9]+.js)",
-            response.text,
-        )[0]
-        guest_token = re.findall(
-            'document\\.cookie = decodeURIComponent\\(\\"gt=([0-9]+);', response.text
-        )[0]
+        main_js_url, guest_token = parse_timeline_stub(response.text)
 
         # Queries the JS-script that carries the bearer token. Currently, this does not
         # seem to constant for all users, but we still check in case this changes in the
         # future.
-        response = self._session_get(main_js_url)
-        bearer_token = re.findall('.="Web-12",.="([^"]+)"', response.text)[0]
+        bearer_token = GUEST_SESSION_POOL.bearer_token(main_js_url)
+        if bearer_token is None:
+            response = self._session_get(main_js_url)
+            bearer_token = parse_main_js(response.text)
+            GUEST_SESSION_POOL.add_bearer_token(main_js_url, bearer_token)
 
         # Emulate cookie setting that would be performed via Javascript.
-        self._session.cookies.set_cookie(  # type: ignore
-            requests.cookies.create_cookie(
-                "gt", guest_token, domain=".twitter.com", path="/"
-            )
-        )
-
-        # Set the two headers that we need to access api.twitter.com.
-        self._session.headers["Authorization"] = "Bearer {}".format(bearer_token)
-        self._session.headers["X-Guest-Token"] = guest_token
+        cookies = {
+            cookie.name: cookie.value
+            for cookie in self._session.cookies
+            if cookie.value is not None
+        }
+        cookies["gt"] = guest_token
 
         logger.debug(
             "    Guest token: {}. Bearer token: {}.".format(guest_token, bearer_token)
         )
+        return GuestSession(
+            bearer_token=bearer_token, guest_token=guest_token, cookies=cookies
+        )
+
+    @final
+    def _reset_session_headers(self) -> None:
+        self._session.headers.clear()
+        self._session.cookies.clear()
+        self._session.headers["User-Agent"] = USER_AGENT
+        self._session.headers["Accept-Language"] = ACCEPT_LANGUAGE
+        self._session.headers["Accept-Encoding"] = accept_encoding()
+
+    @final
+    def _end_guest_session(self, *, discard: bool = False) -> None:
+        """Gives up the current session, returning it to the pool if not discarded.
+
+        Sessions that are only rate-limited are never discarded, as they become usable
+        again once their rate limit is reset.
+        """
+        if self._guest_session is None:
+            return
+        if discard and not self._guest_session.rate_limited:
+            GUEST_SESSION_POOL.discard(self._guest_session)
+        else:
+            GUEST_SESSION_POOL.release(self._guest_session)
+        self._guest_session = None
+
+    @final
+    def _rate_limit_reset(self) -> Optional[float]:
+        if self._guest_session is None:
+            return None
+        return self._guest_session.rate_limit_reset
+
+    @final
+    def _request_rate_limits(
+        self, url: str, crawl_delay_: Optional[float]
+    ) -> Sequence[Tuple[Hashable, RateLimit]]:
+        return request_rate_limits(
+            url,
+            crawl_delay=crawl_delay_,
+            guest_token=(
+                self._guest_session.guest_token
+                if self._guest_session is not None
+                else None
+            ),
+        )
 
     @final
     def _fetch_batch(self) -> RetrieverBatch:
+        response = self._session_get(**self._batch_url())
         return self._retriever_batch_type()(
-            self._session_get(**self._batch_url()).json()
+            cast(Mapping[str, Mapping[str, object]], loads(response.content))
         )
 
     @final
     def _session_get(self, url: str, **kwargs: Any) -> requests.Response:
+        crawl_delay_ = None
         if not getenv("NASTY_DISRESPECT_ROBOTSTXT"):
-            global crawl_delay
-            if crawl_delay is None:
-                response = self._session.get("https://mobile.twitter.com/robots.txt")
-
-                for line in response.text.splitlines():
-                    if line.lower().startswith("crawl-delay:"):
-                        crawl_delay = float(line[len("crawl-delay:") :])
-                        break
-                else:
-                    raise RuntimeError("Could not determine crawl-delay.")
-
-                logger.debug(
-                    "    Determined crawl-delay of {:.2f}s.".format(crawl_delay)
+            crawl_delay_ = cached_crawl_delay()
+            if crawl_delay_ is None:
+                crawl_delay_ = update_crawl_delay(
+                    self._session.get(
+                        twitter_url(ROBOTS_TXT_URL), timeout=timeouts()
+                    ).text
                 )
 
-            sleep(crawl_delay)
-
-        response = self._session.get(url, **kwargs)
+        delay = RATE_LIMITER.reserve(self._request_rate_limits(url, crawl_delay_))
+        if delay > 0.0:
+            SLEEP_SECONDS.inc("rate_limit", amount=delay)
+            sleep(delay)
+
+        host = urlparse(url).netloc
+        start = monotonic()
+        response = self._session.get(twitter_url(url), timeout=timeouts(), **kwargs)
+        HTTP_REQUEST_DURATION.observe(monotonic() - start, host)
+        HTTP_REQUESTS.inc(host, response.status_code)
+        HTTP_RESPONSE_BYTES.inc(host, amount=len(response.content))
+        if self._guest_session is not None:
+            self._guest_session.update_rate_limit(response.headers)
 
         status = HTTPStatus(response.status_code)
         logger.debug(
@@ -14,317 +14,311 @@
 # limitations under the License.
 #
 
+from datetime import date, datetime
 from logging import getLogger
-from typing import Any, Iterable, Mapping, Optional, Sequence, Type, cast
+from typing import Mapping, Optional, Type
 
 from overrides import overrides
 from typing_extensions import Final
 
+from .._util.time_ import utc_timestamp
 from .._util.typing_ import checked_cast
 from ..request.search import Search, SearchFilter
 from ..tweet.tweet import TweetId
 from .retriever import Retriever, RetrieverBatch
+from .timeline import ParsedTimeline, TimelineEntry, TimelineParser, ignore_entry
 
 logger = getLogger(__name__)
 
 
-class SearchRetrieverBatch(RetrieverBatch):
-    @overrides
-    def _tweet_ids(self) -> Iterable[TweetId]:
-        instructions: Final = cast(
-            Sequence[Any], self._json["timeline"]["instructions"]
-        )
+# Search results are contained in instructions. The first batch of a search will
+# look like this:
+# {
+#     ...
+#     "timeline": {
+#         "id": "search-6602913952152093875",
+#         "instructions": [
+#             {
+#                 "addEntries": {
+#                     "entries": [
+#                         {"entryId": "sq-I-t-1155486497451184128", ...},
+#                         {"entryId": "sq-I-t-1194473608061607936", ...},
+#                         {"entryId": "sq-M-1-d7721393", ...},
+#                         {"entryId": "sq-E-1981039365", ...},
+#                         ...
+#                         {"entryId": "sq-cursor-top", ...},
+#                         {"entryId": "sq-cursor-bottom", ...},
+#                     ]
+#                 }
+#             }
+#         ],
+#         ...
+#     },
+# }
+#
+# We need to separate the following entity types:
+# - "sq-I-t-..." are the Tweets matching the search query.
+# - "sq-M-..." contain supplementary information like user profiles that are
+#   somehow related to the matching Tweets (usually occurs once).
+# - "sq-E-..." seem to contain suggested live events (occur rarely).
+# - "sq-cursor-..." entries contain the cursors to fetch the next batch.
+#
+# All following batches will look similar except that the "sq-cursor-..."
+# entries are now differently placed:
+# {
+#     ...
+#     "timeline": {
+#         "id": "search-6602913956034868792",
+#         "instructions": [
+#             {
+#                 "addEntries": {
+#                     "entries": [
+#                         {"entryId": "sq-I-t-1157704001112219650", ...},
+#                         {"entryId": "sq-I-t-1156734175040266240", ...},
+#                         ...
+#                     ]
+#                 }
+#             },
+#             {
+#                 "replaceEntry": {
+#                     "entryIdToReplace": "sq-cursor-top",
+#                     "entry": {"entryId": "sq-cursor-top", ...},
+#                 }
+#             },
+#             {
+#                 "replaceEntry": {
+#                     "entryIdToReplace": "sq-cursor-bottom",
+#                     "entry": {"entryId": "sq-cursor-bottom", ...},
+#                 }
+#             },
+#         ],
+#         ...
+#     },
+# }
 
-        # Search results are contained in instructions. The first batch of a search will
-        # look like this:
-        # {
-        #     ...
-        #     "timeline": {
-        #         "id": "search-6602913952152093875",
-        #         "instructions": [
-        #             {
-        #                 "addEntries": {
-        #                     "entries": [
-        #                         {"entryId": "sq-I-t-1155486497451184128", ...},
-        #                         {"entryId": "sq-I-t-1194473608061607936", ...},
-        #                         {"entryId": "sq-M-1-d7721393", ...},
-        #                         {"entryId": "sq-E-1981039365", ...},
-        #                         ...
-        #                         {"entryId": "sq-cursor-top", ...},
-        #                         {"entryId": "sq-cursor-bottom", ...},
-        #                     ]
-        #                 }
-        #             }
-        #         ],
-        #         ...
-        #     },
-        # }
-        #
-        # We need to separate the following entity types:
-        # - "sq-I-t-..." are the Tweets matching the search query.
-        # - "sq-M-..." contain supplementary information like user profiles that are
-        #   somehow related to the matching Tweets (usually occurs once).
-        # - "sq-E-..." seem to contain suggested live events (occur rarely).
-        # - "sq-cursor-..." entries contain the cursors to fetch the next batch.
-        #
-        # All following batches will look similar except that the "sq-cursor-..."
-        # entries are now differently placed:
+
+def _search_tweet_entry(
+    entry: TimelineEntry, _position: int, result: ParsedTimeline
+) -> None:
+    # Matching Tweet entries look like this:
+    # {
+    #     "entryId": "sq-I-t-1155486497451184128",
+    #     "sortIndex": "999970",
+    #     "content": {
+    #         "item": {
+    #             "content": {
+    #                 "tweet": {
+    #                     "id": "1155486497451184128",
+    #                     "displayType": "Tweet",
+    #                     "highlights": {...},
+    #                 }
+    #             },
+    #             ...
+    #         }
+    #     },
+    # }
+    try:
+        tweet = entry["content"]["item"]["content"]["tweet"]
+    except KeyError:
+        # It can happen that Twitter locks a Tweet behind a tombstone, but
+        # still has it accessible. A corresponding entry:
         # {
-        #     ...
-        #     "timeline": {
-        #         "id": "search-6602913956034868792",
-        #         "instructions": [
-        #             {
-        #                 "addEntries": {
-        #                     "entries": [
-        #                         {"entryId": "sq-I-t-1157704001112219650", ...},
-        #                         {"entryId": "sq-I-t-1156734175040266240", ...},
+        #     "entryId": "sq-I-t-1313449844413992961",
+        #     "sortIndex": "999820",
+        #     "content": {
+        #         "item": {
+        #             "content": {
+        #                 "tombstone": {
+        #                     "displayType": "NonCompliant",
+        #                     "tombstoneInfo": {
+        #                         "text": "This Tweet violated the Twitter
+        #                         Rules about spreading misleading and
+        #                         potentially harmful information related
+        #                         to COVID-19. However, Twitter has
+        #                         determined that it may be in the
+        #                         public\u2019s interest for the Tweet to
+        #                         remain accessible. Learn more",
         #                         ...
-        #                     ]
-        #                 }
-        #             },
-        #             {
-        #                 "replaceEntry": {
-        #                     "entryIdToReplace": "sq-cursor-top",
-        #                     "entry": {"entryId": "sq-cursor-top", ...},
+        #                     },
+        #                     "tweet": {
+        #                         "id": "1313449844413992961",
+        #                         "displayType": "Tweet"
+        #                     }
         #                 }
         #             },
-        #             {
-        #                 "replaceEntry": {
-        #                     "entryIdToReplace": "sq-cursor-bottom",
-        #                     "entry": {"entryId": "sq-cursor-bottom", ...},
-        #                 }
-        #             },
-        #         ],
-        #         ...
+        #             ...
+        #         }
+        #     }
+        # },
+        tweet = entry["content"]["item"]["content"]["tombstone"]["tweet"]
+
+    if "promotedMetadata" in tweet:
+        # Tweets which have been promoted look like this:
+        # {
+        #     "id": "1279090694313959431",
+        #     "displayType": "Tweet",
+        #     "promotedMetadata": {
+        #         "advertiserId": "177112193",
+        #         "impressionId": "14aeb0b7a6b63a42",
+        #         "disclosureType": "NoDisclosure",
+        #         "experimentValues": {},
+        #         "promotedTrendId": "0",
         #     },
         # }
+        logger.debug("Skipping promoted Tweet {}.".format(tweet["id"]))
+        return
 
-        for entry in instructions[0]["addEntries"]["entries"]:
-            if entry["entryId"].startswith("sq-I-t-"):
-                # Matching Tweet entries look like this:
-                # {
-                #     "entryId": "sq-I-t-1155486497451184128",
-                #     "sortIndex": "999970",
-                #     "content": {
-                #         "item": {
-                #             "content": {
-                #                 "tweet": {
-                #                     "id": "1155486497451184128",
-                #                     "displayType": "Tweet",
-                #                     "highlights": {...},
-                #                 }
-                #             },
-                #             ...
-                #         }
-                #     },
-                # }
-                try:
-                    tweet = entry["content"]["item"]["content"]["tweet"]
-                except KeyError:
-                    # It can happen that Twitter locks a Tweet behind a tombstone, but
-                    # still has it accessible. A corresponding entry:
-                    # {
-                    #     "entryId": "sq-I-t-1313449844413992961",
-                    #     "sortIndex": "999820",
-                    #     "content": {
-                    #         "item": {
-                    #             "content": {
-                    #                 "tombstone": {
-                    #                     "displayType": "NonCompliant",
-                    #                     "tombstoneInfo": {
-                    #                         "text": "This Tweet violated the Twitter
-                    #                         Rules about spreading misleading and
-                    #                         potentially harmful information related
-                    #                         to COVID-19. However, Twitter has
-                    #                         determined that it may be in the
-                    #                         public\u2019s interest for the Tweet to
-                    #                         remain accessible. Learn more",
-                    #                         ...
-                    #                     },
-                    #                     "tweet": {
-                    #                         "id": "1313449844413992961",
-                    #                         "displayType": "Tweet"
-                    #                     }
-                    #                 }
-                    #             },
-                    #             ...
-                    #         }
-                    #     }
-                    # },
-                    tweet = entry["content"]["item"]["content"]["tombstone"]["tweet"]
+    result.tweet_ids.append(checked_cast(TweetId, tweet["id"]))
 
-                if "promotedMetadata" in tweet:
-                    # Tweets which have been promoted look like this:
-                    # {
-                    #     "id": "1279090694313959431",
-                    #     "displayType": "Tweet",
-                    #     "promotedMetadata": {
-                    #         "advertiserId": "177112193",
-                    #         "impressionId": "14aeb0b7a6b63a42",
-                    #         "disclosureType": "NoDisclosure",
-                    #         "experimentValues": {},
-                    #         "promotedTrendId": "0",
-                    #     },
-                    # }
-                    logger.debug("Skipping promoted Tweet {}.".format(tweet["id"]))
-                    continue
 
-                yield checked_cast(TweetId, tweet["id"])
-            elif entry["entryId"].startswith("sq-I-s-"):
-                # These entries look like the following and seem to be related to
-                # spell-checking the search queries, offering alternative suggestions,
-                # and highlighting results, so we ignore them.
-                # {
-                #   "entryId": "sq-I-s-aca75bb6",
-                #   "sortIndex": "999980",
-                #   "content": {
-                #     "item": {
-                #       "content": {
-                #         "spelling": {
-                #           "spellingResult": {
-                #             "text": "hilary",
-                #             "hitHighlights": [
-                #               {
-                #                 "startIndex": 0,
-                #                 "endIndex": 6
-                #               }
-                #             ],
-                #             "score": 101.78357696533203
-                #           },
-                #           "spellingAction": "Expand",
-                #           "originalQuery": "hillary lang:en"
-                #         }
-                #       },
-                #       "clientEventInfo": {
-                #         "component": "result",
-                #         "element": "spelling"
-                #       }
-                #     }
-                #   }
-                # }
-                pass
-            elif entry["entryId"].startswith("sq-M-"):
-                # These entries look like the following and seem to suggest users
-                # related to the search term, so we ignore them.
-                # {
-                #   "entryId": "sq-M-1-a0d759d2",
-                #   "sortIndex": "999970",
-                #   "content": {
-                #     "timelineModule": {
-                #       "items": [
-                #         {
-                #           "entryId": "sq-MI-u-1339835893",
-                #           "item": {
-                #             "content": {
-                #               "user": {
-                #                 "id": "1339835893",
-                #                 "displayType": "UserDetailed"
-                #               }
-                #             },
-                #             "clientEventInfo": {
-                #               "component": "user_module",
-                #               "element": "user",
-                #               "details": {
-                #                 "timelinesDetails": {
-                #                   "controllerData": "DAACDAAFDAABDAABDAACCgABAAAAAAAAAAAAAAwAAgoAAQAAAAAAAAABCgACACkc9QD8cSgLAAMAAAAPaGlsbGFyeSBsYW5nOmVuAAAAAAA="
-                #                 }
-                #               }
-                #             }
-                #           }
-                #         },
-                #         ...
-                #       ],
-                #       "displayType": "Vertical",
-                #       "header": {
-                #         "text": "People",
-                #         "sticky": true
-                #       },
-                #       "footer": {
-                #         "text": "View all",
-                #         "url": "twitter://search?query=hillary+lang%3Aen&src=typed_query&type=users"
-                #       },
-                #       "clientEventInfo": {
-                #         "component": "user_module",
-                #         "element": "module"
-                #       }
-                #     }
-                #   }
-                # }
-                pass
-            elif entry["entryId"].startswith("sq-E-"):
-                # TODO: document usage and example.
-                pass
-            elif entry["entryId"].startswith("sq-cursor-"):
-                # These entries look like the following and are used to query the
-                # previous/next Tweet batch. They are used in _next_cursor() but ignored
-                # here.
-                # {
-                #   "entryId": "sq-cursor-top",
-                #   "sortIndex": "999999999",
-                #   "content": {
-                #     "operation": {
-                #       "cursor": {
-                #         "value": "refresh:thGAVUV0VFVBYBFoCo98iIpPfgIxIYzAESY8LrAAAB9D-AYk3S8an8AAAAFxImKQvel2AHEiYpPuYXcAMSJiaHY1eQARE-MiL5FqABEiYlsPPXgAASJq0IQFTABBImicvYVgAQEiYSREbWoAESJkPX7xdwAhImPlMvl7AAEiYiUtlXsAMSIecAAVdgBhImRZcjF4ABEiZSHUTWkAQSJkUYiJeQBhIHM6qRVqAAEiZ34vSWsAASJipgjxewARImFK06V5AAEiaBkGQXcAESJifVa9agAhImkTQ-1gADEiYmF5rWkAElABUAJQARFaCFehWAiXoYBFVTRVIVABUAFS4VABUAAA==",
-                #         "cursorType": "Top"
-                #       }
-                #     }
-                #   }
-                # },
-                # {
-                #   "entryId": "sq-cursor-bottom",
-                #   "sortIndex": "0",
-                #   "content": {
-                #     "operation": {
-                #       "cursor": {
-                #         "value": "scroll:thGAVUV0VFVBYBFoCo98iIpPfgIxIYzAESY8LrAAAB9D-AYk3S8an8AAAAFxImKQvel2AHEiYpPuYXcAMSJiaHY1eQARE-MiL5FqABEiYlsPPXgAASJq0IQFTABBImicvYVgAQEiYSREbWoAESJkPX7xdwAhImPlMvl7AAEiYiUtlXsAMSIecAAVdgBhImRZcjF4ABEiZSHUTWkAQSJkUYiJeQBhIHM6qRVqAAEiZ34vSWsAASJipgjxewARImFK06V5AAEiaBkGQXcAESJifVa9agAhImkTQ-1gADEiYmF5rWkAElABUAJQARFaCFehWAiXoYBFVTRVIVABUAFS4VABUAAA==",
-                #         "cursorType": "Bottom"
-                #       }
-                #     }
-                #   }
-                # }
-                pass
-            elif (
-                entry["entryId"] == "novel_coronavirus_message"
-                or entry["entryId"] == "novel_coronavirus_msg"
-            ):
-                # TODO: document usage and example.
-                pass
-            else:
-                raise RuntimeError(
-                    "Unknown entry type in entry-ID '{}'.".format(entry["entryId"])
-                )
+def _search_cursor_entry(
+    entry: TimelineEntry, _position: int, result: ParsedTimeline
+) -> None:
+    # These entries look like the following and are used to query the previous/next
+    # Tweet batch. They can occur either as part of "addEntries" or "replaceEntry".
+    # We are only interested in sq-cursor-bottom and I'm not sure what sq-cursor-top
+    # is for.
+    # {
+    #   "entryId": "sq-cursor-top",
+    #   "sortIndex": "999999999",
+    #   "content": {
+    #     "operation": {
+    #       "cursor": {
+    #         "value": "refresh:thGAVUV0VFVBYBFoCo98iIpPfgIxIYzAESY8LrAAAB9D-AYk3S8an8AAAAFxImKQvel2AHEiYpPuYXcAMSJiaHY1eQARE-MiL5FqABEiYlsPPXgAASJq0IQFTABBImicvYVgAQEiYSREbWoAESJkPX7xdwAhImPlMvl7AAEiYiUtlXsAMSIecAAVdgBhImRZcjF4ABEiZSHUTWkAQSJkUYiJeQBhIHM6qRVqAAEiZ34vSWsAASJipgjxewARImFK06V5AAEiaBkGQXcAESJifVa9agAhImkTQ-1gADEiYmF5rWkAElABUAJQARFaCFehWAiXoYBFVTRVIVABUAFS4VABUAAA==",
+    #         "cursorType": "Top"
+    #       }
+    #     }
+    #   }
+    # },
+    # {
+    #   "entryId": "sq-cursor-bottom",
+    #   "sortIndex": "0",
+    #   "content": {
+    #     "operation": {
+    #       "cursor": {
+    #         "value": "scroll:thGAVUV0VFVBYBFoCo98iIpPfgIxIYzAESY8LrAAAB9D-AYk3S8an8AAAAFxImKQvel2AHEiYpPuYXcAMSJiaHY1eQARE-MiL5FqABEiYlsPPXgAASJq0IQFTABBImicvYVgAQEiYSREbWoAESJkPX7xdwAhImPlMvl7AAEiYiUtlXsAMSIecAAVdgBhImRZcjF4ABEiZSHUTWkAQSJkUYiJeQBhIHM6qRVqAAEiZ34vSWsAASJipgjxewARImFK06V5AAEiaBkGQXcAESJifVa9agAhImkTQ-1gADEiYmF5rWkAElABUAJQARFaCFehWAiXoYBFVTRVIVABUAFS4VABUAAA==",
+    #         "cursorType": "Bottom"
+    #       }
+    #     }
+    #   }
+    # }
+    result.cursor = checked_cast(str, entry["content"]["operation"]["cursor"]["value"])
 
-    @overrides
-    def _next_cursor(self) -> Optional[str]:
-        instructions: Final = cast(
-            Sequence[Any], self._json["timeline"]["instructions"]
-        )
 
-        # As documented in _tweet_ids_in_batch(), the cursor objects can occur either
-        # as part of "addEntries" or replaceEntry". We are only interested in
-        # sq-cursor-bottom and I'm not sure what sq-cursor-top is for. The actual cursor
-        # entry will look like this:
+_SEARCH_TIMELINE: Final = TimelineParser(
+    "Search",
+    {
+        "sq-I-t-": _search_tweet_entry,
+        # These entries look like the following and seem to be related to
+        # spell-checking the search queries, offering alternative suggestions,
+        # and highlighting results, so we ignore them.
         # {
-        #     "entryId": "sq-cursor-bottom",
-        #     "sortIndex": "0",
-        #     "content": {
-        #         "operation": {
-        #             "cursor": {"value": "scroll:thGAVUV...", "cursorType": "Bottom"}
+        #   "entryId": "sq-I-s-aca75bb6",
+        #   "sortIndex": "999980",
+        #   "content": {
+        #     "item": {
+        #       "content": {
+        #         "spelling": {
+        #           "spellingResult": {
+        #             "text": "hilary",
+        #             "hitHighlights": [
+        #               {
+        #                 "startIndex": 0,
+        #                 "endIndex": 6
+        #               }
+        #             ],
+        #             "score": 101.78357696533203
+        #           },
+        #           "spellingAction": "Expand",
+        #           "originalQuery": "hillary lang:en"
         #         }
-        #     },
+        #       },
+        #       "clientEventInfo": {
+        #         "component": "result",
+        #         "element": "spelling"
+        #       }
+        #     }
+        #   }
+        # }
+        "sq-I-s-": ignore_entry,
+        # These entries look like the following and seem to suggest users
+        # related to the search term, so we ignore them.
+        # {
+        #   "entryId": "sq-M-1-a0d759d2",
+        #   "sortIndex": "999970",
+        #   "content": {
+        #     "timelineModule": {
+        #       "items": [
+        #         {
+        #           "entryId": "sq-MI-u-1339835893",
+        #           "item": {
+        #             "content": {
+        #               "user": {
+        #                 "id": "1339835893",
+        #                 "displayType": "UserDetailed"
+        #               }
+        #             },
+        #             "clientEventInfo": {
+        #               "component": "user_module",
+        #               "element": "user",
+        #               "details": {
+        #                 "timelinesDetails": {
+        #                   "controllerData": "DAACDAAFDAABDAABDAACCgABAAAAAAAAAAAAAAwAAgoAAQAAAAAAAAABCgACACkc9QD8cSgLAAMAAAAPaGlsbGFyeSBsYW5nOmVuAAAAAAA="
+        #                 }
+        #               }
+        #             }
+        #           }
+        #         },
+        #         ...
+        #       ],
+        #       "displayType": "Vertical",
+        #       "header": {
+        #         "text": "People",
+        #         "sticky": true
+        #       },
+        #       "footer": {
+        #         "text": "View all",
+        #         "url": "twitter://search?query=hillary+lang%3Aen&src=typed_query&type=users"
+        #       },
+        #       "clientEventInfo": {
+        #         "component": "user_module",
+        #         "element": "module"
+        #       }
+        #     }
+        #   }
         # }
+        "sq-M-": ignore_entry,
+        # TODO: document usage and example.
+        "sq-E-": ignore_entry,
+        "sq-cursor-top": ignore_entry,
+        "sq-cursor-bottom": _search_cursor_entry,
+        # TODO: document usage and example.
+        "novel_coronavirus_message": ignore_entry,
+        "novel_coronavirus_msg": ignore_entry,
+    },
+)
+
+
+class SearchRetrieverBatch(RetrieverBatch):
+    @classmethod
+    @overrides
+    def _timeline_parser(cls) -> TimelineParser:
+        return _SEARCH_TIMELINE
 
-        cursor_entry = None
-        if instructions[0]["addEntries"]["entries"]:
-            cursor_entry = instructions[0]["addEntries"]["entries"][-1]
-        if not cursor_entry or cursor_entry["entryId"] != "sq-cursor-bottom":
-            cursor_entry = instructions[-1]["replaceEntry"]["entry"]
-        if cursor_entry["entryId"] != "sq-cursor-bottom":
+    @overrides
+    def _next_cursor(self, timeline: ParsedTimeline) -> Optional[str]:
+        # Search batches always carry a cursor, even the last one.
+        if timeline.cursor is None:
             raise RuntimeError("Could not locate cursor entry.")
-        return cast(
-            Optional[str], cursor_entry["content"]["operation"]["cursor"]["value"]
-        )
+        return timeline.cursor
+
+
+def _time_operator(name: str, value: date) -> str:
+    # Dates are matched at the granularity of days, datetimes need the *_time: variant
+    # of the operator, which takes seconds since the Unix epoch.
+    if isinstance(value, datetime):
+        return "{}_time:{}".format(name, utc_timestamp(value))
+    return "{}:{}".format(name, value.isoformat())
 
 
 class SearchRetriever(Retriever[Search]):
@@ -392,9 +386,9 @@ class SearchRetriever(Retriever[Search]):
         """
         result = self._request.query
         if self._request.since:
-            result += " since:" + self._request.since.isoformat()
+            result += " " + _time_operator("since", self._request.since)
         if self._request.until:
-            result += " until:" + self._request.until.isoformat()
+            result += " " + _time_operator("until", self._request.until)
         result += " lang:" + self._request.lang
         return result
 
@@ -0,0 +1,263 @@
+#
+# Copyright 2019-2020 Lukas Schmelzeisen
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from collections import deque
+from logging import getLogger
+from os import getenv
+from threading import Lock
+from time import time
+from typing import Deque, Dict, Mapping, Optional, cast
+
+from overrides import overrides
+from typing_extensions import Final
+
+from .._util.disk_cache import disk_cache
+from .._util.json_ import JsonSerializable
+from .._util.typing_ import checked_cast
+
+logger = getLogger(__name__)
+
+# Twitter sets the "gt"-cookie with a Max-Age of three hours. We stop using guest tokens
+# a bit earlier, so that they do not expire in the middle of a request.
+GUEST_TOKEN_TTL: Final = 3 * 60 * 60 - 10 * 60
+BEARER_TOKEN_TTL: Final = 7 * 24 * 60 * 60  # 1 week.
+
+
+def rate_limit_low_watermark() -> int:
+    """Number of remaining requests at which a session is considered rate-limited.
+
+    Configurable via the NASTY_RATE_LIMIT_LOW_WATERMARK environment variable. Keeping a
+    small reserve means we rotate to another session before Twitter actually starts
+    answering with HTTP 429.
+    """
+    return int(getenv("NASTY_RATE_LIMIT_LOW_WATERMARK", default="1"))
+
+
+_GUEST_SESSION_KEY_PREFIX: Final = "guest_session:"
+_BEARER_TOKEN_KEY_PREFIX: Final = "bearer_token:"
+
+
+class GuestSession(JsonSerializable):
+    """Credentials that authorize requests to api.twitter.com.
+
+    Obtained by emulating a web browser, see Retriever._fetch_new_twitter_session().
+    """
+
+    def __init__(
+        self,
+        *,
+        bearer_token: str,
+        guest_token: str,
+        cookies: Mapping[str, str],
+        expires_at: Optional[float] = None,
+        rate_limit_remaining: Optional[int] = None,
+        rate_limit_reset: Optional[float] = None,
+    ):
+        self.bearer_token: Final = bearer_token
+        self.guest_token: Final = guest_token
+        self.cookies: Final = cookies
+        self.expires_at: Final = (
+            expires_at if expires_at is not None else time() + GUEST_TOKEN_TTL
+        )
+        self.rate_limit_remaining = rate_limit_remaining
+        self.rate_limit_reset = rate_limit_reset
+
+    def __repr__(self) -> str:
+        return "{}(guest_token={!r})".format(type(self).__name__, self.guest_token)
+
+    @property
+    def expired(self) -> bool:
+        return self.expires_at <= time()
+
+    @property
+    def rate_limited(self) -> bool:
+        """Whether the session should not be used until its rate limit is reset."""
+        return (
+            self.rate_limit_remaining is not None
+            and self.rate_limit_reset is not None
+            and self.rate_limit_remaining <= rate_limit_low_watermark()
+            and self.rate_limit_reset > time()
+        )
+
+    def update_rate_limit(self, headers: Mapping[str, str]) -> None:
+        """Tracks the quota reported in the X-Rate-Limit-* headers of a response.
+
+        Responses by api.twitter.com include these for each endpoint. As we only use a
+        single endpoint per session, we do not differentiate between endpoints.
+
+        :param headers: Case-insensitive mapping of response headers.
+        """
+        remaining = headers.get("X-Rate-Limit-Remaining")
+        reset = headers.get("X-Rate-Limit-Reset")
+        if remaining is None or reset is None:
+            return
+        self.rate_limit_remaining = int(remaining)
+        self.rate_limit_reset = float(reset)
+
+    @overrides
+    def to_json(self) -> Mapping[str, object]:
+        return {
+            "bearer_token": self.bearer_token,
+            "guest_token": self.guest_token,
+            "cookies": self.cookies,
+            "expires_at": self.expires_at,
+            "rate_limit_remaining": self.rate_limit_remaining,
+            "rate_limit_reset": self.rate_limit_reset,
+        }
+
+    @classmethod
+    @overrides
+    def from_json(cls, obj: Mapping[str, object]) -> "GuestSession":
+        return cls(
+            bearer_token=checked_cast(str, obj["bearer_token"]),
+            guest_token=checked_cast(str, obj["guest_token"]),
+            cookies=cast(Mapping[str, str], obj["cookies"]),
+            expires_at=checked_cast(float, obj["expires_at"]),
+            rate_limit_remaining=cast(Optional[int], obj.get("rate_limit_remaining")),
+            rate_limit_reset=cast(Optional[float], obj.get("rate_limit_reset")),
+        )
+
+
+class GuestSessionPool:
+    """Process-wide, thread-safe pool of guest sessions shared by all Retrievers.
+
+    Establishing a guest session requires loading an HTML stub page and the
+    multi-megabyte main.js-script. Instead of doing this for every request, a Retriever
+    leases an idle session from this pool and returns it once its request is finished.
+    Sessions that ran into errors (e.g., rate limits) are discarded instead, so that the
+    next lease rotates to a different session.
+
+    Bearer tokens are cached per main.js-URL, so that even establishing a new guest
+    session only requires loading the HTML stub, as long as Twitter does not deploy a
+    new main.js-script.
+
+    Idle sessions and bearer tokens are additionally persisted to the disk cache (see
+    nasty._util.disk_cache), so that they are shared with other processes and survive
+    process restarts. A session leased from the disk cache is removed from it until
+    it is released again. Because the in-memory state is not synchronized with the
+    disk cache on every access, two processes may rarely end up using the same guest
+    token at the same time, which only means that they share its rate limit.
+    """
+
+    def __init__(self) -> None:
+        self._lock: Final = Lock()
+        self._idle_sessions: Deque[GuestSession] = deque()
+        self._bearer_tokens: Dict[str, str] = {}
+
+    def lease(self) -> Optional[GuestSession]:
+        """Takes an idle session from the pool.
+
+        Sessions that are currently rate-limited stay in the pool until their rate limit
+        is reset.
+
+        :return: The session or None, if no usable session is available, in which case
+            the caller needs to establish a new one.
+        """
+        cache = disk_cache()
+        with self._lock:
+            # Use the least recently returned session first, so that load is spread
+            # evenly across all sessions.
+            rate_limited = []
+            leased = None
+            while self._idle_sessions:
+                session = self._idle_sessions.popleft()
+                if session.expired:
+                    continue
+                if session.rate_limited:
+                    rate_limited.append(session)
+                    continue
+                leased = session
+                break
+            self._idle_sessions.extendleft(reversed(rate_limited))
+
+        if leased is not None:
+            if cache is not None:
+                cache.pop(_GUEST_SESSION_KEY_PREFIX + leased.guest_token)
+            return leased
+
+        if cache is not None:
+            obj = cache.pop_first(
+                _GUEST_SESSION_KEY_PREFIX,
+                lambda obj: not GuestSession.from_json(
+                    cast(Mapping[str, object], obj)
+                ).rate_limited,
+            )
+            if obj is not None:
+                leased = GuestSession.from_json(cast(Mapping[str, object], obj))
+                logger.debug(
+                    "  Loaded Twitter session {} from disk cache.".format(leased)
+                )
+                return leased
+
+        return None
+
+    def release(self, session: GuestSession) -> None:
+        """Returns a leased session to the pool, so that it can be used by others."""
+        if session.expired:
+            return
+
+        with self._lock:
+            self._idle_sessions.append(session)
+
+        cache = disk_cache()
+        if cache is not None:
+            cache.set(
+                _GUEST_SESSION_KEY_PREFIX + session.guest_token,
+                session.to_json(),
+                ttl=session.expires_at - time(),
+            )
+
+    def discard(self, session: GuestSession) -> None:
+        """Drops a leased session that should no longer be used."""
+        logger.debug("    Discarding Twitter session {}.".format(session))
+
+    def bearer_token(self, main_js_url: str) -> Optional[str]:
+        with self._lock:
+            bearer_token = self._bearer_tokens.get(main_js_url)
+        if bearer_token is not None:
+            return bearer_token
+
+        cache = disk_cache()
+        if cache is None:
+            return None
+        cached = cache.get(_BEARER_TOKEN_KEY_PREFIX + main_js_url)
+        if cached is None:
+            return None
+        bearer_token = checked_cast(str, cached)
+        with self._lock:
+            self._bearer_tokens[main_js_url] = bearer_token
+        return bearer_token
+
+    def add_bearer_token(self, main_js_url: str, bearer_token: str) -> None:
+        with self._lock:
+            self._bearer_tokens[main_js_url] = bearer_token
+
+        cache = disk_cache()
+        if cache is not None:
+            cache.set(
+                _BEARER_TOKEN_KEY_PREFIX + main_js_url,
+                bearer_token,
+                ttl=BEARER_TOKEN_TTL,
+            )
+
+    def clear(self) -> None:
+        """Forgets all in-memory state. Does not touch the disk cache."""
+        with self._lock:
+            self._idle_sessions.clear()
+            self._bearer_tokens.clear()
+
+
+GUEST_SESSION_POOL: Final = GuestSessionPool()
@@ -14,7 +14,7 @@
 # limitations under the License.
 #
 
-from typing import Any, Iterable, Optional, Sequence, Type, cast
+from typing import Type
 
 from overrides import overrides
 from typing_extensions import Final
@@ -23,176 +23,182 @@ from .._util.typing_ import checked_cast
 from ..request.thread import Thread
 from ..tweet.tweet import TweetId
 from .conversation_retriever import ConversationRetriever, ConversationRetrieverBatch
+from .timeline import ParsedTimeline, TimelineEntry, TimelineParser, ignore_entry
 
+# TODO: ensure all tweets in a thread are by the same user
 
-class ThreadRetrieverBatch(ConversationRetrieverBatch):
-    @overrides
-    def _tweet_ids(self) -> Iterable[TweetId]:
-        # TODO: ensure all tweets in a thread are by the same user
+# The first conversation batch contains entries for the Tweet with the requested
+# URL and possibly multiple conversation threads where the first on is always
+# the one where the Tweet author responds to himself for the first time:
+# {
+#     ...
+#     "timeline": {
+#         "id": "Conversation-1155486497451184128",
+#         "instructions": [
+#             {
+#                 "addEntries": {
+#                     "entries": [
+#                         {"entryId": "tweet-1155486497451184128", ...},
+#                         {"entryId": "conversationThread-11554883561...", ...},
+#                     ]
+#                 },
+#             },
+#             ...
+#         ],
+#         ...
+#     },
+# }
+#
+# Inside of the "conversationThread-" we find the actual thread Tweets:
+# {
+#     "entryId": "conversationThread-1155488356165398528",
+#     "sortIndex": "8067885539403591669",
+#     "content": {
+#         "timelineModule": {
+#             "items": [
+#                 {"entryId": "tweet-1155488356165398528", ...},
+#                 {"entryId": "tweet-1155490920621473792", ...},
+#                 ...
+#                 {"entryId": "conversationThread-11...-show_more_cursor", ...},
+#             ],
+#             ...
+#         }
+#     },
+# }
+# If the thread is over, the "...-show_more_cursor" is not present.
+#
+# All following batches will look like this instead:
+# {
+#     ...
+#     "timeline": {
+#         "id": "Conversation-1155486497451184128",
+#         "instructions": [
+#             {
+#                 "addToModule": {
+#                     "moduleItems": [
+#                         {"entryId": "tweet-1156606255940739078", ...},
+#                         {"entryId": "tweet-1156634771507810306", ...},
+#                         ...
+#                     ]
+#                 }
+#             }
+#         ],
+#     },
+# }
 
-        # The first conversation batch contains entries for the Tweet with the requested
-        # URL and possibly multiple conversation threads where the first on is always
-        # the one where the Tweet author responds to himself for the first time:
-        # {
-        #     ...
-        #     "timeline": {
-        #         "id": "Conversation-1155486497451184128",
-        #         "instructions": [
-        #             {
-        #                 "addEntries": {
-        #                     "entries": [
-        #                         {"entryId": "tweet-1155486497451184128", ...},
-        #                         {"entryId": "conversationThread-11554883561...", ...},
-        #                     ]
-        #                 },
-        #             },
-        #             ...
-        #         ],
-        #         ...
-        #     },
-        # }
-        #
-        # Inside of the "conversationThread-" we find the actual thread Tweets:
-        # {
-        #     "entryId": "conversationThread-1155488356165398528",
-        #     "sortIndex": "8067885539403591669",
-        #     "content": {
-        #         "timelineModule": {
-        #             "items": [
-        #                 {"entryId": "tweet-1155488356165398528", ...},
-        #                 {"entryId": "tweet-1155490920621473792", ...},
-        #                 ...
-        #                 {"entryId": "conversationThread-11...-show_more_cursor", ...},
-        #             ],
-        #             ...
-        #         }
-        #     },
-        # }
-        # If the thread is over, the "...-show_more_cursor" is not present.
-        #
-        # All following batches will look like this instead:
-        # {
-        #     ...
-        #     "timeline": {
-        #         "id": "Conversation-1155486497451184128",
-        #         "instructions": [
-        #             {
-        #                 "addToModule": {
-        #                     "moduleItems": [
-        #                         {"entryId": "tweet-1156606255940739078", ...},
-        #                         {"entryId": "tweet-1156634771507810306", ...},
-        #                         ...
-        #                     ]
-        #                 }
-        #             }
-        #         ],
-        #     },
-        # }
-        for entry in self._parse_instructions():
-            if entry["entryId"].startswith("tweet-"):
-                # Tweets in the thread look like this:
-                # {
-                #     "entryId": "tweet-1155488356165398528",
-                #     "item": {
-                #         "content": {
-                #             "tweet": {
-                #                 "id": "1155488356165398528",
-                #                 "displayType": "SelfThread",
-                #             }
-                #         },
-                #         ...
-                #     },
-                # }
-
-                if "tombstone" in entry["item"]["content"]:
-                    # Sometimes Tweets become unavailable over time (for instance
-                    # because they were deleted). They sometimes still show up
-                    # in results but are only designated with a tombstone. We skip those
-                    # when returning results.
-                    # {
-                    #     "entryId": "tweet-1079406406644715520",
-                    #     "item": {
-                    #         "content": {
-                    #             "tombstone": {
-                    #                 "displayType": "Inline",
-                    #                 "tombstoneInfo": {
-                    #                     "text": "",
-                    #                     "richText": {
-                    #                         "text": "This Tweet is unavailable.",
-                    #                         "entities": [],
-                    #                         "rtl": False,
-                    #                     },
-                    #                 },
-                    #                 "epitaph": "Suspended",
-                    #             }
-                    #         },
-                    #         ...
-                    #     },
-                    # }
-                    self.num_tombstones += 1
-
-                else:
-                    yield entry["item"]["content"]["tweet"]["id"]
-
-            elif entry["entryId"].startswith("conversationThread-") and entry[
-                "entryId"
-            ].endswith("-show_more_cursor"):
-                pass
-            elif entry["entryId"] == "novel_coronavirus_message":
-                pass
-            else:
-                raise RuntimeError(
-                    "Unknown entry type in entry-ID: '{}'.".format(entry["entryId"])
-                )
 
-    @overrides
-    def _next_cursor(self) -> Optional[str]:
-        # See the documentation of _tweet_ids_in_batch() on where the cursor entry
-        # occurs. It looks like this:
+def _thread_tweet_entry(
+    entry: TimelineEntry, _position: int, result: ParsedTimeline
+) -> None:
+    # Tweets in the thread look like this:
+    # {
+    #     "entryId": "tweet-1155488356165398528",
+    #     "item": {
+    #         "content": {
+    #             "tweet": {
+    #                 "id": "1155488356165398528",
+    #                 "displayType": "SelfThread",
+    #             }
+    #         },
+    #         ...
+    #     },
+    # }
+
+    if "tombstone" in entry["item"]["content"]:
+        # Sometimes Tweets become unavailable over time (for instance
+        # because they were deleted). They sometimes still show up
+        # in results but are only designated with a tombstone. We skip those
+        # when returning results.
         # {
-        #     "entryId": "conversationThread-1155488...-show_more_cursor",
+        #     "entryId": "tweet-1079406406644715520",
         #     "item": {
         #         "content": {
-        #             "timelineCursor": {
-        #                 "value": "TBwcFoLAvI3JhYuNIBUCAAAYJmNvbnZlcnNhdGlvbl...",
-        #                 "cursorType": "ShowMore",
-        #                 "displayTreatment": {"actionText": "5 more replies"},
+        #             "tombstone": {
+        #                 "displayType": "Inline",
+        #                 "tombstoneInfo": {
+        #                     "text": "",
+        #                     "richText": {
+        #                         "text": "This Tweet is unavailable.",
+        #                         "entities": [],
+        #                         "rtl": False,
+        #                     },
+        #                 },
+        #                 "epitaph": "Suspended",
         #             }
         #         },
         #         ...
         #     },
         # }
-        instructions = self._parse_instructions()
-        if not instructions:
-            return None
-
-        cursor_entry = instructions[-1]
-        if cursor_entry["entryId"].startswith("conversationThread-") and cursor_entry[
-            "entryId"
-        ].endswith("-show_more_cursor"):
-            return checked_cast(
-                str, cursor_entry["item"]["content"]["timelineCursor"]["value"]
-            )
-        return None
-
-    def _parse_instructions(self) -> Sequence[Any]:
-        # See the documentation of _tweet_ids_in_batch() on what JSON-structures
-        # this navigates.
-        instructions: Final = cast(
-            Sequence[Any], self._json["timeline"]["instructions"]
+        result.num_tombstones += 1
+    else:
+        result.tweet_ids.append(
+            checked_cast(TweetId, entry["item"]["content"]["tweet"]["id"])
         )
-        if "addEntries" in instructions[0]:
-            entries = instructions[0]["addEntries"]["entries"]
-            if not (
-                len(entries) >= 2
-                and entries[1]["entryId"].startswith("conversationThread-")
-            ):
-                return []
-            return cast(Sequence[Any], entries[1]["content"]["timelineModule"]["items"])
-        elif "addToModule" in instructions[0]:
-            return cast(Sequence[Any], instructions[0]["addToModule"]["moduleItems"])
-        else:
-            raise RuntimeError("Could not parse conversation instructions.")
+
+
+def _thread_cursor_entry(
+    entry: TimelineEntry, _position: int, result: ParsedTimeline
+) -> None:
+    # The cursor entry is the last item of the thread and looks like this:
+    # {
+    #     "entryId": "conversationThread-1155488...-show_more_cursor",
+    #     "item": {
+    #         "content": {
+    #             "timelineCursor": {
+    #                 "value": "TBwcFoLAvI3JhYuNIBUCAAAYJmNvbnZlcnNhdGlvbl...",
+    #                 "cursorType": "ShowMore",
+    #                 "displayTreatment": {"actionText": "5 more replies"},
+    #             }
+    #         },
+    #         ...
+    #     },
+    # }
+    result.cursor = checked_cast(
+        str, entry["item"]["content"]["timelineCursor"]["value"]
+    )
+
+
+def _thread_conversation_entry(
+    entry: TimelineEntry, position: int, result: ParsedTimeline
+) -> None:
+    # Only the conversation thread directly following the Tweet with the requested ID
+    # is the author's thread, all following ones are replies by others.
+    if position == 1:
+        _THREAD_ITEMS.parse_entries(entry["content"]["timelineModule"]["items"], result)
+
+
+_THREAD_ITEMS: Final = TimelineParser(
+    "Thread",
+    {
+        "tweet-": _thread_tweet_entry,
+        # Only occurs as "conversationThread-...-show_more_cursor".
+        "conversationThread-": _thread_cursor_entry,
+        "novel_coronavirus_message": ignore_entry,
+    },
+)
+
+_THREAD_TIMELINE: Final = TimelineParser(
+    "Thread",
+    {
+        # The first batch has the same entries as a Replies batch (see
+        # replies_retriever.py), of which we only need the author's thread.
+        "tweet-": ignore_entry,
+        "conversationThread-": _thread_conversation_entry,
+        "label-": ignore_entry,
+        "cursor-bottom-": ignore_entry,
+        "cursor-showMoreThreads-": ignore_entry,
+        "cursor-showMoreThreadsPrompt-": ignore_entry,
+        "novel_coronavirus_message": ignore_entry,
+    },
+    module_item_parser=_THREAD_ITEMS,
+)
+
+
+class ThreadRetrieverBatch(ConversationRetrieverBatch):
+    @classmethod
+    @overrides
+    def _timeline_parser(cls) -> TimelineParser:
+        return _THREAD_TIMELINE
 
 
 class ThreadRetriever(ConversationRetriever[Thread]):
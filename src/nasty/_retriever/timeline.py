@@ -0,0 +1,134 @@
+#
+# Copyright 2019-2020 Lukas Schmelzeisen
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import re
+from logging import getLogger
+from typing import Any, Callable, List, Mapping, Optional, Sequence
+
+from typing_extensions import Final
+
+from ..tweet.tweet import TweetId
+
+logger = getLogger(__name__)
+
+TimelineEntry = Mapping[str, Any]
+
+
+class ParsedTimeline:
+    """Everything extracted from the instructions of a timeline batch."""
+
+    def __init__(self) -> None:
+        self.tweet_ids: Final[List[TweetId]] = []
+        self.cursor: Optional[str] = None
+        self.num_tombstones = 0
+        self.num_unknown_entries = 0
+
+
+# Entry handlers receive the entry, its position in the list of entries it occurs in,
+# and the ParsedTimeline to record their findings in.
+EntryHandler = Callable[[TimelineEntry, int, ParsedTimeline], None]
+
+
+def ignore_entry(
+    _entry: TimelineEntry, _position: int, _result: ParsedTimeline
+) -> None:
+    pass
+
+
+class TimelineParser:
+    """Single-pass parser for the instructions of Twitter's timeline API responses.
+
+    A timeline consists of instructions ("addEntries", "replaceEntry", "addToModule")
+    that carry entries whose type is encoded in the prefix of their entry-ID (e.g.,
+    "sq-I-t-..." for Search results or "cursor-bottom-..." for cursors). Each parser is
+    given a table that maps these prefixes to handlers, which is compiled into a single
+    regular expression, so that each entry is dispatched with one match. If multiple
+    prefixes match an entry-ID, the longest one wins. Since entries of the same type
+    tend to follow each other (e.g., the Tweets of a batch), each entry is first checked
+    against the prefix of the previous one, if that is not part of a longer prefix.
+
+    Entries with unknown prefixes are counted and skipped, so that Twitter introducing
+    new entry types does not break running requests.
+
+    :param name: Name of the timeline, used in log messages.
+    :param handlers: Maps entry-ID prefixes to the handlers for such entries.
+    :param module_item_parser: Parser for the items of "addToModule" instructions, if
+        they differ from top-level entries. Defaults to this parser.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        handlers: Mapping[str, EntryHandler],
+        *,
+        module_item_parser: Optional["TimelineParser"] = None,
+    ):
+        self.name: Final = name
+        self._handlers: Final = dict(handlers)
+        self._pattern: Final = re.compile(
+            "|".join(
+                re.escape(prefix) for prefix in sorted(handlers, key=len, reverse=True)
+            )
+        )
+        self._module_item_parser: Final = module_item_parser or self
+
+        # Prefixes that are not the start of another prefix, i.e., for which a matching
+        # startswith() is conclusive.
+        self._maximal_prefixes: Final = frozenset(
+            prefix
+            for prefix in handlers
+            if not any(
+                other != prefix and other.startswith(prefix) for other in handlers
+            )
+        )
+
+    def parse(self, instructions: Sequence[Mapping[str, Any]]) -> ParsedTimeline:
+        result = ParsedTimeline()
+        for instruction in instructions:
+            if "addEntries" in instruction:
+                self.parse_entries(instruction["addEntries"]["entries"], result)
+            elif "replaceEntry" in instruction:
+                self.parse_entries([instruction["replaceEntry"]["entry"]], result)
+            elif "addToModule" in instruction:
+                self._module_item_parser.parse_entries(
+                    instruction["addToModule"]["moduleItems"], result
+                )
+        return result
+
+    def parse_entries(
+        self, entries: Sequence[TimelineEntry], result: ParsedTimeline
+    ) -> None:
+        match = self._pattern.match
+        handlers = self._handlers
+        maximal_prefixes = self._maximal_prefixes
+        prev_prefix = None
+        prev_handler = ignore_entry
+        for position, entry in enumerate(entries):
+            entry_id = entry["entryId"]
+            if prev_prefix is None or not entry_id.startswith(prev_prefix):
+                prefix_match = match(entry_id)
+                if prefix_match is None:
+                    logger.warning(
+                        "Skipping entry '{}' of unknown type in {} timeline.".format(
+                            entry_id, self.name
+                        )
+                    )
+                    result.num_unknown_entries += 1
+                    continue
+                prefix = prefix_match.group()
+                prev_prefix = prefix if prefix in maximal_prefixes else None
+                prev_handler = handlers[prefix]
+            prev_handler(entry, position, result)
@@ -0,0 +1,161 @@
+#
+# Copyright 2019-2020 Lukas Schmelzeisen
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from http import HTTPStatus
+from importlib.util import find_spec
+from logging import getLogger
+from os import getenv
+from threading import Lock
+from typing import Optional, Tuple, Type
+from urllib.parse import urlsplit, urlunsplit
+
+from requests.adapters import HTTPAdapter
+from typing_extensions import Final
+from urllib3 import Retry
+
+from .replay import RecordingHTTPAdapter, ReplayHTTPAdapter, transport_mode
+
+logger = getLogger(__name__)
+
+# Automated retries are performed by urllib3 for the synchronous Retriever and by
+# hand for the AsyncRetriever. Both use the following configuration.
+MAX_RETRIES: Final = 5
+RETRY_BACKOFF_FACTOR: Final = 0.1
+RETRY_STATUS_CODES: Final = [
+    HTTPStatus.REQUEST_TIMEOUT,  # HTTP 408
+    HTTPStatus.CONFLICT,  # HTTP 409
+    HTTPStatus.INTERNAL_SERVER_ERROR,  # HTTP 500
+    HTTPStatus.NOT_IMPLEMENTED,  # HTTP 501
+    HTTPStatus.BAD_GATEWAY,  # HTTP 502
+    HTTPStatus.SERVICE_UNAVAILABLE,  # HTTP 503
+    HTTPStatus.GATEWAY_TIMEOUT,  # HTTP 504
+]
+
+
+def accept_encoding() -> str:
+    """Value for the Accept-Encoding header, i.e., which compressions we can decode.
+
+    Batches from api.twitter.com are large JSON documents that compress very well.
+    Brotli is only offered if a module to decode it is installed (both requests/urllib3
+    and httpx support the same ones).
+    """
+    encodings = ["gzip", "deflate"]
+    if find_spec("brotli") is not None or find_spec("brotlicffi") is not None:
+        encodings.append("br")
+    return ", ".join(encodings)
+
+
+def timeouts() -> Tuple[float, float]:
+    """Timeouts for establishing connections and for waiting on data respectively.
+
+    Configurable via the NASTY_CONNECT_TIMEOUT and NASTY_READ_TIMEOUT environment
+    variables (in seconds). Timed out requests are retried like failed connections.
+    """
+    return (
+        float(getenv("NASTY_CONNECT_TIMEOUT", default="10")),
+        float(getenv("NASTY_READ_TIMEOUT", default="60")),
+    )
+
+
+def pool_size() -> int:
+    """Number of connections to keep open per host.
+
+    Configurable via NASTY_POOL_SIZE. Defaults to the number of Batch workers
+    (NASTY_NUM_WORKERS), as each worker performs at most one request at a time.
+    """
+    return int(getenv("NASTY_POOL_SIZE", default=getenv("NASTY_NUM_WORKERS", "1")))
+
+
+def use_http2() -> bool:
+    """Whether the AsyncRetriever should use HTTP/2 (set NASTY_HTTP2 to enable).
+
+    Requires the h2 package, e.g., via "pip install httpx[http2]". Not supported by the
+    synchronous Retriever, as requests only speaks HTTP/1.1.
+    """
+    return bool(getenv("NASTY_HTTP2"))
+
+
+def twitter_url(url: str) -> str:
+    """Redirects URLs of Twitter to the mock server given via NASTY_MOCK_SERVER.
+
+    The mock server (see nasty._mock_server) is given by its base URL, e.g.,
+    "http://127.0.0.1:8080". Only scheme and host of the URL are replaced, as paths
+    suffice to tell Twitter's endpoints apart. Without NASTY_MOCK_SERVER, URLs are
+    returned as is.
+    """
+    mock_server = getenv("NASTY_MOCK_SERVER")
+    if not mock_server:
+        return url
+    parts = urlsplit(url)
+    if not parts.netloc.endswith(("twitter.com", "twimg.com")):
+        return url
+    server = urlsplit(mock_server)
+    return urlunsplit(parts._replace(scheme=server.scheme, netloc=server.netloc))
+
+
+_shared_http_adapter: Optional[HTTPAdapter] = None
+_shared_http_adapter_lock: Final = Lock()
+
+
+def shared_http_adapter() -> HTTPAdapter:
+    """HTTPAdapter shared by the sessions of all Retrievers in this process.
+
+    An HTTPAdapter owns the connection pools, so sharing it means that connections
+    (and their TLS handshakes) are reused across requests instead of being established
+    anew for each Retriever. Cookies and headers are kept per session and are not
+    affected by this.
+
+    Depending on transport_mode(), the adapter records all responses or replays them
+    without accessing the network.
+    """
+    global _shared_http_adapter
+    with _shared_http_adapter_lock:
+        if _shared_http_adapter is None:
+            size = pool_size()
+            mode = transport_mode()
+            logger.debug(
+                "Creating HTTP connection pools of size {} "
+                "(transport mode: {}).".format(size, mode)
+            )
+            adapter_type: Type[HTTPAdapter] = HTTPAdapter
+            if mode == "record":
+                adapter_type = RecordingHTTPAdapter
+            elif mode == "replay":
+                adapter_type = ReplayHTTPAdapter
+            _shared_http_adapter = adapter_type(
+                pool_maxsize=size,
+                # Configure on which status codes we should perform automated retries.
+                max_retries=Retry(
+                    total=MAX_RETRIES,
+                    connect=MAX_RETRIES,
+                    redirect=10,
+                    backoff_factor=RETRY_BACKOFF_FACTOR,
+                    raise_on_redirect=True,
+                    raise_on_status=True,
+                    status_forcelist=RETRY_STATUS_CODES,
+                ),
+            )
+        return _shared_http_adapter
+
+
+def reset_shared_http_adapter() -> None:
+    """Drops the shared_http_adapter(), so that the next call creates a new one.
+
+    Needed in forked processes, which must not use the connections of their parent.
+    """
+    global _shared_http_adapter
+    with _shared_http_adapter_lock:
+        _shared_http_adapter = None
@@ -0,0 +1,77 @@
+#
+# Copyright 2019-2020 Lukas Schmelzeisen
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import hashlib
+from math import ceil, log
+from threading import Lock
+from typing import Sequence
+
+from typing_extensions import Final
+
+
+class BloomFilter:
+    """Memory-bounded set of strings that may report false positives, but never misses.
+
+    Sized for the given capacity, i.e., the number of expected distinct keys, so that
+    the probability of a false positive stays below error_rate until then. Adding
+    more keys does not grow the filter, instead the false positive rate increases.
+
+    Bit positions are derived from a single BLAKE2 digest per key via double hashing
+    (Kirsch and Mitzenmacher, 2006). All operations are thread-safe.
+    """
+
+    def __init__(self, capacity: int, error_rate: float):
+        if capacity < 1:
+            raise ValueError("Capacity needs to be positive, was {}.".format(capacity))
+        if not 0.0 < error_rate < 1.0:
+            raise ValueError(
+                "Error rate needs to be in (0, 1), was {}.".format(error_rate)
+            )
+
+        self.capacity: Final = capacity
+        self.error_rate: Final = error_rate
+        self.num_bits: Final = ceil(-capacity * log(error_rate) / (log(2) ** 2))
+        self.num_hashes: Final = max(1, round(self.num_bits / capacity * log(2)))
+        self._bits: Final = bytearray((self.num_bits + 7) // 8)
+        self._lock: Final = Lock()
+
+    def _indices(self, key: str) -> Sequence[int]:
+        digest = hashlib.blake2b(key.encode("UTF-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+
+    def __contains__(self, key: object) -> bool:
+        if not isinstance(key, str):
+            return False
+        indices = self._indices(key)
+        with self._lock:
+            return all(self._bits[index >> 3] & (1 << (index & 7)) for index in indices)
+
+    def add(self, key: str) -> bool:
+        """Adds the key to the filter.
+
+        :return: Whether the key was (probably) already contained before.
+        """
+        indices = self._indices(key)
+        contained = True
+        with self._lock:
+            for index in indices:
+                mask = 1 << (index & 7)
+                if not self._bits[index >> 3] & mask:
+                    self._bits[index >> 3] |= mask
+                    contained = False
+        return contained
@@ -0,0 +1,344 @@
+#
+# Copyright 2019-2020 Lukas Schmelzeisen
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import gzip
+import io
+import lzma
+from abc import abstractmethod
+from functools import lru_cache
+from hashlib import sha256
+from os import getenv
+from pathlib import Path
+from typing import BinaryIO, Iterable, Mapping, Optional, cast
+
+from overrides import overrides
+from typing_extensions import Final
+
+from .json_ import JsonSerializable
+from .typing_ import checked_cast
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None
+
+# Directory (relative to a results directory) holding the Zstandard dictionaries used
+# by its data files.
+DICTIONARIES_DIR_NAME: Final = Path("dictionaries")
+
+
+class Codec(JsonSerializable):
+    """Compression format of data files.
+
+    Data files are written in frames: each call to compress() yields a self-contained
+    frame, and a file of concatenated frames decompresses to the concatenated data.
+    This allows appending to data files, e.g., when checkpointing.
+    """
+
+    name: str
+    suffix: str
+
+    def __init__(self, *, level: Optional[int] = None):
+        self.level: Final = level
+
+    def __eq__(self, other: object) -> bool:
+        return type(self) == type(other) and self.__dict__ == other.__dict__
+
+    @abstractmethod
+    def compress(self, data: bytes) -> bytes:
+        raise NotImplementedError()
+
+    @abstractmethod
+    def open_read(self, file: Path) -> BinaryIO:
+        raise NotImplementedError()
+
+    def open_write(self, file: Path) -> BinaryIO:
+        # Compressing everything as one frame on close is fine for the files written
+        # at once, which are small compared to those of executing requests.
+        return _CompressOnClose(file, self)
+
+    def resolve(self, results_dir: Path) -> "Codec":
+        """Codec ready to read data files from the given results directory."""
+        return self
+
+    def install(self, results_dir: Path) -> None:
+        """Stores what is needed to read files of this codec into the results dir."""
+
+    @classmethod
+    def parse(cls, spec: str) -> "Codec":
+        """Parses codecs in the form NAME[:LEVEL[:DICTIONARY_FILE]].
+
+        For example, "xz", "gzip:9", "none", or "zstd:19:tweets.zstd-dict".
+        """
+        name, *args = spec.split(":", maxsplit=2)
+        level = int(args[0]) if args and args[0] else None
+        dictionary_file = Path(args[1]) if len(args) > 1 else None
+        if dictionary_file is not None and name != ZstdCodec.name:
+            raise ValueError("Only zstd supports dictionaries: '{}'.".format(spec))
+
+        if name == XzCodec.name:
+            return XzCodec(level=level)
+        elif name == ZstdCodec.name:
+            return ZstdCodec(
+                level=level,
+                dictionary=(
+                    dictionary_file.read_bytes()
+                    if dictionary_file is not None
+                    else None
+                ),
+            )
+        elif name == GzipCodec.name:
+            return GzipCodec(level=level)
+        elif name == NoneCodec.name:
+            if level is not None:
+                raise ValueError("Codec none has no level: '{}'.".format(spec))
+            return NoneCodec()
+        raise ValueError("Unknown codec: '{}'.".format(spec))
+
+    @overrides
+    def to_json(self) -> Mapping[str, object]:
+        obj: Mapping[str, object] = {"name": self.name}
+        if self.level is not None:
+            obj = {**obj, "level": self.level}
+        return obj
+
+    @classmethod
+    @overrides
+    def from_json(cls, obj: Mapping[str, object]) -> "Codec":
+        name = obj["name"]
+        level = cast(Optional[int], obj.get("level"))
+        if name == XzCodec.name:
+            return XzCodec(level=level)
+        elif name == ZstdCodec.name:
+            return ZstdCodec(
+                level=level,
+                dictionary_id=cast(Optional[str], obj.get("dictionary")),
+            )
+        elif name == GzipCodec.name:
+            return GzipCodec(level=level)
+        elif name == NoneCodec.name:
+            return NoneCodec()
+        raise ValueError("Unknown codec: '{}'.".format(name))
+
+
+class XzCodec(Codec):
+    """LZMA in XZ container. Compresses best, but is slowest to (de)compress."""
+
+    name = "xz"
+    suffix = ".xz"
+
+    @overrides
+    def compress(self, data: bytes) -> bytes:
+        return lzma.compress(data, preset=self.level)
+
+    @overrides
+    def open_read(self, file: Path) -> BinaryIO:
+        return cast(BinaryIO, lzma.open(file, "rb"))
+
+    @overrides
+    def open_write(self, file: Path) -> BinaryIO:
+        return cast(BinaryIO, lzma.open(file, "wb", preset=self.level))
+
+
+class GzipCodec(Codec):
+    name = "gzip"
+    suffix = ".gz"
+
+    @overrides
+    def compress(self, data: bytes) -> bytes:
+        return gzip.compress(data, compresslevel=self._compresslevel)
+
+    @overrides
+    def open_read(self, file: Path) -> BinaryIO:
+        return cast(BinaryIO, gzip.open(file, "rb"))
+
+    @overrides
+    def open_write(self, file: Path) -> BinaryIO:
+        return cast(BinaryIO, gzip.open(file, "wb", compresslevel=self._compresslevel))
+
+    @property
+    def _compresslevel(self) -> int:
+        return self.level if self.level is not None else 6
+
+
+class NoneCodec(Codec):
+    name = "none"
+    suffix = ""
+
+    @overrides
+    def compress(self, data: bytes) -> bytes:
+        return data
+
+    @overrides
+    def open_read(self, file: Path) -> BinaryIO:
+        return file.open("rb")
+
+    @overrides
+    def open_write(self, file: Path) -> BinaryIO:
+        return file.open("wb")
+
+
+class ZstdCodec(Codec):
+    """Zstandard, optionally with a dictionary (see train_zstd_dictionary()).
+
+    Much faster to (de)compress than XZ. With a dictionary trained on Tweets, it also
+    compresses small frames, as written when checkpointing, considerably better.
+    Requires zstandard to be installed (via "pip install nasty[zstd]").
+    """
+
+    name = "zstd"
+    suffix = ".zst"
+
+    def __init__(
+        self,
+        *,
+        level: Optional[int] = None,
+        dictionary: Optional[bytes] = None,
+        dictionary_id: Optional[str] = None,
+    ):
+        super().__init__(level=level)
+        if dictionary is not None:
+            dictionary_id = sha256(dictionary).hexdigest()[:16]
+        self.dictionary_id: Final = dictionary_id
+        self._dictionary = dictionary
+
+    @overrides
+    def __eq__(self, other: object) -> bool:
+        return (
+            type(self) == type(other)
+            and self.level == cast(ZstdCodec, other).level
+            and self.dictionary_id == cast(ZstdCodec, other).dictionary_id
+        )
+
+    @overrides
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor().compress(data)
+
+    @overrides
+    def open_read(self, file: Path) -> BinaryIO:
+        reader = self._decompressor().stream_reader(  # type: ignore
+            file.open("rb"), read_across_frames=True, closefd=True
+        )
+        return cast(BinaryIO, io.BufferedReader(reader))
+
+    @overrides
+    def resolve(self, results_dir: Path) -> "Codec":
+        if self.dictionary_id is None or self._dictionary is not None:
+            return self
+        return ZstdCodec(
+            level=self.level,
+            dictionary=_read_dictionary(self._dictionary_file(results_dir)),
+        )
+
+    @overrides
+    def install(self, results_dir: Path) -> None:
+        if self.dictionary_id is None:
+            return
+        file = self._dictionary_file(results_dir)
+        if not file.exists():
+            file.parent.mkdir(parents=True, exist_ok=True)
+            tmp_file = file.parent / (".tmp." + file.name)
+            tmp_file.write_bytes(self._checked_dictionary())
+            tmp_file.replace(file)
+
+    @overrides
+    def to_json(self) -> Mapping[str, object]:
+        obj = super().to_json()
+        if self.dictionary_id is not None:
+            obj = {**obj, "dictionary": self.dictionary_id}
+        return obj
+
+    def _dictionary_file(self, results_dir: Path) -> Path:
+        return (
+            results_dir
+            / DICTIONARIES_DIR_NAME
+            / (checked_cast(str, self.dictionary_id) + ".zstd-dict")
+        )
+
+    def _checked_dictionary(self) -> bytes:
+        if self._dictionary is None:
+            raise ValueError(
+                "Dictionary '{}' was not loaded, call resolve() first.".format(
+                    self.dictionary_id
+                )
+            )
+        return self._dictionary
+
+    def _compressor(self) -> "zstandard.ZstdCompressor":
+        return zstandard.ZstdCompressor(  # type: ignore
+            level=self.level if self.level is not None else 3,
+            dict_data=self._compression_dict(),
+        )
+
+    def _decompressor(self) -> "zstandard.ZstdDecompressor":
+        return zstandard.ZstdDecompressor(  # type: ignore
+            dict_data=self._compression_dict()
+        )
+
+    def _compression_dict(self) -> object:
+        _check_zstandard()
+        if self.dictionary_id is None:
+            return None
+        return zstandard.ZstdCompressionDict(self._checked_dictionary())  # type: ignore
+
+
+def _check_zstandard() -> None:
+    if zstandard is None:
+        raise ImportError(
+            "The zstd codec requires zstandard to be installed. Install it via "
+            "'pip install nasty[zstd]'."
+        )
+
+
+@lru_cache(maxsize=16)
+def _read_dictionary(file: Path) -> bytes:
+    # Dictionaries are immutable (named by their hash), so caching them is safe.
+    return file.read_bytes()
+
+
+def train_zstd_dictionary(samples: Iterable[bytes], *, size: int = 112_640) -> bytes:
+    """Trains a Zstandard dictionary of the given size on the samples.
+
+    Samples should resemble the data to compress, e.g., lines of Tweet JSON.
+    """
+    _check_zstandard()
+    return cast(
+        bytes,
+        zstandard.train_dictionary(size, list(samples)).as_bytes(),  # type: ignore
+    )
+
+
+class _CompressOnClose(io.BytesIO):
+    def __init__(self, file: Path, codec: Codec):
+        super().__init__()
+        self._file = file
+        self._codec = codec
+
+    @overrides
+    def close(self) -> None:
+        if not self.closed:
+            self._file.write_bytes(self._codec.compress(self.getvalue()))
+        super().close()
+
+
+XZ: Final[Codec] = XzCodec()
+
+CODECS: Final = (XzCodec, ZstdCodec, GzipCodec, NoneCodec)
+
+
+def default_codec() -> Codec:
+    """Codec for data files of new results (NASTY_CODEC, see Codec.parse())."""
+    return Codec.parse(getenv("NASTY_CODEC", default="xz"))
@@ -0,0 +1,144 @@
+#
+# Copyright 2019-2020 Lukas Schmelzeisen
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from contextlib import ExitStack, contextmanager
+from logging import getLogger
+from os import getenv
+from pathlib import Path
+from time import time
+from typing import Callable, Dict, Iterator, Mapping, Optional, cast
+
+from typing_extensions import Final
+from xdg import XDG_CACHE_HOME
+
+from .io_ import locked, read_file, write_file
+from .json_ import dumps, loads
+
+logger = getLogger(__name__)
+
+
+def nasty_cache_dir() -> Path:
+    """Directory for files that NASTY may delete and recreate at any time.
+
+    Defaults to ${XDG_CACHE_HOME}/nasty and can be overwritten via the NASTY_CACHE_DIR
+    environment variable.
+    """
+    cache_dir = getenv("NASTY_CACHE_DIR")
+    return Path(cache_dir) if cache_dir else XDG_CACHE_HOME / "nasty"
+
+
+class DiskCache:
+    """Key-value store with per-entry time-to-live that is shared between processes.
+
+    All entries are kept in a single JSON file. Every operation locks the file, so that
+    concurrent processes (e.g., multiple "nasty" CLI calls) see a consistent state.
+    Values need to be JSON-serializable. Expiration is measured in wall-clock time,
+    since monotonic clocks are not comparable across processes.
+
+    The cache is purely an optimization: if the file can not be read or written, a
+    warning is logged and the cache behaves as if it was empty.
+    """
+
+    def __init__(self, file: Path):
+        self.file: Final = file
+        self._lock_file: Final = file.parent / (".lock." + file.name)
+
+    def get(self, key: str) -> Optional[object]:
+        with self._entries() as entries:
+            entry = entries.get(key)
+            return entry["value"] if entry is not None else None
+
+    def set(self, key: str, value: object, *, ttl: float) -> None:
+        with self._entries(modify=True) as entries:
+            entries[key] = {"value": value, "expires_at": time() + ttl}
+
+    def pop(self, key: str) -> Optional[object]:
+        with self._entries(modify=True) as entries:
+            entry = entries.pop(key, None)
+            return entry["value"] if entry is not None else None
+
+    def pop_first(
+        self, key_prefix: str, predicate: Optional[Callable[[object], bool]] = None
+    ) -> Optional[object]:
+        """Removes and returns the value of the oldest entry with the given prefix.
+
+        :param predicate: If given, only entries whose value satisfy it are considered.
+        """
+        with self._entries(modify=True) as entries:
+            for key, entry in entries.items():
+                if key.startswith(key_prefix) and (
+                    predicate is None or predicate(entry["value"])
+                ):
+                    return entries.pop(key)["value"]
+            return None
+
+    @contextmanager
+    def _entries(
+        self, *, modify: bool = False
+    ) -> Iterator[Dict[str, Dict[str, object]]]:
+        with ExitStack() as stack:
+            try:
+                stack.enter_context(locked(self._lock_file))
+                entries = self._read_unexpired_entries()
+            except OSError as e:
+                self._warn_inaccessible(e)
+                yield {}
+                return
+
+            yield entries
+            if modify:
+                try:
+                    write_file(self.file, dumps(entries), overwrite_existing=True)
+                except OSError as e:
+                    self._warn_inaccessible(e)
+
+    def _warn_inaccessible(self, e: OSError) -> None:
+        logger.warning(
+            "Could not access cache file '{}': {}. Continuing without.".format(
+                self.file, e
+            )
+        )
+
+    def _read_unexpired_entries(self) -> Dict[str, Dict[str, object]]:
+        if not self.file.exists():
+            return {}
+
+        try:
+            entries = cast(Mapping[str, Dict[str, object]], loads(read_file(self.file)))
+        except ValueError:
+            logger.warning(
+                "Cache file '{}' is corrupted, ignoring its contents.".format(self.file)
+            )
+            return {}
+
+        now = time()
+        return {
+            key: entry
+            for key, entry in entries.items()
+            if cast(float, entry["expires_at"]) > now
+        }
+
+
+def disk_cache() -> Optional[DiskCache]:
+    """Returns the cache for the Retriever or None, if disabled.
+
+    Can be disabled by setting the NASTY_DISABLE_DISK_CACHE environment variable. Also
+    disabled when talking to a mock server (NASTY_MOCK_SERVER), so that its guest
+    sessions and crawl-delay are never used for the real Twitter.
+    """
+    if getenv("NASTY_DISABLE_DISK_CACHE") or getenv("NASTY_MOCK_SERVER"):
+        return None
+    return DiskCache(nasty_cache_dir() / "retriever.json")
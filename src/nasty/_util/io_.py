@@ -14,15 +14,75 @@
 # limitations under the License.
 #
 
+import io
 import lzma
+import os
 from contextlib import contextmanager
+from logging import getLogger
 from pathlib import Path
-from typing import Iterable, Iterator, TextIO, cast
+from typing import (
+    TYPE_CHECKING,
+    BinaryIO,
+    Callable,
+    Iterable,
+    Iterator,
+    Optional,
+    TextIO,
+    cast,
+)
+
+if TYPE_CHECKING:  # pragma: no cover
+    from .codec import Codec
+
+logger = getLogger(__name__)
+
+if os.name == "nt":  # pragma: no cover
+    import msvcrt
+
+    def _lock_fd(fd: int) -> None:
+        msvcrt.locking(fd, msvcrt.LK_LOCK, 1)  # type: ignore
+
+    def _unlock_fd(fd: int) -> None:
+        msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)  # type: ignore
+
+
+else:
+    import fcntl
+
+    def _lock_fd(fd: int) -> None:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+
+    def _unlock_fd(fd: int) -> None:
+        fcntl.flock(fd, fcntl.LOCK_UN)
 
 
 @contextmanager
-def _read_file(file: Path, *, use_lzma: bool = False) -> Iterator[TextIO]:
-    if use_lzma:
+def locked(lock_file: Path) -> Iterator[None]:
+    """Holds an exclusive lock on the given file for the duration of the context.
+
+    The lock is advisory, i.e., it only guards against other processes also using this
+    function. The lock file is created if it does not exist and never deleted.
+    """
+    lock_file.parent.mkdir(parents=True, exist_ok=True)
+    fd = os.open(str(lock_file), os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        _lock_fd(fd)
+        try:
+            yield
+        finally:
+            _unlock_fd(fd)
+    finally:
+        os.close(fd)
+
+
+@contextmanager
+def _read_file(
+    file: Path, *, use_lzma: bool = False, codec: Optional["Codec"] = None
+) -> Iterator[TextIO]:
+    if codec is not None:
+        with io.TextIOWrapper(codec.open_read(file), encoding="UTF-8") as fin:
+            yield fin
+    elif use_lzma:
         with lzma.open(file, "rt", encoding="UTF-8") as fin:
             yield cast(TextIO, fin)
     else:
@@ -31,18 +91,50 @@ def _read_file(file: Path, *, use_lzma: bool = False) -> Iterator[TextIO]:
 
 
 @contextmanager
-def _write_file_with_tmp_guard(
-    file: Path, *, overwrite_existing: bool = False, use_lzma: bool = False
-) -> Iterator[TextIO]:
-    if not overwrite_existing and file.exists():
+def _read_binary_file(
+    file: Path, *, use_lzma: bool = False, codec: Optional["Codec"] = None
+) -> Iterator[BinaryIO]:
+    if codec is not None:
+        with codec.open_read(file) as fin:
+            yield fin
+    elif use_lzma:
+        with lzma.open(file, "rb") as fin:
+            yield cast(BinaryIO, fin)
+    else:
+        with file.open("rb") as fin:
+            yield fin
+
+
+def tmp_file_of(file: Path) -> Path:
+    """File that is written to first, before it is renamed to the given file."""
+    return file.parent / (".tmp." + file.name)
+
+
+def check_not_exists(file: Path) -> None:
+    if file.exists():
         raise ValueError(
             "File '{}' to be written to, already exists. Manual intervention required! "
             "Check file and delete if no longer needed.".format(file)
         )
 
-    tmp_file = file.parent / (".tmp." + file.name)
 
-    if use_lzma:
+@contextmanager
+def _write_file_with_tmp_guard(
+    file: Path,
+    *,
+    overwrite_existing: bool = False,
+    use_lzma: bool = False,
+    codec: Optional["Codec"] = None,
+) -> Iterator[TextIO]:
+    if not overwrite_existing:
+        check_not_exists(file)
+
+    tmp_file = tmp_file_of(file)
+
+    if codec is not None:
+        with io.TextIOWrapper(codec.open_write(tmp_file), encoding="UTF-8") as fout:
+            yield fout
+    elif use_lzma:
         with lzma.open(tmp_file, "wt", encoding="UTF-8") as fin:
             yield cast(TextIO, fin)
     else:
@@ -72,16 +164,103 @@ def read_lines_file(file: Path, *, use_lzma: bool = False) -> Iterable[str]:
             yield line.strip()
 
 
+def read_binary_lines_file(
+    file: Path, *, use_lzma: bool = False, codec: Optional["Codec"] = None
+) -> Iterable[bytes]:
+    """Like read_lines_file() but without decoding lines, e.g., to pass them to JSON.
+
+    If a codec is given, it is used instead of use_lzma.
+    """
+    with _read_binary_file(file, use_lzma=use_lzma, codec=codec) as fin:
+        for line in fin:
+            yield line.strip()
+
+
 def write_lines_file(
     file: Path,
     values: Iterable[str],
     *,
     overwrite_existing: bool = False,
     use_lzma: bool = False,
+    codec: Optional["Codec"] = None,
 ) -> None:
     with _write_file_with_tmp_guard(
-        file, overwrite_existing=overwrite_existing, use_lzma=use_lzma
+        file, overwrite_existing=overwrite_existing, use_lzma=use_lzma, codec=codec
     ) as fout:
         for value in values:
             fout.write(value)
             fout.write("\n")
+
+
+def lock_file_of(file: Path) -> Path:
+    """Lock file guarding concurrent modifications of the given file."""
+    return file.parent / (".lock." + file.name)
+
+
+def append_lines_file(
+    file: Path,
+    values: Iterable[str],
+    *,
+    is_valid_line: Optional[Callable[[bytes], bool]] = None,
+) -> None:
+    """Appends the lines to the file in one write, creating the file if necessary.
+
+    Appends hold the lock file of the file, so that concurrent appends never
+    interleave. If the file does not end with a newline, its last line is either the
+    remainder of an interrupted append, or was written without a trailing newline
+    (e.g., by hand). If is_valid_line is given and accepts it, the newline is added.
+    Otherwise, the partial line is removed before appending.
+    """
+    data = "".join(value + "\n" for value in values).encode("UTF-8")
+    if not data:
+        return
+
+    with locked(lock_file_of(file)):
+        fd = os.open(
+            str(file), os.O_RDWR | os.O_CREAT | getattr(os, "O_BINARY", 0), 0o644
+        )
+        try:
+            if _complete_last_line(fd, file, is_valid_line):
+                data = b"\n" + data
+            os.lseek(fd, 0, os.SEEK_END)
+            view = memoryview(data)
+            while view:
+                view = view[os.write(fd, view) :]
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+
+def _complete_last_line(
+    fd: int,
+    file: Path,
+    is_valid_line: Optional[Callable[[bytes], bool]],
+    block_size: int = 4096,
+) -> bool:
+    """Removes the last line if partial and invalid.
+
+    :return: Whether the last line needs to be completed with a newline.
+    """
+    size = os.fstat(fd).st_size
+    end = size
+    while end:
+        start = max(0, end - block_size)
+        os.lseek(fd, start, os.SEEK_SET)
+        block = os.read(fd, end - start)
+        newline = block.rfind(b"\n")
+        if newline != -1:
+            end = start + newline + 1
+            break
+        end = start
+    if end == size:
+        return False
+
+    os.lseek(fd, end, os.SEEK_SET)
+    partial_line = os.read(fd, size - end)
+    if is_valid_line is not None and is_valid_line(partial_line):
+        return True
+    logger.warning(
+        "Removing partial last line of file '{}': {!r}".format(file, partial_line)
+    )
+    os.ftruncate(fd, end)
+    return False
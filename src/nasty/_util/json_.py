@@ -18,16 +18,82 @@ import json
 import traceback
 from abc import abstractmethod
 from datetime import datetime
+from logging import getLogger
+from os import getenv
 from pathlib import Path
-from typing import Iterable, Mapping, Type, TypeVar, cast
+from typing import (
+    TYPE_CHECKING,
+    Callable,
+    Iterable,
+    Mapping,
+    Optional,
+    Type,
+    TypeVar,
+    Union,
+    cast,
+)
 
 from overrides import overrides
 from typing_extensions import Final
 
 from .consts import NASTY_DATE_TIME_FORMAT
-from .io_ import read_file, read_lines_file, write_file, write_lines_file
+from .io_ import (
+    append_lines_file,
+    read_binary_lines_file,
+    read_file,
+    write_file,
+    write_lines_file,
+)
 from .typing_ import checked_cast
 
+if TYPE_CHECKING:  # pragma: no cover
+    from .codec import Codec
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+logger = getLogger(__name__)
+
+
+def _select_json_backend() -> Callable[[Union[bytes, str]], object]:
+    # Decoding is by far the most expensive JSON operation we perform (each batch from
+    # Twitter is a large JSON document). If installed (e.g., via "pip install
+    # nasty[fast]"), we therefore use orjson for it, which parses bytes directly, i.e.,
+    # without decoding them to str first. The backend can be forced via the
+    # NASTY_JSON_BACKEND environment variable.
+    backend = getenv("NASTY_JSON_BACKEND", default="orjson" if orjson else "json")
+    if backend == "orjson":
+        if orjson is None:
+            raise ImportError(
+                "NASTY_JSON_BACKEND=orjson requires orjson to be installed. Install it "
+                "via 'pip install nasty[fast]'."
+            )
+        return cast(Callable[[Union[bytes, str]], object], orjson.loads)
+    elif backend == "json":
+        return json.loads
+    raise ValueError("Unknown JSON backend '{}'.".format(backend))
+
+
+_loads: Final = _select_json_backend()
+
+
+def loads(data: Union[bytes, str]) -> object:
+    """Deserializes JSON, preferably given as UTF-8 encoded bytes."""
+    return _loads(data)
+
+
+def dumps(obj: object, *, indent: Optional[int] = None) -> str:
+    """Serializes JSON.
+
+    Always uses the standard library, as its output (e.g., escaping of non-ASCII
+    characters and separators) is what all existing files were written with, and fast
+    backends like orjson do not support producing it.
+    """
+    return json.dumps(obj, indent=indent)
+
+
 _T_JsonSerializable = TypeVar("_T_JsonSerializable", bound="JsonSerializable")
 
 
@@ -98,7 +164,9 @@ class JsonSerializedException(JsonSerializable):
 def read_json(
     file: Path, type_: Type[_T_JsonSerializable], *, use_lzma: bool = False
 ) -> _T_JsonSerializable:
-    return type_.from_json(json.loads(read_file(file, use_lzma=use_lzma)))
+    return type_.from_json(
+        cast(Mapping[str, object], loads(read_file(file, use_lzma=use_lzma)))
+    )
 
 
 def write_json(
@@ -110,17 +178,21 @@ def write_json(
 ) -> None:
     write_file(
         file,
-        json.dumps(value.to_json(), indent=2),
+        dumps(value.to_json(), indent=2),
         overwrite_existing=overwrite_existing,
         use_lzma=use_lzma,
     )
 
 
 def read_json_lines(
-    file: Path, type_: Type[_T_JsonSerializable], *, use_lzma: bool = False
+    file: Path,
+    type_: Type[_T_JsonSerializable],
+    *,
+    use_lzma: bool = False,
+    codec: Optional["Codec"] = None,
 ) -> Iterable[_T_JsonSerializable]:
-    for line in read_lines_file(file, use_lzma=use_lzma):
-        yield type_.from_json(json.loads(line))
+    for line in read_binary_lines_file(file, use_lzma=use_lzma, codec=codec):
+        yield type_.from_json(cast(Mapping[str, object], loads(line)))
 
 
 def write_jsonl_lines(
@@ -129,10 +201,30 @@ def write_jsonl_lines(
     *,
     overwrite_existing: bool = False,
     use_lzma: bool = False,
+    codec: Optional["Codec"] = None,
 ) -> None:
     write_lines_file(
         file,
-        (json.dumps(value.to_json()) for value in values),
+        (dumps(value.to_json()) for value in values),
         overwrite_existing=overwrite_existing,
         use_lzma=use_lzma,
+        codec=codec,
     )
+
+
+def append_jsonl_lines(file: Path, values: Iterable[_T_JsonSerializable]) -> None:
+    """Appends the values to the file, see append_lines_file().
+
+    A last line without trailing newline is kept if it is valid JSON.
+    """
+    append_lines_file(
+        file, (dumps(value.to_json()) for value in values), is_valid_line=_is_json
+    )
+
+
+def _is_json(line: bytes) -> bool:
+    try:
+        loads(line)
+    except ValueError:
+        return False
+    return True
@@ -0,0 +1,451 @@
+#
+# Copyright 2019-2020 Lukas Schmelzeisen
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from bisect import bisect_left
+from contextlib import contextmanager
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from logging import getLogger
+from os import getenv
+from pathlib import Path
+from socketserver import ThreadingMixIn
+from threading import Event, Lock, Thread
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple, TypeVar
+
+from typing_extensions import Final
+
+from .io_ import write_file
+
+logger = getLogger(__name__)
+
+_LabelValues = Tuple[str, ...]
+
+# Values of all metrics of a MetricsRegistry, by metric name and label values.
+MetricsSnapshot = Dict[str, Dict[_LabelValues, Any]]
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return str(int(value)) if float(value).is_integer() else repr(value)
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    return (
+        "{"
+        + ",".join(
+            '{}="{}"'.format(
+                name,
+                value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"),
+            )
+            for name, value in zip(names, values)
+        )
+        + "}"
+    )
+
+
+class _Metric:
+    type_: str
+
+    def __init__(self, name: str, help_: str, label_names: Sequence[str] = ()):
+        self.name: Final = name
+        self.help: Final = help_
+        self.label_names: Final = tuple(label_names)
+        self._lock: Final = Lock()
+
+    def _check_label_values(self, label_values: Sequence[object]) -> _LabelValues:
+        if len(label_values) != len(self.label_names):
+            raise ValueError(
+                "Metric {} expects labels {}, got {} values.".format(
+                    self.name, self.label_names, len(label_values)
+                )
+            )
+        return tuple(str(value) for value in label_values)
+
+    def render(self) -> List[str]:
+        return [
+            "# HELP {} {}".format(self.name, self.help),
+            "# TYPE {} {}".format(self.name, self.type_),
+        ] + self._render_samples()
+
+    def _render_samples(self) -> List[str]:
+        raise NotImplementedError()
+
+    def _drain(self) -> Dict[_LabelValues, Any]:
+        raise NotImplementedError()
+
+    def _merge(self, values: Dict[_LabelValues, Any]) -> None:
+        raise NotImplementedError()
+
+
+class CounterMetric(_Metric):
+    """Monotonically increasing value, per combination of label values."""
+
+    type_ = "counter"
+
+    def __init__(self, name: str, help_: str, label_names: Sequence[str] = ()):
+        super().__init__(name, help_, label_names)
+        self._values: Dict[_LabelValues, float] = {}
+
+    def inc(self, *label_values: object, amount: float = 1.0) -> None:
+        if amount < 0.0:
+            raise ValueError("Counters can only be increased, got {}.".format(amount))
+        key = self._check_label_values(label_values)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, *label_values: object) -> float:
+        key = self._check_label_values(label_values)
+        with self._lock:
+            return self._values.get(key, 0.0)
+
+    def _drain(self) -> Dict[_LabelValues, Any]:
+        with self._lock:
+            values = dict(self._values)
+            self._values.clear()
+        return values
+
+    def _merge(self, values: Dict[_LabelValues, Any]) -> None:
+        with self._lock:
+            for key, value in values.items():
+                self._values[key] = self._values.get(key, 0.0) + value
+
+    def _render_samples(self) -> List[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        return [
+            "{}{} {}".format(
+                self.name, _format_labels(self.label_names, key), _format_value(value)
+            )
+            for key, value in values
+        ]
+
+
+class HistogramMetric(_Metric):
+    """Distribution of observed values, counted in cumulative buckets."""
+
+    type_ = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help_: str,
+        label_names: Sequence[str] = (),
+        *,
+        buckets: Sequence[float],
+    ):
+        super().__init__(name, help_, label_names)
+        self.buckets: Final = tuple(sorted(buckets)) + (float("inf"),)
+        # Per label values: count per (non-cumulative) bucket, sum, and count.
+        self._values: Dict[_LabelValues, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, *label_values: object) -> None:
+        key = self._check_label_values(label_values)
+        with self._lock:
+            bucket_counts, sum_count = self._values.setdefault(
+                key, ([0] * len(self.buckets), [0.0, 0.0])
+            )
+            bucket_counts[bisect_left(self.buckets, value)] += 1
+            sum_count[0] += value
+            sum_count[1] += 1
+
+    def count(self, *label_values: object) -> int:
+        key = self._check_label_values(label_values)
+        with self._lock:
+            return int(self._values[key][1][1]) if key in self._values else 0
+
+    def _drain(self) -> Dict[_LabelValues, Any]:
+        with self._lock:
+            values = dict(self._values)
+            self._values.clear()
+        return values
+
+    def _merge(self, values: Dict[_LabelValues, Any]) -> None:
+        with self._lock:
+            for key, (bucket_counts, sum_count) in values.items():
+                own_bucket_counts, own_sum_count = self._values.setdefault(
+                    key, ([0] * len(self.buckets), [0.0, 0.0])
+                )
+                for i, bucket_count in enumerate(bucket_counts):
+                    own_bucket_counts[i] += bucket_count
+                own_sum_count[0] += sum_count[0]
+                own_sum_count[1] += sum_count[1]
+
+    def _render_samples(self) -> List[str]:
+        with self._lock:
+            values = sorted(
+                (key, (list(counts), list(sum_count)))
+                for key, (counts, sum_count) in self._values.items()
+            )
+
+        lines = []
+        for key, (bucket_counts, (sum_, count)) in values:
+            cumulative = 0
+            for bucket, bucket_count in zip(self.buckets, bucket_counts):
+                cumulative += bucket_count
+                lines.append(
+                    "{}_bucket{} {}".format(
+                        self.name,
+                        _format_labels(
+                            self.label_names + ("le",), key + (_format_value(bucket),)
+                        ),
+                        cumulative,
+                    )
+                )
+            labels = _format_labels(self.label_names, key)
+            lines.append("{}_sum{} {}".format(self.name, labels, _format_value(sum_)))
+            lines.append(
+                "{}_count{} {}".format(self.name, labels, _format_value(count))
+            )
+        return lines
+
+
+_T_Metric = TypeVar("_T_Metric", bound=_Metric)
+
+
+class MetricsRegistry:
+    def __init__(self) -> None:
+        self._lock: Final = Lock()
+        self._metrics: Dict[str, _Metric] = {}
+
+    def counter(
+        self, name: str, help_: str, label_names: Sequence[str] = ()
+    ) -> CounterMetric:
+        return self._register(CounterMetric(name, help_, label_names))
+
+    def histogram(
+        self,
+        name: str,
+        help_: str,
+        label_names: Sequence[str] = (),
+        *,
+        buckets: Sequence[float],
+    ) -> HistogramMetric:
+        return self._register(
+            HistogramMetric(name, help_, label_names, buckets=buckets)
+        )
+
+    def _register(self, metric: _T_Metric) -> _T_Metric:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError("Metric {} is already registered.".format(metric.name))
+            self._metrics[metric.name] = metric
+        return metric
+
+    def drain(self) -> "MetricsSnapshot":
+        """Returns the values of all metrics and resets them.
+
+        Used to transfer the metrics of worker processes to the exporting process.
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return {metric.name: metric._drain() for metric in metrics}
+
+    def merge(self, snapshot: "MetricsSnapshot") -> None:
+        """Adds the values of a snapshot from drain() to the metrics."""
+        with self._lock:
+            metrics = dict(self._metrics)
+        for name, values in snapshot.items():
+            metrics[name]._merge(values)
+
+    def render(self) -> str:
+        """Renders all metrics in the Prometheus text exposition format."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY: Final = MetricsRegistry()
+
+HTTP_REQUESTS: Final = REGISTRY.counter(
+    "nasty_http_requests_total",
+    "HTTP requests performed, by host and response status code.",
+    ("host", "status"),
+)
+HTTP_RESPONSE_BYTES: Final = REGISTRY.counter(
+    "nasty_http_response_bytes_total",
+    "Bytes of (decompressed) HTTP response bodies received, by host.",
+    ("host",),
+)
+HTTP_REQUEST_DURATION: Final = REGISTRY.histogram(
+    "nasty_http_request_duration_seconds",
+    "Latency of HTTP requests (including automated retries), by host.",
+    ("host",),
+    buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0),
+)
+TWEETS: Final = REGISTRY.counter(
+    "nasty_tweets_total", "Tweets yielded, by request type.", ("request",)
+)
+TOMBSTONES: Final = REGISTRY.counter(
+    "nasty_tombstones_total",
+    "Unavailable Tweets that were skipped, by request type.",
+    ("request",),
+)
+TWEETS_WITHOUT_META: Final = REGISTRY.counter(
+    "nasty_tweets_without_meta_total",
+    "Tweet-IDs skipped because Twitter sent no meta information, by request type.",
+    ("request",),
+)
+UNKNOWN_TIMELINE_ENTRIES: Final = REGISTRY.counter(
+    "nasty_unknown_timeline_entries_total",
+    "Timeline entries of unknown type that were skipped, by request type.",
+    ("request",),
+)
+DUPLICATE_TWEETS: Final = REGISTRY.counter(
+    "nasty_duplicate_tweets_total",
+    "Tweets dropped as duplicates (NASTY_DEDUP), by scope (stream or batch).",
+    ("scope",),
+)
+GUEST_SESSIONS: Final = REGISTRY.counter(
+    "nasty_guest_sessions_total",
+    "Guest sessions taken into use, by source (pool or established).",
+    ("source",),
+)
+SLEEP_SECONDS: Final = REGISTRY.counter(
+    "nasty_sleep_seconds_total",
+    "Time spent waiting before requests, by reason (rate_limit or "
+    "rate_limit_reset).",
+    ("reason",),
+)
+BATCH_ENTRIES: Final = REGISTRY.counter(
+    "nasty_batch_entries_total",
+    "Executed batch entries, by result (success, skip, or fail).",
+    ("result",),
+)
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class _MetricsRequestHandler(BaseHTTPRequestHandler):
+    registry: MetricsRegistry
+
+    def do_GET(self) -> None:  # noqa: N802
+        body = self.registry.render().encode("UTF-8")
+        self.send_response(HTTPStatus.OK.value)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args: Any) -> None:  # noqa: A002
+        pass
+
+
+class MetricsExporter:
+    """Exposes the metrics of a registry while a long-running operation is active.
+
+    Metrics are either written to a file every interval seconds (e.g., for the textfile
+    collector of the Prometheus node exporter) or served via HTTP on a local port, or
+    both. Files are replaced atomically, so that readers never see partial writes.
+    """
+
+    def __init__(
+        self,
+        registry: MetricsRegistry,
+        *,
+        file: Optional[Path] = None,
+        port: Optional[int] = None,
+        interval: float = 15.0,
+    ):
+        self.registry: Final = registry
+        self.file: Final = file
+        self.port: Final = port
+        self.interval: Final = interval
+        self._stop: Final = Event()
+        self._threads: List[Thread] = []
+        self._http_server: Optional[HTTPServer] = None
+
+    def start(self) -> None:
+        self._stop.clear()
+        if self.file is not None:
+            self._start_thread(self._write_periodically)
+        if self.port is not None:
+            registry = self.registry
+
+            class Handler(_MetricsRequestHandler):
+                pass
+
+            Handler.registry = registry
+            self._http_server = _ThreadingHTTPServer(("127.0.0.1", self.port), Handler)
+            self._start_thread(self._http_server.serve_forever)
+            logger.info(
+                "Serving metrics on http://127.0.0.1:{}/metrics.".format(
+                    self._http_server.server_address[1]
+                )
+            )
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._http_server is not None:
+            self._http_server.shutdown()
+            self._http_server.server_close()
+            self._http_server = None
+        for thread in self._threads:
+            thread.join()
+        self._threads.clear()
+        if self.file is not None:
+            self.write()
+
+    def write(self) -> None:
+        if self.file is None:
+            return
+        try:
+            write_file(self.file, self.registry.render(), overwrite_existing=True)
+        except OSError as e:
+            logger.warning("Could not write metrics to '{}': {}.".format(self.file, e))
+
+    def _start_thread(self, target: Any) -> None:
+        thread = Thread(target=target, name="nasty-metrics", daemon=True)
+        thread.start()
+        self._threads.append(thread)
+
+    def _write_periodically(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.write()
+
+
+@contextmanager
+def exported_metrics() -> Iterator[None]:
+    """Exports metrics for the duration of the context, if configured.
+
+    Set NASTY_METRICS_FILE to periodically write metrics to the given file (every
+    NASTY_METRICS_INTERVAL seconds, default: 15) and/or NASTY_METRICS_PORT to serve them
+    on the given local port.
+    """
+    file = getenv("NASTY_METRICS_FILE")
+    port = getenv("NASTY_METRICS_PORT")
+    if not file and not port:
+        yield
+        return
+
+    exporter = MetricsExporter(
+        REGISTRY,
+        file=Path(file) if file else None,
+        port=int(port) if port else None,
+        interval=float(getenv("NASTY_METRICS_INTERVAL", default="15")),
+    )
+    exporter.start()
+    try:
+        yield
+    finally:
+        exporter.stop()
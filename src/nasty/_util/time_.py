@@ -15,7 +15,7 @@
 #
 
 from argparse import ArgumentTypeError
-from datetime import date, datetime, timedelta
+from datetime import date, datetime, time, timedelta, timezone
 from typing import Iterable
 
 
@@ -30,6 +30,37 @@ def yyyy_mm_dd_date(string: str) -> date:
         )
 
 
+def yyyy_mm_dd_date_or_datetime(string: str) -> date:
+    """Parses either a date as YYYY-MM-DD or a datetime as YYYY-MM-DDTHH:MM:SS."""
+    if "T" not in string:
+        return yyyy_mm_dd_date(string)
+    try:
+        return datetime.strptime(string, "%Y-%m-%dT%H:%M:%S")
+    except ValueError:
+        raise ArgumentTypeError(
+            'Can not parse datetime: "{}". Make sure it is in '
+            "YYYY-MM-DDTHH:MM:SS format.".format(string)
+        )
+
+
+def utc_datetime(value: date) -> datetime:
+    """Converts dates and datetimes to naive datetimes in UTC.
+
+    Dates are taken to mean midnight (UTC, as for Twitter's since: and until:
+    operators), naive datetimes are assumed to already be in UTC.
+    """
+    if not isinstance(value, datetime):
+        return datetime.combine(value, time())
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def utc_timestamp(value: date) -> int:
+    """Seconds since the Unix epoch, as used by the since_time: operator."""
+    return int(utc_datetime(value).replace(tzinfo=timezone.utc).timestamp())
+
+
 # Adapted from: https://stackoverflow.com/a/1060352/211404
 def daterange(start_date: date, end_date: date) -> Iterable[date]:
     if start_date > end_date:
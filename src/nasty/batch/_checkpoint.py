@@ -0,0 +1,264 @@
+#
+# Copyright 2019-2020 Lukas Schmelzeisen
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import os
+from contextlib import contextmanager
+from logging import getLogger
+from os import getenv
+from pathlib import Path
+from time import monotonic
+from typing import BinaryIO, Iterator, List, Mapping, Optional, cast
+
+from overrides import overrides
+from typing_extensions import Final
+
+from .._retriever.retriever import RetrieverCheckpoint, RetrieverTweetStream
+from .._util.bloom_filter import BloomFilter
+from .._util.codec import XZ, Codec
+from .._util.io_ import check_not_exists, tmp_file_of
+from .._util.json_ import JsonSerializable, dumps, read_json, write_json
+from .._util.metrics import DUPLICATE_TWEETS
+from .._util.typing_ import checked_cast
+from ._lease import Lease
+
+logger = getLogger(__name__)
+
+
+def checkpoint_interval() -> float:
+    """Seconds between checkpoints of a running request (NASTY_CHECKPOINT_INTERVAL)."""
+    return float(getenv("NASTY_CHECKPOINT_INTERVAL", default="60"))
+
+
+class BatchEntryCheckpoint(JsonSerializable):
+    """State of a partially executed BatchEntry.
+
+    The first data_size bytes of the temporary data file contain all Tweets up to the
+    position of retriever_checkpoint, as frames compressed with codec.
+    """
+
+    def __init__(
+        self,
+        *,
+        retriever_checkpoint: RetrieverCheckpoint,
+        data_size: int,
+        codec: Codec = XZ,
+    ):
+        self.retriever_checkpoint: Final = retriever_checkpoint
+        self.data_size: Final = data_size
+        self.codec: Final = codec
+
+    @overrides
+    def to_json(self) -> Mapping[str, object]:
+        return {
+            "retriever_checkpoint": self.retriever_checkpoint.to_json(),
+            "data_size": self.data_size,
+            "codec": self.codec.to_json(),
+        }
+
+    @classmethod
+    @overrides
+    def from_json(cls, obj: Mapping[str, object]) -> "BatchEntryCheckpoint":
+        return cls(
+            retriever_checkpoint=RetrieverCheckpoint.from_json(
+                cast(Mapping[str, object], obj["retriever_checkpoint"])
+            ),
+            data_size=checked_cast(int, obj["data_size"]),
+            # Checkpoints from before codecs were configurable are always XZ.
+            codec=(
+                Codec.from_json(cast(Mapping[str, object], obj["codec"]))
+                if "codec" in obj
+                else XZ
+            ),
+        )
+
+
+def write_tweets_with_checkpoints(
+    tweet_stream: RetrieverTweetStream,
+    data_file: Path,
+    checkpoint_file: Path,
+    *,
+    codec: Codec = XZ,
+    seen_tweets: Optional[BloomFilter] = None,
+    lease: Optional[Lease] = None,
+) -> None:
+    """Writes the Tweets of the stream as JSONL compressed with codec to data_file.
+
+    Like write_jsonl_lines(), Tweets are first written to a temporary file, which is
+    only renamed to data_file once the stream is exhausted. Additionally, every
+    checkpoint_interval() seconds and when an exception occurs, all buffered Tweets are
+    appended to the temporary file as a self-contained frame of the codec (concatenated
+    frames are read as one) and the position of the stream is saved to
+    checkpoint_file. If both files exist when this is called, the stream is restored to
+    the saved position and the temporary file is truncated to match it, so that no
+    Tweet is lost or written twice.
+
+    :param seen_tweets: If given, Tweets whose ID it (probably) contains are dropped,
+        and the IDs of all other Tweets are added to it.
+    :param lease: If given, writing stops with a LeaseLostException once it is lost,
+        as another process then continues from the last checkpoint. Frames are only
+        written to the temporary file while the lease is held locally, and saving
+        checkpoint_file and renaming to data_file are fenced by it, so that only data
+        committed while owning the lease counts. The lock of the fence is not held
+        while compressing or writing frames, which other processes would wait for.
+    """
+    check_not_exists(data_file)
+    tmp_file = tmp_file_of(data_file)
+
+    data_size = 0
+    checkpoint = _read_checkpoint(checkpoint_file, tmp_file, codec)
+    if checkpoint is not None:
+        logger.debug(
+            "  Resuming request from checkpoint after {} Tweets.".format(
+                checkpoint.retriever_checkpoint.num_retrieved
+            )
+        )
+        tweet_stream.restore(checkpoint.retriever_checkpoint)
+        data_size = checkpoint.data_size
+
+    _check(lease)
+    with tmp_file.open("r+b" if data_size else "wb") as fout:
+        fout.truncate(data_size)
+
+    with tmp_file.open("r+b") as fout:
+        fout.seek(data_size)
+        writer = _CheckpointWriter(
+            tweet_stream, fout, checkpoint_file, codec=codec, lease=lease
+        )
+        try:
+            _write_tweets(tweet_stream, writer, seen_tweets, lease)
+        except BaseException:
+            writer.flush()
+            raise
+        writer.finish()
+
+    with _fenced(lease):
+        tmp_file.rename(data_file)
+        if checkpoint_file.exists():
+            checkpoint_file.unlink()
+
+
+def _check(lease: Optional[Lease]) -> None:
+    if lease is not None:
+        lease.check()
+
+
+@contextmanager
+def _fenced(lease: Optional[Lease]) -> Iterator[None]:
+    if lease is None:
+        yield
+        return
+    with lease.fenced():
+        yield
+
+
+def _write_tweets(
+    tweet_stream: RetrieverTweetStream,
+    writer: "_CheckpointWriter",
+    seen_tweets: Optional[BloomFilter],
+    lease: Optional[Lease],
+) -> None:
+    interval = checkpoint_interval()
+    last_flush = monotonic()
+    for tweet in tweet_stream:
+        _check(lease)
+        if seen_tweets is not None and seen_tweets.add(tweet.id):
+            DUPLICATE_TWEETS.inc("batch")
+            continue
+        writer.append(dumps(tweet.to_json()).encode("UTF-8") + b"\n")
+        if monotonic() - last_flush >= interval:
+            writer.flush()
+            last_flush = monotonic()
+
+
+class _CheckpointWriter:
+    """Buffers lines of the temporary data file and flushes them as checkpoints."""
+
+    def __init__(
+        self,
+        tweet_stream: RetrieverTweetStream,
+        fout: BinaryIO,
+        checkpoint_file: Path,
+        *,
+        codec: Codec,
+        lease: Optional[Lease],
+    ):
+        self._tweet_stream: Final = tweet_stream
+        self._fout: Final = fout
+        self._checkpoint_file: Final = checkpoint_file
+        self._codec: Final = codec
+        self._lease: Final = lease
+        self._lines: Final[List[bytes]] = []
+
+    def append(self, line: bytes) -> None:
+        self._lines.append(line)
+
+    def flush(self) -> None:
+        """Appends the buffered lines as a frame and saves the stream position."""
+        _check(self._lease)
+        if not self._lines:
+            return
+        self._write(self._codec.compress(b"".join(self._lines)))
+        # The frame only counts once the checkpoint covering it is saved.
+        with _fenced(self._lease):
+            write_json(
+                self._checkpoint_file,
+                BatchEntryCheckpoint(
+                    retriever_checkpoint=self._tweet_stream.checkpoint(),
+                    data_size=self._fout.tell(),
+                    codec=self._codec,
+                ),
+                overwrite_existing=True,
+            )
+        self._lines.clear()
+
+    def finish(self) -> None:
+        """Appends the remaining buffered lines, without saving a checkpoint."""
+        # An empty file is no valid XZ file, so always write at least one frame.
+        if self._lines or not self._fout.tell():
+            self._write(self._codec.compress(b"".join(self._lines)))
+            self._lines.clear()
+
+    def _write(self, frame: bytes) -> None:
+        # Compressing may take a while, so check the lease again right before writing.
+        _check(self._lease)
+        self._fout.write(frame)
+        self._fout.flush()
+        os.fsync(self._fout.fileno())
+
+
+def _read_checkpoint(
+    checkpoint_file: Path, tmp_file: Path, codec: Codec
+) -> Optional[BatchEntryCheckpoint]:
+    if not checkpoint_file.exists():
+        return None
+
+    checkpoint = read_json(checkpoint_file, BatchEntryCheckpoint)
+    if not tmp_file.exists() or tmp_file.stat().st_size < checkpoint.data_size:
+        logger.warning(
+            "Ignoring checkpoint '{}', because its data file '{}' is incomplete. "
+            "Starting request from scratch.".format(checkpoint_file, tmp_file)
+        )
+        return None
+    # Frames of different codecs (or Zstandard dictionaries) can not be concatenated.
+    if checkpoint.codec.to_json() != codec.to_json():
+        logger.warning(
+            "Ignoring checkpoint '{}', because it was written with codec {} instead "
+            "of {}. Starting request from scratch.".format(
+                checkpoint_file, checkpoint.codec.to_json(), codec.to_json()
+            )
+        )
+        return None
+    return checkpoint
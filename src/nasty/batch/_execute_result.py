@@ -21,3 +21,5 @@ class _ExecuteResult(Enum):
     SUCCESS = "SUCCESS"
     SKIP = "SKIP"
     FAIL = "FAIL"
+    # The entry is being executed by another process, see LeaseKeeper.
+    LEASED = "LEASED"
@@ -0,0 +1,257 @@
+#
+# Copyright 2019-2020 Lukas Schmelzeisen
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import os
+import socket
+from contextlib import contextmanager
+from logging import getLogger
+from os import getenv
+from pathlib import Path
+from threading import Event, Lock, Thread
+from time import monotonic, time
+from types import TracebackType
+from typing import ContextManager, Dict, Iterator, Mapping, Optional, Type, cast
+from uuid import uuid4
+
+from typing_extensions import Final
+
+from .._util.io_ import locked, read_file, write_file
+from .._util.json_ import dumps, loads
+from .._util.typing_ import checked_cast
+
+logger = getLogger(__name__)
+
+# Fraction of the lease TTL by which a lease is considered lost locally before it
+# expires for other processes. Covers delays between checking and writing, and clock
+# skew between nodes.
+_SAFETY_MARGIN: Final = 0.2
+
+
+def lease_ttl() -> float:
+    """Seconds after which leases of unresponsive nodes expire (NASTY_LEASE_TTL)."""
+    return float(getenv("NASTY_LEASE_TTL", default="300"))
+
+
+class LeaseLostException(Exception):
+    def __init__(self, file: Path):
+        self.file: Final = file
+        super().__init__(
+            "Lease '{}' was taken over, because it was not renewed in time.".format(
+                file
+            )
+        )
+
+
+class Lease:
+    """Exclusive right of one process to execute a batch entry, until it expires.
+
+    Leases are kept alive by the heartbeat of their LeaseKeeper. If it fails to renew a
+    lease in time (e.g., because the node was suspended), the lease may be claimed by
+    another process, after which this lease is lost. To not rely on the heartbeat to
+    notice this, each lease also has a local deadline, which lies a safety margin
+    before the expiry other processes see, and after which it is considered lost.
+    """
+
+    def __init__(self, file: Path, keeper: "LeaseKeeper", deadline: float):
+        self.file: Final = file
+        self.lost = False
+        self.deadline = deadline
+        self._keeper: Final = keeper
+
+    def check(self) -> None:
+        """Raises LeaseLostException, if the lease was lost or its deadline passed."""
+        if not self.lost and monotonic() >= self.deadline:
+            logger.error("Lease '{}' was not renewed in time.".format(self.file))
+            self.lost = True
+        if self.lost:
+            raise LeaseLostException(self.file)
+
+    @contextmanager
+    def fenced(self) -> Iterator[None]:
+        """Guards commits to files that other owners of the lease would also write.
+
+        On entering, checks that the lease is still held, and raises
+        LeaseLostException otherwise. While in the context, no other process can claim
+        or renew any lease in the results directory, so it should only enclose short
+        writes.
+        """
+        with self._keeper.locked():
+            self.check()
+            if not self._keeper.owns(self.file):
+                logger.error("Lost lease '{}' to another process.".format(self.file))
+                self.lost = True
+                raise LeaseLostException(self.file)
+            yield
+
+
+class LeaseKeeper:
+    """Claims leases on batch entries and renews them via a heartbeat thread.
+
+    Lease files live in the shared results directory, so that multiple processes, also
+    on different nodes, can execute the same Batch without executing any entry twice.
+    Each lease file contains its owner and its expiry, which the heartbeat pushes back
+    every third of the lease TTL. Expired leases, and leases of processes on this host
+    that no longer run, are reclaimed. All reads and writes of lease files happen while
+    holding a lock file in the results directory, so that claiming is atomic.
+    """
+
+    def __init__(self, results_dir: Path, ttl: Optional[float] = None):
+        self.results_dir: Final = results_dir
+        self.ttl: Final = ttl if ttl is not None else lease_ttl()
+        self.host: Final = socket.gethostname()
+        self.owner: Final = "{}:{}:{}".format(self.host, os.getpid(), uuid4().hex)
+        self._lock_file: Final = results_dir / ".lock.leases"
+        self._leases_lock: Final = Lock()
+        self._leases: Dict[Path, Lease] = {}
+        self._stop: Final = Event()
+        self._thread: Optional[Thread] = None
+
+    def __enter__(self) -> "LeaseKeeper":
+        self._thread = Thread(target=self._run, name="nasty-leases", daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(
+        self,
+        _exc_type: Optional[Type[BaseException]],
+        _exc_value: Optional[BaseException],
+        _traceback: Optional[TracebackType],
+    ) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def claim(self, file: Path) -> Optional[Lease]:
+        """Claims the lease in the given file.
+
+        :return: The lease, or None, if it is held by another live process.
+        """
+        start = monotonic()
+        with self.locked():
+            lease_json = self._read(file)
+            if lease_json is not None and not self._reclaimable(lease_json):
+                logger.debug(
+                    "  Lease '{}' is held by {}.".format(file, lease_json["owner"])
+                )
+                return None
+            if lease_json is not None:
+                logger.info(
+                    "Reclaiming lease '{}' of {}.".format(file, lease_json["owner"])
+                )
+            self._write(file)
+
+        lease = Lease(file, self, self._deadline(start))
+        with self._leases_lock:
+            self._leases[file] = lease
+        return lease
+
+    def release(self, lease: Lease) -> None:
+        with self._leases_lock:
+            self._leases.pop(lease.file, None)
+        # Leases that are lost only locally are still released, so that other
+        # processes do not need to wait for them to expire.
+        with self.locked():
+            if self.owns(lease.file):
+                lease.file.unlink()
+
+    def renew(self) -> None:
+        """Pushes back the expiry of all held leases. Called by the heartbeat.
+
+        If renewing fails, all held leases are marked as lost, as they might expire
+        before the next attempt.
+        """
+        with self._leases_lock:
+            leases = list(self._leases.values())
+        if not leases:
+            return
+
+        start = monotonic()
+        try:
+            with self.locked():
+                for lease in leases:
+                    if lease.lost:
+                        continue
+                    if not self.owns(lease.file):
+                        logger.error(
+                            "Lost lease '{}' to another process.".format(lease.file)
+                        )
+                        lease.lost = True
+                        continue
+                    self._write(lease.file)
+                    lease.deadline = self._deadline(start)
+        except BaseException:
+            for lease in leases:
+                lease.lost = True
+            raise
+
+    def locked(self) -> ContextManager[None]:
+        """Holds the lock guarding all lease files in the results directory."""
+        return locked(self._lock_file)
+
+    def owns(self, file: Path) -> bool:
+        """Whether this keeper holds the lease in the given file. Requires locked()."""
+        lease_json = self._read(file)
+        return lease_json is not None and lease_json["owner"] == self.owner
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.ttl / 3):
+            try:
+                self.renew()
+            except OSError:
+                logger.exception("Could not renew leases, giving them up.")
+
+    def _deadline(self, written_at: float) -> float:
+        # The lease file is written after written_at, so it expires later than this.
+        return written_at + self.ttl * (1 - _SAFETY_MARGIN)
+
+    def _read(self, file: Path) -> Optional[Mapping[str, object]]:
+        try:
+            return cast(Mapping[str, object], loads(read_file(file)))
+        except FileNotFoundError:
+            return None
+        except ValueError:
+            logger.warning("Lease '{}' is corrupted, reclaiming it.".format(file))
+            return {"owner": None, "expires_at": 0.0}
+
+    def _write(self, file: Path) -> None:
+        write_file(
+            file,
+            dumps(
+                {
+                    "owner": self.owner,
+                    "host": self.host,
+                    "pid": os.getpid(),
+                    "expires_at": time() + self.ttl,
+                }
+            ),
+            overwrite_existing=True,
+        )
+
+    def _reclaimable(self, lease_json: Mapping[str, object]) -> bool:
+        if lease_json["owner"] == self.owner:
+            return True
+        if checked_cast(float, lease_json["expires_at"]) < time():
+            return True
+        # Processes on this host can be checked directly, so that restarting a crashed
+        # "nasty batch" does not need to wait for its leases to expire.
+        if lease_json.get("host") == self.host and os.name == "posix":
+            try:
+                os.kill(checked_cast(int, lease_json["pid"]), 0)
+            except ProcessLookupError:
+                return True
+            except OSError:
+                pass
+        return False
@@ -0,0 +1,171 @@
+#
+# Copyright 2019-2020 Lukas Schmelzeisen
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from logging import getLogger
+from pathlib import Path
+from typing import Dict, List, Mapping, Tuple, cast
+
+from typing_extensions import Final
+
+from .._util.io_ import lock_file_of, locked
+from .._util.json_ import (
+    append_jsonl_lines,
+    loads,
+    read_json,
+    write_json,
+    write_jsonl_lines,
+)
+from .batch_entry import BatchEntry, BatchEntryId
+from .results_layout import ResultsLayout
+
+logger = getLogger(__name__)
+
+MANIFEST_FILE_NAME: Final = Path("manifest.jsonl")
+_META_FILE_SUFFIX: Final = ".meta.json"
+
+# The manifest is compacted once it holds this many times more lines than entries.
+_MAX_LINES_PER_ENTRY: Final = 2
+
+# The manifest is an append-only JSONL log of the meta files in a results directory:
+# every write of a meta file is followed by appending the same entry as a line, and
+# later lines supersede earlier ones with the same ID. This lets BatchResults load all
+# entries from a single file instead of opening one meta file per entry.
+#
+# The meta files remain authoritative. When loading, the manifest is reconciled with
+# the names of the meta files (only directory listings, no file opens): entries
+# whose meta file was written without appending to the manifest (e.g., by an older
+# version or a crashed process) are read from their meta file, entries whose meta
+# file no longer exists are dropped. If anything had to be reconciled, or the log
+# grew too long, the manifest is rewritten.
+
+
+def write_meta(
+    results_dir: Path,
+    layout: ResultsLayout,
+    entry: BatchEntry,
+    *,
+    overwrite_existing: bool = False,
+) -> None:
+    """Writes the meta file of the entry and records it in the manifest."""
+    write_json(
+        layout.entry_dir(results_dir, entry.id) / entry.meta_file_name,
+        entry,
+        overwrite_existing=overwrite_existing,
+    )
+    append_to_manifest(results_dir, entry)
+
+
+def append_to_manifest(results_dir: Path, entry: BatchEntry) -> None:
+    append_jsonl_lines(results_dir / MANIFEST_FILE_NAME, [entry])
+
+
+def read_manifest(results_dir: Path, layout: ResultsLayout) -> List[BatchEntry]:
+    """Loads all entries of the results directory, updating the manifest if stale."""
+    meta_entries: Dict[BatchEntryId, BatchEntry] = {}
+    entries, stale = _reconcile(results_dir, layout, meta_entries)
+    if stale:
+        try:
+            with locked(lock_file_of(results_dir / MANIFEST_FILE_NAME)):
+                # Reconcile again, so that no concurrently appended line is lost.
+                entries, stale = _reconcile(results_dir, layout, meta_entries)
+                if stale:
+                    logger.debug(
+                        "Rewriting manifest of '{}' with {:d} entries.".format(
+                            results_dir, len(entries)
+                        )
+                    )
+                    write_jsonl_lines(
+                        results_dir / MANIFEST_FILE_NAME,
+                        entries.values(),
+                        overwrite_existing=True,
+                    )
+        except OSError:
+            logger.warning(
+                "Could not update manifest of '{}'.".format(results_dir), exc_info=True
+            )
+    return list(entries.values())
+
+
+def rebuild_manifest(results_dir: Path, layout: ResultsLayout) -> List[BatchEntry]:
+    """Discards the manifest and recreates it from the meta files.
+
+    Only necessary if a meta file was modified without appending to the manifest, as
+    added and deleted meta files are picked up automatically.
+    """
+    with locked(lock_file_of(results_dir / MANIFEST_FILE_NAME)):
+        manifest_file = results_dir / MANIFEST_FILE_NAME
+        if manifest_file.exists():
+            manifest_file.unlink()
+    return read_manifest(results_dir, layout)
+
+
+def _reconcile(
+    results_dir: Path,
+    layout: ResultsLayout,
+    meta_entries: Dict[BatchEntryId, BatchEntry],
+) -> Tuple[Dict[BatchEntryId, BatchEntry], bool]:
+    # Returns entries in order of first appearance and whether the manifest is stale.
+    # Entries read from meta files are cached in meta_entries, to read each once.
+    logged, num_lines, stale = _read_manifest_lines(results_dir / MANIFEST_FILE_NAME)
+
+    meta_files = {
+        file_name.name[: -len(_META_FILE_SUFFIX)]: file_name
+        for file_name in layout.entry_file_names(results_dir)
+        if file_name.name.endswith(_META_FILE_SUFFIX)
+        and not file_name.name.startswith(".")
+    }
+
+    entries = {id_: entry for id_, entry in logged.items() if id_ in meta_files}
+    if len(entries) != len(logged):
+        stale = True
+
+    for id_ in sorted(meta_files.keys() - entries.keys()):
+        entry = meta_entries.get(id_)
+        if entry is None:
+            entry = read_json(results_dir / meta_files[id_], BatchEntry)
+            meta_entries[id_] = entry
+        entries[id_] = entry
+        stale = True
+
+    if num_lines > _MAX_LINES_PER_ENTRY * len(entries):
+        stale = True
+    return entries, stale
+
+
+def _read_manifest_lines(
+    manifest_file: Path,
+) -> Tuple[Dict[BatchEntryId, BatchEntry], int, bool]:
+    # Returns the latest entry per ID, the number of lines, and whether unreadable
+    # lines (e.g., from an interrupted append) were encountered.
+    entries: Dict[BatchEntryId, BatchEntry] = {}
+    num_lines = 0
+    corrupt = False
+    try:
+        fin = manifest_file.open("rb")
+    except FileNotFoundError:
+        return entries, num_lines, True
+    with fin:
+        for line in fin:
+            num_lines += 1
+            try:
+                entry = BatchEntry.from_json(cast(Mapping[str, object], loads(line)))
+            except Exception:
+                corrupt = True
+                continue
+            entries[entry.id] = entry
+    if corrupt:
+        logger.warning("Ignored corrupt lines in manifest '{}'.".format(manifest_file))
+    return entries, num_lines, corrupt
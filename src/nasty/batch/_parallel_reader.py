@@ -0,0 +1,202 @@
+#
+# Copyright 2019-2020 Lukas Schmelzeisen
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import multiprocessing
+from logging import getLogger
+from multiprocessing.process import BaseProcess
+from multiprocessing.queues import Queue
+from pathlib import Path
+from queue import Empty
+from typing import Dict, Iterator, List, Optional, Sequence, Set, Tuple, Union, cast
+
+from typing_extensions import Final
+
+from .._util.codec import Codec
+from .._util.io_ import read_binary_lines_file
+from .._util.json_ import loads
+from ..tweet.tweet import Tweet
+
+logger = getLogger(__name__)
+
+# Number of lines a worker sends back at once, to amortize queue overhead.
+_CHUNK_SIZE: Final = 1000
+
+# Bound of the queue with chunks sent back, per worker, limiting how far workers read
+# ahead of the consumer.
+_QUEUED_CHUNKS_PER_WORKER: Final = 4
+
+# A data file to read, together with the codec it was written with.
+ReadJob = Tuple[Path, Codec]
+
+_Chunk = Union[List[bytes], List[Tweet]]
+
+# Message from a worker: index of the job, lines of it (or the exception that reading
+# raised), and whether the job is complete.
+_Message = Tuple[int, Union[_Chunk, BaseException], bool]
+
+
+def iter_parallel(
+    jobs: Sequence[ReadJob], *, workers: int, ordered: bool, decode: bool
+) -> Iterator[Union[bytes, Tweet]]:
+    """Reads the data files of the jobs in worker processes.
+
+    Workers decompress files and, if decode is set, parse their lines into Tweets,
+    which are then streamed back through a bounded queue, i.e., if the consumer is
+    slower, workers wait.
+
+    If ordered is set, lines are yielded in the order of the jobs and within each file.
+    For this, lines of jobs that complete before all preceding ones are buffered,
+    whereby at most 2 * workers jobs are started ahead of the one currently yielded.
+    Otherwise, lines are yielded as soon as they are read, i.e., lines of different
+    files interleave (lines of the same file stay in order), and workers never idle.
+    """
+    if not jobs:
+        return
+
+    window = 2 * workers
+    pool = _ReaderPool(jobs, workers=workers, decode=decode)
+    try:
+        pool.submit_until(window)
+        if ordered:
+            yield from _consume_ordered(pool, len(jobs), window)
+        else:
+            yield from _consume_unordered(pool, len(jobs))
+    finally:
+        pool.close()
+
+
+def _consume_ordered(
+    pool: "_ReaderPool", num_jobs: int, window: int
+) -> Iterator[Union[bytes, Tweet]]:
+    next_index = 0  # Job whose lines are yielded next.
+    buffered: Dict[int, List[_Chunk]] = {}
+    completed: Set[int] = set()
+    while next_index < num_jobs:
+        index, chunk, done = pool.receive()
+        if index != next_index:
+            buffered.setdefault(index, []).append(chunk)
+            if done:
+                completed.add(index)
+            continue
+
+        yield from chunk
+        while done:
+            next_index += 1
+            pool.submit_until(next_index + window)
+            for buffered_chunk in buffered.pop(next_index, []):
+                yield from buffered_chunk
+            done = next_index in completed
+            completed.discard(next_index)
+
+
+def _consume_unordered(
+    pool: "_ReaderPool", num_jobs: int
+) -> Iterator[Union[bytes, Tweet]]:
+    num_completed = 0
+    while num_completed < num_jobs:
+        _, chunk, done = pool.receive()
+        yield from chunk
+        if done:
+            num_completed += 1
+            pool.submit_until(pool.num_submitted + 1)
+
+
+class _ReaderPool:
+    """Worker processes reading submitted jobs, and the queues to talk to them."""
+
+    def __init__(self, jobs: Sequence[ReadJob], *, workers: int, decode: bool):
+        context = multiprocessing.get_context()
+        self._jobs: Final = jobs
+        self._tasks: "Queue[Optional[Tuple[int, ReadJob]]]" = context.Queue()
+        self._messages: "Queue[_Message]" = context.Queue(
+            maxsize=_QUEUED_CHUNKS_PER_WORKER * workers
+        )
+        self._processes: Final[Sequence[BaseProcess]] = [
+            context.Process(
+                target=_read_worker,
+                args=(self._tasks, self._messages, decode),
+                daemon=True,
+            )
+            for _ in range(workers)
+        ]
+        for process in self._processes:
+            process.start()
+        self.num_submitted = 0
+
+    def submit_until(self, num_jobs: int) -> None:
+        """Submits jobs in order, until the first num_jobs jobs are submitted."""
+        while self.num_submitted < min(num_jobs, len(self._jobs)):
+            self._tasks.put((self.num_submitted, self._jobs[self.num_submitted]))
+            self.num_submitted += 1
+
+    def receive(self) -> Tuple[int, _Chunk, bool]:
+        """Waits for the next chunk of lines, reraising exceptions of workers."""
+        while True:
+            try:
+                index, payload, done = self._messages.get(timeout=1)
+            except Empty:
+                self._check_alive()
+                continue
+            if isinstance(payload, BaseException):
+                raise payload
+            return index, payload, done
+
+    def close(self) -> None:
+        for _ in self._processes:
+            self._tasks.put(None)
+        for process in self._processes:
+            # Workers may be blocked on the full queue if the consumer stopped early.
+            process.join(timeout=1)
+            if process.is_alive():
+                process.terminate()
+                process.join()
+        self._tasks.close()
+        self._messages.close()
+
+    def _check_alive(self) -> None:
+        # Workers only exit when told to, so any exit means they were killed.
+        for process in self._processes:
+            if process.exitcode is not None:
+                raise RuntimeError(
+                    "Reader process exited unexpectedly with code {}.".format(
+                        process.exitcode
+                    )
+                )
+
+
+def _read_worker(
+    tasks: "Queue[Optional[Tuple[int, ReadJob]]]",
+    messages: "Queue[_Message]",
+    decode: bool,
+) -> None:
+    while True:
+        task = tasks.get()
+        if task is None:
+            return
+        index, (file, codec) = task
+        try:
+            chunk: List[Union[bytes, Tweet]] = []
+            for line in read_binary_lines_file(file, codec=codec):
+                chunk.append(
+                    Tweet(cast(Dict[str, object], loads(line))) if decode else line
+                )
+                if len(chunk) == _CHUNK_SIZE:
+                    messages.put((index, cast(_Chunk, chunk), False))
+                    chunk = []
+            messages.put((index, cast(_Chunk, chunk), True))
+        except Exception as e:
+            logger.exception("Reading '{}' failed with exception.".format(file))
+            messages.put((index, e, True))
@@ -14,27 +14,56 @@
 # limitations under the License.
 #
 
-from collections import Counter
+import multiprocessing
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 from logging import getLogger
+from multiprocessing.process import BaseProcess
+from multiprocessing.queues import Queue
+from multiprocessing.synchronize import Event
 from os import getenv
 from pathlib import Path
+from queue import Empty
 from tempfile import mkdtemp
-from typing import Iterator, List, Optional, Sequence, Union, overload
+from threading import Thread
+from time import sleep
+from typing import (
+    Counter,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+    overload,
+)
 from uuid import uuid4
 
+from .._retriever.rate_limiter import RATE_LIMITER, set_host_rate_share
+from .._retriever.retriever import RetrieverTweetStream
+from .._retriever.session_pool import GUEST_SESSION_POOL
+from .._retriever.transport import reset_shared_http_adapter
+from .._util.bloom_filter import BloomFilter
+from .._util.codec import Codec, default_codec
+from .._util.io_ import lock_file_of, locked
 from .._util.json_ import (
     JsonSerializedException,
+    append_jsonl_lines,
     read_json,
     read_json_lines,
-    write_json,
     write_jsonl_lines,
 )
+from .._util.metrics import BATCH_ENTRIES, REGISTRY, MetricsSnapshot, exported_metrics
+from .._util.typing_ import checked_cast
 from ..request.request import Request
+from ._checkpoint import write_tweets_with_checkpoints
 from ._execute_result import _ExecuteResult
+from ._lease import Lease, LeaseKeeper, LeaseLostException, lease_ttl
+from ._manifest import write_meta
 from .batch_entry import BatchEntry
 from .batch_results import BatchResults
+from .results_layout import ResultsLayout, resolve_results_layout
 
 logger = getLogger(__name__)
 
@@ -48,15 +77,43 @@ class Batch:
             BatchEntry(request, id_=uuid4().hex, completed_at=None, exception=None)
         )
 
-    def dump(self, file: Path) -> None:
+    def extend(self, requests: Iterable[Request]) -> None:
+        for request in requests:
+            self.append(request)
+
+    def dump(self, file: Path, *, append: bool = False) -> None:
+        """Writes the entries of this batch to the file.
+
+        :param append: If set, the entries are appended to the file instead of
+            replacing its contents. Appending only writes the new entries, so that
+            building large batch files, possibly from multiple processes at once, takes
+            time linear in the number of entries.
+        """
+        if append:
+            logger.debug(
+                "Appending {:d} requests to batch file '{}'.".format(
+                    len(self._entries), file
+                )
+            )
+            append_jsonl_lines(file, self._entries)
+            return
+
         logger.debug("Dumping batch to file '{}'.".format(file))
-        write_jsonl_lines(file, self._entries, overwrite_existing=True)
+        with locked(lock_file_of(file)):
+            write_jsonl_lines(file, self._entries, overwrite_existing=True)
 
     def load(self, file: Path) -> None:
         logger.debug("Loading batch from file '{}'.".format(file))
         self._entries += read_json_lines(file, BatchEntry)
 
-    def execute(self, results_dir: Optional[Path] = None) -> Optional[BatchResults]:
+    def execute(
+        self, results_dir: Optional[Path] = None, codec: Optional[Codec] = None
+    ) -> Optional[BatchResults]:
+        """Executes all requests, writing their results to results_dir.
+
+        :param codec: Compression of the written data files, default_codec() if None.
+            Entries that were completed earlier keep the codec they were written with.
+        """
         logger.debug(
             "Started executing batch of {:d} requests.".format(len(self._entries))
         )
@@ -65,16 +122,46 @@ class Batch:
             results_dir = Path(mkdtemp())
         logger.debug("  Saving results to '{}'.".format(results_dir))
         Path.mkdir(results_dir, exist_ok=True, parents=True)
+        layout = resolve_results_layout(results_dir)
+        if codec is None:
+            codec = default_codec()
+        codec.install(results_dir)
+        for entry in self._entries:
+            entry.codec = codec
 
         num_workers = int(getenv("NASTY_NUM_WORKERS", default="1"))
-        with ThreadPoolExecutor(max_workers=num_workers) as pool:
-            futures = (
-                pool.submit(self._execute_entry, entry, results_dir)
-                for entry in self._entries
+        num_processes = int(getenv("NASTY_NUM_PROCESSES", default="0"))
+        result_counter: Counter[_ExecuteResult] = Counter()
+        entries: Sequence[BatchEntry] = self._entries
+        while True:
+            results = (
+                self._execute_entries_in_processes(
+                    entries, results_dir, layout, num_processes, num_workers
+                )
+                if num_processes
+                else self._execute_entries_in_threads(
+                    entries, results_dir, layout, num_workers
+                )
             )
-            result_counter = Counter(
-                future.result() for future in as_completed(futures)
+            leased_entries = []
+            for entry, result in results:
+                if result == _ExecuteResult.LEASED:
+                    leased_entries.append(entry)
+                    continue
+                result_counter[result] += 1
+                BATCH_ENTRIES.inc(result.value.lower())
+
+            # Wait for entries executed by other processes, so that we can take them
+            # over, should their processes die.
+            if not leased_entries:
+                break
+            logger.info(
+                "Waiting for {:d} requests executed by other processes.".format(
+                    len(leased_entries)
+                )
             )
+            sleep(lease_ttl() / 3)
+            entries = leased_entries
 
         logger.info(
             "Executing batch completed. "
@@ -90,18 +177,171 @@ class Batch:
         return BatchResults(results_dir)
 
     @classmethod
-    def _execute_entry(cls, entry: BatchEntry, results_dir: Path) -> _ExecuteResult:
+    def _execute_entries_in_threads(
+        cls,
+        entries: Sequence[BatchEntry],
+        results_dir: Path,
+        layout: ResultsLayout,
+        num_workers: int,
+    ) -> Iterator[Tuple[BatchEntry, _ExecuteResult]]:
+        seen_tweets = cls._seen_tweets_filter()
+        with exported_metrics(), LeaseKeeper(results_dir) as lease_keeper:
+            with ThreadPoolExecutor(max_workers=num_workers) as pool:
+                futures = {
+                    pool.submit(
+                        cls._execute_entry,
+                        entry,
+                        results_dir,
+                        layout,
+                        lease_keeper,
+                        seen_tweets,
+                    ): entry
+                    for entry in entries
+                }
+                for future in as_completed(futures):
+                    yield futures[future], future.result()
+
+    @classmethod
+    def _execute_entries_in_processes(
+        cls,
+        entries: Sequence[BatchEntry],
+        results_dir: Path,
+        layout: ResultsLayout,
+        num_processes: int,
+        num_workers: int,
+    ) -> Iterator[Tuple[BatchEntry, _ExecuteResult]]:
+        """Executes entries in num_processes processes with num_workers threads each.
+
+        JSON parsing, Tweet construction, and compression are CPU-bound and serialized
+        by the GIL, so threads alone can not use more than one core. The threads of all
+        processes take entries one at a time from a shared queue, so none idles while
+        entries are left. Each process keeps its own guest sessions, leases, and
+        duplicate filter (NASTY_DEDUP) and gets an equal share of the host rate limit.
+        Their metrics are merged into the ones of this process.
+        """
+        logger.debug(
+            "  Using {:d} processes with {:d} threads each.".format(
+                num_processes, num_workers
+            )
+        )
+        context = multiprocessing.get_context()
+        tasks: "Queue[Optional[Tuple[int, BatchEntry]]]" = context.Queue()
+        messages: "Queue[_ProcessMessage]" = context.Queue()
+        stopped = context.Event()
+        for index, entry in enumerate(entries):
+            tasks.put((index, entry))
+        for _ in range(num_processes * num_workers):
+            tasks.put(None)
+        processes = [
+            context.Process(
+                target=_execute_entries_in_process,
+                args=(
+                    tasks,
+                    messages,
+                    stopped,
+                    results_dir,
+                    layout,
+                    num_processes,
+                    num_workers,
+                ),
+                daemon=True,
+            )
+            for _ in range(num_processes)
+        ]
+        for process in processes:
+            process.start()
+
+        try:
+            # Only start the exporter's thread now that the processes are forked.
+            with exported_metrics():
+                for _ in range(len(entries)):
+                    index, outcome, metrics = _receive_message(messages, processes)
+                    REGISTRY.merge(metrics)
+                    if isinstance(outcome, BaseException):
+                        raise outcome
+                    executed_entry, result = outcome
+                    entry = entries[index]
+                    entry.completed_at = executed_entry.completed_at
+                    entry.exception = executed_entry.exception
+                    entry.codec = executed_entry.codec
+                    yield entry, result
+        finally:
+            # Let processes finish the entries they are executing, so that they release
+            # their leases, but not start new ones.
+            stopped.set()
+            while any(process.is_alive() for process in processes):
+                try:
+                    messages.get(timeout=1)
+                except Empty:
+                    pass
+            for process in processes:
+                process.join()
+            # Entries that were not taken may still be buffered for the queue.
+            tasks.cancel_join_thread()
+            tasks.close()
+            messages.close()
+
+    @classmethod
+    def _seen_tweets_filter(cls) -> Optional[BloomFilter]:
+        """Filter to drop Tweets already written by other entries (set NASTY_DEDUP).
+
+        Its memory is bounded by sizing it for NASTY_DEDUP_CAPACITY distinct Tweets
+        (default 10 million) with a false positive rate of NASTY_DEDUP_ERROR_RATE
+        (default 0.001), i.e., about 18 MB by default. Each false positive drops a
+        Tweet that is not actually a duplicate. Only entries executed in the same call
+        are considered, not those skipped because they were completed earlier.
+        """
+        if not getenv("NASTY_DEDUP"):
+            return None
+        return BloomFilter(
+            int(getenv("NASTY_DEDUP_CAPACITY", default="10000000")),
+            float(getenv("NASTY_DEDUP_ERROR_RATE", default="0.001")),
+        )
+
+    @classmethod
+    def _execute_entry(
+        cls,
+        entry: BatchEntry,
+        results_dir: Path,
+        layout: ResultsLayout,
+        lease_keeper: LeaseKeeper,
+        seen_tweets: Optional[BloomFilter] = None,
+    ) -> _ExecuteResult:
+        entry_dir = layout.entry_dir(results_dir, entry.id)
+        entry_dir.mkdir(parents=True, exist_ok=True)
+        lease = lease_keeper.claim(entry_dir / entry.lease_file_name)
+        if lease is None:
+            return _ExecuteResult.LEASED
+        try:
+            return cls._execute_leased_entry(
+                entry, results_dir, layout, lease, seen_tweets
+            )
+        finally:
+            lease_keeper.release(lease)
+
+    @classmethod
+    def _execute_leased_entry(
+        cls,
+        entry: BatchEntry,
+        results_dir: Path,
+        layout: ResultsLayout,
+        lease: Lease,
+        seen_tweets: Optional[BloomFilter],
+    ) -> _ExecuteResult:
         logger.debug("Executing request: {}".format(entry.request.to_json()))
 
-        meta_file = results_dir / entry.meta_file_name
-        data_file = results_dir / entry.data_file_name
+        entry_dir = layout.entry_dir(results_dir, entry.id)
+        meta_file = entry_dir / entry.meta_file_name
+        data_file = entry_dir / entry.data_file_name
+        checkpoint_file = entry_dir / entry.checkpoint_file_name
 
         if meta_file.exists():
             prev_execution_entry = read_json(meta_file, BatchEntry)
 
-            if data_file.exists():
+            if (entry_dir / prev_execution_entry.data_file_name).exists():
                 logger.debug("  Skipping request, because files already exist.")
                 entry.completed_at = prev_execution_entry.completed_at
+                entry.codec = prev_execution_entry.codec
                 return _ExecuteResult.SKIP
 
             logger.debug(
@@ -112,14 +352,24 @@ class Batch:
 
         result = _ExecuteResult.SUCCESS
         try:
-            write_jsonl_lines(data_file, entry.request.request(), use_lzma=True)
+            write_tweets_with_checkpoints(
+                checked_cast(RetrieverTweetStream, entry.request.request()),
+                data_file,
+                checkpoint_file,
+                codec=entry.codec,
+                seen_tweets=seen_tweets,
+                lease=lease,
+            )
             entry.completed_at = datetime.now()
+        except LeaseLostException:
+            logger.warning("  Request execution was taken over by another process.")
+            return _ExecuteResult.LEASED
         except Exception as e:
             logger.exception("  Request execution failed with exception.")
             entry.exception = JsonSerializedException.from_exception(e)
             result = _ExecuteResult.FAIL
 
-        write_json(meta_file, entry)
+        write_meta(results_dir, layout, entry)
         return result
 
     def __len__(self) -> int:
@@ -146,3 +396,97 @@ class Batch:
 
     def __repr__(self) -> str:
         return repr(self._entries)
+
+
+# Message from a worker process: index of the entry, the executed entry and its result
+# (or the exception that executing it raised), and metrics since the last message.
+_ProcessMessage = Tuple[
+    int, Union[Tuple[BatchEntry, _ExecuteResult], BaseException], MetricsSnapshot
+]
+
+
+def _execute_entries_in_process(
+    tasks: "Queue[Optional[Tuple[int, BatchEntry]]]",
+    messages: "Queue[_ProcessMessage]",
+    stopped: Event,
+    results_dir: Path,
+    layout: ResultsLayout,
+    num_processes: int,
+    num_workers: int,
+) -> None:
+    # Forked processes inherit the state of their parent, which they may not share.
+    GUEST_SESSION_POOL.clear()
+    RATE_LIMITER.clear()
+    reset_shared_http_adapter()
+    REGISTRY.drain()
+    set_host_rate_share(1.0 / num_processes)
+    seen_tweets = Batch._seen_tweets_filter()
+
+    with LeaseKeeper(results_dir) as lease_keeper:
+        threads = [
+            Thread(
+                target=_execute_queued_entries,
+                args=(
+                    tasks,
+                    messages,
+                    stopped,
+                    results_dir,
+                    layout,
+                    lease_keeper,
+                    seen_tweets,
+                ),
+            )
+            for _ in range(num_workers)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+
+def _execute_queued_entries(
+    tasks: "Queue[Optional[Tuple[int, BatchEntry]]]",
+    messages: "Queue[_ProcessMessage]",
+    stopped: Event,
+    results_dir: Path,
+    layout: ResultsLayout,
+    lease_keeper: LeaseKeeper,
+    seen_tweets: Optional[BloomFilter],
+) -> None:
+    while not stopped.is_set():
+        task = tasks.get()
+        if task is None:
+            return
+        index, entry = task
+        outcome: Union[Tuple[BatchEntry, _ExecuteResult], BaseException]
+        try:
+            outcome = (
+                entry,
+                Batch._execute_entry(
+                    entry, results_dir, layout, lease_keeper, seen_tweets
+                ),
+            )
+        except Exception as e:
+            outcome = e
+        messages.put((index, outcome, REGISTRY.drain()))
+
+
+def _receive_message(
+    messages: "Queue[_ProcessMessage]", processes: Sequence[BaseProcess]
+) -> _ProcessMessage:
+    """Waits for the next message of the worker processes."""
+    while True:
+        # Processes flush their messages before exiting, so if all exited before
+        # waiting, no message will arrive anymore.
+        exitcodes = [process.exitcode for process in processes]
+        try:
+            return messages.get(timeout=1)
+        except Empty:
+            pass
+        for exitcode in exitcodes:
+            if exitcode:
+                raise RuntimeError(
+                    "Batch process exited unexpectedly with code {}.".format(exitcode)
+                )
+        if None not in exitcodes:
+            raise RuntimeError("Batch processes exited before executing all entries.")
@@ -21,6 +21,7 @@ from typing import Mapping, Optional, cast
 from overrides import overrides
 from typing_extensions import Final
 
+from .._util.codec import XZ, Codec
 from .._util.consts import NASTY_DATE_TIME_FORMAT
 from .._util.json_ import JsonSerializable, JsonSerializedException
 from .._util.typing_ import checked_cast
@@ -37,11 +38,14 @@ class BatchEntry(JsonSerializable):
         id_: BatchEntryId,
         completed_at: Optional[datetime],
         exception: Optional[JsonSerializedException],
+        codec: Codec = XZ,
     ):
         self.request: Final = request
         self.id: Final = id_
         self.completed_at = completed_at
         self.exception = exception
+        # Codec of the data file, set when it is written.
+        self.codec = codec
 
     def __eq__(self, other: object) -> bool:
         return type(self) == type(other) and self.__dict__ == other.__dict__
@@ -52,7 +56,15 @@ class BatchEntry(JsonSerializable):
 
     @property
     def data_file_name(self) -> Path:
-        return Path("{:s}.data.jsonl.xz".format(self.id))
+        return Path("{:s}.data.jsonl{:s}".format(self.id, self.codec.suffix))
+
+    @property
+    def checkpoint_file_name(self) -> Path:
+        return Path("{:s}.checkpoint.json".format(self.id))
+
+    @property
+    def lease_file_name(self) -> Path:
+        return Path("{:s}.lease.json".format(self.id))
 
     @property
     def ids_file_name(self) -> Path:
@@ -68,6 +80,8 @@ class BatchEntry(JsonSerializable):
             obj["completed_at"] = self.completed_at.strftime(NASTY_DATE_TIME_FORMAT)
         if self.exception is not None:
             obj["exception"] = self.exception.to_json()
+        if self.codec != XZ:
+            obj["codec"] = self.codec.to_json()
         return obj
 
     @classmethod
@@ -90,4 +104,9 @@ class BatchEntry(JsonSerializable):
                 if "exception" in obj
                 else None
             ),
+            codec=(
+                Codec.from_json(cast(Mapping[str, object], obj["codec"]))
+                if "codec" in obj
+                else XZ
+            ),
         )
@@ -14,14 +14,17 @@
 # limitations under the License.
 #
 
+from itertools import islice
 from logging import getLogger
 from operator import itemgetter
+from os import cpu_count, getenv
 from pathlib import Path
 from typing import (
     Callable,
     Counter,
     Iterable,
     Iterator,
+    Mapping,
     Optional,
     Sequence,
     Tuple,
@@ -31,45 +34,181 @@ from typing import (
 )
 
 from more_itertools import groupby_transform, spy, unzip
+from typing_extensions import Final
 
 from nasty._settings import TwitterApiSettings
 
-from .._util.io_ import read_lines_file, write_lines_file
-from .._util.json_ import read_json, read_json_lines, write_json, write_jsonl_lines
+from .._util.codec import Codec, train_zstd_dictionary
+from .._util.io_ import read_binary_lines_file, read_lines_file, write_lines_file
+from .._util.json_ import dumps, loads, read_json_lines, write_jsonl_lines
 from .._util.tweepy_ import statuses_lookup
 from ..tweet.tweet import Tweet, TweetId
 from ._execute_result import _ExecuteResult
-from .batch_entry import BatchEntry
+from ._manifest import read_manifest, rebuild_manifest, write_meta
+from ._parallel_reader import iter_parallel
+from .batch_entry import BatchEntry, BatchEntryId
+from .results_layout import (
+    ResultsLayout,
+    migrate_results_layout,
+    resolve_results_layout,
+)
 
 logger = getLogger(__name__)
 
+_MISSING: Final = object()
+
 
 class BatchResults(Sequence[BatchEntry]):
     def __init__(self, results_dir: Path):
         self._results_dir = results_dir
-        self._entries: Sequence[BatchEntry] = [
-            read_json(meta_file, BatchEntry)
-            for meta_file in self._results_dir.iterdir()
-            if meta_file.name.endswith(".meta.json")
+        self._layout = resolve_results_layout(results_dir, default=ResultsLayout.FLAT)
+        self._entries: Sequence[BatchEntry] = read_manifest(results_dir, self._layout)
+        self._entries_by_id: Mapping[BatchEntryId, BatchEntry] = {
+            entry.id: entry for entry in self._entries
+        }
+
+    def entry(self, entry_id: BatchEntryId) -> BatchEntry:
+        """Looks up the entry with the given ID, raising KeyError if there is none."""
+        return self._entries_by_id[entry_id]
+
+    def find(self, **request_fields: object) -> Sequence[BatchEntry]:
+        """Selects all entries whose request has the given field values.
+
+        For example, results.find(query="trump", lang="en").
+        """
+        return [
+            entry
+            for entry in self._entries
+            if all(
+                getattr(entry.request, name, _MISSING) == value
+                for name, value in request_fields.items()
+            )
         ]
 
+    @property
+    def layout(self) -> ResultsLayout:
+        return self._layout
+
+    def migrate(self, layout: ResultsLayout) -> None:
+        """Rearranges the files of the results directory into the given layout.
+
+        Must not be called while a batch is executed into the directory.
+        """
+        migrate_results_layout(self._results_dir, layout)
+        self._layout = layout
+
+    def rebuild_manifest(self) -> None:
+        """Recreates the manifest of the results directory from its meta files."""
+        self._entries = rebuild_manifest(self._results_dir, self._layout)
+        self._entries_by_id = {entry.id: entry for entry in self._entries}
+
     def tweets(self, entry: BatchEntry) -> Iterable[Tweet]:
-        data_file = self._results_dir / entry.data_file_name
-        ids_file = self._results_dir / entry.ids_file_name
+        yield from read_json_lines(
+            self._data_file(entry), Tweet, codec=entry.codec.resolve(self._results_dir)
+        )
+
+    def iter_tweets(
+        self,
+        entries: Optional[Iterable[BatchEntry]] = None,
+        *,
+        workers: Optional[int] = None,
+        ordered: bool = False,
+    ) -> Iterator[Tweet]:
+        """Reads the Tweets of many entries (all if None) in parallel processes.
+
+        Decompressing and parsing data files is CPU-bound, so tweets() is limited to a
+        single core. Here, entries are fanned out to a pool of worker processes, which
+        stream the parsed Tweets back through a bounded queue.
+
+        :param workers: Number of worker processes. Defaults to NASTY_NUM_READERS, or
+            the number of CPUs if unset. If 0 (also via NASTY_NUM_READERS), reads on
+            the calling thread.
+        :param ordered: If set, Tweets are yielded in the order of the entries, and
+            within each entry in the order of its data file, which requires buffering
+            entries that complete early. Otherwise, Tweets of different entries
+            interleave in the order they are read.
+        """
+        return cast(
+            Iterator[Tweet], self._iter_parallel(entries, workers, ordered, True)
+        )
+
+    def iter_lines(
+        self,
+        entries: Optional[Iterable[BatchEntry]] = None,
+        *,
+        workers: Optional[int] = None,
+        ordered: bool = False,
+    ) -> Iterator[bytes]:
+        """Like iter_tweets(), but yields the undecoded JSON line of each Tweet.
+
+        Use this, if Tweets are parsed by other means, or not at all (e.g., to filter
+        lines by substring first).
+        """
+        return cast(
+            Iterator[bytes], self._iter_parallel(entries, workers, ordered, False)
+        )
+
+    def _iter_parallel(
+        self,
+        entries: Optional[Iterable[BatchEntry]],
+        workers: Optional[int],
+        ordered: bool,
+        decode: bool,
+    ) -> Iterator[Union[bytes, Tweet]]:
+        if entries is None:
+            entries = self
+        if workers is None:
+            num_readers = getenv("NASTY_NUM_READERS")
+            workers = int(num_readers) if num_readers else cpu_count() or 1
+        jobs = [
+            (self._data_file(entry), entry.codec.resolve(self._results_dir))
+            for entry in entries
+        ]
+        if workers:
+            yield from iter_parallel(
+                jobs, workers=workers, ordered=ordered, decode=decode
+            )
+            return
+
+        for data_file, codec in jobs:
+            for line in read_binary_lines_file(data_file, codec=codec):
+                yield Tweet(cast(Mapping[str, object], loads(line))) if decode else line
+
+    def _data_file(self, entry: BatchEntry) -> Path:
+        entry_dir = self._layout.entry_dir(self._results_dir, entry.id)
+        data_file = entry_dir / entry.data_file_name
+        ids_file = entry_dir / entry.ids_file_name
         if not data_file.exists() and ids_file.exists():
             raise ValueError("Tweet data not available. Did you forget to unidify?")
-
-        yield from read_json_lines(data_file, Tweet, use_lzma=True)
+        return data_file
 
     def tweet_ids(self, entry: BatchEntry) -> Iterable[TweetId]:
-        data_file = self._results_dir / entry.data_file_name
-        ids_file = self._results_dir / entry.ids_file_name
+        entry_dir = self._layout.entry_dir(self._results_dir, entry.id)
+        ids_file = entry_dir / entry.ids_file_name
         if ids_file.exists():
             yield from read_lines_file(ids_file)
         else:
-            yield from (
-                tweet.id for tweet in read_json_lines(data_file, Tweet, use_lzma=True)
-            )
+            yield from (tweet.id for tweet in self.tweets(entry))
+
+    def train_zstd_dictionary(
+        self, *, num_samples: int = 100_000, size: int = 112_640
+    ) -> bytes:
+        """Trains a dictionary for ZstdCodec on up to num_samples of these Tweets.
+
+        Pass it to Batch.execute() via ZstdCodec(dictionary=...), or save it to a file
+        and set NASTY_CODEC=zstd:LEVEL:FILE.
+        """
+        return train_zstd_dictionary(
+            islice(
+                (
+                    dumps(tweet.to_json()).encode("UTF-8")
+                    for entry in self
+                    for tweet in self.tweets(entry)
+                ),
+                num_samples,
+            ),
+            size=size,
+        )
 
     def _transform(
         self,
@@ -89,10 +228,12 @@ class BatchResults(Sequence[BatchEntry]):
         )
 
         same_dir = results_dir.exists() and results_dir.samefile(self._results_dir)
+        layout = self._layout
         if not same_dir:
             Path.mkdir(results_dir, exist_ok=True, parents=True)
+            layout = resolve_results_layout(results_dir, default=self._layout)
 
-        result_counter = transform_func(results_dir, **transform_kwargs)
+        result_counter = transform_func(results_dir, layout, **transform_kwargs)
         logger.info(
             "  {} batch results completed. {:d} successful, {:d} skipped, {:d} "
             "failed.".format(
@@ -113,19 +254,25 @@ class BatchResults(Sequence[BatchEntry]):
     def idify(self, new_results_dir: Optional[Path] = None) -> Optional["BatchResults"]:
         return self._transform(new_results_dir, "Idifying", self._transform_idify)
 
-    def _transform_idify(self, results_dir: Path) -> Counter[_ExecuteResult]:
+    def _transform_idify(
+        self, results_dir: Path, layout: ResultsLayout
+    ) -> Counter[_ExecuteResult]:
         result_counter = Counter[_ExecuteResult]()
         for entry in self:
             try:
-                ids_file = results_dir / entry.ids_file_name
-                meta_file = results_dir / entry.meta_file_name
+                entry_dir = layout.entry_dir(results_dir, entry.id)
+                ids_file = entry_dir / entry.ids_file_name
+                meta_file = entry_dir / entry.meta_file_name
 
                 if ids_file.exists() and meta_file.exists():
                     result_counter[_ExecuteResult.SKIP] += 1
                     continue
 
+                entry_dir.mkdir(parents=True, exist_ok=True)
                 write_lines_file(ids_file, self.tweet_ids(entry))
-                write_json(meta_file, entry, overwrite_existing=True)
+                # Keep the dictionary needed to unidify into the codec of the entry.
+                self._installed_codec(entry, results_dir)
+                write_meta(results_dir, layout, entry, overwrite_existing=True)
                 result_counter[_ExecuteResult.SUCCESS] += 1
             except Exception:
                 logger.exception("  Entry '{}' failed with exception.".format(entry.id))
@@ -147,12 +294,13 @@ class BatchResults(Sequence[BatchEntry]):
     def _transform_unidify(
         self,
         results_dir: Path,
+        layout: ResultsLayout,
         twitter_api_settings: TwitterApiSettings,
     ) -> Counter[_ExecuteResult]:
         result_counter = Counter[_ExecuteResult]()
 
         head, entries_tweet_ids = spy(
-            self._iter_entries_tweet_ids(results_dir, result_counter)
+            self._iter_entries_tweet_ids(results_dir, layout, result_counter)
         )
         if not head:  # Check if any entries with Tweet-IDs exist (else unzip fails).
             return result_counter
@@ -166,26 +314,29 @@ class BatchResults(Sequence[BatchEntry]):
             valuefunc=itemgetter(1),
         ):
             write_jsonl_lines(
-                results_dir / entry.data_file_name,
+                layout.entry_dir(results_dir, entry.id) / entry.data_file_name,
                 (tweet for tweet in tweets if tweet is not None),
-                use_lzma=True,
-            )
-            write_json(
-                results_dir / entry.meta_file_name, entry, overwrite_existing=True
+                codec=self._installed_codec(entry, results_dir),
             )
+            write_meta(results_dir, layout, entry, overwrite_existing=True)
             result_counter[_ExecuteResult.SUCCESS] += 1
 
         return result_counter
 
     def _iter_entries_tweet_ids(
-        self, results_dir: Path, result_counter: Counter[_ExecuteResult]
+        self,
+        results_dir: Path,
+        layout: ResultsLayout,
+        result_counter: Counter[_ExecuteResult],
     ) -> Iterable[Tuple[BatchEntry, TweetId]]:
         for entry in self:
-            meta_file = results_dir / entry.meta_file_name
-            data_file = results_dir / entry.data_file_name
+            entry_dir = layout.entry_dir(results_dir, entry.id)
+            meta_file = entry_dir / entry.meta_file_name
+            data_file = entry_dir / entry.data_file_name
             if data_file.exists() and meta_file.exists():
                 result_counter[_ExecuteResult.SKIP] += 1
                 continue
+            entry_dir.mkdir(parents=True, exist_ok=True)
 
             is_entry_empty = True
             for tweet in self.tweet_ids(entry):
@@ -193,12 +344,17 @@ class BatchResults(Sequence[BatchEntry]):
                 yield entry, tweet
 
             if is_entry_empty:
-                write_jsonl_lines(results_dir / entry.data_file_name, [], use_lzma=True)
-                write_json(
-                    results_dir / entry.meta_file_name, entry, overwrite_existing=True
+                write_jsonl_lines(
+                    data_file, [], codec=self._installed_codec(entry, results_dir)
                 )
+                write_meta(results_dir, layout, entry, overwrite_existing=True)
                 result_counter[_ExecuteResult.SUCCESS] += 1
 
+    def _installed_codec(self, entry: BatchEntry, results_dir: Path) -> Codec:
+        codec = entry.codec.resolve(self._results_dir)
+        codec.install(results_dir)
+        return codec
+
     def __len__(self) -> int:
         return len(self._entries)
 
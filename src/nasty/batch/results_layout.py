@@ -0,0 +1,195 @@
+#
+# Copyright 2019-2020 Lukas Schmelzeisen
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import os
+from enum import Enum
+from hashlib import blake2b
+from logging import getLogger
+from os import getenv
+from pathlib import Path
+from typing import Iterator, Mapping, Optional, cast
+
+from typing_extensions import Final
+
+from .._util.codec import CODECS
+from .._util.io_ import lock_file_of, locked, read_file, write_file
+from .._util.json_ import dumps, loads
+from .._util.typing_ import checked_cast
+from .batch_entry import BatchEntryId
+
+logger = getLogger(__name__)
+
+LAYOUT_FILE_NAME: Final = Path("layout.json")
+
+# Suffixes of the files belonging to a batch entry, see BatchEntry.
+ENTRY_FILE_SUFFIXES: Final = (
+    ".meta.json",
+    *(".data.jsonl" + codec.suffix for codec in CODECS),
+    ".ids",
+    ".checkpoint.json",
+    ".lease.json",
+)
+
+
+class ResultsLayout(Enum):
+    """How the files of batch entries are arranged in a results directory.
+
+    FLAT puts all files directly into the results directory. SHARDED distributes them
+    over a two-level hierarchy of directories named after the first two and next two
+    hex digits of a hash of the entry ID (e.g., "3f/a0/"). For 1 million entries this
+    gives about 15 entries per directory instead of a single directory with several
+    million files, which keeps listings, existence checks, and backups fast.
+
+    Directories that use the SHARDED layout are marked by a layout file, so that all
+    readers and writers pick it up transparently.
+    """
+
+    FLAT = "flat"
+    SHARDED = "sharded"
+
+    def entry_dir(self, results_dir: Path, entry_id: BatchEntryId) -> Path:
+        if self == ResultsLayout.FLAT:
+            return results_dir
+        digest = blake2b(entry_id.encode("UTF-8"), digest_size=2).hexdigest()
+        return results_dir / digest[:2] / digest[2:]
+
+    def entry_dirs(self, results_dir: Path) -> Iterator[Path]:
+        if self == ResultsLayout.FLAT:
+            yield results_dir
+            return
+        for level1 in _shard_dirs(results_dir):
+            yield from _shard_dirs(level1)
+
+    def entry_file_names(self, results_dir: Path) -> Iterator[Path]:
+        """All files of batch entries, relative to the results directory.
+
+        Includes temporary files of entries currently executing.
+        """
+        for entry_dir in self.entry_dirs(results_dir):
+            for name in os.listdir(str(entry_dir)):
+                if name.endswith(ENTRY_FILE_SUFFIXES):
+                    yield entry_dir.relative_to(results_dir) / name
+
+
+def _shard_dirs(dir_: Path) -> Iterator[Path]:
+    for name in sorted(os.listdir(str(dir_))):
+        if len(name) == 2 and all(c in "0123456789abcdef" for c in name):
+            path = dir_ / name
+            if path.is_dir():
+                yield path
+
+
+def default_results_layout() -> ResultsLayout:
+    """Layout for new results directories (NASTY_RESULTS_LAYOUT, flat or sharded)."""
+    return ResultsLayout(getenv("NASTY_RESULTS_LAYOUT", default="flat"))
+
+
+def resolve_results_layout(
+    results_dir: Path, default: Optional[ResultsLayout] = None
+) -> ResultsLayout:
+    """Layout of the given results directory.
+
+    If the directory does not contain any entries yet, it is given the default layout
+    (default_results_layout() if None).
+    """
+    layout_file = results_dir / LAYOUT_FILE_NAME
+    if layout_file.exists():
+        return _read_layout_file(layout_file)
+
+    if default is None:
+        default = default_results_layout()
+    if default == ResultsLayout.FLAT:
+        return default
+
+    with locked(lock_file_of(layout_file)):
+        if layout_file.exists():
+            return _read_layout_file(layout_file)
+        if any(ResultsLayout.FLAT.entry_file_names(results_dir)):
+            return ResultsLayout.FLAT
+        _write_layout_file(layout_file, default)
+        return default
+
+
+def _set_results_layout(results_dir: Path, layout: ResultsLayout) -> None:
+    layout_file = results_dir / LAYOUT_FILE_NAME
+    if layout == ResultsLayout.FLAT:
+        if layout_file.exists():
+            layout_file.unlink()
+    else:
+        _write_layout_file(layout_file, layout)
+
+
+def _read_layout_file(layout_file: Path) -> ResultsLayout:
+    obj = cast(Mapping[str, object], loads(read_file(layout_file)))
+    return ResultsLayout(checked_cast(str, obj["layout"]))
+
+
+def _write_layout_file(layout_file: Path, layout: ResultsLayout) -> None:
+    write_file(
+        layout_file,
+        dumps({"layout": layout.value}, indent=2),
+        overwrite_existing=True,
+    )
+
+
+def migrate_results_layout(results_dir: Path, layout: ResultsLayout) -> int:
+    """Moves the files of all entries to the given layout, returns how many moved.
+
+    Every file is moved with an atomic rename and the layout is only switched after
+    all files were moved. If interrupted, migrating again completes the migration.
+    Must not run concurrently with the execution of a batch into the directory.
+    """
+    current_layout = resolve_results_layout(results_dir, default=ResultsLayout.FLAT)
+    logger.debug(
+        "Migrating results in '{}' from layout {} to {}.".format(
+            results_dir, current_layout.value, layout.value
+        )
+    )
+
+    num_moved = 0
+    if current_layout != layout:
+        for file_name in list(current_layout.entry_file_names(results_dir)):
+            entry_id = _entry_id_of(file_name.name)
+            target_dir = layout.entry_dir(results_dir, entry_id)
+            target_dir.mkdir(parents=True, exist_ok=True)
+            (results_dir / file_name).rename(target_dir / file_name.name)
+            num_moved += 1
+        _set_results_layout(results_dir, layout)
+
+    if layout == ResultsLayout.FLAT:
+        _remove_empty_shard_dirs(results_dir)
+
+    logger.info(
+        "Migrated {:d} files in '{}' to layout {}.".format(
+            num_moved, results_dir, layout.value
+        )
+    )
+    return num_moved
+
+
+def _entry_id_of(file_name: str) -> BatchEntryId:
+    if file_name.startswith(".tmp."):
+        file_name = file_name[len(".tmp.") :]
+    return file_name.split(".", 1)[0]
+
+
+def _remove_empty_shard_dirs(results_dir: Path) -> None:
+    for level1 in list(_shard_dirs(results_dir)):
+        for level2 in list(_shard_dirs(level1)):
+            if not any(level2.iterdir()):
+                level2.rmdir()
+        if not any(level1.iterdir()):
+            level1.rmdir()
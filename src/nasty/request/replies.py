@@ -17,6 +17,7 @@
 from overrides import overrides
 
 from ..tweet.conversation_tweet_stream import ConversationTweetStream
+from ..tweet.tweet_stream import AsyncTweetStream
 from .conversation_request import ConversationRequest
 
 
@@ -26,3 +27,9 @@ class Replies(ConversationRequest):
         from .._retriever.replies_retriever import RepliesRetriever
 
         return RepliesRetriever(self).tweet_stream
+
+    @overrides
+    def request_async(self) -> AsyncTweetStream:
+        from .._retriever.async_retriever import AsyncRepliesRetriever
+
+        return AsyncRepliesRetriever(self).async_tweet_stream
@@ -21,7 +21,7 @@ from overrides import overrides
 from typing_extensions import Final, final
 
 from .._util.json_ import JsonSerializable
-from ..tweet.tweet_stream import TweetStream
+from ..tweet.tweet_stream import AsyncTweetStream, TweetStream
 
 DEFAULT_MAX_TWEETS: Final = 100
 DEFAULT_BATCH_SIZE: Final = 20
@@ -101,3 +101,11 @@ class Request(ABC, JsonSerializable):
     @abstractmethod
     def request(self) -> TweetStream:
         raise NotImplementedError()
+
+    @abstractmethod
+    def request_async(self) -> AsyncTweetStream:
+        """Like request(), but returns a stream that is consumed via "async for".
+
+        Requires httpx to be installed (``pip install nasty[async]``).
+        """
+        raise NotImplementedError()
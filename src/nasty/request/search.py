@@ -14,18 +14,21 @@
 # limitations under the License.
 #
 
-from datetime import date, timedelta
+from datetime import date, datetime, timedelta
 from enum import Enum
-from typing import Dict, Mapping, Optional, Sequence, cast
+from typing import TYPE_CHECKING, Dict, List, Mapping, Optional, Sequence, cast
 
 from overrides import overrides
 from typing_extensions import Final
 
-from .._util.time_ import daterange, yyyy_mm_dd_date
+from .._util.time_ import utc_datetime, yyyy_mm_dd_date_or_datetime
 from .._util.typing_ import checked_cast
-from ..tweet.tweet_stream import TweetStream
+from ..tweet.tweet_stream import AsyncTweetStream, TweetStream
 from .request import DEFAULT_BATCH_SIZE, DEFAULT_MAX_TWEETS, Request
 
+if TYPE_CHECKING:
+    from .search_planner import VolumeEstimator
+
 
 class SearchFilter(Enum):
     """Different sorting/filtering rules for Twitter search results.
@@ -78,15 +81,27 @@ class Search(Request):
             There is no guarantee that the query string will be contained in the Tweet
             text. It could also be part of the name of the authoring user, or even the
             title of a linked external website.
-        :param since: Only find Tweets written after this date (inclusive).
-        :param until: Only find Tweets written before this date (exclusive).
+        :param since: Only find Tweets written after this date (inclusive). Can also
+            be a datetime, to search at a granularity of seconds. Naive datetimes are
+            interpreted as UTC.
+        :param until: Only find Tweets written before this date (exclusive). Can also
+            be a datetime, like since.
         :param filter_: Method to sort/filter Tweets.
         :param lang: Only search Tweets written in this language. These are directly
             passed to Twitter and it's undocumented what arguments they except here.
             Presumably ISO 3166-1 alpha-2 and alpha-3 codes should work.
         """
 
-        if since is not None and until is not None and since >= until:
+        # Twitter's since_time: and until_time: operators take whole seconds.
+        if isinstance(since, datetime):
+            since = utc_datetime(since).replace(microsecond=0)
+        if isinstance(until, datetime):
+            until = utc_datetime(until).replace(microsecond=0)
+        if (
+            since is not None
+            and until is not None
+            and utc_datetime(since) >= utc_datetime(until)
+        ):
             raise ValueError("since date must be before until date.")
 
         super().__init__(max_tweets=max_tweets, batch_size=batch_size)
@@ -118,12 +133,12 @@ class Search(Request):
         return cls(
             query=checked_cast(str, obj["query"]),
             since=(
-                yyyy_mm_dd_date(checked_cast(str, obj["since"]))
+                yyyy_mm_dd_date_or_datetime(checked_cast(str, obj["since"]))
                 if "since" in obj
                 else None
             ),
             until=(
-                yyyy_mm_dd_date(checked_cast(str, obj["until"]))
+                yyyy_mm_dd_date_or_datetime(checked_cast(str, obj["until"]))
                 if "until" in obj
                 else None
             ),
@@ -147,21 +162,62 @@ class Search(Request):
 
         return SearchRetriever(self).tweet_stream
 
+    @overrides
+    def request_async(self) -> AsyncTweetStream:
+        from .._retriever.async_retriever import AsyncSearchRetriever
+
+        return AsyncSearchRetriever(self).async_tweet_stream
+
     def to_daily_requests(self) -> Sequence["Search"]:
+        """Splits this request into one request per day.
+
+        Requests are cut at midnight (UTC). If since or until have a time of day, the
+        first and last request only cover the remainder of their day.
+        """
         if self.since is None or self.until is None:
             raise ValueError(
                 "Need both since and until date for into_daily_requests()."
             )
 
+        boundaries: List[date] = [self.since]
+        day = utc_datetime(self.since).date() + timedelta(days=1)
+        while utc_datetime(day) < utc_datetime(self.until):
+            boundaries.append(day)
+            day += timedelta(days=1)
+        boundaries.append(self.until)
+
         return [
             Search(
                 self.query,
-                since=date_,
-                until=date_ + timedelta(days=1),
+                since=since,
+                until=until,
                 filter_=self.filter,
                 lang=self.lang,
                 max_tweets=self.max_tweets,
                 batch_size=self.batch_size,
             )
-            for date_ in daterange(self.since, self.until - timedelta(days=1))
+            for since, until in zip(boundaries, boundaries[1:])
         ]
+
+    def to_adaptive_requests(
+        self,
+        target_tweets: int,
+        *,
+        estimator: Optional["VolumeEstimator"] = None,
+        min_window: timedelta = timedelta(hours=1),
+    ) -> Sequence["Search"]:
+        """Splits this request into time windows of about target_tweets Tweets each.
+
+        Unlike to_daily_requests(), busy days are split into multiple requests and
+        quiet days are merged into one, so that each request is a similar amount of
+        work. See SearchPlanner for details.
+
+        :param estimator: Estimates how many Tweets a request will find. Defaults to
+            performing probe requests (ProbeVolumeEstimator).
+        :param min_window: Time windows are never split further than this.
+        """
+        from .search_planner import SearchPlanner
+
+        return SearchPlanner(
+            target_tweets, estimator=estimator, min_window=min_window
+        ).plan(self)
@@ -0,0 +1,251 @@
+#
+# Copyright 2019-2020 Lukas Schmelzeisen
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from abc import ABC, abstractmethod
+from datetime import date, datetime, time, timedelta
+from logging import getLogger
+from math import ceil
+from typing import Dict, List, Mapping, Optional, Sequence, Tuple
+
+from overrides import overrides
+from typing_extensions import Final
+
+from .._util.time_ import utc_datetime
+from ..batch.batch_results import BatchResults
+from .search import Search, SearchFilter
+
+logger = getLogger(__name__)
+
+_ONE_HOUR: Final = timedelta(hours=1)
+_ONE_DAY: Final = timedelta(days=1)
+
+
+def _window(search: Search) -> Tuple[datetime, datetime]:
+    if search.since is None or search.until is None:
+        raise ValueError("Need both since and until date to plan a Search.")
+    return utc_datetime(search.since), utc_datetime(search.until)
+
+
+class VolumeEstimator(ABC):
+    """Estimates how many Tweets a Search will find (disregarding max_tweets)."""
+
+    @abstractmethod
+    def estimate(self, search: Search) -> float:
+        raise NotImplementedError()
+
+
+class ProbeVolumeEstimator(VolumeEstimator):
+    """Estimates volumes by retrieving the newest probe_size Tweets of each Search.
+
+    Probes are run with SearchFilter.LATEST, so that Tweets arrive newest first. If
+    fewer than probe_size Tweets are found, that is the exact volume. Otherwise, the
+    rate at which Tweets were written between the oldest probed Tweet and the end of the
+    time window is extrapolated to the whole window.
+
+    Each probe costs probe_size / batch_size requests (plus establishing a session, if
+    none is pooled), so probe_size should be small compared to the target size of the
+    planned requests.
+    """
+
+    def __init__(self, probe_size: int = 100):
+        if probe_size <= 0:
+            raise ValueError("probe_size must be positive.")
+        self.probe_size: Final = probe_size
+
+    @overrides
+    def estimate(self, search: Search) -> float:
+        since, until = _window(search)
+        probe = Search(
+            search.query,
+            since=search.since,
+            until=search.until,
+            filter_=SearchFilter.LATEST,
+            lang=search.lang,
+            max_tweets=self.probe_size,
+            batch_size=search.batch_size,
+        )
+        created_ats = [utc_datetime(tweet.created_at) for tweet in probe.request()]
+        if len(created_ats) < self.probe_size:
+            return float(len(created_ats))
+
+        covered = (until - max(min(created_ats), since)).total_seconds()
+        return len(created_ats) * (until - since).total_seconds() / max(covered, 1.0)
+
+
+class HistoricalVolumeEstimator(VolumeEstimator):
+    """Estimates volumes from the number of Tweets per hour found in the past.
+
+    Volumes within an hour are assumed to be evenly distributed. Hours without a count
+    are assumed to have no Tweets.
+
+    :param hourly_counts: Maps (naive UTC) datetimes of full hours to the number of
+        Tweets written during that hour.
+    """
+
+    def __init__(self, hourly_counts: Mapping[datetime, int]):
+        self.hourly_counts: Final = hourly_counts
+
+    @classmethod
+    def from_batch_results(
+        cls, results: BatchResults, query: Optional[str] = None
+    ) -> "HistoricalVolumeEstimator":
+        """Counts the Tweets of executed Search requests, e.g., from a previous crawl.
+
+        :param query: If given, only counts Tweets of Search requests with this query.
+        """
+        hourly_counts: Dict[datetime, int] = {}
+        for entry in results:
+            if not isinstance(entry.request, Search) or (
+                query is not None and entry.request.query != query
+            ):
+                continue
+            for tweet in results.tweets(entry):
+                hour = utc_datetime(tweet.created_at).replace(
+                    minute=0, second=0, microsecond=0
+                )
+                hourly_counts[hour] = hourly_counts.get(hour, 0) + 1
+        return cls(hourly_counts)
+
+    @overrides
+    def estimate(self, search: Search) -> float:
+        since, until = _window(search)
+        volume = 0.0
+        hour = since.replace(minute=0, second=0, microsecond=0)
+        while hour < until:
+            count = self.hourly_counts.get(hour)
+            if count:
+                overlap = min(hour + _ONE_HOUR, until) - max(hour, since)
+                volume += count * overlap.total_seconds() / _ONE_HOUR.total_seconds()
+            hour += _ONE_HOUR
+        return volume
+
+
+class SearchPlanner:
+    """Splits a Search into time windows that each contain about target_tweets Tweets.
+
+    Planning starts with one window per day (as Search.to_daily_requests()). Windows
+    estimated to contain more than target_tweets Tweets are split into equal parts,
+    which are estimated again and split recursively (down to min_window), so that busy
+    periods are searched via many small requests (via the since_time: and until_time:
+    operators). Afterwards, consecutive windows are merged while their combined
+    estimate stays below target_tweets, so that quiet periods do not cost a request
+    (and session) per day. The resulting requests are similarly sized units of work
+    that parallelize well across the workers of a Batch.
+
+    :param estimator: Estimates the number of Tweets in a time window. Defaults to a
+        ProbeVolumeEstimator.
+    """
+
+    def __init__(
+        self,
+        target_tweets: int,
+        *,
+        estimator: Optional[VolumeEstimator] = None,
+        min_window: timedelta = _ONE_HOUR,
+    ):
+        if target_tweets <= 0:
+            raise ValueError("target_tweets must be positive.")
+        if min_window < timedelta(seconds=1):
+            raise ValueError("min_window must be at least one second.")
+        self.target_tweets: Final = target_tweets
+        self.estimator: Final = estimator or ProbeVolumeEstimator()
+        self.min_window: Final = min_window
+
+    def plan(self, search: Search) -> Sequence[Search]:
+        since, until = _window(search)
+
+        windows: List[Tuple[datetime, datetime, float]] = []
+        day_start = since
+        while day_start < until:
+            day_end = min(datetime.combine(day_start.date(), time()) + _ONE_DAY, until)
+            self._split(search, day_start, day_end, windows)
+            day_start = day_end
+
+        requests = [
+            self._search(search, window_since, window_until)
+            for window_since, window_until in self._merge(windows)
+        ]
+        logger.info(
+            "Planned {:d} requests of about {:d} Tweets each for '{}' ({:.0f} Tweets "
+            "estimated in total).".format(
+                len(requests),
+                self.target_tweets,
+                search.query,
+                sum(estimate for _, _, estimate in windows),
+            )
+        )
+        return requests
+
+    def _split(
+        self,
+        search: Search,
+        since: datetime,
+        until: datetime,
+        windows: List[Tuple[datetime, datetime, float]],
+    ) -> None:
+        estimate = self.estimator.estimate(self._search(search, since, until))
+        logger.debug(
+            "  Estimated {:.0f} Tweets from {} until {}.".format(estimate, since, until)
+        )
+
+        # Split into parts whose length is a multiple of min_window (so that, e.g.,
+        # hourly parts start at full hours) and of whole seconds (the granularity of
+        # since_time:).
+        length = until - since
+        num_parts = ceil(estimate / self.target_tweets)
+        part_length = length
+        if num_parts > 1:
+            part_length = max((length / num_parts) // self.min_window, 1) * (
+                self.min_window
+            )
+            part_length = timedelta(seconds=int(part_length.total_seconds()))
+        if part_length >= length:
+            windows.append((since, until, estimate))
+            return
+
+        part_since = since
+        while part_since < until:
+            part_until = min(part_since + part_length, until)
+            self._split(search, part_since, part_until, windows)
+            part_since = part_until
+
+    def _merge(
+        self, windows: Sequence[Tuple[datetime, datetime, float]]
+    ) -> Sequence[Tuple[datetime, datetime]]:
+        merged: List[Tuple[datetime, datetime, float]] = []
+        for since, until, estimate in windows:
+            if merged and merged[-1][2] + estimate <= self.target_tweets:
+                merged[-1] = (merged[-1][0], until, merged[-1][2] + estimate)
+            else:
+                merged.append((since, until, estimate))
+        return [(since, until) for since, until, _ in merged]
+
+    @classmethod
+    def _search(cls, search: Search, since: datetime, until: datetime) -> Search:
+        return Search(
+            search.query,
+            since=cls._date_if_midnight(since),
+            until=cls._date_if_midnight(until),
+            filter_=search.filter,
+            lang=search.lang,
+            max_tweets=search.max_tweets,
+            batch_size=search.batch_size,
+        )
+
+    @staticmethod
+    def _date_if_midnight(value: datetime) -> date:
+        # Keeps requests with whole days readable (and in the format of daily ones).
+        return value.date() if value.time() == time() else value
@@ -15,7 +15,7 @@
 #
 
 from abc import ABC, abstractmethod
-from typing import Iterable, Iterator
+from typing import AsyncIterator, Iterable, Iterator
 
 from .tweet import Tweet
 
@@ -27,3 +27,47 @@ class TweetStream(ABC, Iterator[Tweet], Iterable[Tweet]):
     @abstractmethod
     def __next__(self) -> Tweet:
         raise NotImplementedError()
+
+    def close(self) -> None:
+        """Release all resources held by the stream, e.g., background threads.
+
+        Only needs to be called when stopping iteration early.
+        """
+
+    def state(self) -> str:
+        """Position of the stream as a compact JSON token that can be persisted.
+
+        The token can be passed to resume() of a new stream of the same request, even in
+        another process, which then continues right after the last returned Tweet.
+        Batches whose Tweets were all consumed are not fetched again.
+        """
+        raise NotImplementedError(
+            "{} does not support saving its state.".format(type(self).__name__)
+        )
+
+    def resume(self, state: str) -> None:
+        """Continues the stream at a position previously obtained from state().
+
+        Needs to be called before iterating the stream.
+
+        :raises ValueError: If the state is malformed or belongs to another request.
+        """
+        raise NotImplementedError(
+            "{} does not support resuming from a state.".format(type(self).__name__)
+        )
+
+
+class AsyncTweetStream(ABC, AsyncIterator[Tweet]):
+    def __aiter__(self) -> AsyncIterator[Tweet]:
+        return self
+
+    @abstractmethod
+    async def __anext__(self) -> Tweet:
+        raise NotImplementedError()
+
+    async def aclose(self) -> None:
+        """Release all resources held by the stream, e.g., open network connections.
+
+        Called automatically once the stream is exhausted. Only needs to be called
+        manually when stopping iteration early.
+        """
@@ -18,6 +18,7 @@ from pathlib import Path
 from typing import Optional
 
 from nasty._settings import TwitterApiSettings
+from nasty._util.codec import Codec
 from nasty.request.request import Request
 from nasty.tweet.tweet import Tweet
 from nasty.tweet.tweet_stream import TweetStream
@@ -61,8 +62,10 @@ class MockBatchContext:
                 self.load_args = (file,)
 
             @staticmethod
-            def execute(results_dir: Optional[Path]) -> None:
-                self.execute_args = (results_dir,)
+            def execute(
+                results_dir: Optional[Path], codec: Optional[Codec] = None
+            ) -> None:
+                self.execute_args = (results_dir, codec)
 
         self.MockBatch = MockBatch
 
@@ -14,7 +14,10 @@
 # limitations under the License.
 #
 
+import sys
+from io import StringIO
 from pathlib import Path
+from typing import Sequence
 
 import pytest
 from _pytest.capture import CaptureFixture
@@ -22,6 +25,14 @@ from _pytest.monkeypatch import MonkeyPatch
 
 import nasty._cli
 from nasty import main
+from nasty._util.codec import GzipCodec
+from nasty._util.json_ import dumps
+from nasty.batch.batch import Batch
+from nasty.batch.batch_results import BatchResults
+from nasty.batch.results_layout import ResultsLayout
+from nasty.request.replies import Replies
+from nasty.request.request import Request
+from nasty.request.search import Search
 
 from .mock_context import MockBatchContext
 
@@ -43,10 +54,37 @@ def test_correct_call(
     main("batch", "--batch-file", str(batch_file), "--results-dir", str(results_dir))
 
     assert mock_context.load_args == (batch_file,)
-    assert mock_context.execute_args == (results_dir,)
+    assert mock_context.execute_args == (results_dir, None)
     assert capsys.readouterr().out == ""
 
 
+def test_codec(monkeypatch: MonkeyPatch, tmp_path: Path) -> None:
+    mock_context = MockBatchContext()
+    monkeypatch.setattr(
+        nasty._cli,
+        nasty._cli.Batch.__name__,  # type: ignore
+        mock_context.MockBatch,
+    )
+
+    batch_file = tmp_path / "batch.jsonl"
+    results_dir = tmp_path / "out"
+    main(
+        "batch",
+        "--batch-file",
+        str(batch_file),
+        "--results-dir",
+        str(results_dir),
+        "--codec",
+        "gzip:9",
+    )
+
+    assert mock_context.execute_args is not None
+    assert mock_context.execute_args[0] == results_dir
+    codec = mock_context.execute_args[1]
+    assert isinstance(codec, GzipCodec)
+    assert codec.to_json() == GzipCodec(level=9).to_json()
+
+
 def test_no_batch_file(tmp_path: Path) -> None:
     batch_file = tmp_path / "batch.jsonl"
     results_dir = tmp_path / "out"
@@ -59,3 +97,45 @@ def test_no_batch_file(tmp_path: Path) -> None:
             "--results-dir",
             str(results_dir),
         )
+
+
+def _requests_jsonl(requests: Sequence[Request]) -> str:
+    return "".join(dumps(request.to_json()) + "\n" for request in requests)
+
+
+def test_submit_stdin(monkeypatch: MonkeyPatch, tmp_path: Path) -> None:
+    batch_file = tmp_path / "batch.jsonl"
+    requests = [Search("trump"), Replies("332308211321425920", max_tweets=None)]
+
+    monkeypatch.setattr(sys, "stdin", StringIO(_requests_jsonl(requests)))
+    main("submit", "--batch-file", str(batch_file))
+    monkeypatch.setattr(sys, "stdin", StringIO(_requests_jsonl(requests[:1])))
+    main("submit", "--batch-file", str(batch_file))
+
+    batch = Batch()
+    batch.load(batch_file)
+    assert requests + requests[:1] == [entry.request for entry in batch]
+    assert 3 == len({entry.id for entry in batch})
+
+
+def test_submit_requests_file(tmp_path: Path) -> None:
+    batch_file = tmp_path / "batch.jsonl"
+    requests_file = tmp_path / "requests.jsonl"
+    requests = [Search(str(i), lang="de") for i in range(100)]
+    requests_file.write_text(_requests_jsonl(requests), encoding="UTF-8")
+
+    main("submit", "-b", str(batch_file), "-f", str(requests_file))
+
+    batch = Batch()
+    batch.load(batch_file)
+    assert requests == [entry.request for entry in batch]
+
+
+def test_migrate(tmp_path: Path) -> None:
+    results_dir = tmp_path / "out"
+    results_dir.mkdir()
+
+    main("migrate", "--results-dir", str(results_dir))
+    assert ResultsLayout.SHARDED == BatchResults(results_dir).layout
+    main("migrate", "-r", str(results_dir), "-l", "flat")
+    assert ResultsLayout.FLAT == BatchResults(results_dir).layout
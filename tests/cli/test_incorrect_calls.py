@@ -39,6 +39,13 @@ logger = getLogger(__name__)
         "search --query trump --to-batch file --daily",
         "search --query trump --since 2019-03-21 --to-batch file --daily",
         "search --query trump --until 2019-03-21 --to-batch file --daily",
+        "search --query trump --adaptive 100",
+        "search --query trump --since 2019-03-21 --until 2019-03-22 --adaptive 100",
+        "search --query trump --since 2019-03-21 --to-batch file --adaptive 100",
+        "search --query trump --since 2019-03-21 --until 2019-03-22 --to-batch file "
+        + "--adaptive 0",
+        "search --query trump --since 2019-03-21 --until 2019-03-22 --to-batch file "
+        + "--daily --adaptive 100",
         "replies 332308211321425920",
         "replies --tweet-id 332308211321425920 --max-tweets five",
         "replies --tweet-id 332308211321425920 --batch-size 3.0",
@@ -53,6 +60,10 @@ logger = getLogger(__name__)
         "batch --batch-file batch.jsonl --results-dir",
         "batch --results-dir",
         "batch --batch-file --results-dir out/",
+        "batch --batch-file batch.jsonl --results-dir out/ --codec",
+        "batch --batch-file batch.jsonl --results-dir out/ --codec rar",
+        "batch --batch-file batch.jsonl --results-dir out/ --codec xz:best",
+        "batch --batch-file batch.jsonl --results-dir out/ --codec gzip:9:dict",
         "idify --in-dir",
         "idify --out-dir",
         "idify --out-dir out/",
@@ -20,8 +20,10 @@ import pytest
 from _pytest.config import Config
 from _pytest.fixtures import FixtureRequest
 from _pytest.monkeypatch import MonkeyPatch
+from _pytest.tmpdir import TempPathFactory
 from nasty_utils import LoggingSettings
 
+from nasty._retriever.session_pool import GUEST_SESSION_POOL
 from nasty._settings import NastySettings
 
 from .util.requests_cache import RequestsCache
@@ -67,3 +69,17 @@ def activate_requests_cache(
 @pytest.fixture(autouse=True)
 def disrespect_robotstxt(monkeypatch: MonkeyPatch) -> None:
     monkeypatch.setenv("NASTY_DISRESPECT_ROBOTSTXT", "1")
+
+
+@pytest.fixture(autouse=True)
+def isolate_disk_cache(
+    monkeypatch: MonkeyPatch, tmp_path_factory: TempPathFactory
+) -> None:
+    monkeypatch.setenv("NASTY_CACHE_DIR", str(tmp_path_factory.mktemp("nasty-cache")))
+
+
+@pytest.fixture(autouse=True)
+def clear_guest_session_pool() -> Iterator[None]:
+    GUEST_SESSION_POOL.clear()
+    yield
+    GUEST_SESSION_POOL.clear()
@@ -0,0 +1,113 @@
+#
+# Copyright 2019-2020 Lukas Schmelzeisen
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import asyncio
+from typing import Awaitable, Iterator, List, Sequence, TypeVar
+
+import pytest
+from _pytest.monkeypatch import MonkeyPatch
+
+from nasty._mock_server import MockTwitterConfig, MockTwitterServer
+from nasty._retriever.async_retriever import AsyncSearchRetriever
+from nasty.request.replies import Replies
+from nasty.request.search import Search, SearchFilter
+from nasty.request.thread import Thread
+from nasty.tweet.tweet import Tweet, TweetId
+from nasty.tweet.tweet_stream import AsyncTweetStream
+
+_T = TypeVar("_T")
+
+
+@pytest.fixture
+def mock_server(monkeypatch: MonkeyPatch) -> Iterator[MockTwitterServer]:
+    with MockTwitterServer(MockTwitterConfig(crawl_delay=0.001)) as server:
+        monkeypatch.setenv("NASTY_MOCK_SERVER", server.url)
+        monkeypatch.delenv("NASTY_DISRESPECT_ROBOTSTXT")
+        yield server
+
+
+def _run(awaitable: Awaitable[_T]) -> _T:
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(awaitable)
+    finally:
+        loop.close()
+
+
+async def _collect(tweet_stream: AsyncTweetStream) -> List[Tweet]:
+    return [tweet async for tweet in tweet_stream]
+
+
+@pytest.mark.requests_cache_disabled
+@pytest.mark.parametrize("max_tweets", [1, 10, 100], ids=repr)
+def test_max_tweets(max_tweets: int, mock_server: MockTwitterServer) -> None:
+    tweets = _run(
+        _collect(
+            Search(
+                "trump", filter_=SearchFilter.LATEST, max_tweets=max_tweets
+            ).request_async()
+        )
+    )
+    assert max_tweets == len(tweets)
+    assert len(tweets) == len({tweet.id for tweet in tweets})
+
+
+@pytest.mark.requests_cache_disabled
+@pytest.mark.parametrize("tweet_id", [TweetId("1115689254271819777")], ids=repr)
+def test_exact_thread(tweet_id: TweetId, mock_server: MockTwitterServer) -> None:
+    tweets = _run(_collect(Thread(tweet_id).request_async()))
+    assert tweets
+    assert list(Thread(tweet_id).request()) == tweets
+
+
+@pytest.mark.requests_cache_disabled
+@pytest.mark.parametrize("tweet_id", [TweetId("1115689254271819777")], ids=repr)
+def test_exact_replies(tweet_id: TweetId, mock_server: MockTwitterServer) -> None:
+    tweets = _run(_collect(Replies(tweet_id, max_tweets=None).request_async()))
+    assert 200 == len(tweets)
+    assert {tweet.id for tweet in Replies(tweet_id, max_tweets=None).request()} == {
+        tweet.id for tweet in tweets
+    }
+
+
+@pytest.mark.requests_cache_disabled
+@pytest.mark.parametrize("words", [("trump", "hillary", "obama")], ids=repr)
+def test_concurrent(words: Sequence[str], mock_server: MockTwitterServer) -> None:
+    async def collect_all() -> Sequence[List[Tweet]]:
+        return await asyncio.gather(
+            *(
+                _collect(
+                    Search(
+                        word, filter_=SearchFilter.LATEST, max_tweets=50
+                    ).request_async()
+                )
+                for word in words
+            )
+        )
+
+    for word, tweets in zip(words, _run(collect_all())):
+        assert 50 == len(tweets)
+        assert (
+            list(Search(word, filter_=SearchFilter.LATEST, max_tweets=50).request())
+            == tweets
+        )
+
+
+def test_no_sync_transport(monkeypatch: MonkeyPatch) -> None:
+    monkeypatch.setenv("NASTY_PREFETCH_BATCHES", "2")
+    retriever = AsyncSearchRetriever(Search("q"))
+    assert retriever._prefetcher is None
+    assert not hasattr(retriever, "_session")
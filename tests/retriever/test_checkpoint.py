@@ -0,0 +1,147 @@
+#
+# Copyright 2019-2020 Lukas Schmelzeisen
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import json
+from http import HTTPStatus
+from itertools import islice
+from typing import Iterator, Optional
+
+import pytest
+from _pytest.monkeypatch import MonkeyPatch
+
+from nasty._mock_server import MockTwitterConfig, MockTwitterServer
+from nasty._retriever.retriever import RetrieverCheckpoint, RetrieverTweetStream
+from nasty._util.typing_ import checked_cast
+from nasty.request.search import Search
+
+
+@pytest.fixture
+def mock_server(monkeypatch: MonkeyPatch) -> Iterator[MockTwitterServer]:
+    with MockTwitterServer(MockTwitterConfig(num_tweets=50)) as server:
+        monkeypatch.setenv("NASTY_MOCK_SERVER", server.url)
+        yield server
+
+
+@pytest.mark.requests_cache_disabled
+@pytest.mark.parametrize("prefetch_batches", ["0", "2"], ids=repr)
+@pytest.mark.parametrize("max_tweets", [None, 45], ids=repr)
+@pytest.mark.parametrize("num_consumed", [0, 7, 20, 33, 45], ids=repr)
+def test_restore(
+    prefetch_batches: str,
+    max_tweets: Optional[int],
+    num_consumed: int,
+    mock_server: MockTwitterServer,
+    monkeypatch: MonkeyPatch,
+) -> None:
+    monkeypatch.setenv("NASTY_PREFETCH_BATCHES", prefetch_batches)
+    search = Search("q", max_tweets=max_tweets, batch_size=20)
+    tweets = list(search.request())
+
+    tweet_stream = checked_cast(RetrieverTweetStream, search.request())
+    consumed = list(islice(tweet_stream, num_consumed))
+    checkpoint = tweet_stream.checkpoint()
+    tweet_stream.close()
+    assert num_consumed == checkpoint.num_retrieved
+    assert checkpoint == RetrieverCheckpoint.from_json(checkpoint.to_json())
+
+    tweet_stream = checked_cast(RetrieverTweetStream, search.request())
+    tweet_stream.restore(checkpoint)
+    assert checkpoint == tweet_stream.checkpoint()
+    assert tweets == consumed + list(tweet_stream)
+
+
+@pytest.mark.requests_cache_disabled
+def test_restore_after_iteration(mock_server: MockTwitterServer) -> None:
+    tweet_stream = checked_cast(RetrieverTweetStream, Search("q").request())
+    checkpoint = tweet_stream.checkpoint()
+    next(tweet_stream)
+    with pytest.raises(RuntimeError):
+        tweet_stream.restore(checkpoint)
+    tweet_stream.close()
+
+
+def test_illegal_checkpoint() -> None:
+    with pytest.raises(ValueError):
+        RetrieverCheckpoint(cursor=None, num_skipped=3, num_retrieved=2)
+    with pytest.raises(ValueError):
+        RetrieverCheckpoint(cursor=None, num_skipped=-1, num_retrieved=2)
+
+
+def _num_search_requests(mock_server: MockTwitterServer) -> int:
+    return mock_server.status_counts[("search", HTTPStatus.OK.value)]
+
+
+@pytest.mark.requests_cache_disabled
+@pytest.mark.parametrize(
+    "num_consumed,num_consumed_batches",
+    [(0, 0), (7, 0), (20, 1), (33, 1), (50, 3)],
+    ids=repr,
+)
+def test_state_resume(
+    num_consumed: int, num_consumed_batches: int, mock_server: MockTwitterServer
+) -> None:
+    search = Search("q", max_tweets=None, batch_size=20)
+    num_requests = _num_search_requests(mock_server)
+    tweets = list(search.request())
+    num_requests = _num_search_requests(mock_server) - num_requests
+
+    tweet_stream = search.request()
+    consumed = list(islice(tweet_stream, num_consumed))
+    state = tweet_stream.state()
+    tweet_stream.close()
+    assert isinstance(json.loads(state), dict)
+
+    # Only batches whose Tweets were all consumed are not fetched again.
+    num_requests -= num_consumed_batches
+    num_requests += _num_search_requests(mock_server)
+    tweet_stream = Search("q", max_tweets=None, batch_size=20).request()
+    tweet_stream.resume(state)
+    assert tweets == consumed + list(tweet_stream)
+    assert num_requests == _num_search_requests(mock_server)
+
+
+@pytest.mark.requests_cache_disabled
+def test_state_resume_exhausted(mock_server: MockTwitterServer) -> None:
+    tweet_stream = Search("q", max_tweets=30, batch_size=20).request()
+    assert 30 == len(list(tweet_stream))
+    state = tweet_stream.state()
+    assert json.loads(state)["finished"]
+
+    tweet_stream = Search("q", max_tweets=30, batch_size=20).request()
+    tweet_stream.resume(state)
+    assert json.loads(state) == json.loads(tweet_stream.state())
+    assert not list(tweet_stream)
+
+
+@pytest.mark.requests_cache_disabled
+@pytest.mark.parametrize(
+    "state",
+    ["", "[]", '{"cursor": null}', '{"cursor": null, "num_skipped": "1"}'],
+    ids=repr,
+)
+def test_resume_malformed(state: str, mock_server: MockTwitterServer) -> None:
+    with pytest.raises(ValueError):
+        Search("q").request().resume(state)
+
+
+@pytest.mark.requests_cache_disabled
+def test_resume_other_request(mock_server: MockTwitterServer) -> None:
+    tweet_stream = Search("q").request()
+    next(tweet_stream)
+    state = tweet_stream.state()
+    tweet_stream.close()
+    with pytest.raises(ValueError):
+        Search("r").request().resume(state)
@@ -0,0 +1,129 @@
+#
+# Copyright 2019-2020 Lukas Schmelzeisen
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import gc
+import threading
+from http import HTTPStatus
+from time import sleep
+
+import pytest
+import responses
+from _pytest.monkeypatch import MonkeyPatch
+
+from nasty._retriever.session_pool import GUEST_SESSION_POOL
+from nasty._util.errors import UnexpectedStatusCodeException
+from nasty.request.search import Search
+
+from ..util.mock_twitter import (
+    ADAPTIVE_JSON_URL,
+    add_batch_response,
+    add_session_responses,
+    count_calls,
+)
+
+
+def _prefetch_threads_finished() -> bool:
+    for _ in range(50):
+        # Dropped streams are part of reference cycles, so only the cyclic garbage
+        # collector frees them.
+        gc.collect()
+        if not any(t.name == "nasty-prefetch" for t in threading.enumerate()):
+            return True
+        sleep(0.1)
+    return False
+
+
+@pytest.fixture(autouse=True)
+def enable_prefetch(monkeypatch: MonkeyPatch) -> None:
+    monkeypatch.setenv("NASTY_PREFETCH_BATCHES", "1")
+
+
+@pytest.mark.requests_cache_disabled
+@responses.activate
+def test_prefetch() -> None:
+    add_session_responses("1")
+    add_batch_response("1", "2")
+    add_batch_response("3", "4")
+    add_batch_response("5")
+    for _ in range(3):
+        add_batch_response()
+
+    tweet_stream = Search("q", max_tweets=None).request()
+    assert [t.id for t in tweet_stream] == ["1", "2", "3", "4", "5"]
+    assert _prefetch_threads_finished()
+    assert GUEST_SESSION_POOL.lease() is not None
+
+
+@pytest.mark.requests_cache_disabled
+@responses.activate
+def test_prefetch_max_tweets() -> None:
+    add_session_responses("1")
+    for i in range(10):
+        add_batch_response(str(2 * i), str(2 * i + 1))
+
+    tweet_stream = Search("q", max_tweets=3).request()
+    assert [t.id for t in tweet_stream] == ["0", "1", "2"]
+    assert _prefetch_threads_finished()
+    assert count_calls("https://api.twitter.com") == 2
+
+
+@pytest.mark.requests_cache_disabled
+@responses.activate
+def test_prefetch_exception() -> None:
+    add_session_responses("1")
+    add_batch_response("1")
+    responses.add(responses.GET, ADAPTIVE_JSON_URL, status=HTTPStatus.NOT_FOUND.value)
+
+    tweet_stream = Search("q", max_tweets=None).request()
+    assert next(tweet_stream).id == "1"
+    with pytest.raises(UnexpectedStatusCodeException):
+        next(tweet_stream)
+    with pytest.raises(StopIteration):
+        next(tweet_stream)
+
+
+@pytest.mark.requests_cache_disabled
+@responses.activate
+def test_prefetch_close() -> None:
+    add_session_responses("1")
+    for i in range(10):
+        add_batch_response(str(i))
+
+    tweet_stream = Search("q", max_tweets=None).request()
+    assert next(tweet_stream).id == "0"
+    sleep(0.5)
+    tweet_stream.close()
+    with pytest.raises(StopIteration):
+        next(tweet_stream)
+    assert _prefetch_threads_finished()
+
+    # One batch being consumed, one waiting in the queue, and one waiting to be put
+    # into the queue.
+    assert count_calls("https://api.twitter.com") == 3
+    assert GUEST_SESSION_POOL.lease() is not None
+
+
+@pytest.mark.requests_cache_disabled
+@responses.activate
+def test_prefetch_dropped() -> None:
+    add_session_responses("1")
+    for i in range(10):
+        add_batch_response(str(i))
+
+    tweet_stream = Search("q", max_tweets=None).request()
+    assert next(tweet_stream).id == "0"
+    del tweet_stream
+    assert _prefetch_threads_finished()
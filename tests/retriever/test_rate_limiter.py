@@ -0,0 +1,118 @@
+#
+# Copyright 2019-2020 Lukas Schmelzeisen
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from typing import List
+
+import pytest
+from _pytest.monkeypatch import MonkeyPatch
+
+from nasty._retriever.rate_limiter import (
+    RateLimit,
+    RateLimiter,
+    request_rate_limits,
+    set_host_rate_share,
+)
+
+
+class _Clock:
+    def __init__(self) -> None:
+        self.now = 100.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_rate() -> None:
+    clock = _Clock()
+    rate_limiter = RateLimiter(clock)
+    limits = [("host", RateLimit(2.0))]
+
+    assert [rate_limiter.reserve(limits) for _ in range(4)] == [0.0, 0.5, 1.0, 1.5]
+
+    clock.now += 10.0
+    assert rate_limiter.reserve(limits) == 0.0
+
+
+def test_burst() -> None:
+    clock = _Clock()
+    rate_limiter = RateLimiter(clock)
+    limits = [("host", RateLimit(1.0, burst=3))]
+
+    assert [rate_limiter.reserve(limits) for _ in range(5)] == [0.0, 0.0, 0.0, 1.0, 2.0]
+
+    # After idling, the burst budget is available again, but not more than that.
+    clock.now += 100.0
+    assert [rate_limiter.reserve(limits) for _ in range(4)] == [0.0, 0.0, 0.0, 1.0]
+
+
+def test_multiple_limits() -> None:
+    clock = _Clock()
+    rate_limiter = RateLimiter(clock)
+    host = ("host", RateLimit(2.0))
+    delays: List[float] = []
+    for guest_token in ["1", "2", "1", "2"]:
+        delays.append(rate_limiter.reserve([host, (guest_token, RateLimit(0.5))]))
+
+    # Host limit spaces all requests 0.5s apart, the guest token limit additionally
+    # spaces requests with the same token 2s apart.
+    assert delays == [0.0, 0.5, 2.0, 2.5]
+
+
+def test_invalid() -> None:
+    with pytest.raises(ValueError):
+        RateLimit(0.0)
+    with pytest.raises(ValueError):
+        RateLimit(1.0, burst=0)
+
+
+def test_request_rate_limits(monkeypatch: MonkeyPatch) -> None:
+    url = "https://api.twitter.com/2/search/adaptive.json"
+    assert request_rate_limits(url, crawl_delay=None, guest_token="1") == []
+    assert request_rate_limits(url, crawl_delay=0.5, guest_token="1") == [
+        (("host", "api.twitter.com"), RateLimit(2.0))
+    ]
+
+    monkeypatch.setenv("NASTY_RATE_LIMIT", "10")
+    monkeypatch.setenv("NASTY_RATE_LIMIT_BURST", "5")
+    monkeypatch.setenv("NASTY_GUEST_TOKEN_RATE_LIMIT", "0.2")
+    assert request_rate_limits(url, crawl_delay=0.5, guest_token="1") == [
+        (("host", "api.twitter.com"), RateLimit(10.0, burst=5)),
+        (("guest_token", "1"), RateLimit(0.2)),
+    ]
+    assert request_rate_limits(url, crawl_delay=None, guest_token=None) == [
+        (("host", "api.twitter.com"), RateLimit(10.0, burst=5)),
+    ]
+
+
+def test_request_rate_limits_share(monkeypatch: MonkeyPatch) -> None:
+    url = "https://api.twitter.com/2/search/adaptive.json"
+    monkeypatch.setenv("NASTY_RATE_LIMIT_BURST", "5")
+    monkeypatch.setenv("NASTY_GUEST_TOKEN_RATE_LIMIT", "0.2")
+    try:
+        set_host_rate_share(0.25)
+        assert request_rate_limits(url, crawl_delay=0.5, guest_token="1") == [
+            (("host", "api.twitter.com"), RateLimit(0.5)),
+            (("guest_token", "1"), RateLimit(0.2)),
+        ]
+        monkeypatch.setenv("NASTY_RATE_LIMIT", "10")
+        assert request_rate_limits(url, crawl_delay=0.5, guest_token=None) == [
+            (("host", "api.twitter.com"), RateLimit(2.5)),
+        ]
+    finally:
+        set_host_rate_share(1.0)
+
+    with pytest.raises(ValueError):
+        set_host_rate_share(0.0)
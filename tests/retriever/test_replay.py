@@ -0,0 +1,103 @@
+#
+# Copyright 2019-2020 Lukas Schmelzeisen
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import asyncio
+from pathlib import Path
+from typing import List
+
+import pytest
+import responses
+from _pytest.monkeypatch import MonkeyPatch
+
+from nasty._retriever import transport
+from nasty._retriever.replay import (
+    NoRecordedResponseException,
+    RecordedResponse,
+    ReplayStore,
+)
+from nasty._retriever.session_pool import GUEST_SESSION_POOL
+from nasty.request.search import Search
+
+from ..util.mock_twitter import add_batch_response, add_session_responses
+
+
+def _set_transport_mode(monkeypatch: MonkeyPatch, mode: str) -> None:
+    monkeypatch.setenv("NASTY_TRANSPORT", mode)
+    monkeypatch.setattr(transport, "_shared_http_adapter", None)
+
+
+@pytest.mark.requests_cache_disabled
+@responses.activate
+def test_record_replay(monkeypatch: MonkeyPatch, tmp_path: Path) -> None:
+    monkeypatch.setenv("NASTY_TRANSPORT_DIR", str(tmp_path))
+
+    _set_transport_mode(monkeypatch, "record")
+    add_session_responses("1")
+    add_batch_response("1", "2", cursor="a")
+    add_batch_response("3", cursor="b")
+    add_batch_response(cursor="b")
+    recorded = [t.to_json() for t in Search("q", max_tweets=None).request()]
+    assert [t["id_str"] for t in recorded] == ["1", "2", "3"]
+    assert any(tmp_path.glob("*.idx"))
+
+    # Without registered responses, anything not coming from the recording would fail.
+    responses.reset()
+    GUEST_SESSION_POOL.clear()
+    _set_transport_mode(monkeypatch, "replay")
+    replayed = [t.to_json() for t in Search("q", max_tweets=None).request()]
+    assert replayed == recorded
+    assert len(responses.calls) == 0
+
+    with pytest.raises(NoRecordedResponseException):
+        list(Search("other", max_tweets=None).request())
+
+    async def request_async() -> List[str]:
+        return [t.id async for t in Search("q", max_tweets=None).request_async()]
+
+    GUEST_SESSION_POOL.clear()
+    assert asyncio.run(request_async()) == ["1", "2", "3"]
+    assert len(responses.calls) == 0
+
+
+def test_replay_order(tmp_path: Path) -> None:
+    store = ReplayStore(tmp_path)
+    for status_code in (429, 200):
+        store.record(
+            "GET",
+            "https://example.org",
+            None,
+            RecordedResponse(
+                status_code=status_code,
+                reason="",
+                headers=[("Content-Encoding", "gzip"), ("X-Test", "1")],
+                content=b"\x00body",
+            ),
+        )
+
+    replay_store = ReplayStore(tmp_path)
+    assert replay_store.replay("GET", "https://example.org", b"body") is None
+    status_codes = []
+    for _ in range(3):
+        response = replay_store.replay("GET", "https://example.org", None)
+        assert response is not None
+        assert response.headers == [("X-Test", "1")]
+        assert response.content == b"\x00body"
+        status_codes.append(response.status_code)
+    assert status_codes == [429, 200, 200]
+    assert [
+        (method, url, response.status_code)
+        for method, url, response in replay_store.recordings()
+    ] == [("GET", "https://example.org", 429), ("GET", "https://example.org", 200)]
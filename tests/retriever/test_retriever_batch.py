@@ -0,0 +1,67 @@
+#
+# Copyright 2019-2020 Lukas Schmelzeisen
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from typing import Any, Dict, Mapping, cast
+
+from nasty._retriever.search_retriever import SearchRetrieverBatch
+
+from ..util.mock_twitter import search_batch_json
+
+
+def _batch_json() -> Dict[str, Any]:
+    json = cast(Dict[str, Any], search_batch_json(["1", "2", "3"]))
+    for tweet_json in json["globalObjects"]["tweets"].values():
+        tweet_json["user_id"] = 1
+        tweet_json["lang"] = "en"
+    return json
+
+
+def test_tweets_lazy() -> None:
+    json = _batch_json()
+    tweets_json = cast(Mapping[str, Mapping[str, object]], json["globalObjects"])[
+        "tweets"
+    ]
+    batch = SearchRetrieverBatch(json)
+
+    assert len(batch.tweets) == 3
+    assert all("user" not in tweet_json for tweet_json in tweets_json.values())
+
+    tweet = batch.tweets[1]
+    assert tweet.id == "2"
+    assert "user" not in tweets_json["1"]
+    assert batch.tweets[1] is tweet
+
+
+def test_tweets_user_merge() -> None:
+    batch = SearchRetrieverBatch(_batch_json())
+
+    # The user object needs to be added as the last key, so that serialized Tweets stay
+    # exactly the same.
+    assert list(batch.tweets[0].to_json().keys()) == [
+        "id_str",
+        "full_text",
+        "lang",
+        "user",
+    ]
+    assert batch.tweets[0].user.id == "1"
+    assert batch.tweets[0].to_json()["user"] is batch.tweets[1].to_json()["user"]
+
+
+def test_tweets_slice() -> None:
+    batch = SearchRetrieverBatch(_batch_json())
+    assert [tweet.id for tweet in batch.tweets[1:]] == ["2", "3"]
+    assert [tweet.id for tweet in batch.tweets] == ["1", "2", "3"]
+    assert [tweet.id for tweet in batch.tweets[:2]] == ["1", "2"]
@@ -0,0 +1,163 @@
+#
+# Copyright 2019-2020 Lukas Schmelzeisen
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from http import HTTPStatus
+from time import time
+from typing import Mapping
+
+import pytest
+import responses
+from _pytest.monkeypatch import MonkeyPatch
+
+from nasty._retriever.session_pool import GUEST_SESSION_POOL, GuestSession
+from nasty.request.search import Search
+
+from ..util.mock_twitter import (
+    ADAPTIVE_JSON_URL,
+    MAIN_JS_URL,
+    SEARCH_STUB_URL,
+    add_batch_response,
+    add_session_responses,
+    count_calls,
+    guest_tokens,
+)
+
+
+@pytest.mark.requests_cache_disabled
+@responses.activate
+def test_session_shared_between_requests() -> None:
+    add_session_responses("1")
+    add_batch_response("10")
+    add_batch_response("20")
+
+    assert [t.id for t in Search("q", max_tweets=1).request()] == ["10"]
+    assert [t.id for t in Search("q", max_tweets=1).request()] == ["20"]
+
+    assert count_calls(SEARCH_STUB_URL) == 1
+    assert count_calls(MAIN_JS_URL) == 1
+    assert guest_tokens() == {"1": 2}
+
+
+@pytest.mark.requests_cache_disabled
+@responses.activate
+def test_bearer_token_cached_across_sessions() -> None:
+    add_session_responses("1")
+    add_batch_response("10")
+
+    GUEST_SESSION_POOL.add_bearer_token(MAIN_JS_URL, "bearer")
+    assert [t.id for t in Search("q", max_tweets=1).request()] == ["10"]
+
+    assert count_calls(SEARCH_STUB_URL) == 1
+    assert count_calls(MAIN_JS_URL) == 0
+
+
+def test_pool_lease_release_discard() -> None:
+    session1 = GuestSession(bearer_token="b", guest_token="1", cookies={})
+    session2 = GuestSession(bearer_token="b", guest_token="2", cookies={})
+
+    assert GUEST_SESSION_POOL.lease() is None
+    GUEST_SESSION_POOL.release(session1)
+    GUEST_SESSION_POOL.release(session2)
+    assert GUEST_SESSION_POOL.lease() is session1
+    GUEST_SESSION_POOL.discard(session1)
+    assert GUEST_SESSION_POOL.lease() is session2
+    assert GUEST_SESSION_POOL.lease() is None
+
+
+def test_pool_persisted_to_disk_cache() -> None:
+    session = GuestSession(bearer_token="b", guest_token="1", cookies={"gt": "1"})
+    GUEST_SESSION_POOL.release(session)
+    GUEST_SESSION_POOL.add_bearer_token(MAIN_JS_URL, "bearer")
+
+    # Simulate a new process, which starts with an empty in-memory pool.
+    GUEST_SESSION_POOL.clear()
+
+    assert GUEST_SESSION_POOL.bearer_token(MAIN_JS_URL) == "bearer"
+    leased = GUEST_SESSION_POOL.lease()
+    assert leased is not None
+    assert leased.to_json() == session.to_json()
+    assert GUEST_SESSION_POOL.lease() is None
+
+
+def test_pool_skips_expired_sessions() -> None:
+    GUEST_SESSION_POOL.release(
+        GuestSession(bearer_token="b", guest_token="1", cookies={}, expires_at=0.0)
+    )
+    assert GUEST_SESSION_POOL.lease() is None
+
+
+def test_pool_disk_cache_disabled(monkeypatch: MonkeyPatch) -> None:
+    monkeypatch.setenv("NASTY_DISABLE_DISK_CACHE", "1")
+    GUEST_SESSION_POOL.release(
+        GuestSession(bearer_token="b", guest_token="1", cookies={})
+    )
+    GUEST_SESSION_POOL.clear()
+    assert GUEST_SESSION_POOL.lease() is None
+
+
+def _rate_limit_headers(remaining: int, reset: float) -> Mapping[str, str]:
+    return {
+        "X-Rate-Limit-Limit": "180",
+        "X-Rate-Limit-Remaining": str(remaining),
+        "X-Rate-Limit-Reset": str(int(reset)),
+    }
+
+
+@pytest.mark.requests_cache_disabled
+@responses.activate
+def test_rotate_before_rate_limit() -> None:
+    add_session_responses("1")
+    add_session_responses("2")
+    add_batch_response("10", headers=_rate_limit_headers(1, time() + 900))
+    add_batch_response("20", headers=_rate_limit_headers(179, time() + 900))
+
+    assert [t.id for t in Search("q", max_tweets=2).request()] == ["10", "20"]
+
+    # The second batch already used a new session and the first one was returned to the
+    # pool, but can not be leased until its rate limit is reset.
+    assert guest_tokens() == {"1": 1, "2": 1}
+    assert count_calls(MAIN_JS_URL) == 1
+    leased = GUEST_SESSION_POOL.lease()
+    assert leased is not None and leased.guest_token == "2"
+    assert GUEST_SESSION_POOL.lease() is None
+
+
+@pytest.mark.requests_cache_disabled
+@responses.activate
+def test_wait_for_rate_limit_reset() -> None:
+    for guest_token in ["1", "2", "3"]:
+        add_session_responses(guest_token)
+        responses.add(
+            responses.GET,
+            ADAPTIVE_JSON_URL,
+            status=HTTPStatus.TOO_MANY_REQUESTS.value,
+            headers=_rate_limit_headers(0, time()),
+        )
+    add_batch_response("10")
+
+    assert [t.id for t in Search("q", max_tweets=1).request()] == ["10"]
+    assert guest_tokens() == {"1": 1, "2": 1, "3": 2}
+
+
+def test_rate_limited() -> None:
+    session = GuestSession(bearer_token="b", guest_token="1", cookies={})
+    assert not session.rate_limited
+    session.update_rate_limit(_rate_limit_headers(100, time() + 900))
+    assert not session.rate_limited
+    session.update_rate_limit(_rate_limit_headers(1, time() + 900))
+    assert session.rate_limited
+    session.update_rate_limit(_rate_limit_headers(1, time() - 1))
+    assert not session.rate_limited
@@ -0,0 +1,91 @@
+#
+# Copyright 2019-2020 Lukas Schmelzeisen
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from typing import Any, Dict, List, cast
+
+from nasty._retriever.search_retriever import SearchRetrieverBatch
+from nasty._retriever.timeline import (
+    ParsedTimeline,
+    TimelineEntry,
+    TimelineParser,
+    ignore_entry,
+)
+
+from ..util.mock_twitter import search_batch_json
+
+
+def _record_entry_id(
+    entry: TimelineEntry, _position: int, result: ParsedTimeline
+) -> None:
+    result.tweet_ids.append(entry["entryId"])
+
+
+def _set_cursor(entry: TimelineEntry, position: int, result: ParsedTimeline) -> None:
+    result.cursor = "{}@{}".format(entry["entryId"], position)
+
+
+def _add_entries(*entry_ids: str) -> Dict[str, Any]:
+    return {"addEntries": {"entries": [{"entryId": id_} for id_ in entry_ids]}}
+
+
+def test_dispatch() -> None:
+    parser = TimelineParser(
+        "Test",
+        {
+            "cursor-": _set_cursor,
+            "cursor-top-": ignore_entry,
+            "tweet-": _record_entry_id,
+        },
+    )
+    timeline = parser.parse(
+        [
+            _add_entries(
+                "tweet-1", "cursor-bottom-0", "cursor-top-1", "unknown-1", "tweet-2"
+            ),
+            {"replaceEntry": {"entry": {"entryId": "cursor-bottom-1"}}},
+            {"clearCache": {}},
+        ]
+    )
+    assert timeline.tweet_ids == ["tweet-1", "tweet-2"]
+    assert timeline.cursor == "cursor-bottom-1@0"
+    assert timeline.num_unknown_entries == 1
+
+
+def test_module_items() -> None:
+    items = TimelineParser("Test", {"tweet-": _record_entry_id})
+    parser = TimelineParser("Test", {"tweet-": ignore_entry}, module_item_parser=items)
+    timeline = parser.parse(
+        [
+            _add_entries("tweet-1"),
+            {"addToModule": {"moduleItems": [{"entryId": "tweet-2"}]}},
+        ]
+    )
+    assert timeline.tweet_ids == ["tweet-2"]
+    assert timeline.num_unknown_entries == 0
+
+
+def test_unknown_entry_in_batch() -> None:
+    json = cast(Dict[str, Any], search_batch_json(["1", "2"]))
+    entries = cast(
+        List[Dict[str, Any]],
+        json["timeline"]["instructions"][0]["addEntries"]["entries"],
+    )
+    entries.insert(1, {"entryId": "sq-X-new-entry-type"})
+
+    batch = SearchRetrieverBatch(json)
+    assert len(batch.tweets) == 2
+    assert batch.num_unknown_entries == 1
+    assert batch.next_cursor is not None
@@ -0,0 +1,58 @@
+#
+# Copyright 2019-2020 Lukas Schmelzeisen
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import pytest
+import responses
+from _pytest.monkeypatch import MonkeyPatch
+
+from nasty._retriever.search_retriever import SearchRetriever
+from nasty._retriever.transport import accept_encoding, pool_size, timeouts
+from nasty.request.search import Search
+
+from ..util.mock_twitter import add_batch_response, add_session_responses
+
+
+@pytest.mark.requests_cache_disabled
+@responses.activate
+def test_compression_negotiated() -> None:
+    add_session_responses("1")
+    add_batch_response("1")
+
+    assert [t.id for t in Search("q", max_tweets=1).request()] == ["1"]
+    for call in responses.calls:
+        assert call.request.headers["Accept-Encoding"] == accept_encoding()
+    assert "gzip" in accept_encoding()
+
+
+def test_connection_pool_shared() -> None:
+    session1 = SearchRetriever(Search("q"))._session
+    session2 = SearchRetriever(Search("q"))._session
+    assert session1.get_adapter("https://api.twitter.com") is session2.get_adapter(
+        "https://api.twitter.com"
+    )
+
+
+def test_config(monkeypatch: MonkeyPatch) -> None:
+    monkeypatch.delenv("NASTY_NUM_WORKERS", raising=False)
+    assert pool_size() == 1
+    monkeypatch.setenv("NASTY_NUM_WORKERS", "8")
+    assert pool_size() == 8
+    monkeypatch.setenv("NASTY_POOL_SIZE", "16")
+    assert pool_size() == 16
+
+    monkeypatch.setenv("NASTY_CONNECT_TIMEOUT", "1.5")
+    monkeypatch.setenv("NASTY_READ_TIMEOUT", "30")
+    assert timeouts() == (1.5, 30.0)
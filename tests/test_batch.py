@@ -18,6 +18,7 @@ import json
 from datetime import date, datetime
 from http import HTTPStatus
 from pathlib import Path
+from threading import Thread as Thread_
 from typing import Sequence
 
 import pytest
@@ -25,9 +26,14 @@ import responses
 from _pytest.logging import LogCaptureFixture
 from _pytest.monkeypatch import MonkeyPatch
 
-from nasty._util.io_ import read_file, read_lines_file, write_file
+from nasty._mock_server import MockTwitterConfig, MockTwitterServer
+from nasty._retriever.retriever import RetrieverCheckpoint, RetrieverTweetStream
+from nasty._util.codec import XZ, XzCodec
+from nasty._util.io_ import read_file, read_lines_file, tmp_file_of, write_file
 from nasty._util.json_ import JsonSerializedException, read_json, write_json
+from nasty._util.metrics import TWEETS
 from nasty._util.typing_ import checked_cast
+from nasty.batch._checkpoint import BatchEntryCheckpoint
 from nasty.batch.batch import Batch
 from nasty.batch.batch_entry import BatchEntry
 from nasty.batch.batch_results import BatchResults
@@ -35,6 +41,7 @@ from nasty.request.replies import Replies
 from nasty.request.request import Request
 from nasty.request.search import Search, SearchFilter
 from nasty.request.thread import Thread
+from nasty.tweet.tweet import Tweet
 
 REQUESTS: Sequence[Request] = [
     Search("q"),
@@ -120,6 +127,68 @@ def test_dump_load_multiple(num_batch_entries: int, tmp_path: Path) -> None:
     assert list(batch) == list(batch2)
 
 
+def test_dump_append(tmp_path: Path) -> None:
+    batch_file = tmp_path / "batch.jsonl"
+
+    batch = Batch()
+    batch.extend(REQUESTS[:3])
+    batch.dump(batch_file, append=True)
+
+    # Simulate an append interrupted mid-line, which the next append removes.
+    with batch_file.open("a", encoding="UTF-8") as fout:
+        fout.write('{"request": {"type": "Sea')
+
+    batch2 = Batch()
+    batch2.extend(REQUESTS[3:])
+    batch2.dump(batch_file, append=True)
+
+    batch3 = Batch()
+    batch3.load(batch_file)
+    assert list(batch) + list(batch2) == list(batch3)
+
+
+def test_dump_append_without_trailing_newline(tmp_path: Path) -> None:
+    batch_file = tmp_path / "batch.jsonl"
+
+    # E.g., a batch file written by hand.
+    batch = Batch()
+    batch.extend(REQUESTS[:3])
+    batch.dump(batch_file)
+    write_file(batch_file, read_file(batch_file).rstrip("\n"), overwrite_existing=True)
+
+    batch2 = Batch()
+    batch2.extend(REQUESTS[3:])
+    batch2.dump(batch_file, append=True)
+
+    batch3 = Batch()
+    batch3.load(batch_file)
+    assert list(batch) + list(batch2) == list(batch3)
+
+
+def test_dump_append_concurrent(tmp_path: Path) -> None:
+    batch_file = tmp_path / "batch.jsonl"
+
+    def append_requests(thread_index: int) -> None:
+        for i in range(20):
+            batch = Batch()
+            batch.extend(
+                Search("{}-{}-{}".format(thread_index, i, j)) for j in range(50)
+            )
+            batch.dump(batch_file, append=True)
+
+    threads = [Thread_(target=append_requests, args=(i,)) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    batch = Batch()
+    batch.load(batch_file)
+    assert 4 * 20 * 50 == len(
+        {checked_cast(Search, entry.request).query for entry in batch}
+    )
+
+
 # -- test_execute_* --------------------------------------------------------------------
 
 
@@ -307,3 +376,132 @@ def test_execute_exception_internal_server_error(tmp_path: Path) -> None:
     assert batch_entry == read_json(tmp_path / batch_entry.meta_file_name, BatchEntry)
     assert batch_entry.exception is not None
     assert batch_entry.exception.type == "UnexpectedStatusCodeException"
+
+
+@pytest.mark.requests_cache_disabled
+@pytest.mark.parametrize("checkpoint_interval", ["0", "60"], ids=repr)
+def test_execute_resuming_from_checkpoint(
+    checkpoint_interval: str,
+    tmp_path: Path,
+    monkeypatch: MonkeyPatch,
+    caplog: LogCaptureFixture,
+) -> None:
+    monkeypatch.setenv("NASTY_CHECKPOINT_INTERVAL", checkpoint_interval)
+    batch = Batch()
+    batch.append(Search("q", max_tweets=None, batch_size=20))
+    batch_entry = batch[0]
+
+    with MockTwitterServer(MockTwitterConfig(num_tweets=90)) as server:
+        monkeypatch.setenv("NASTY_MOCK_SERVER", server.url)
+        tweets = list(batch_entry.request.request())
+
+        # Fail while fetching the third batch.
+        update_tweets = RetrieverTweetStream.update_tweets
+        num_updates = 0
+
+        def failing_update_tweets(
+            self: RetrieverTweetStream,
+            tweets: Sequence[Tweet],
+            *checkpoints: RetrieverCheckpoint,
+        ) -> None:
+            nonlocal num_updates
+            num_updates += 1
+            if num_updates == 3:
+                raise ValueError("Test Error.")
+            update_tweets(self, tweets, *checkpoints)
+
+        monkeypatch.setattr(
+            RetrieverTweetStream, "update_tweets", failing_update_tweets
+        )
+        assert not batch.execute(tmp_path)
+        monkeypatch.setattr(RetrieverTweetStream, "update_tweets", update_tweets)
+
+        checkpoint = read_json(
+            tmp_path / batch_entry.checkpoint_file_name, BatchEntryCheckpoint
+        )
+        assert 40 == checkpoint.retriever_checkpoint.num_retrieved
+        assert not (tmp_path / batch_entry.data_file_name).exists()
+
+        batch_entry.exception = None
+        caplog.clear()
+        assert batch.execute(tmp_path)
+        assert 1 == len(
+            [record for record in caplog.records if "Resuming" in record.msg]
+        )
+
+    assert not (tmp_path / batch_entry.checkpoint_file_name).exists()
+    assert tweets == list(BatchResults(tmp_path).tweets(batch_entry))
+
+
+@pytest.mark.requests_cache_disabled
+def test_execute_ignoring_checkpoint_of_other_codec(
+    tmp_path: Path, monkeypatch: MonkeyPatch, caplog: LogCaptureFixture
+) -> None:
+    batch = Batch()
+    batch.append(Search("q", max_tweets=None, batch_size=20))
+    batch_entry = batch[0]
+
+    # Left behind by an execution with the default codec, which uses the same suffix.
+    frame = XZ.compress(b"Not a Tweet.\n")
+    tmp_file_of(tmp_path / batch_entry.data_file_name).write_bytes(frame)
+    write_json(
+        tmp_path / batch_entry.checkpoint_file_name,
+        BatchEntryCheckpoint(
+            retriever_checkpoint=RetrieverCheckpoint(
+                cursor="scroll:20", num_skipped=0, num_retrieved=20
+            ),
+            data_size=len(frame),
+        ),
+    )
+
+    with MockTwitterServer(MockTwitterConfig(num_tweets=50)) as server:
+        monkeypatch.setenv("NASTY_MOCK_SERVER", server.url)
+        tweets = list(batch_entry.request.request())
+        assert batch.execute(tmp_path, codec=XzCodec(level=1))
+
+    assert 1 == len(
+        [record for record in caplog.records if "Ignoring checkpoint" in record.msg]
+    )
+    assert tweets == list(BatchResults(tmp_path).tweets(batch_entry))
+
+
+@pytest.mark.requests_cache_disabled
+def test_execute_processes(tmp_path: Path, monkeypatch: MonkeyPatch) -> None:
+    monkeypatch.setenv("NASTY_NUM_PROCESSES", "2")
+    monkeypatch.setenv("NASTY_NUM_WORKERS", "2")
+    batch = Batch()
+    for i in range(5):
+        batch.append(Search(str(i), max_tweets=None, batch_size=20))
+    batch.append(Search("5", max_tweets=None, batch_size=20))
+    write_file(tmp_path / batch[-1].data_file_name, "Just some stray data.")
+
+    num_tweets = TWEETS.value("search")
+    with MockTwitterServer(MockTwitterConfig(num_tweets=30)) as server:
+        monkeypatch.setenv("NASTY_MOCK_SERVER", server.url)
+        assert not batch.execute(tmp_path)
+
+    # Entries are updated, and metrics are transferred from the worker processes.
+    assert all(batch_entry.completed_at is not None for batch_entry in batch[:5])
+    assert batch[5].exception is not None
+    assert batch[5] == read_json(tmp_path / batch[5].meta_file_name, BatchEntry)
+    assert num_tweets + 5 * 30 == TWEETS.value("search")
+
+    results = BatchResults(tmp_path)
+    for batch_entry in batch[:5]:
+        assert 30 == len(list(results.tweets(batch_entry)))
+
+
+def test_execute_processes_exception(tmp_path: Path, monkeypatch: MonkeyPatch) -> None:
+    def _execute_entry(*_args: object) -> None:
+        raise OSError("Disk full.")
+
+    # Processes are forked, so they inherit the patched method.
+    monkeypatch.setattr(Batch, "_execute_entry", _execute_entry)
+    monkeypatch.setenv("NASTY_NUM_PROCESSES", "2")
+    monkeypatch.setenv("NASTY_NUM_WORKERS", "2")
+    batch = Batch()
+    for i in range(5):
+        batch.append(Search(str(i)))
+
+    with pytest.raises(OSError, match="Disk full."):
+        batch.execute(tmp_path)
@@ -0,0 +1,38 @@
+#
+# Copyright 2019-2020 Lukas Schmelzeisen
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from pathlib import Path
+
+import nasty._util.tweepy_
+from benchmarks.__main__ import main
+from nasty._util.json_ import loads
+
+
+def test_benchmarks(tmp_path: Path) -> None:
+    results_file = tmp_path / "results.json"
+    args = ["--scale", "0.01", "--repeat", "1", "--output", str(results_file)]
+    tweepy_api = nasty._util.tweepy_.TWEEPY_API
+    assert main(args) == 0
+    # Global state patched by benchmarks is restored.
+    assert tweepy_api is nasty._util.tweepy_.TWEEPY_API
+
+    results = loads(results_file.read_bytes())
+    assert isinstance(results, dict)
+    names = {result["name"] for result in results["results"]}
+    assert {"parse.search", "io.read_json_lines.lzma", "batch_results.init"} <= names
+
+    # Comparing against itself must not report any regressions.
+    assert main(args + ["--compare", str(results_file), "--max-slowdown", "100"]) == 0
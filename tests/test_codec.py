@@ -0,0 +1,154 @@
+#
+# Copyright 2019-2020 Lukas Schmelzeisen
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from pathlib import Path
+from typing import Optional
+
+import pytest
+from _pytest.monkeypatch import MonkeyPatch
+
+from nasty._mock_server import MockTwitterConfig, MockTwitterServer
+from nasty._util.codec import (
+    DICTIONARIES_DIR_NAME,
+    XZ,
+    Codec,
+    GzipCodec,
+    NoneCodec,
+    XzCodec,
+    ZstdCodec,
+)
+from nasty._util.json_ import read_json
+from nasty.batch.batch import Batch
+from nasty.batch.batch_entry import BatchEntry
+from nasty.batch.batch_results import BatchResults
+from nasty.request.search import Search
+
+CODECS = [
+    XzCodec(),
+    XzCodec(level=1),
+    ZstdCodec(),
+    ZstdCodec(level=19),
+    ZstdCodec(dictionary=b"tweet" * 100),
+    GzipCodec(level=9),
+    NoneCodec(),
+]
+
+
+@pytest.mark.parametrize("codec", CODECS, ids=repr)
+def test_concatenated_frames(codec: Codec, tmp_path: Path) -> None:
+    file = tmp_path / ("data" + codec.suffix)
+    file.write_bytes(
+        codec.compress(b"a\nb\n") + codec.compress(b"") + codec.compress(b"c\n")
+    )
+    with codec.open_read(file) as fin:
+        assert [b"a\n", b"b\n", b"c\n"] == list(fin)
+
+
+@pytest.mark.parametrize("codec", CODECS, ids=repr)
+def test_json_conversion(codec: Codec) -> None:
+    assert codec == Codec.from_json(codec.to_json())
+
+
+@pytest.mark.parametrize(
+    "spec,codec",
+    [
+        ("xz", XZ),
+        ("xz:9", XzCodec(level=9)),
+        ("zstd", ZstdCodec()),
+        ("zstd:3", ZstdCodec(level=3)),
+        ("gzip:1", GzipCodec(level=1)),
+        ("none", NoneCodec()),
+    ],
+)
+def test_parse(spec: str, codec: Codec) -> None:
+    assert codec == Codec.parse(spec)
+
+
+def test_parse_dictionary(tmp_path: Path) -> None:
+    dictionary_file = tmp_path / "tweets.zstd-dict"
+    dictionary_file.write_bytes(b"tweet" * 100)
+    assert ZstdCodec(level=19, dictionary=b"tweet" * 100) == Codec.parse(
+        "zstd:19:" + str(dictionary_file)
+    )
+
+
+@pytest.mark.parametrize("spec", ["lz4", "none:1", "xz:1:file", "gzip:fast"])
+def test_parse_illegal(spec: str) -> None:
+    with pytest.raises(ValueError):
+        Codec.parse(spec)
+
+
+def _execute(batch: Batch, results_dir: Path, codec: Optional[Codec]) -> BatchResults:
+    results = batch.execute(results_dir, codec)
+    assert results is not None
+    return results
+
+
+@pytest.mark.requests_cache_disabled
+def test_execute_codecs(tmp_path: Path, monkeypatch: MonkeyPatch) -> None:
+    batch = Batch()
+    for i in range(3):
+        batch.append(Search(str(i), max_tweets=None, batch_size=10))
+
+    config = MockTwitterConfig(num_tweets=25)
+    with MockTwitterServer(config) as server:
+        monkeypatch.setenv("NASTY_MOCK_SERVER", server.url)
+
+        xz_results = _execute(batch, tmp_path / "xz", XZ)
+        tweets = [list(xz_results.tweets(entry)) for entry in xz_results]
+        dictionary = xz_results.train_zstd_dictionary(size=4096)
+
+        codec = ZstdCodec(level=19, dictionary=dictionary)
+        results_dir = tmp_path / "zstd"
+        results = _execute(batch, results_dir, codec)
+        assert (results_dir / DICTIONARIES_DIR_NAME).exists()
+
+        # Already completed entries keep their codec.
+        num_searches = server.status_counts[("search", 200)]
+        _execute(batch, results_dir, GzipCodec())
+        assert num_searches == server.status_counts[("search", 200)]
+
+    for entry in batch:
+        assert codec == entry.codec
+        assert entry.data_file_name.name.endswith(".data.jsonl.zst")
+        assert (results_dir / entry.data_file_name).exists()
+        meta = read_json(results_dir / entry.meta_file_name, BatchEntry)
+        assert "dictionary" in meta.codec.to_json()
+
+    results = BatchResults(results_dir)
+    assert tweets == [list(results.tweets(entry)) for entry in results]
+
+    idified = results.idify(tmp_path / "idified")
+    assert idified is not None
+    assert (tmp_path / "idified" / DICTIONARIES_DIR_NAME).exists()
+    assert [[tweet.id for tweet in entry_tweets] for entry_tweets in tweets] == [
+        list(idified.tweet_ids(entry)) for entry in idified
+    ]
+
+
+@pytest.mark.requests_cache_disabled
+def test_execute_default_codec(tmp_path: Path, monkeypatch: MonkeyPatch) -> None:
+    batch = Batch()
+    batch.append(Search("q", max_tweets=None, batch_size=10))
+
+    monkeypatch.setenv("NASTY_CODEC", "none")
+    with MockTwitterServer(MockTwitterConfig(num_tweets=5)) as server:
+        monkeypatch.setenv("NASTY_MOCK_SERVER", server.url)
+        results = _execute(batch, tmp_path, None)
+
+    entry = results[0]
+    assert NoneCodec() == entry.codec
+    assert 5 == len((tmp_path / entry.data_file_name).read_text().splitlines())
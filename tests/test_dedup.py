@@ -0,0 +1,99 @@
+#
+# Copyright 2019-2020 Lukas Schmelzeisen
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from pathlib import Path
+
+import pytest
+import responses
+from _pytest.monkeypatch import MonkeyPatch
+
+from nasty._mock_server import MockTwitterConfig, MockTwitterServer
+from nasty._util.bloom_filter import BloomFilter
+from nasty._util.metrics import DUPLICATE_TWEETS
+from nasty.batch.batch import Batch
+from nasty.request.search import Search
+
+from .util.mock_twitter import add_batch_response, add_session_responses
+
+
+def test_bloom_filter() -> None:
+    bloom_filter = BloomFilter(1000, 0.01)
+    assert 0 == sum(bloom_filter.add(str(i)) for i in range(0, 2000, 2))
+    assert all(str(i) in bloom_filter for i in range(0, 2000, 2))
+    assert all(bloom_filter.add(str(i)) for i in range(0, 2000, 2))
+
+    # Generous bound, as the false positive rate is only met on average.
+    num_false_positives = sum(str(i) in bloom_filter for i in range(1, 20001, 2))
+    assert num_false_positives < 10000 * 0.03
+    assert 1 not in bloom_filter
+
+
+@pytest.mark.parametrize(
+    "capacity,error_rate", [(0, 0.01), (10, 0.0), (10, 1.0)], ids=repr
+)
+def test_bloom_filter_illegal_args(capacity: int, error_rate: float) -> None:
+    with pytest.raises(ValueError):
+        BloomFilter(capacity, error_rate)
+
+
+@pytest.mark.requests_cache_disabled
+@pytest.mark.parametrize("dedup", [False, True], ids=repr)
+@responses.activate
+def test_stream(dedup: bool, monkeypatch: MonkeyPatch) -> None:
+    if dedup:
+        monkeypatch.setenv("NASTY_DEDUP", "1")
+    add_session_responses("1")
+    add_batch_response("1", "2")
+    add_batch_response("2", "3")
+    add_batch_response("3", "1", "4")
+    for _ in range(3):
+        add_batch_response()
+
+    num_duplicates = DUPLICATE_TWEETS.value("stream")
+    tweet_ids = [tweet.id for tweet in Search("q", max_tweets=None).request()]
+    if dedup:
+        assert ["1", "2", "3", "4"] == tweet_ids
+        assert num_duplicates + 3 == DUPLICATE_TWEETS.value("stream")
+    else:
+        assert ["1", "2", "2", "3", "3", "1", "4"] == tweet_ids
+        assert num_duplicates == DUPLICATE_TWEETS.value("stream")
+
+
+@pytest.mark.requests_cache_disabled
+@pytest.mark.parametrize("dedup", [False, True], ids=repr)
+def test_batch(dedup: bool, tmp_path: Path, monkeypatch: MonkeyPatch) -> None:
+    if dedup:
+        monkeypatch.setenv("NASTY_DEDUP", "1")
+        monkeypatch.setenv("NASTY_DEDUP_CAPACITY", "1000")
+
+    # Both entries return the same timeline of the mock server.
+    batch = Batch()
+    batch.append(Search("q", max_tweets=None, batch_size=20))
+    batch.append(Search("q", max_tweets=None, batch_size=30))
+
+    num_duplicates = DUPLICATE_TWEETS.value("batch")
+    with MockTwitterServer(MockTwitterConfig(num_tweets=50)) as server:
+        monkeypatch.setenv("NASTY_MOCK_SERVER", server.url)
+        results = batch.execute(tmp_path)
+    assert results is not None
+
+    tweet_ids = [tweet.id for entry in results for tweet in results.tweets(entry)]
+    if dedup:
+        assert 50 == len(tweet_ids) == len(set(tweet_ids))
+        assert num_duplicates + 50 == DUPLICATE_TWEETS.value("batch")
+    else:
+        assert 100 == len(tweet_ids)
+        assert num_duplicates == DUPLICATE_TWEETS.value("batch")
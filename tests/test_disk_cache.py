@@ -0,0 +1,79 @@
+#
+# Copyright 2019-2020 Lukas Schmelzeisen
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from pathlib import Path
+
+from _pytest.logging import LogCaptureFixture
+
+from nasty._retriever import retriever
+from nasty._util.disk_cache import DiskCache, disk_cache, nasty_cache_dir
+from nasty._util.io_ import write_file
+
+
+def test_get_set_pop(tmp_path: Path) -> None:
+    cache = DiskCache(tmp_path / "cache.json")
+    assert cache.get("a") is None
+
+    cache.set("a", {"b": [1, 2]}, ttl=60)
+    cache.set("prefix:1", 1, ttl=60)
+    cache.set("prefix:2", 2, ttl=60)
+    assert DiskCache(tmp_path / "cache.json").get("a") == {"b": [1, 2]}
+
+    assert cache.pop_first("prefix:") == 1
+    assert cache.pop("prefix:2") == 2
+    assert cache.pop_first("prefix:") is None
+    assert cache.pop("a") == {"b": [1, 2]}
+    assert cache.get("a") is None
+
+
+def test_expiry(tmp_path: Path) -> None:
+    cache = DiskCache(tmp_path / "cache.json")
+    cache.set("a", 1, ttl=-1)
+    assert cache.get("a") is None
+
+
+def test_corrupted(tmp_path: Path, caplog: LogCaptureFixture) -> None:
+    write_file(tmp_path / "cache.json", "{")
+    cache = DiskCache(tmp_path / "cache.json")
+    assert cache.get("a") is None
+    assert "is corrupted" in caplog.text
+
+    cache.set("a", 1, ttl=60)
+    assert cache.get("a") == 1
+
+
+def test_crawl_delay_shared_between_processes() -> None:
+    assert nasty_cache_dir().exists()
+    retriever.crawl_delay = None
+    try:
+        assert retriever.cached_crawl_delay() is None
+        assert retriever.update_crawl_delay("User-agent: *\nCrawl-delay: 1\n") == 1.0
+
+        # Simulate a new process.
+        retriever.crawl_delay = None
+        assert retriever.cached_crawl_delay() == 1.0
+        cache = disk_cache()
+        assert cache is not None and cache.get("crawl_delay") == 1.0
+    finally:
+        retriever.crawl_delay = None
+
+
+def test_inaccessible(tmp_path: Path, caplog: LogCaptureFixture) -> None:
+    write_file(tmp_path / "file", "")
+    cache = DiskCache(tmp_path / "file" / "cache.json")
+    cache.set("a", 1, ttl=60)
+    assert cache.get("a") is None
+    assert "Could not access cache file" in caplog.text
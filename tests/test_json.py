@@ -0,0 +1,51 @@
+#
+# Copyright 2019-2020 Lukas Schmelzeisen
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import json
+from pathlib import Path
+
+from nasty._util.json_ import dumps, loads, read_json_lines, write_jsonl_lines
+from nasty.tweet.tweet import Tweet
+
+_OBJ = {
+    "id_str": "1115689254271819777",
+    "id": 1115689254271819777,
+    "full_text": 'Ümläuts and emojis \U0001F600 \\ "quotes"',
+    "favorite_count": 0,
+    "possibly_sensitive": False,
+    "coordinates": None,
+    "entities": {"hashtags": [], "urls": [{"indices": [1, 2]}]},
+    "score": 0.5,
+}
+
+
+def test_loads() -> None:
+    text = json.dumps(_OBJ)
+    assert loads(text) == _OBJ
+    assert loads(text.encode("UTF-8")) == _OBJ
+
+
+def test_dumps_compatible() -> None:
+    assert dumps(_OBJ) == json.dumps(_OBJ)
+    assert dumps(_OBJ, indent=2) == json.dumps(_OBJ, indent=2)
+
+
+def test_jsonl_roundtrip(tmp_path: Path) -> None:
+    tweets = [Tweet(_OBJ), Tweet(dict(_OBJ, id_str="2"))]
+    for use_lzma in [False, True]:
+        file = tmp_path / ("tweets.jsonl" + (".xz" if use_lzma else ""))
+        write_jsonl_lines(file, tweets, use_lzma=use_lzma)
+        assert list(read_json_lines(file, Tweet, use_lzma=use_lzma)) == tweets
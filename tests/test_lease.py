@@ -0,0 +1,241 @@
+#
+# Copyright 2019-2020 Lukas Schmelzeisen
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import json
+import os
+import socket
+import subprocess
+import sys
+from contextlib import contextmanager
+from pathlib import Path
+from threading import Thread
+from time import sleep
+from typing import Iterator, List, Optional
+
+import pytest
+from _pytest.monkeypatch import MonkeyPatch
+
+from nasty._mock_server import MockTwitterConfig, MockTwitterServer
+from nasty._util.metrics import TWEETS
+from nasty.batch._lease import LeaseKeeper, LeaseLostException
+from nasty.batch.batch import Batch
+from nasty.batch.batch_results import BatchResults
+from nasty.request.search import Search
+
+
+def test_claim_release(tmp_path: Path) -> None:
+    file = tmp_path / "entry.lease.json"
+    keeper1 = LeaseKeeper(tmp_path, ttl=60)
+    keeper2 = LeaseKeeper(tmp_path, ttl=60)
+
+    lease = keeper1.claim(file)
+    assert lease is not None
+    assert keeper2.claim(file) is None
+    keeper1.renew()
+    assert not lease.lost
+
+    keeper1.release(lease)
+    assert not file.exists()
+    lease = keeper2.claim(file)
+    assert lease is not None
+    keeper2.release(lease)
+
+
+def test_reclaim_expired(tmp_path: Path) -> None:
+    file = tmp_path / "entry.lease.json"
+    keeper1 = LeaseKeeper(tmp_path, ttl=0.1)
+    keeper2 = LeaseKeeper(tmp_path, ttl=60)
+
+    lease1 = keeper1.claim(file)
+    assert lease1 is not None
+    sleep(0.2)
+    lease2 = keeper2.claim(file)
+    assert lease2 is not None
+
+    keeper1.renew()
+    assert lease1.lost
+    with pytest.raises(LeaseLostException):
+        lease1.check()
+    keeper1.release(lease1)
+    assert file.exists()
+
+    keeper2.renew()
+    assert not lease2.lost
+    keeper2.release(lease2)
+
+
+def test_deadline(tmp_path: Path) -> None:
+    file = tmp_path / "entry.lease.json"
+    keeper = LeaseKeeper(tmp_path, ttl=1)
+
+    lease = keeper.claim(file)
+    assert lease is not None
+    lease.check()
+    sleep(0.85)
+    # Not yet expired for other processes, but no longer safe to write.
+    assert LeaseKeeper(tmp_path).claim(file) is None
+    with pytest.raises(LeaseLostException):
+        lease.check()
+    assert lease.lost
+
+    keeper.release(lease)
+    assert not file.exists()
+
+
+def test_renew_failure(tmp_path: Path, monkeypatch: MonkeyPatch) -> None:
+    file = tmp_path / "entry.lease.json"
+    keeper = LeaseKeeper(tmp_path, ttl=60)
+    lease = keeper.claim(file)
+    assert lease is not None
+
+    def failing_write(_file: Path) -> None:
+        raise OSError("Test Error.")
+
+    monkeypatch.setattr(keeper, "_write", failing_write)
+    with pytest.raises(OSError):
+        keeper.renew()
+    assert lease.lost
+
+
+def test_fenced(tmp_path: Path) -> None:
+    file = tmp_path / "entry.lease.json"
+    keeper1 = LeaseKeeper(tmp_path, ttl=0.1)
+    keeper2 = LeaseKeeper(tmp_path, ttl=60)
+
+    lease1 = keeper1.claim(file)
+    assert lease1 is not None
+    with lease1.fenced():
+        pass
+
+    sleep(0.2)
+    lease2 = keeper2.claim(file)
+    assert lease2 is not None
+    # Push back the local deadline, as if the heartbeat was not notified of the loss.
+    lease1.deadline += 60
+    with pytest.raises(LeaseLostException):
+        with lease1.fenced():
+            pytest.fail("Entered fence of lost lease.")
+    assert lease1.lost
+    with lease2.fenced():
+        pass
+
+    keeper1.release(lease1)
+    assert file.exists()
+    keeper2.release(lease2)
+
+
+@pytest.mark.requests_cache_disabled
+def test_fenced_commits_only(tmp_path: Path, monkeypatch: MonkeyPatch) -> None:
+    # Other processes need the lock to claim or renew leases, so writing frames must
+    # not hold it.
+    holding_lock = []
+    fsynced_frames = []
+    locked = LeaseKeeper.locked
+    fsync = os.fsync
+
+    @contextmanager
+    def tracked_locked(self: LeaseKeeper) -> Iterator[None]:
+        with locked(self):
+            holding_lock.append(True)
+            try:
+                yield
+            finally:
+                holding_lock.pop()
+
+    def tracked_fsync(fd: int) -> None:
+        fsynced_frames.append(bool(holding_lock))
+        fsync(fd)
+
+    monkeypatch.setattr(LeaseKeeper, "locked", tracked_locked)
+    monkeypatch.setattr("nasty.batch._checkpoint.os.fsync", tracked_fsync)
+    monkeypatch.setenv("NASTY_CHECKPOINT_INTERVAL", "0")
+    batch = Batch()
+    batch.append(Search("q", max_tweets=None, batch_size=10))
+
+    with MockTwitterServer(MockTwitterConfig(num_tweets=30)) as server:
+        monkeypatch.setenv("NASTY_MOCK_SERVER", server.url)
+        results = batch.execute(tmp_path)
+
+    assert results is not None
+    assert 30 == len(list(results.tweets(batch[0])))
+    assert fsynced_frames and not any(fsynced_frames)
+
+
+def test_reclaim_dead_process(tmp_path: Path) -> None:
+    process = subprocess.Popen([sys.executable, "-c", "pass"])
+    process.wait()
+
+    file = tmp_path / "entry.lease.json"
+    lease_json = {
+        "owner": "dead",
+        "host": socket.gethostname(),
+        "pid": process.pid,
+        "expires_at": 1e12,
+    }
+    file.write_text(json.dumps(lease_json), encoding="UTF-8")
+    assert LeaseKeeper(tmp_path).claim(file) is not None
+
+    # Processes on other hosts can not be checked.
+    file.write_text(json.dumps(dict(lease_json, host="other")), encoding="UTF-8")
+    assert LeaseKeeper(tmp_path).claim(file) is None
+
+
+def test_heartbeat(tmp_path: Path) -> None:
+    file = tmp_path / "entry.lease.json"
+    with LeaseKeeper(tmp_path, ttl=0.3) as keeper1:
+        lease = keeper1.claim(file)
+        assert lease is not None
+        sleep(0.6)
+        assert LeaseKeeper(tmp_path).claim(file) is None
+        keeper1.release(lease)
+
+
+@pytest.mark.requests_cache_disabled
+def test_concurrent_batches(tmp_path: Path, monkeypatch: MonkeyPatch) -> None:
+    monkeypatch.setenv("NASTY_LEASE_TTL", "3")
+    batch_file = tmp_path / "batch.jsonl"
+    results_dir = tmp_path / "out"
+
+    batch = Batch()
+    for i in range(6):
+        batch.append(Search(str(i), max_tweets=None, batch_size=10))
+    batch.dump(batch_file)
+
+    # Simulate multiple nodes, each executing the same batch file.
+    num_tweets = TWEETS.value("search")
+    all_results: List[Optional[BatchResults]] = []
+
+    def execute() -> None:
+        node_batch = Batch()
+        node_batch.load(batch_file)
+        all_results.append(node_batch.execute(results_dir))
+
+    config = MockTwitterConfig(num_tweets=30, latency=0.02)
+    with MockTwitterServer(config) as server:
+        monkeypatch.setenv("NASTY_MOCK_SERVER", server.url)
+        threads = [Thread(target=execute) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    assert 3 == len(all_results) and all(all_results)
+    assert num_tweets + 6 * 30 == TWEETS.value("search")
+    assert not list(results_dir.glob("*.lease.json"))
+    results = BatchResults(results_dir)
+    assert 6 == len(results)
+    for batch_entry in results:
+        assert 30 == len(list(results.tweets(batch_entry)))
@@ -0,0 +1,138 @@
+#
+# Copyright 2019-2020 Lukas Schmelzeisen
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from datetime import datetime
+from pathlib import Path
+from typing import List
+
+from _pytest.monkeypatch import MonkeyPatch
+
+import nasty.batch._manifest
+from nasty._util.io_ import read_lines_file
+from nasty._util.json_ import write_json
+from nasty.batch._manifest import MANIFEST_FILE_NAME, append_to_manifest, write_meta
+from nasty.batch.batch_entry import BatchEntry
+from nasty.batch.batch_results import BatchResults
+from nasty.batch.results_layout import ResultsLayout
+from nasty.request.search import Search
+
+
+def _entries(num_entries: int) -> List[BatchEntry]:
+    return [
+        BatchEntry(
+            Search("q{}".format(i), lang="en" if i % 2 else "de"),
+            id_="{:02d}".format(i),
+            completed_at=datetime(2020, 1, 1),
+            exception=None,
+        )
+        for i in range(num_entries)
+    ]
+
+
+def _forbid_meta_reads(monkeypatch: MonkeyPatch) -> None:
+    def read_json(*_args: object, **_kwargs: object) -> None:
+        raise AssertionError("Meta file read although manifest is up to date.")
+
+    monkeypatch.setattr(nasty.batch._manifest, "read_json", read_json)
+
+
+def test_open_from_manifest(tmp_path: Path, monkeypatch: MonkeyPatch) -> None:
+    entries = _entries(5)
+    for entry in entries:
+        write_meta(tmp_path, ResultsLayout.FLAT, entry)
+
+    _forbid_meta_reads(monkeypatch)
+    assert entries == list(BatchResults(tmp_path))
+
+
+def test_rebuild_missing_manifest(tmp_path: Path, monkeypatch: MonkeyPatch) -> None:
+    entries = _entries(5)
+    for entry in entries:
+        write_json(tmp_path / entry.meta_file_name, entry)
+
+    assert not (tmp_path / MANIFEST_FILE_NAME).exists()
+    assert entries == list(BatchResults(tmp_path))
+    assert (tmp_path / MANIFEST_FILE_NAME).exists()
+
+    _forbid_meta_reads(monkeypatch)
+    assert entries == list(BatchResults(tmp_path))
+
+
+def test_reconcile_stale_manifest(tmp_path: Path) -> None:
+    entries = _entries(5)
+    for entry in entries[:4]:
+        write_meta(tmp_path, ResultsLayout.FLAT, entry)
+    write_json(tmp_path / entries[4].meta_file_name, entries[4])
+    (tmp_path / entries[0].meta_file_name).unlink()
+
+    assert entries[1:] == list(BatchResults(tmp_path))
+    assert 4 == len(list(read_lines_file(tmp_path / MANIFEST_FILE_NAME)))
+
+
+def test_latest_line_wins(tmp_path: Path) -> None:
+    entry = _entries(1)[0]
+    write_meta(tmp_path, ResultsLayout.FLAT, entry)
+    entry.completed_at = None
+    entry.exception = None
+    write_meta(tmp_path, ResultsLayout.FLAT, entry, overwrite_existing=True)
+    entry.completed_at = datetime(2020, 2, 2)
+    write_meta(tmp_path, ResultsLayout.FLAT, entry, overwrite_existing=True)
+
+    assert [entry] == list(BatchResults(tmp_path))
+    # Three lines for one entry exceed the allowed growth, so it is compacted.
+    assert 1 == len(list(read_lines_file(tmp_path / MANIFEST_FILE_NAME)))
+
+
+def test_corrupt_line(tmp_path: Path) -> None:
+    entries = _entries(3)
+    for entry in entries[:2]:
+        write_meta(tmp_path, ResultsLayout.FLAT, entry)
+    with (tmp_path / MANIFEST_FILE_NAME).open("a", encoding="UTF-8") as fout:
+        fout.write('{"id": "02", "requ')
+    write_json(tmp_path / entries[2].meta_file_name, entries[2])
+    append_to_manifest(tmp_path, entries[2])
+
+    assert entries == list(BatchResults(tmp_path))
+    assert 3 == len(list(read_lines_file(tmp_path / MANIFEST_FILE_NAME)))
+
+
+def test_rebuild_manifest(tmp_path: Path) -> None:
+    entries = _entries(2)
+    for entry in entries:
+        write_meta(tmp_path, ResultsLayout.FLAT, entry)
+    entries[0].completed_at = datetime(2020, 2, 2)
+    write_json(
+        tmp_path / entries[0].meta_file_name, entries[0], overwrite_existing=True
+    )
+
+    results = BatchResults(tmp_path)
+    assert entries != list(results)
+    results.rebuild_manifest()
+    assert entries == list(results)
+    assert entries == list(BatchResults(tmp_path))
+
+
+def test_lookup(tmp_path: Path) -> None:
+    entries = _entries(4)
+    for entry in entries:
+        write_meta(tmp_path, ResultsLayout.FLAT, entry)
+
+    results = BatchResults(tmp_path)
+    assert entries[2] == results.entry("02")
+    assert [entries[1], entries[3]] == results.find(lang="en")
+    assert [entries[2]] == results.find(query="q2", lang="de")
+    assert [] == results.find(query="q2", lang="en")
+    assert [] == results.find(tweet_id="1")
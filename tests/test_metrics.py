@@ -0,0 +1,130 @@
+#
+# Copyright 2019-2020 Lukas Schmelzeisen
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from pathlib import Path
+from socket import socket
+from urllib.request import urlopen
+
+import pytest
+from _pytest.monkeypatch import MonkeyPatch
+
+from nasty._mock_server import MockTwitterConfig, MockTwitterServer
+from nasty._util.metrics import (
+    BATCH_ENTRIES,
+    REGISTRY,
+    TWEETS,
+    MetricsExporter,
+    MetricsRegistry,
+)
+from nasty.batch.batch import Batch
+from nasty.request.search import Search
+
+
+def _registry() -> MetricsRegistry:
+    registry = MetricsRegistry()
+    counter = registry.counter("test_total", "A counter.", ("a", "b"))
+    counter.inc("x", 1)
+    counter.inc("x", 1, amount=2)
+    counter.inc('"y"\n', 2)
+    histogram = registry.histogram("test_seconds", "A histogram.", buckets=(1, 2.5))
+    for value in (0.5, 1, 2, 10):
+        histogram.observe(value)
+    return registry
+
+
+def test_render() -> None:
+    assert _registry().render() == (
+        "# HELP test_total A counter.\n"
+        "# TYPE test_total counter\n"
+        'test_total{a="\\"y\\"\\n",b="2"} 1\n'
+        'test_total{a="x",b="1"} 3\n'
+        "# HELP test_seconds A histogram.\n"
+        "# TYPE test_seconds histogram\n"
+        'test_seconds_bucket{le="1"} 2\n'
+        'test_seconds_bucket{le="2.5"} 3\n'
+        'test_seconds_bucket{le="+Inf"} 4\n'
+        "test_seconds_sum 13.5\n"
+        "test_seconds_count 4\n"
+    )
+
+
+def test_drain_merge() -> None:
+    registry = _registry()
+    rendered = registry.render()
+    snapshot = registry.drain()
+    assert "test_total" not in registry.render().split("# TYPE test_total counter\n")[1]
+
+    registry.merge(snapshot)
+    assert rendered == registry.render()
+    registry.merge(registry.drain())
+    assert rendered == registry.render()
+
+
+def test_invalid() -> None:
+    registry = MetricsRegistry()
+    counter = registry.counter("test_total", "A counter.", ("a",))
+    with pytest.raises(ValueError):
+        counter.inc()
+    with pytest.raises(ValueError):
+        counter.inc("x", amount=-1)
+    with pytest.raises(ValueError):
+        registry.counter("test_total", "Another counter.")
+
+
+def test_exporter_file(tmp_path: Path) -> None:
+    file = tmp_path / "nasty.prom"
+    registry = _registry()
+    exporter = MetricsExporter(registry, file=file, interval=0.01)
+    exporter.start()
+    exporter.stop()
+    assert file.read_text(encoding="UTF-8") == registry.render()
+
+
+def test_exporter_port() -> None:
+    with socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+
+    registry = _registry()
+    exporter = MetricsExporter(registry, port=port)
+    exporter.start()
+    try:
+        with urlopen("http://127.0.0.1:{}/metrics".format(port)) as response:
+            assert response.read().decode("UTF-8") == registry.render()
+    finally:
+        exporter.stop()
+
+
+@pytest.mark.requests_cache_disabled
+def test_batch(monkeypatch: MonkeyPatch, tmp_path: Path) -> None:
+    file = tmp_path / "nasty.prom"
+    monkeypatch.setenv("NASTY_METRICS_FILE", str(file))
+    monkeypatch.delenv("NASTY_DISRESPECT_ROBOTSTXT")
+
+    batch = Batch()
+    for i in range(3):
+        batch.append(Search(str(i), max_tweets=None))
+
+    num_tweets = TWEETS.value("search")
+    num_successes = BATCH_ENTRIES.value("success")
+    config = MockTwitterConfig(num_tweets=50, crawl_delay=0.001)
+    with MockTwitterServer(config) as server:
+        monkeypatch.setenv("NASTY_MOCK_SERVER", server.url)
+        assert batch.execute(tmp_path / "results") is not None
+
+    assert TWEETS.value("search") == num_tweets + 3 * 50
+    assert BATCH_ENTRIES.value("success") == num_successes + 3
+    assert file.read_text(encoding="UTF-8") == REGISTRY.render()
@@ -0,0 +1,117 @@
+#
+# Copyright 2019-2020 Lukas Schmelzeisen
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from pathlib import Path
+from typing import Iterator
+
+import pytest
+from _pytest.monkeypatch import MonkeyPatch
+
+from nasty._mock_server import MockTwitterConfig, MockTwitterServer
+from nasty._retriever.transport import twitter_url
+from nasty.batch.batch import Batch
+from nasty.request.replies import Replies
+from nasty.request.request import Request
+from nasty.request.search import Search
+from nasty.request.thread import Thread
+
+
+def _serve(
+    monkeypatch: MonkeyPatch, config: MockTwitterConfig
+) -> Iterator[MockTwitterServer]:
+    with MockTwitterServer(config) as server:
+        monkeypatch.setenv("NASTY_MOCK_SERVER", server.url)
+        monkeypatch.delenv("NASTY_DISRESPECT_ROBOTSTXT")
+        yield server
+
+
+@pytest.fixture
+def mock_server(monkeypatch: MonkeyPatch) -> Iterator[MockTwitterServer]:
+    yield from _serve(monkeypatch, MockTwitterConfig(num_tweets=50, crawl_delay=0.001))
+
+
+@pytest.fixture
+def misbehaving_mock_server(monkeypatch: MonkeyPatch) -> Iterator[MockTwitterServer]:
+    yield from _serve(
+        monkeypatch,
+        MockTwitterConfig(
+            num_tweets=50,
+            crawl_delay=0.001,
+            session_rate_limit=4,
+            rate_limit_probability=0.1,
+            forbidden_probability=0.1,
+            server_error_probability=0.1,
+            empty_batch_probability=0.1,
+            tombstone_probability=0.1,
+            missing_meta_probability=0.1,
+            seed=5,
+        ),
+    )
+
+
+def test_twitter_url(monkeypatch: MonkeyPatch) -> None:
+    url = "https://api.twitter.com/2/search/adaptive.json?q=q"
+    assert twitter_url(url) == url
+    monkeypatch.setenv("NASTY_MOCK_SERVER", "http://127.0.0.1:8080")
+    assert twitter_url(url) == "http://127.0.0.1:8080/2/search/adaptive.json?q=q"
+    assert twitter_url("https://example.org/") == "https://example.org/"
+
+
+@pytest.mark.requests_cache_disabled
+@pytest.mark.parametrize(
+    "request_",
+    [Search("q", max_tweets=None), Replies("1", max_tweets=None), Thread("1")],
+    ids=repr,
+)
+def test_timelines(request_: Request, mock_server: MockTwitterServer) -> None:
+    tweet_ids = [tweet.id for tweet in request_.request()]
+    assert len(tweet_ids) == len(set(tweet_ids)) == 50
+    assert (
+        sum(
+            count
+            for (_, status), count in mock_server.status_counts.items()
+            if status != 200
+        )
+        == 0
+    )
+
+
+@pytest.mark.requests_cache_disabled
+def test_misbehaving(misbehaving_mock_server: MockTwitterServer) -> None:
+    tweets = list(Search("q", max_tweets=None).request())
+    assert 0 < len(tweets) < 50
+    assert tweets == list(Search("q", max_tweets=None).request())
+
+    status_counts = misbehaving_mock_server.status_counts
+    for status in (403, 429, 503):
+        assert status_counts[("search", status)] > 0
+    assert status_counts[("stub", 200)] > 1
+
+
+@pytest.mark.requests_cache_disabled
+def test_batch(
+    mock_server: MockTwitterServer, monkeypatch: MonkeyPatch, tmp_path: Path
+) -> None:
+    monkeypatch.setenv("NASTY_NUM_WORKERS", "4")
+    batch = Batch()
+    for i in range(8):
+        batch.append(Search(str(i), max_tweets=None))
+
+    results = batch.execute(tmp_path)
+    assert results is not None
+    assert len(results) == 8
+    for entry in results:
+        assert len(list(results.tweets(entry))) == 50
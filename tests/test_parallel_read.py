@@ -0,0 +1,146 @@
+#
+# Copyright 2019-2020 Lukas Schmelzeisen
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import multiprocessing
+from datetime import datetime
+from itertools import islice
+from pathlib import Path
+from typing import Iterator, List, Sequence, Union
+
+import pytest
+from _pytest.monkeypatch import MonkeyPatch
+
+from nasty._util.codec import XZ, NoneCodec, ZstdCodec
+from nasty._util.json_ import dumps, write_jsonl_lines
+from nasty.batch import _parallel_reader
+from nasty.batch._manifest import write_meta
+from nasty.batch._parallel_reader import ReadJob
+from nasty.batch.batch_entry import BatchEntry
+from nasty.batch.batch_results import BatchResults
+from nasty.batch.results_layout import ResultsLayout
+from nasty.request.search import Search
+from nasty.tweet.tweet import Tweet
+
+# Includes entries spanning multiple chunks and empty entries.
+_NUM_TWEETS_PER_ENTRY = [10, 2500, 0, 1, 1200, 0, 30, 999, 1000, 5]
+
+
+def _write_results(results_dir: Path) -> List[List[Tweet]]:
+    codecs = [XZ, ZstdCodec(), NoneCodec()]
+    all_tweets = []
+    for i, num_tweets in enumerate(_NUM_TWEETS_PER_ENTRY):
+        entry = BatchEntry(
+            Search(str(i)),
+            id_="{:02d}".format(i),
+            completed_at=datetime(2020, 1, 1),
+            exception=None,
+            codec=codecs[i % len(codecs)],
+        )
+        tweets = [
+            Tweet({"id_str": "{}-{}".format(i, j), "text": "Tweet"})
+            for j in range(num_tweets)
+        ]
+        write_jsonl_lines(results_dir / entry.data_file_name, tweets, codec=entry.codec)
+        write_meta(results_dir, ResultsLayout.FLAT, entry)
+        all_tweets.append(tweets)
+    return all_tweets
+
+
+def _ids(tweets: Sequence[Tweet]) -> List[str]:
+    return [tweet.id for tweet in tweets]
+
+
+@pytest.mark.parametrize("workers", [0, 1, 3])
+def test_ordered(workers: int, tmp_path: Path) -> None:
+    all_tweets = _write_results(tmp_path)
+    results = BatchResults(tmp_path)
+    expected = [tweet for entry in results for tweet in results.tweets(entry)]
+    assert sum(map(len, all_tweets)) == len(expected)
+
+    assert expected == list(results.iter_tweets(workers=workers, ordered=True))
+    assert [dumps(tweet.to_json()).encode("UTF-8") for tweet in expected] == list(
+        results.iter_lines(workers=workers, ordered=True)
+    )
+
+
+@pytest.mark.parametrize("num_readers", ["0", "2"])
+def test_num_readers_env(
+    num_readers: str, tmp_path: Path, monkeypatch: MonkeyPatch
+) -> None:
+    all_tweets = _write_results(tmp_path)
+    results = BatchResults(tmp_path)
+
+    used_workers = []
+
+    def iter_parallel(
+        jobs: Sequence[ReadJob], *, workers: int, ordered: bool, decode: bool
+    ) -> Iterator[Union[bytes, Tweet]]:
+        used_workers.append(workers)
+        return _parallel_reader.iter_parallel(
+            jobs, workers=workers, ordered=ordered, decode=decode
+        )
+
+    monkeypatch.setattr("nasty.batch.batch_results.iter_parallel", iter_parallel)
+    monkeypatch.setenv("NASTY_NUM_READERS", num_readers)
+    assert [t for tweets in all_tweets for t in tweets] == list(
+        results.iter_tweets(ordered=True)
+    )
+    # An explicit 0 reads on the calling thread instead of using all CPUs.
+    assert ([int(num_readers)] if int(num_readers) else []) == used_workers
+
+
+def test_unordered(tmp_path: Path) -> None:
+    all_tweets = _write_results(tmp_path)
+    results = BatchResults(tmp_path)
+
+    tweet_ids = _ids(list(results.iter_tweets(workers=4)))
+    assert sorted(_ids([t for tweets in all_tweets for t in tweets])) == sorted(
+        tweet_ids
+    )
+    # Tweets of each entry remain in order.
+    for tweets in all_tweets:
+        ids = set(_ids(tweets))
+        assert _ids(tweets) == [tweet_id for tweet_id in tweet_ids if tweet_id in ids]
+
+
+def test_selected_entries(tmp_path: Path) -> None:
+    all_tweets = _write_results(tmp_path)
+    results = BatchResults(tmp_path)
+
+    entries = results.find(query="4") + results.find(query="1")
+    assert all_tweets[4] + all_tweets[1] == list(
+        results.iter_tweets(entries, workers=2, ordered=True)
+    )
+
+
+def test_stop_early(tmp_path: Path) -> None:
+    _write_results(tmp_path)
+    results = BatchResults(tmp_path)
+
+    tweets = results.iter_tweets(workers=2)
+    assert 10 == len(list(islice(tweets, 10)))
+    tweets.close()
+    assert not multiprocessing.active_children()
+
+
+def test_missing_data_file(tmp_path: Path) -> None:
+    _write_results(tmp_path)
+    results = BatchResults(tmp_path)
+    (tmp_path / results[1].data_file_name).unlink()
+
+    with pytest.raises(FileNotFoundError):
+        list(results.iter_tweets(workers=2, ordered=True))
+    assert not multiprocessing.active_children()
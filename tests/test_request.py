@@ -14,7 +14,7 @@
 # limitations under the License.
 #
 
-from datetime import date, timedelta
+from datetime import date, datetime, timedelta, timezone
 from typing import Mapping, Tuple, Type
 
 import pytest
@@ -34,6 +34,14 @@ from nasty.request.thread import Thread
         (Search, {"query": "q", "batch_size": -1}),
         (Search, {"query": "q", "since": date(2010, 1, 1), "until": date(2010, 1, 1)}),
         (Search, {"query": "q", "since": date(2010, 1, 2), "until": date(2010, 1, 1)}),
+        (
+            Search,
+            {
+                "query": "q",
+                "since": datetime(2010, 1, 1, 12),
+                "until": date(2010, 1, 1),
+            },
+        ),
     ],
     ids=lambda args: args[0].__name__ + ": " + repr(args[1]),
 )
@@ -47,6 +55,7 @@ def test_illegal_args(args: Tuple[Type[Request], Mapping[str, object]]) -> None:
     "request_",
     [
         Search("q"),
+        Search("q", since=datetime(2010, 1, 1, 12, 30), until=date(2010, 1, 2)),
         Replies("332308211321425920", max_tweets=None),
         Thread("332308211321425920", max_tweets=123, batch_size=456),
     ],
@@ -71,6 +80,21 @@ def test_search_to_daily_requests(search: Search) -> None:
         assert timedelta(days=1) == daily_request.until - daily_request.since
 
 
+def test_search_to_daily_requests_time_of_day() -> None:
+    search = Search("q", since=datetime(2020, 1, 1, 12), until=datetime(2020, 1, 3, 6))
+    assert [
+        (datetime(2020, 1, 1, 12), date(2020, 1, 2)),
+        (date(2020, 1, 2), date(2020, 1, 3)),
+        (date(2020, 1, 3), datetime(2020, 1, 3, 6)),
+    ] == [
+        (daily_request.since, daily_request.until)
+        for daily_request in search.to_daily_requests()
+    ]
+
+    search = Search("q", since=datetime(2020, 1, 1, 12), until=datetime(2020, 1, 1, 18))
+    assert [search] == search.to_daily_requests()
+
+
 @pytest.mark.parametrize(
     "search",
     [
@@ -83,3 +107,13 @@ def test_search_to_daily_requests(search: Search) -> None:
 def test_search_into_daily_requests_illegal_args(search: Search) -> None:
     with pytest.raises(ValueError):
         search.to_daily_requests()
+
+
+def test_search_datetime_normalization() -> None:
+    search = Search(
+        "q",
+        since=datetime(
+            2010, 1, 1, 12, 30, 15, 999, tzinfo=timezone(timedelta(hours=2))
+        ),
+    )
+    assert search.since == datetime(2010, 1, 1, 10, 30, 15)
@@ -0,0 +1,133 @@
+#
+# Copyright 2019-2020 Lukas Schmelzeisen
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from datetime import datetime
+from pathlib import Path
+from typing import List
+
+import pytest
+from _pytest.monkeypatch import MonkeyPatch
+
+from nasty._mock_server import MockTwitterConfig, MockTwitterServer
+from nasty._util.json_ import write_jsonl_lines
+from nasty.batch._manifest import write_meta
+from nasty.batch.batch import Batch
+from nasty.batch.batch_entry import BatchEntry
+from nasty.batch.batch_results import BatchResults
+from nasty.batch.results_layout import LAYOUT_FILE_NAME, ResultsLayout
+from nasty.request.search import Search
+
+
+def _write_entries(results_dir: Path, num_entries: int) -> List[BatchEntry]:
+    entries = []
+    for i in range(num_entries):
+        entry = BatchEntry(
+            Search(str(i)),
+            id_="{:032x}".format(i),
+            completed_at=datetime(2020, 1, 1),
+            exception=None,
+        )
+        write_jsonl_lines(results_dir / entry.data_file_name, [], use_lzma=True)
+        write_meta(results_dir, ResultsLayout.FLAT, entry)
+        entries.append(entry)
+    return entries
+
+
+def _top_level_entry_files(results_dir: Path) -> List[Path]:
+    return [
+        file
+        for file in results_dir.iterdir()
+        if file.name.endswith((".meta.json", ".data.jsonl.xz", ".ids"))
+    ]
+
+
+def test_entry_dir() -> None:
+    results_dir = Path("out")
+    assert results_dir == ResultsLayout.FLAT.entry_dir(results_dir, "abc")
+
+    entry_dir = ResultsLayout.SHARDED.entry_dir(results_dir, "abc")
+    assert entry_dir == ResultsLayout.SHARDED.entry_dir(results_dir, "abc")
+    assert results_dir == entry_dir.parent.parent
+    assert 2 == len(entry_dir.name) == len(entry_dir.parent.name)
+
+
+@pytest.mark.requests_cache_disabled
+def test_execute_sharded(tmp_path: Path, monkeypatch: MonkeyPatch) -> None:
+    monkeypatch.setenv("NASTY_RESULTS_LAYOUT", "sharded")
+    batch = Batch()
+    for i in range(4):
+        batch.append(Search(str(i), max_tweets=None, batch_size=10))
+
+    config = MockTwitterConfig(num_tweets=15)
+    with MockTwitterServer(config) as server:
+        monkeypatch.setenv("NASTY_MOCK_SERVER", server.url)
+        results = batch.execute(tmp_path)
+        num_searches = server.status_counts[("search", 200)]
+        assert batch.execute(tmp_path) is not None
+        assert num_searches == server.status_counts[("search", 200)]
+
+    assert results is not None
+    assert ResultsLayout.SHARDED == results.layout
+    assert (tmp_path / LAYOUT_FILE_NAME).exists()
+    assert not _top_level_entry_files(tmp_path)
+    assert 4 == len(results)
+    for entry in results:
+        entry_dir = ResultsLayout.SHARDED.entry_dir(tmp_path, entry.id)
+        assert (entry_dir / entry.meta_file_name).exists()
+        assert 15 == len(list(results.tweets(entry)))
+
+
+def test_existing_flat_dir_stays_flat(tmp_path: Path, monkeypatch: MonkeyPatch) -> None:
+    _write_entries(tmp_path, 2)
+    monkeypatch.setenv("NASTY_RESULTS_LAYOUT", "sharded")
+    assert Batch().execute(tmp_path) is not None
+    assert not (tmp_path / LAYOUT_FILE_NAME).exists()
+
+
+def test_migrate(tmp_path: Path) -> None:
+    entries = _write_entries(tmp_path, 20)
+
+    results = BatchResults(tmp_path)
+    results.migrate(ResultsLayout.SHARDED)
+    assert not _top_level_entry_files(tmp_path)
+    for results in [results, BatchResults(tmp_path)]:
+        assert ResultsLayout.SHARDED == results.layout
+        assert entries == list(results)
+        for entry in results:
+            assert [] == list(results.tweets(entry))
+
+    results.migrate(ResultsLayout.FLAT)
+    assert 40 == len(_top_level_entry_files(tmp_path))
+    assert not (tmp_path / LAYOUT_FILE_NAME).exists()
+    assert {"manifest.jsonl"} == {
+        file.name for file in tmp_path.iterdir() if not file.name.startswith(".")
+    } - {file.name for file in _top_level_entry_files(tmp_path)}
+    assert entries == list(BatchResults(tmp_path))
+
+
+def test_idify_keeps_layout(tmp_path: Path) -> None:
+    results_dir = tmp_path / "results"
+    results_dir.mkdir()
+    entries = _write_entries(results_dir, 5)
+    BatchResults(results_dir).migrate(ResultsLayout.SHARDED)
+
+    idified = BatchResults(results_dir).idify(tmp_path / "idified")
+    assert idified is not None
+    assert ResultsLayout.SHARDED == idified.layout
+    assert not _top_level_entry_files(tmp_path / "idified")
+    assert entries == list(idified)
+    for entry in idified:
+        assert [] == list(idified.tweet_ids(entry))
@@ -0,0 +1,127 @@
+#
+# Copyright 2019-2020 Lukas Schmelzeisen
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from typing import Dict, Iterator
+
+import pytest
+from _pytest.monkeypatch import MonkeyPatch
+
+from nasty._mock_server import MockTwitterConfig, MockTwitterServer
+from nasty._retriever.search_retriever import SearchRetriever
+from nasty.batch.batch import Batch
+from nasty.request.search import Search, SearchFilter
+from nasty.request.search_planner import (
+    HistoricalVolumeEstimator,
+    ProbeVolumeEstimator,
+    SearchPlanner,
+)
+
+
+@pytest.fixture
+def mock_server(monkeypatch: MonkeyPatch) -> Iterator[MockTwitterServer]:
+    # Every search timeline of the mock server has one Tweet per minute, starting at
+    # 2020-01-01 00:00 UTC.
+    with MockTwitterServer(MockTwitterConfig(num_tweets=50)) as server:
+        monkeypatch.setenv("NASTY_MOCK_SERVER", server.url)
+        yield server
+
+
+def test_time_operators() -> None:
+    search = Search("q", since=date(2020, 1, 1), until=datetime(2020, 1, 2, 12))
+    assert (
+        SearchRetriever(search)._q_url_param()
+        == "q since:2020-01-01 until_time:1577966400 lang:en"
+    )
+
+
+def test_plan() -> None:
+    hourly_counts: Dict[datetime, int] = {}
+    # Quiet days with 10 Tweets per day.
+    for day in range(1, 5):
+        hourly_counts[datetime(2020, 1, day, 12)] = 10
+    # A busy day with 1000 Tweets between 08:00 and 12:00.
+    for hour in range(8, 12):
+        hourly_counts[datetime(2020, 1, 5, hour)] = 250
+
+    search = Search(
+        "q",
+        since=date(2020, 1, 1),
+        until=date(2020, 1, 6),
+        filter_=SearchFilter.LATEST,
+        max_tweets=None,
+    )
+    planner = SearchPlanner(
+        100,
+        estimator=HistoricalVolumeEstimator(hourly_counts),
+        min_window=timedelta(hours=1),
+    )
+    requests = planner.plan(search)
+
+    # Quiet days are merged (also with the quiet first hours of the busy day), busy
+    # hours are split down to min_window.
+    assert requests[0] == Search(
+        "q",
+        since=date(2020, 1, 1),
+        until=datetime(2020, 1, 5, 8),
+        filter_=SearchFilter.LATEST,
+        max_tweets=None,
+    )
+    assert [(request.since, request.until) for request in requests[1:5]] == [
+        (datetime(2020, 1, 5, hour), datetime(2020, 1, 5, hour + 1))
+        for hour in range(8, 12)
+    ]
+    assert requests[-1].until == date(2020, 1, 6)
+    for previous, next_ in zip(requests, requests[1:]):
+        assert previous.until == next_.since
+
+
+def test_plan_illegal_args() -> None:
+    with pytest.raises(ValueError):
+        SearchPlanner(0)
+    with pytest.raises(ValueError):
+        SearchPlanner(100, estimator=HistoricalVolumeEstimator({})).plan(Search("q"))
+
+
+@pytest.mark.requests_cache_disabled
+def test_probe_volume_estimator(mock_server: MockTwitterServer) -> None:
+    search = Search(
+        "q", since=datetime(2019, 12, 31, 9, 20), until=datetime(2020, 1, 1, 1, 40)
+    )
+
+    # Fewer Tweets than the probe size are counted exactly.
+    assert ProbeVolumeEstimator(probe_size=100).estimate(search) == 50
+
+    # Otherwise 20 Tweets since 00:00 are extrapolated to the whole window, i.e.,
+    # 20 Tweets per 100 minutes over 980 minutes.
+    assert ProbeVolumeEstimator(probe_size=20).estimate(search) == pytest.approx(196)
+
+
+@pytest.mark.requests_cache_disabled
+def test_historical_volume_estimator(
+    mock_server: MockTwitterServer, tmp_path: Path
+) -> None:
+    batch = Batch()
+    batch.append(Search("q", max_tweets=30))
+    batch.append(Search("other", max_tweets=None))
+    results = batch.execute(tmp_path)
+    assert results is not None
+
+    estimator = HistoricalVolumeEstimator.from_batch_results(results, query="q")
+    assert estimator.hourly_counts == {datetime(2020, 1, 1): 30}
+    search = Search("q", since=datetime(2020, 1, 1, 0, 30), until=date(2020, 1, 2))
+    assert estimator.estimate(search) == pytest.approx(15)
@@ -0,0 +1,96 @@
+#
+# Copyright 2019-2020 Lukas Schmelzeisen
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+# Helpers to register minimal fake Twitter responses with the responses-library, for
+# tests that need to control exactly what Twitter answers (e.g., rate limit headers).
+
+import re
+from typing import Mapping, Optional, Sequence
+
+import responses
+from typing_extensions import Final
+
+MAIN_JS_URL: Final = "https://abs.twimg.com/responsive-web/client-web/main.0123abcd.js"
+SEARCH_STUB_URL: Final = "https://mobile.twitter.com/search"
+ADAPTIVE_JSON_URL: Final = re.compile(
+    r"https://api\.twitter\.com/2/search/adaptive\.json.*"
+)
+
+
+def add_session_responses(guest_token: str) -> None:
+    responses.add(
+        responses.GET,
+        re.compile(re.escape(SEARCH_STUB_URL) + ".*"),
+        body='<script src="{}"></script><script>document.cookie = '
+        'decodeURIComponent("gt={}; Max-Age=10800;")</script>'.format(
+            MAIN_JS_URL, guest_token
+        ),
+    )
+    responses.add(responses.GET, MAIN_JS_URL, body='a="Web-12",b="bearer"')
+
+
+def search_batch_json(
+    tweet_ids: Sequence[str], cursor: str = "cursor"
+) -> Mapping[str, object]:
+    entries: Sequence[Mapping[str, object]] = [
+        {
+            "entryId": "sq-I-t-" + tweet_id,
+            "content": {"item": {"content": {"tweet": {"id": tweet_id}}}},
+        }
+        for tweet_id in tweet_ids
+    ] + [
+        {
+            "entryId": "sq-cursor-bottom",
+            "content": {"operation": {"cursor": {"value": cursor}}},
+        }
+    ]
+    return {
+        "globalObjects": {
+            "tweets": {
+                tweet_id: {"id_str": tweet_id, "user_id_str": "1", "full_text": "text"}
+                for tweet_id in tweet_ids
+            },
+            "users": {"1": {"id_str": "1"}},
+        },
+        "timeline": {"instructions": [{"addEntries": {"entries": entries}}]},
+    }
+
+
+def add_batch_response(
+    *tweet_ids: str,
+    cursor: str = "cursor",
+    headers: Optional[Mapping[str, str]] = None,
+) -> None:
+    responses.add(
+        responses.GET,
+        ADAPTIVE_JSON_URL,
+        headers=headers,
+        json=search_batch_json(tweet_ids, cursor),
+    )
+
+
+def count_calls(url_prefix: str) -> int:
+    return sum(call.request.url.startswith(url_prefix) for call in responses.calls)
+
+
+def guest_tokens() -> Mapping[str, int]:
+    """Counts how often each guest token was used for requests."""
+    result = {}
+    for call in responses.calls:
+        token = call.request.headers.get("X-Guest-Token")
+        if token is not None:
+            result[token] = result.get(token, 0) + 1
+    return result